@@ -15,6 +15,7 @@
 
 import pecan
 from pecan import rest
+import six
 from six.moves import http_client
 import wsme
 from wsme import types as wtypes
@@ -25,6 +26,8 @@ from ironic.api.controllers.v1 import types
 from ironic.api.controllers.v1 import utils as api_utils
 from ironic.api import expose
 from ironic.common import exception
+from ironic.common.i18n import _
+from ironic.conductor import manager as conductor_manager
 
 
 # Property information for drivers:
@@ -210,6 +213,89 @@ class DriverRaidController(rest.RestController):
         return _RAID_PROPERTIES[driver_name]
 
 
+class DriverImageCacheController(rest.RestController):
+    """REST controller for the image caches of the conductors of a driver."""
+
+    @staticmethod
+    def _get_hosts(driver_name):
+        hosts = pecan.request.dbapi.get_active_driver_dict().get(driver_name)
+        if not hosts:
+            raise exception.DriverNotFound(driver_name=driver_name)
+        return sorted(hosts)
+
+    @expose.expose(types.jsontype, wtypes.text)
+    def get_all(self, driver_name):
+        """Retrieve the status of the image prefetches of a driver.
+
+        :param driver_name: name of the driver.
+        :returns: a dictionary with a "conductors" key, whose value is a
+            dictionary with <conductor host>:<list of prefetches> entries.
+            Each prefetch is a dictionary with the "href" and "interface"
+            of the image, its "state" ("waiting", "fetching", "cached",
+            "skipped" or "failed"), an "error" message and when the state
+            was last updated ("updated_at").
+        :raises: NotAcceptable, if requested version of the API is less than
+            1.17.
+        :raises: DriverNotFound, if driver is not loaded on any of the
+            conductors.
+        """
+        if not api_utils.allow_driver_image_cache():
+            raise exception.NotAcceptable()
+
+        rpcapi = pecan.request.rpcapi
+        conductors = {}
+        for host in self._get_hosts(driver_name):
+            conductors[host] = rpcapi.get_image_prefetch_status(
+                pecan.request.context, driver_name,
+                topic='%s.%s' % (rpcapi.topic, host))
+        return {'conductors': conductors}
+
+    @expose.expose(None, wtypes.text, body=types.jsontype,
+                   status_code=http_client.ACCEPTED)
+    def post(self, driver_name, body):
+        """Prefetch images into the caches of the conductors of a driver.
+
+        Every conductor supporting the driver fetches the images into the
+        cache of the interface of the driver using them, so that the nodes
+        deployed with these images do not wait for their download. The
+        images can be evicted from the caches like any other image.
+
+        :param driver_name: name of the driver.
+        :param body: a dictionary with an "images" key, whose value is a
+            list of dictionaries with the "href" of an image and the
+            "interface" of the driver using it: "boot" for the kernels and
+            ramdisks, "deploy" for the instance images.
+        :raises: NotAcceptable, if requested version of the API is less than
+            1.17.
+        :raises: InvalidParameterValue, if the body is not valid.
+        :raises: DriverNotFound, if driver is not loaded on any of the
+            conductors.
+        """
+        if not api_utils.allow_driver_image_cache():
+            raise exception.NotAcceptable()
+
+        images = body.get('images') if isinstance(body, dict) else None
+        if not images or not isinstance(images, list):
+            raise exception.InvalidParameterValue(
+                _('The body must have a non-empty list of "images".'))
+        for image in images:
+            if (not isinstance(image, dict) or
+                    set(image) != {'href', 'interface'} or
+                    not isinstance(image['href'], six.string_types) or
+                    image['interface'] not in
+                    conductor_manager.PREFETCH_INTERFACES):
+                raise exception.InvalidParameterValue(
+                    _('Invalid image %(image)s, expected a dictionary with '
+                      'an "href" and an "interface", one of '
+                      '%(interfaces)s.') %
+                    {'image': image, 'interfaces': ', '.join(
+                        conductor_manager.PREFETCH_INTERFACES)})
+
+        self._get_hosts(driver_name)
+        pecan.request.rpcapi.prefetch_images(pecan.request.context,
+                                             driver_name, images)
+
+
 class DriversController(rest.RestController):
     """REST controller for Drivers."""
 
@@ -218,6 +304,9 @@ class DriversController(rest.RestController):
     raid = DriverRaidController()
     """Expose RAID as a sub-element of drivers"""
 
+    image_cache = DriverImageCacheController()
+    """Expose the image caches as a sub-element of drivers"""
+
     _custom_actions = {
         'properties': ['GET'],
     }
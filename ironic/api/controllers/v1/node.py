@@ -758,10 +758,18 @@ class Node(base.APIBase):
 
     @classmethod
     def convert_with_links(cls, rpc_node, fields=None):
-        node = Node(**rpc_node.as_dict())
-
-        if fields is not None:
-            api_utils.check_for_invalid_fields(fields, node.as_dict())
+        if fields is None:
+            node = Node(**rpc_node.as_dict())
+        else:
+            # NOTE: only read the requested fields, the JSON fields of the
+            # node object are decoded when they are first accessed.
+            needed = set(fields) | set(['uuid'])
+            if 'chassis_uuid' in needed:
+                needed.add('chassis_id')
+            node = Node(**dict((field, rpc_node[field]) for field in needed
+                               if field in rpc_node.fields and
+                               rpc_node.obj_attr_is_set(field)))
+            api_utils.check_for_invalid_fields(fields, node.fields)
 
         update_state_in_older_versions(node)
         hide_fields_in_newer_versions(node)
@@ -984,11 +992,6 @@ class NodesController(rest.RestController):
         limit = api_utils.validate_limit(limit)
         sort_dir = api_utils.validate_sort_dir(sort_dir)
 
-        marker_obj = None
-        if marker:
-            marker_obj = objects.Node.get_by_uuid(pecan.request.context,
-                                                  marker)
-
         if sort_key in self.invalid_sort_key_list:
             raise exception.InvalidParameterValue(
                 _("The sort_key value %(key)s is an invalid field for "
@@ -1009,9 +1012,11 @@ class NodesController(rest.RestController):
             if driver:
                 filters['driver'] = driver
 
-            nodes = objects.Node.list(pecan.request.context, limit, marker_obj,
-                                      sort_key=sort_key, sort_dir=sort_dir,
-                                      filters=filters)
+            # NOTE: the marker is resolved by the query fetching the page,
+            # which raises NodeNotFound if it does not exist.
+            nodes = objects.Node.list(pecan.request.context, limit,
+                                      marker or None, sort_key=sort_key,
+                                      sort_dir=sort_dir, filters=filters)
 
         parameters = {'sort_key': sort_key, 'sort_dir': sort_dir}
         if associated:
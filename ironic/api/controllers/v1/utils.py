@@ -289,6 +289,16 @@ def allow_links_node_states_and_driver_properties():
             versions.MINOR_14_LINKS_NODESTATES_DRIVERPROPERTIES)
 
 
+def allow_driver_image_cache():
+    """Check if image prefetching is allowed for drivers.
+
+    Version 1.17 of the API allows prefetching images into the caches of
+    the conductors of a driver.
+    """
+    return (pecan.request.version.minor >=
+            versions.MINOR_17_DRIVER_IMAGE_CACHE)
+
+
 def get_controller_reserved_names(cls):
     """Get reserved names for a given controller.
 
@@ -46,6 +46,7 @@ BASE_VERSION = 1
 #        2. '/v1/drivers/<driver-name>/properties'
 # v1.15: Add ability to do manual cleaning of nodes
 # v1.16: Add ability to filter nodes by driver.
+# v1.17: Add ability to prefetch images into the caches of a driver.
 
 MINOR_0_JUNO = 0
 MINOR_1_INITIAL_VERSION = 1
@@ -64,11 +65,12 @@ MINOR_13_ABORT_VERB = 13
 MINOR_14_LINKS_NODESTATES_DRIVERPROPERTIES = 14
 MINOR_15_MANUAL_CLEAN = 15
 MINOR_16_DRIVER_FILTER = 16
+MINOR_17_DRIVER_IMAGE_CACHE = 17
 
 # When adding another version, update MINOR_MAX_VERSION and also update
 # doc/source/webapi/v1.rst with a detailed explanation of what the version has
 # changed.
-MINOR_MAX_VERSION = MINOR_16_DRIVER_FILTER
+MINOR_MAX_VERSION = MINOR_17_DRIVER_IMAGE_CACHE
 
 # String representations of the minor and maximum versions
 MIN_VERSION_STRING = '{}.{}'.format(BASE_VERSION, MINOR_1_INITIAL_VERSION)
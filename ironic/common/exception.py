@@ -449,6 +449,11 @@ class NodeNotLocked(Invalid):
     _msg_fmt = _("Node %(node)s found not to be locked on release")
 
 
+class NodeFilterMismatch(Conflict):
+    _msg_fmt = _("Node %(node)s does not match the requested filters "
+                 "%(filters)s.")
+
+
 class NoFreeConductorWorker(TemporaryFailure):
     _msg_fmt = _('Requested action cannot be performed due to lack of free '
                  'conductor workers.')
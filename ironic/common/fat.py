@@ -0,0 +1,477 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Writer of FAT12 and FAT16 file system images.
+
+The images are laid out as mkfs.fat does: a boot sector, two copies of the
+file allocation table, the fixed root directory and the data clusters. Files
+and directories are stored contiguously, in the order they are added, with
+VFAT long file names. No mount, device or privilege is needed, so images can
+be built in memory or written straight to a file.
+"""
+
+import datetime
+import os
+import random
+import re
+import shutil
+import struct
+
+import six
+
+from ironic.common.i18n import _
+
+SECTOR_SIZE = 512
+DIR_ENTRY_SIZE = 32
+NUM_FATS = 2
+MEDIA_DESCRIPTOR = 0xf8
+
+# Highest number of clusters of a FAT12 and of a FAT16 file system
+MAX_FAT12_CLUSTERS = 4084
+MAX_FAT16_CLUSTERS = 65524
+MAX_SECTORS_PER_CLUSTER = 64
+
+ATTR_READ_ONLY = 0x01
+ATTR_HIDDEN = 0x02
+ATTR_SYSTEM = 0x04
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LONG_NAME = (ATTR_READ_ONLY | ATTR_HIDDEN | ATTR_SYSTEM |
+                  ATTR_VOLUME_ID)
+
+# Characters of a long name in each long name directory entry
+LONG_NAME_CHARS = 13
+MAX_LONG_NAME_CHARS = 255
+
+_SHORT_NAME_INVALID_CHARS = re.compile(r'[^A-Z0-9!#$%&\'()@^_`{}~-]')
+
+_BOOT_SECTOR = struct.Struct('<3s8sHBHBHHBHHHLLBBBL11s8s')
+_DIR_ENTRY = struct.Struct('<11sBBBHHHHHHHL')
+_LONG_NAME_ENTRY = struct.Struct('<B10sBBB12sH4s')
+
+
+def _ceil_div(dividend, divisor):
+    return -(-dividend // divisor)
+
+
+def _to_unicode(name):
+    if isinstance(name, six.binary_type):
+        return name.decode('utf-8')
+    return name
+
+
+def _split_short_name(name):
+    """Get the base and extension of a name valid as 8.3 name, or None."""
+    base, dot, ext = name.partition('.')
+    if (not base or len(base) > 8 or len(ext) > 3 or (dot and not ext) or
+            '.' in ext or name != name.upper() or
+            _SHORT_NAME_INVALID_CHARS.search(base + ext)):
+        return None
+    return base, ext
+
+
+def _short_name_basis(name):
+    """Get the base and extension from which a short name is generated."""
+    name = name.upper().lstrip('.')
+    base, dot, ext = name.rpartition('.')
+    if not dot:
+        base, ext = ext, ''
+    base = _SHORT_NAME_INVALID_CHARS.sub('_', base.replace(' ', '')) or '_'
+    ext = _SHORT_NAME_INVALID_CHARS.sub('_', ext.replace(' ', ''))
+    return base, ext[:3]
+
+
+def _short_name_checksum(short_name):
+    checksum = 0
+    for char in six.iterbytes(short_name):
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + char) & 0xff
+    return checksum
+
+
+def _date_time(when):
+    date = (((when.year - 1980) << 9) | (when.month << 5) | when.day)
+    time = (when.hour << 11) | (when.minute << 5) | (when.second // 2)
+    return date, time
+
+
+class _File(object):
+
+    def __init__(self, name, data=None, source=None):
+        self.name = name
+        self.data = data
+        self.source = source
+        self.short_name = None
+        self.first_cluster = 0
+
+    @property
+    def size(self):
+        if self.source is not None:
+            return os.path.getsize(self.source)
+        return len(self.data)
+
+    def write_to(self, fileobj):
+        if self.source is not None:
+            with open(self.source, 'rb') as source:
+                shutil.copyfileobj(source, fileobj)
+        else:
+            fileobj.write(self.data)
+
+
+class _Directory(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.short_name = None
+        self.first_cluster = 0
+        self.children = []
+
+    def get_child(self, name):
+        for child in self.children:
+            if child.name.upper() == name.upper():
+                return child
+
+    def add_child(self, child):
+        used = set(c.short_name for c in self.children)
+        short_name = _split_short_name(child.name)
+        if short_name is not None:
+            child.short_name = (short_name[0].ljust(8) +
+                                short_name[1].ljust(3)).encode('ascii')
+        else:
+            base, ext = _short_name_basis(child.name)
+            for number in six.moves.range(1, 1000000):
+                tail = '~%d' % number
+                candidate = ((base[:8 - len(tail)] + tail).ljust(8) +
+                             ext.ljust(3)).encode('ascii')
+                if candidate not in used:
+                    child.short_name = candidate
+                    break
+            else:
+                raise ValueError(_("Too many files named like %s in the "
+                                   "same directory.") % child.name)
+        if child.short_name in used:
+            raise ValueError(_("The file %s already exists.") % child.name)
+        self.children.append(child)
+
+    @staticmethod
+    def _needs_long_name(child):
+        return _split_short_name(child.name) is None
+
+    def entry_count(self, is_root):
+        """Get the number of directory entries used by the directory."""
+        # The volume label in the root directory, "." and ".." in the others
+        count = 1 if is_root else 2
+        for child in self.children:
+            count += 1
+            if self._needs_long_name(child):
+                # Characters out of the BMP take two UTF-16 code units
+                units = len(child.name.encode('utf-16-le')) // 2
+                count += _ceil_div(units, LONG_NAME_CHARS)
+        return count
+
+    def entries(self, is_root, label, parent_cluster, date, time):
+        """Get the directory entries of the directory, as bytes."""
+        entries = []
+        if is_root:
+            entries.append(_DIR_ENTRY.pack(label, ATTR_VOLUME_ID, 0, 0, 0, 0,
+                                           0, 0, time, date, 0, 0))
+        else:
+            for name, cluster in ((b'.', self.first_cluster),
+                                  (b'..', parent_cluster)):
+                entries.append(_DIR_ENTRY.pack(
+                    name.ljust(11), ATTR_DIRECTORY, 0, 0, time, date, date,
+                    cluster >> 16, time, date, cluster & 0xffff, 0))
+
+        for child in self.children:
+            if self._needs_long_name(child):
+                entries.extend(self._long_name_entries(child))
+            if isinstance(child, _Directory):
+                attributes, size = ATTR_DIRECTORY, 0
+            else:
+                attributes, size = ATTR_ARCHIVE, child.size
+            cluster = child.first_cluster
+            entries.append(_DIR_ENTRY.pack(
+                child.short_name, attributes, 0, 0, time, date, date,
+                cluster >> 16, time, date, cluster & 0xffff, size))
+        return b''.join(entries)
+
+    @staticmethod
+    def _long_name_entries(child):
+        checksum = _short_name_checksum(child.short_name)
+        name = child.name.encode('utf-16-le')
+        # The name is terminated by a null character if it does not fill
+        # the last entry, then padded with 0xFFFF
+        chunk_size = LONG_NAME_CHARS * 2
+        count = _ceil_div(len(name), chunk_size)
+        if len(name) < count * chunk_size:
+            name += b'\0\0'
+        name = name.ljust(count * chunk_size, b'\xff')
+
+        entries = []
+        for index in range(count):
+            chunk = name[index * chunk_size:(index + 1) * chunk_size]
+            order = index + 1
+            if order == count:
+                order |= 0x40
+            entries.append(_LONG_NAME_ENTRY.pack(
+                order, chunk[:10], ATTR_LONG_NAME, 0, checksum, chunk[10:22],
+                0, chunk[22:]))
+        # The entries are stored last part first
+        return reversed(entries)
+
+
+class FatImage(object):
+    """A FAT12 or FAT16 file system image.
+
+    Files are added with add_file() or add_data(), then the image is written
+    with write() or to_bytes().
+    """
+
+    def __init__(self, size_kib, label=None, volume_id=None, when=None):
+        """Create an empty image.
+
+        :param size_kib: the size of the image in KiB.
+        :param label: the volume label, up to 11 characters. Like mkfs.fat,
+                      its case is kept, since it is used to find the file
+                      system by label.
+        :param volume_id: the 32-bit volume serial number. Random if None.
+        :param when: the datetime of the files and directories. The current
+                     time if None.
+        :raises: ValueError, if the image is too small or too big for
+                 FAT12 and FAT16, or the label is too long.
+        """
+        self.total_sectors = size_kib * 1024 // SECTOR_SIZE
+        label = label or 'NO NAME'
+        if len(label) > 11:
+            raise ValueError(_("The label %s is longer than 11 "
+                               "characters.") % label)
+        self.label = label.ljust(11).encode('ascii')
+        if volume_id is None:
+            volume_id = random.getrandbits(32)
+        self.volume_id = volume_id
+        self.when = when or datetime.datetime.now()
+        self.root = _Directory('')
+
+        # Floppy sized images get as few root directory entries as a floppy
+        self.root_entries = 224 if size_kib <= 2880 else 512
+        self.root_dir_sectors = (self.root_entries * DIR_ENTRY_SIZE //
+                                 SECTOR_SIZE)
+        self._compute_geometry()
+
+    def _compute_geometry(self):
+        sectors_per_cluster = 1
+        while True:
+            fat_sectors = 1
+            while True:
+                data_sectors = (self.total_sectors - 1 -
+                                NUM_FATS * fat_sectors -
+                                self.root_dir_sectors)
+                clusters = data_sectors // sectors_per_cluster
+                fat_bits = 12 if clusters <= MAX_FAT12_CLUSTERS else 16
+                needed = _ceil_div(
+                    _ceil_div((clusters + 2) * fat_bits, 8), SECTOR_SIZE)
+                if needed <= fat_sectors:
+                    break
+                fat_sectors = needed
+            if clusters <= MAX_FAT16_CLUSTERS:
+                break
+            sectors_per_cluster *= 2
+            if sectors_per_cluster > MAX_SECTORS_PER_CLUSTER:
+                raise ValueError(_("The image is too big for FAT16."))
+        if clusters < 1:
+            raise ValueError(_("The image is too small for a FAT file "
+                               "system."))
+        self.sectors_per_cluster = sectors_per_cluster
+        self.cluster_size = sectors_per_cluster * SECTOR_SIZE
+        self.fat_sectors = fat_sectors
+        self.clusters = clusters
+        self.fat_bits = fat_bits
+        self.data_offset = (1 + NUM_FATS * fat_sectors +
+                            self.root_dir_sectors) * SECTOR_SIZE
+
+    def _get_directory(self, names):
+        directory = self.root
+        for name in names:
+            child = directory.get_child(name)
+            if child is None:
+                child = _Directory(name)
+                directory.add_child(child)
+            elif not isinstance(child, _Directory):
+                raise ValueError(_("%s is a file, not a directory.") % name)
+            directory = child
+        return directory
+
+    def _add(self, path, data=None, source=None):
+        names = [_to_unicode(n) for n in path.split('/') if n]
+        if not names:
+            raise ValueError(_("The path of a file cannot be empty."))
+        for name in names:
+            if name in ('.', '..') or len(name) > MAX_LONG_NAME_CHARS:
+                raise ValueError(_("%s is not a valid file name.") % name)
+        directory = self._get_directory(names[:-1])
+        if directory.get_child(names[-1]) is not None:
+            raise ValueError(_("The file %s already exists.") % path)
+        directory.add_child(_File(names[-1], data=data, source=source))
+
+    def add_data(self, path, data):
+        """Add a file with some content.
+
+        :param path: the path of the file in the image, with '/' separated
+                     directories, created as needed.
+        :param data: the content of the file, as bytes or text encoded to
+                     UTF-8.
+        :raises: ValueError, if the path is not valid.
+        """
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        self._add(path, data=data)
+
+    def add_file(self, path, source):
+        """Add a copy of a file.
+
+        :param path: the path of the file in the image, with '/' separated
+                     directories, created as needed.
+        :param source: the path of the file to copy, read by write().
+        :raises: ValueError, if the path is not valid.
+        """
+        self._add(path, source=source)
+
+    def _layout(self):
+        """Allocate the clusters of all files and directories.
+
+        :returns: a list of (file or directory, parent directory or None,
+                  number of clusters) tuples, in the order of their
+                  clusters.
+        """
+        if self.root.entry_count(True) > self.root_entries:
+            raise ValueError(_("Too many files in the root directory."))
+
+        allocations = []
+        next_cluster = [2]
+
+        def allocate(node, parent, size):
+            count = _ceil_div(size, self.cluster_size)
+            node.first_cluster = next_cluster[0] if count else 0
+            next_cluster[0] += count
+            allocations.append((node, parent, count))
+
+        def visit(directory):
+            for child in directory.children:
+                if isinstance(child, _Directory):
+                    allocate(child, directory,
+                             child.entry_count(False) * DIR_ENTRY_SIZE)
+                    visit(child)
+                else:
+                    allocate(child, directory, child.size)
+
+        visit(self.root)
+        if next_cluster[0] - 2 > self.clusters:
+            raise ValueError(_("The files need %(needed)d clusters, but the "
+                               "image has only %(clusters)d.") %
+                             {'needed': next_cluster[0] - 2,
+                              'clusters': self.clusters})
+        return allocations
+
+    def _boot_sector(self):
+        total_16, total_32 = self.total_sectors, 0
+        if self.total_sectors > 0xffff:
+            total_16, total_32 = 0, self.total_sectors
+        fs_type = b'FAT12   ' if self.fat_bits == 12 else b'FAT16   '
+        sector = _BOOT_SECTOR.pack(
+            b'\xeb\x3c\x90', b'mkfs.fat', SECTOR_SIZE,
+            self.sectors_per_cluster, 1, NUM_FATS, self.root_entries,
+            total_16, MEDIA_DESCRIPTOR, self.fat_sectors, 32, 64, 0,
+            total_32, 0x80, 0, 0x29, self.volume_id, self.label, fs_type)
+        # Boot code printing nothing and halting, then the signature
+        sector += b'\xfa\xf4\xeb\xfd'
+        return sector.ljust(SECTOR_SIZE - 2, b'\0') + b'\x55\xaa'
+
+    def _fat(self, allocations):
+        end_of_chain = (1 << self.fat_bits) - 1
+        entries = [((end_of_chain >> 8) << 8) | MEDIA_DESCRIPTOR,
+                   end_of_chain]
+        for node, parent, count in allocations:
+            first = node.first_cluster
+            entries.extend(range(first + 1, first + count))
+            if count:
+                entries.append(end_of_chain)
+
+        if self.fat_bits == 16:
+            fat = struct.pack('<%dH' % len(entries), *entries)
+        else:
+            if len(entries) % 2:
+                entries.append(0)
+            fat = bytearray()
+            for index in range(0, len(entries), 2):
+                pair = entries[index] | (entries[index + 1] << 12)
+                fat.extend(struct.pack('<I', pair)[:3])
+            fat = bytes(fat)
+        return fat.ljust(self.fat_sectors * SECTOR_SIZE, b'\0')
+
+    def write(self, fileobj):
+        """Write the image.
+
+        :param fileobj: a binary file object, open for writing and seekable,
+                        positioned at the start of the image.
+        :raises: ValueError, if the files do not fit into the image.
+        :raises: IOError or OSError, if reading a copied file or writing
+                 the image fails.
+        """
+        allocations = self._layout()
+        date, time = _date_time(self.when)
+        start = fileobj.tell()
+
+        fileobj.write(self._boot_sector())
+        fat = self._fat(allocations)
+        for index in range(NUM_FATS):
+            fileobj.write(fat)
+        root = self.root.entries(True, self.label, 0, date, time)
+        fileobj.write(root.ljust(self.root_dir_sectors * SECTOR_SIZE, b'\0'))
+
+        for node, parent, count in allocations:
+            if not count:
+                continue
+            fileobj.seek(start + self.data_offset +
+                         (node.first_cluster - 2) * self.cluster_size)
+            if isinstance(node, _Directory):
+                # ".." refers to the root directory as cluster 0
+                fileobj.write(node.entries(False, None, parent.first_cluster,
+                                           date, time))
+            else:
+                node.write_to(fileobj)
+
+        # Directories are zero filled up to the end of their clusters, the
+        # free space is left as is
+        end = start + self.total_sectors * SECTOR_SIZE
+        fileobj.seek(end - 1)
+        fileobj.write(b'\0')
+        fileobj.seek(end)
+
+    def to_bytes(self):
+        """Get the image as bytes.
+
+        :raises: ValueError, if the files do not fit into the image.
+        """
+        fileobj = six.BytesIO()
+        self.write(fileobj)
+        return fileobj.getvalue()
+
+    def write_to_file(self, path):
+        """Write the image to a new file, or over an existing file.
+
+        :param path: the path of the file.
+        :raises: ValueError, if the files do not fit into the image.
+        :raises: IOError or OSError, if writing the file fails.
+        """
+        with open(path, 'wb') as fileobj:
+            self.write(fileobj)
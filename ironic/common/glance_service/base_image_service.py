@@ -28,6 +28,7 @@ import six
 import six.moves.urllib.parse as urlparse
 
 from ironic.common import exception
+from ironic.common.glance_service import metadata_cache
 from ironic.common.glance_service import service_utils
 from ironic.common.i18n import _LE
 
@@ -173,16 +174,22 @@ class BaseImageService(object):
     def _show(self, image_href, method='get'):
         """Returns a dict with image data for the given opaque image id.
 
+        The result is cached, see metadata_cache.
+
         :param image_id: The opaque image identifier.
         :returns: A dict containing image metadata.
 
         :raises: ImageNotFound
         """
-        LOG.debug("Getting image metadata from glance. Image: %s"
-                  % image_href)
         (image_id, self.glance_host,
          self.glance_port, use_ssl) = service_utils.parse_image_ref(image_href)
+        return metadata_cache.IMAGE_METADATA_CACHE.get(
+            image_id, self.version, self.context,
+            lambda: self._show_uncached(image_id, method))
 
+    def _show_uncached(self, image_id, method):
+        LOG.debug("Getting image metadata from glance. Image: %s"
+                  % image_id)
         image = self.call(method, image_id)
 
         if not service_utils.is_image_available(self.context, image):
@@ -266,6 +273,7 @@ class BaseImageService(object):
         image_meta.pop('id', None)
 
         image_meta = self.call(method, image_id, **image_meta)
+        metadata_cache.invalidate(image_id)
 
         if self.version == 2 and data:
             self.call('upload', image_id, data)
@@ -287,4 +295,7 @@ class BaseImageService(object):
         (image_id, glance_host,
          glance_port, use_ssl) = service_utils.parse_image_ref(image_id)
 
-        self.call(method, image_id)
+        try:
+            self.call(method, image_id)
+        finally:
+            metadata_cache.invalidate(image_id)
@@ -0,0 +1,128 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache of the image metadata returned by Glance.
+
+A deployment asks Glance for the metadata of the same images many times
+(image size, properties, whether it is a whole disk image, whether the
+cached copy is stale, ...). The metadata is kept for
+[glance]image_metadata_cache_ttl seconds, so that these calls do not all
+go to Glance.
+"""
+
+import collections
+import copy
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+from ironic.common.i18n import _
+
+LOG = log.getLogger(__name__)
+
+opts = [
+    cfg.IntOpt('image_metadata_cache_ttl',
+               default=0, min=0,
+               help=_('Time in seconds during which the metadata of an image '
+                      'returned by Glance is cached by each ironic process. '
+                      'Changes made to an image outside of ironic may not be '
+                      'seen during this time. 0 disables the cache.')),
+    cfg.IntOpt('image_metadata_cache_size',
+               default=1000, min=1,
+               help=_('Maximum number of images whose metadata is cached. '
+                      'The least recently used entry is dropped when the '
+                      'cache is full.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group='glance')
+
+_Entry = collections.namedtuple('_Entry', ['expires_at', 'image_meta'])
+
+
+class ImageMetadataCache(object):
+    """Size-bounded cache of image metadata, with a time to live.
+
+    Entries are keyed by the image ID, the version of the Glance API used
+    and the project (tenant) of the request context, since the images
+    visible to a project depend on it.
+    """
+
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, image_id, version, context, fetch):
+        """Get the metadata of an image, fetching it if not cached.
+
+        :param image_id: the ID of the image.
+        :param version: the version of the Glance API used.
+        :param context: the request context, or None.
+        :param fetch: function called without arguments to get the metadata
+                      from Glance. Its exceptions are not cached.
+        :returns: a copy of the metadata of the image.
+        """
+        ttl = CONF.glance.image_metadata_cache_ttl
+        if not ttl:
+            return fetch()
+
+        key = (image_id, version, getattr(context, 'tenant', None))
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry.expires_at > time.time():
+                # Keep the most recently used entry at the end
+                self._entries[key] = entry
+                self.hits += 1
+                return copy.deepcopy(entry.image_meta)
+            self.misses += 1
+
+        image_meta = fetch()
+        LOG.debug("Caching the metadata of image %(image)s for %(ttl)s "
+                  "seconds, %(hits)d hits and %(misses)d misses so far.",
+                  {'image': image_id, 'ttl': ttl, 'hits': self.hits,
+                   'misses': self.misses})
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = _Entry(time.time() + ttl,
+                                        copy.deepcopy(image_meta))
+            while len(self._entries) > CONF.glance.image_metadata_cache_size:
+                self._entries.popitem(last=False)
+        return image_meta
+
+    def invalidate(self, image_id=None):
+        """Drop cached metadata.
+
+        :param image_id: the ID of the image whose metadata is dropped for
+                         all projects. All entries are dropped if None.
+        """
+        with self._lock:
+            if image_id is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == image_id]:
+                del self._entries[key]
+
+
+IMAGE_METADATA_CACHE = ImageMetadataCache()
+
+
+def invalidate(image_id=None):
+    """Drop the cached metadata of an image, or of all images if None."""
+    IMAGE_METADATA_CACHE.invalidate(image_id)
@@ -14,6 +14,8 @@
 #    under the License.
 
 import collections
+import heapq
+import threading
 import time
 
 from oslo_config import cfg
@@ -58,6 +60,11 @@ glance_opts = [
                 help=_('Whether to cache generated Swift temporary URLs. '
                        'Setting it to true is only useful when an image '
                        'caching proxy is used. Defaults to False.')),
+    cfg.IntOpt('swift_temp_url_cache_size',
+               default=1000, min=1,
+               help=_('Maximum number of Swift temporary URLs cached when '
+                      'swift_temp_url_cache_enabled is True. The URLs '
+                      'expiring first are dropped when the cache is full.')),
     cfg.IntOpt('swift_temp_url_expected_download_start_delay',
                default=0, min=0,
                help=_('This is the delay (in seconds) from the time of the '
@@ -127,18 +134,80 @@ TempUrlCacheElement = collections.namedtuple('TempUrlCacheElement',
                                              ['url', 'url_expires_at'])
 
 
+class TempUrlCache(object):
+    """Swift temporary URLs of images, shared by all the service objects.
+
+    The URLs are indexed by image ID, and also kept in a heap ordered by
+    expiration time so that expired URLs are dropped without looking at
+    the others.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        # (url_expires_at, image_id) tuples, some of them possibly stale:
+        # an entry only counts if it is still the one in self._entries.
+        self._heap = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, image_id):
+        return image_id in self._entries
+
+    def __getitem__(self, image_id):
+        return self._entries[image_id]
+
+    def __setitem__(self, image_id, element):
+        with self._lock:
+            self._entries[image_id] = element
+            heapq.heappush(self._heap, (element.url_expires_at, image_id))
+            while len(self._entries) > CONF.glance.swift_temp_url_cache_size:
+                self._pop()
+            # Do not let stale heap entries pile up when URLs are replaced
+            if len(self._heap) > 2 * len(self._entries):
+                self._heap = [(e.url_expires_at, i)
+                              for i, e in six.iteritems(self._entries)]
+                heapq.heapify(self._heap)
+
+    def _pop(self):
+        expires_at, image_id = heapq.heappop(self._heap)
+        element = self._entries.get(image_id)
+        if element is not None and element.url_expires_at == expires_at:
+            del self._entries[image_id]
+
+    def get(self, image_id):
+        """Get the cached URL of an image, counting hits and misses.
+
+        :param image_id: UUID of a Glance image.
+        :returns: the temporary URL, or None if it is not cached.
+        """
+        with self._lock:
+            element = self._entries.get(image_id)
+            if element is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return element.url
+
+    def remove_expired(self, max_valid_time):
+        """Drop the URLs expiring before a time.
+
+        :param max_valid_time: the time, in seconds since the epoch.
+        """
+        with self._lock:
+            while self._heap and self._heap[0][0] < max_valid_time:
+                self._pop()
+
+
 class GlanceImageService(base_image_service.BaseImageService,
                          service.ImageService):
 
-    # A dictionary containing cached temp URLs in namedtuples
-    # in format:
-    # {
-    #     <image_id> : (
-    #          url=<temp_url>,
-    #          url_expires_at=<expiration_time>
-    #     )
-    # }
-    _cache = {}
+    # The cached temp URLs, as TempUrlCacheElement namedtuples indexed by
+    # image ID. It is shared by all the instances of this class.
+    _cache = TempUrlCache()
 
     def detail(self, **kwargs):
         return self._detail(method='list', **kwargs)
@@ -182,8 +251,9 @@ class GlanceImageService(base_image_service.BaseImageService,
 
         if CONF.glance.swift_temp_url_cache_enabled:
             self._remove_expired_items_from_cache()
-            if image_id in self._cache:
-                return self._cache[image_id].url
+            temp_url = self._cache.get(image_id)
+            if temp_url is not None:
+                return temp_url
 
         path = swift_utils.generate_temp_url(
             path=path, seconds=seconds, key=key, method=method)
@@ -354,8 +424,4 @@ class GlanceImageService(base_image_service.BaseImageService,
         max_valid_time = (
             int(time.time()) +
             CONF.glance.swift_temp_url_expected_download_start_delay)
-        keys_to_remove = [
-            k for k, v in six.iteritems(self._cache)
-            if (v.url_expires_at < max_valid_time)]
-        for k in keys_to_remove:
-            del self._cache[k]
+        self._cache.remove_expired(max_valid_time)
@@ -56,6 +56,30 @@ hash_opts = [
 CONF = cfg.CONF
 CONF.register_opts(hash_opts)
 
+HASH_BUCKET_BITS = 31
+"""Number of bits of the ring position kept in a hash bucket.
+
+This fits a signed 32 bit integer column in any database.
+"""
+
+_HASH_BITS = 128
+_BUCKET_SHIFT = _HASH_BITS - HASH_BUCKET_BITS
+
+
+def get_hash_bucket(data):
+    """Get the hash bucket of a string identifier.
+
+    The bucket consists of the most significant bits of the identifier's
+    position on the ring, so that the partitions of a ring can be turned
+    into ranges of buckets (see :meth:`HashRing.get_bucket_ranges`).
+
+    :param data: A string identifier, e.g. a node UUID.
+    :returns: An integer between 0 and 2 ** HASH_BUCKET_BITS - 1.
+    """
+    if six.PY3:
+        data = data.encode('utf-8')
+    return int(hashlib.md5(data).hexdigest(), 16) >> _BUCKET_SHIFT
+
 
 class HashRing(object):
     """A stable hash ring.
@@ -82,6 +106,7 @@ class HashRing(object):
         if replicas is None:
             replicas = CONF.hash_distribution_replicas
 
+        self.partition_exponent = CONF.hash_partition_exponent
         try:
             self.hosts = set(hosts)
             self.replicas = replicas if replicas <= len(hosts) else len(hosts)
@@ -89,17 +114,20 @@ class HashRing(object):
             raise exception.Invalid(
                 _("Invalid hosts supplied when building HashRing."))
 
-        self._host_hashes = {}
+        host_hashes = {}
         for host in hosts:
             key = str(host).encode('utf8')
             key_hash = hashlib.md5(key)
-            for p in range(2 ** CONF.hash_partition_exponent):
+            for p in range(2 ** self.partition_exponent):
                 key_hash.update(key)
                 hashed_key = self._hash2int(key_hash)
-                self._host_hashes[hashed_key] = host
+                host_hashes[hashed_key] = host
         # Gather the (possibly colliding) resulting hashes into a bisectable
-        # list.
-        self._partitions = sorted(self._host_hashes.keys())
+        # list, and the hosts serving them into a list with the same order,
+        # so that looking up a host is a plain index operation.
+        self._partitions = sorted(host_hashes)
+        self._partition_hosts = [host_hashes[h] for h in self._partitions]
+        self._bucket_ranges = {}
 
     def _hash2int(self, key_hash):
         """Convert the given hash's digest to a numerical value for the ring.
@@ -120,26 +148,18 @@ class HashRing(object):
             raise exception.Invalid(
                 _("Invalid data supplied to HashRing.get_hosts."))
 
-    def get_hosts(self, data, ignore_hosts=None):
-        """Get the list of hosts which the supplied data maps onto.
+    def _get_ignore_hosts(self, ignore_hosts):
+        if ignore_hosts is None:
+            return set()
+        ignore_hosts = set(ignore_hosts)
+        ignore_hosts.intersection_update(self.hosts)
+        return ignore_hosts
+
+    def _get_hosts_for_partition(self, partition, ignore_hosts):
+        if self.replicas == 1 and not ignore_hosts:
+            return [self._partition_hosts[partition]]
 
-        :param data: A string identifier to be mapped across the ring.
-        :param ignore_hosts: A list of hosts to skip when performing the hash.
-                             Useful to temporarily skip down hosts without
-                             performing a full rebalance.
-                             Default: None.
-        :returns: a list of hosts.
-                  The length of this list depends on the number of replicas
-                  this `HashRing` was created with. It may be less than this
-                  if ignore_hosts is not None.
-        """
         hosts = []
-        if ignore_hosts is None:
-            ignore_hosts = set()
-        else:
-            ignore_hosts = set(ignore_hosts)
-            ignore_hosts.intersection_update(self.hosts)
-        partition = self._get_partition(data)
         for replica in range(0, self.replicas):
             if len(hosts) + len(ignore_hosts) == len(self.hosts):
                 # prevent infinite loop - cannot allocate more fallbacks.
@@ -154,6 +174,108 @@ class HashRing(object):
             hosts.append(host)
         return hosts
 
+    def get_hosts(self, data, ignore_hosts=None):
+        """Get the list of hosts which the supplied data maps onto.
+
+        :param data: A string identifier to be mapped across the ring.
+        :param ignore_hosts: A list of hosts to skip when performing the hash.
+                             Useful to temporarily skip down hosts without
+                             performing a full rebalance.
+                             Default: None.
+        :returns: a list of hosts.
+                  The length of this list depends on the number of replicas
+                  this `HashRing` was created with. It may be less than this
+                  if ignore_hosts is not None.
+        """
+        ignore_hosts = self._get_ignore_hosts(ignore_hosts)
+        partition = self._get_partition(data)
+        return self._get_hosts_for_partition(partition, ignore_hosts)
+
+    def get_hosts_many(self, data_list, ignore_hosts=None):
+        """Get the lists of hosts which each of the supplied data maps onto.
+
+        This is equivalent to calling :meth:`get_hosts` for every item, but
+        it only prepares ignore_hosts once and avoids the per call overhead,
+        which matters when mapping thousands of identifiers at a time.
+
+        :param data_list: An iterable of string identifiers to be mapped
+                          across the ring.
+        :param ignore_hosts: A list of hosts to skip when performing the hash.
+                             Default: None.
+        :returns: a list with a list of hosts for each item of data_list,
+                  in the same order.
+        """
+        ignore_hosts = self._get_ignore_hosts(ignore_hosts)
+        if self.replicas != 1 or ignore_hosts:
+            return [self._get_hosts_for_partition(self._get_partition(data),
+                                                  ignore_hosts)
+                    for data in data_list]
+
+        # Fast path for the common case of a single replica: the same as
+        # _get_partition() and _get_host(), with everything bound to locals.
+        partitions = self._partitions
+        partition_hosts = self._partition_hosts
+        count = len(partitions)
+        md5 = hashlib.md5
+        bisect_right = bisect.bisect
+        result = []
+        try:
+            for data in data_list:
+                if six.PY3 and data is not None:
+                    data = data.encode('utf-8')
+                position = bisect_right(partitions,
+                                        int(md5(data).hexdigest(), 16))
+                result.append([partition_hosts[position
+                                               if position < count else 0]])
+        except TypeError:
+            raise exception.Invalid(
+                _("Invalid data supplied to HashRing.get_hosts_many."))
+        return result
+
+    def get_bucket_ranges(self, host):
+        """Get the ranges of hash buckets which a host is serving.
+
+        Any identifier mapped onto the host by :meth:`get_hosts` has its
+        bucket (see :func:`get_hash_bucket`) in one of these ranges. As
+        buckets are coarser than ring positions, identifiers close to the
+        boundary of a partition may fall into a range and still be mapped
+        onto another host.
+
+        :param host: A host of this ring.
+        :returns: a sorted list of (first, last) tuples of bucket numbers,
+                  inclusive. The list is empty if the host is not serving
+                  any partition.
+        """
+        try:
+            return self._bucket_ranges[host]
+        except KeyError:
+            pass
+
+        positions = []
+        for index, upper in enumerate(self._partitions):
+            if host not in self._get_hosts_for_partition(index, set()):
+                continue
+            if index == 0:
+                # The first partition also takes the positions after
+                # the last divider.
+                positions.append((0, upper))
+                positions.append((self._partitions[-1], 2 ** _HASH_BITS))
+            else:
+                positions.append((self._partitions[index - 1], upper))
+
+        ranges = []
+        for start, end in sorted(positions):
+            if start >= end:
+                continue
+            first, last = start >> _BUCKET_SHIFT, (end - 1) >> _BUCKET_SHIFT
+            if ranges and first <= ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], max(last, ranges[-1][1]))
+            else:
+                ranges.append((first, last))
+
+        self._bucket_ranges[host] = ranges
+        return ranges
+
     def _get_host(self, partition):
         """Find what host is serving a partition.
 
@@ -161,16 +283,20 @@ class HashRing(object):
             e.g. 0 is the first partition, 1 is the second.
         :return: The host object the ring was constructed with.
         """
-        return self._host_hashes[self._partitions[partition]]
+        return self._partition_hosts[partition]
 
 
 class HashRingManager(object):
     _hash_rings = None
     _lock = threading.Lock()
+    # NOTE: shared like the rings themselves, since a new manager is
+    # created e.g. for every API request.
+    updated_at = 0
+    # Last check-in of the conductors when the rings were loaded
+    heartbeats = {}
 
     def __init__(self):
         self.dbapi = dbapi.get_instance()
-        self.updated_at = time.time()
 
     @property
     def ring(self):
@@ -184,17 +310,48 @@ class HashRingManager(object):
             if self.__class__._hash_rings is None or self.updated_at < limit:
                 rings = self._load_hash_rings()
                 self.__class__._hash_rings = rings
-                self.updated_at = time.time()
+                self.__class__.updated_at = time.time()
             return self.__class__._hash_rings
 
+    def refresh(self, interval=0):
+        """Re-read conductor membership and update the rings.
+
+        Unlike :meth:`reset`, only the rings of drivers whose set of
+        conductors has changed are rebuilt, the others are kept as they are.
+
+        :param interval: do nothing if membership was read less than this
+                         number of seconds ago. Default: 0, always re-read.
+        """
+        if (interval and self.__class__._hash_rings is not None and
+                self.updated_at >= time.time() - interval):
+            return
+
+        with self._lock:
+            self.__class__._hash_rings = self._load_hash_rings()
+            self.__class__.updated_at = time.time()
+
     def _load_hash_rings(self):
         rings = {}
         d2c = self.dbapi.get_active_driver_dict()
+        self.__class__.heartbeats = (
+            self.dbapi.get_active_conductor_heartbeats())
+        old_rings = self.__class__._hash_rings or {}
 
         for driver_name, hosts in d2c.items():
-            rings[driver_name] = HashRing(hosts)
+            ring = old_rings.get(driver_name)
+            if ring is None or not self._is_ring_current(ring, hosts):
+                ring = HashRing(hosts)
+            rings[driver_name] = ring
         return rings
 
+    @staticmethod
+    def _is_ring_current(ring, hosts):
+        """Check whether a ring can still be used for the given hosts."""
+        replicas = min(CONF.hash_distribution_replicas, len(hosts))
+        return (ring.hosts == set(hosts) and
+                ring.replicas == replicas and
+                ring.partition_exponent == CONF.hash_partition_exponent)
+
     @classmethod
     def reset(cls):
         with cls._lock:
@@ -17,10 +17,14 @@
 
 import abc
 import datetime
+import io
 import os
 import shutil
 
+import eventlet
 from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import excutils
 from oslo_utils import importutils
 import requests
 import sendfile
@@ -30,12 +34,17 @@ import six.moves.urllib.parse as urlparse
 
 from ironic.common import exception
 from ironic.common.i18n import _
+from ironic.common.i18n import _LW
 from ironic.common import keystone
 from ironic.common import utils
 
 
 IMAGE_CHUNK_SIZE = 1024 * 1024  # 1mb
 
+# The file objects which byte ranges can be written around, by opening
+# their path again.
+_PLAIN_FILE_TYPES = (io.IOBase,) + ((file,) if six.PY2 else ())  # noqa
+
 
 CONF = cfg.CONF
 # Import this opt early so that it is available when registering
@@ -79,6 +88,31 @@ glance_opts = [
 
 CONF.register_opts(glance_opts, group='glance')
 
+http_opts = [
+    cfg.IntOpt('http_download_segments',
+               default=1, min=1,
+               help=_('Number of byte ranges of an image downloaded '
+                      'concurrently from an HTTP(S) server, if the server '
+                      'supports range requests. The image is downloaded as a '
+                      'single stream otherwise.')),
+    cfg.IntOpt('http_download_min_segment_size',
+               default=64, min=1,
+               help=_('Minimum size in MiB of the byte ranges an image is '
+                      'split into when downloaded from an HTTP(S) server. '
+                      'Smaller images are downloaded with fewer concurrent '
+                      'requests.')),
+    cfg.IntOpt('http_download_retries',
+               default=0, min=0,
+               help=_('Number of times the download of a byte range of an '
+                      'image from an HTTP(S) server is resumed from where it '
+                      'stopped after a connection error. Only used if the '
+                      'server supports range requests.')),
+]
+
+CONF.register_opts(http_opts)
+
+LOG = logging.getLogger(__name__)
+
 
 def import_versioned_module(version, submodule=None):
     module = 'ironic.common.glance_service.v%s' % version
@@ -157,6 +191,13 @@ class HttpImageService(BaseImageService):
     def download(self, image_href, image_file):
         """Downloads image to specified location.
 
+        If the server supports range requests, image_file is a plain file
+        (or a utils.FileWrapper around one) and
+        [DEFAULT]http_download_segments or [DEFAULT]http_download_retries
+        are set, the image is split into byte ranges downloaded concurrently
+        into the file, and the download of a range is resumed after a
+        connection error. It is downloaded as a single stream otherwise.
+
         :param image_href: Image reference.
         :param image_file: File object to write data to.
         :raises: exception.ImageRefValidationFailed if GET request returned
@@ -165,6 +206,20 @@ class HttpImageService(BaseImageService):
             * IOError happened during file write;
             * GET request failed.
         """
+        if (CONF.http_download_segments > 1 or
+                CONF.http_download_retries > 0):
+            plain_file = image_file
+            if isinstance(image_file, utils.FileWrapper):
+                plain_file = image_file.wrapped_file
+            size = self._get_ranged_size(image_href, plain_file)
+            if size is not None:
+                self._download_ranges(image_href, plain_file, size)
+                if plain_file is not image_file:
+                    image_file.written_directly()
+                return
+        self._download_stream(image_href, image_file)
+
+    def _download_stream(self, image_href, image_file):
         try:
             response = requests.get(image_href, stream=True)
             if response.status_code != http_client.OK:
@@ -178,6 +233,124 @@ class HttpImageService(BaseImageService):
             raise exception.ImageDownloadFailed(image_href=image_href,
                                                 reason=e)
 
+    def _get_ranged_size(self, image_href, image_file):
+        """Find whether an image can be downloaded by byte ranges.
+
+        :param image_href: Image reference.
+        :param image_file: File object to write data to. Byte ranges are
+            written through other file objects opened on the same path, so
+            it must be a plain named file.
+        :returns: the size of the image, or None if it has to be downloaded
+            as a single stream.
+        """
+        if not isinstance(image_file, _PLAIN_FILE_TYPES):
+            return None
+        path = getattr(image_file, 'name', None)
+        if not isinstance(path, six.string_types) or not os.path.isfile(path):
+            return None
+        try:
+            response = requests.head(image_href,
+                                     headers={'Accept-Encoding': 'identity'})
+        except requests.RequestException as e:
+            LOG.warning(_LW("Cannot find whether %(image)s can be downloaded "
+                            "by byte ranges, downloading it as a single "
+                            "stream: %(error)s"),
+                        {'image': image_href, 'error': e})
+            return None
+        if (response.status_code != http_client.OK or
+                'bytes' not in response.headers.get('Accept-Ranges', '') or
+                response.headers.get('Content-Encoding',
+                                     'identity') != 'identity'):
+            return None
+        try:
+            size = int(response.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return None
+        return size if size > 0 else None
+
+    def _download_ranges(self, image_href, image_file, size):
+        min_size = CONF.http_download_min_segment_size * 1024 * 1024
+        count = max(1, min(CONF.http_download_segments, size // min_size))
+        bounds = [size * i // count for i in range(count + 1)]
+        try:
+            # Preallocate the file, the ranges are written in place
+            image_file.truncate(size)
+            image_file.flush()
+        except IOError as e:
+            raise exception.ImageDownloadFailed(image_href=image_href,
+                                                reason=e)
+
+        pool = eventlet.GreenPool(count)
+        threads = [pool.spawn(self._download_range, image_href,
+                              image_file.name, bounds[i], bounds[i + 1] - 1)
+                   for i in range(count)]
+        try:
+            for thread in threads:
+                thread.wait()
+        except BaseException:
+            with excutils.save_and_reraise_exception():
+                # Stop the other ranges, the image is incomplete anyway
+                for thread in threads:
+                    thread.kill()
+
+    def _download_range(self, image_href, path, start, end):
+        """Download a byte range of an image, resuming on connection errors.
+
+        :param image_href: Image reference.
+        :param path: the path of the file to write data to.
+        :param start: offset of the first byte of the range.
+        :param end: offset of the last byte of the range.
+        :raises: exception.ImageDownloadFailed if the range could not be
+            downloaded after [DEFAULT]http_download_retries retries.
+        """
+        offset = start
+        retries = CONF.http_download_retries
+        try:
+            output = open(path, 'r+b')
+        except IOError as e:
+            raise exception.ImageDownloadFailed(image_href=image_href,
+                                                reason=e)
+        with output:
+            while True:
+                output.seek(offset)
+                try:
+                    response = requests.get(
+                        image_href, stream=True,
+                        headers={'Range': 'bytes=%d-%d' % (offset, end),
+                                 'Accept-Encoding': 'identity'})
+                    if response.status_code != http_client.PARTIAL_CONTENT:
+                        raise exception.ImageDownloadFailed(
+                            image_href=image_href,
+                            reason=_("Got HTTP code %s instead of 206 in "
+                                     "response to ranged GET request.") %
+                            response.status_code)
+                    try:
+                        for chunk in response.iter_content(IMAGE_CHUNK_SIZE):
+                            chunk = chunk[:end + 1 - offset]
+                            output.write(chunk)
+                            offset += len(chunk)
+                            if offset > end:
+                                break
+                    finally:
+                        response.close()
+                    if offset > end:
+                        return
+                    reason = _("The connection was closed after %d bytes "
+                               "of the range.") % (offset - start)
+                except requests.RequestException as e:
+                    reason = e
+                except IOError as e:
+                    raise exception.ImageDownloadFailed(image_href=image_href,
+                                                        reason=e)
+                if retries <= 0:
+                    raise exception.ImageDownloadFailed(image_href=image_href,
+                                                        reason=reason)
+                retries -= 1
+                LOG.warning(_LW("Resuming the download of %(image)s at byte "
+                                "%(offset)d after an error: %(error)s"),
+                            {'image': image_href, 'offset': offset,
+                             'error': reason})
+
     def show(self, image_href):
         """Get dictionary of image properties.
 
@@ -23,7 +23,6 @@ import os
 import shutil
 
 from ironic_lib import disk_utils
-from ironic_lib import utils as ironic_utils
 import jinja2
 from oslo_concurrency import processutils
 from oslo_config import cfg
@@ -31,6 +30,7 @@ from oslo_log import log as logging
 from oslo_utils import fileutils
 
 from ironic.common import exception
+from ironic.common import fat
 from ironic.common.glance_service import service_utils as glance_utils
 from ironic.common.i18n import _
 from ironic.common.i18n import _LE
@@ -60,6 +60,86 @@ image_opts = [
 CONF = cfg.CONF
 CONF.register_opts(image_opts)
 
+# Signatures of the image formats known to "qemu-img info", as tuples
+# (offset, magic bytes, format).
+IMAGE_FORMAT_MAGICS = (
+    (0, b'QFI\xfb', 'qcow2'),
+    (0, b'QED\x00', 'qed'),
+    (0, b'KDMV', 'vmdk'),
+    (0, b'COWD', 'vmdk'),
+    (0, b'# Disk DescriptorFile', 'vmdk'),
+    (0x40, b'\x7f\x10\xda\xbe', 'vdi'),
+    (0, b'vhdxfile', 'vhdx'),
+    (0, b'conectix', 'vpc'),
+    (0, b'Bochs Virtual HD Image', 'bochs'),
+    (0, b'#!/bin/sh\n#V2.0 Format\nmodprobe cloop', 'cloop'),
+    (0, b'WithoutFreeSpace', 'parallels'),
+    (0, b'WithouFreSpacExt', 'parallels'),
+    (0, b'LUKS\xba\xbe', 'luks'),
+)
+
+# Boot signature ending the master boot record of partitioned disks, and
+# the boot sector of most file systems, as (offset, magic bytes).
+RAW_IMAGE_MAGIC = (510, b'\x55\xaa')
+
+# Number of bytes needed to look for the signatures above
+IMAGE_FORMAT_HEADER_SIZE = 512
+
+
+def detect_image_format(header):
+    """Find the format of an image from its first bytes.
+
+    :param header: the first IMAGE_FORMAT_HEADER_SIZE bytes of the image
+                   (or the whole image, if it is smaller).
+    :returns: the format of the image, as reported by "qemu-img info", or
+              None if it cannot be found from the first bytes. Raw images
+              are only recognized by their boot signature, and some formats,
+              such as "dmg", are only identified by their last bytes.
+    """
+    for offset, magic, image_format in IMAGE_FORMAT_MAGICS:
+        if header[offset:offset + len(magic)] == magic:
+            return image_format
+    offset, magic = RAW_IMAGE_MAGIC
+    if header[offset:offset + len(magic)] == magic:
+        return 'raw'
+
+
+class ImageWriter(utils.FileWrapper):
+    """File object writing a downloaded image, keeping its first bytes.
+
+    It wraps the file object given to the image services, so that the format
+    of the image can be found while it is being downloaded.
+    """
+
+    def __init__(self, image_file):
+        super(ImageWriter, self).__init__(image_file)
+        self._header = b''
+
+    def write(self, data):
+        if len(self._header) < IMAGE_FORMAT_HEADER_SIZE:
+            self._header += data[:IMAGE_FORMAT_HEADER_SIZE -
+                                 len(self._header)]
+        self._file.write(data)
+
+    def written_directly(self):
+        """Read the header again, after data was written to the file."""
+        super(ImageWriter, self).written_directly()
+        with open(self.wrapped_file.name, 'rb') as image_file:
+            self._header = image_file.read(IMAGE_FORMAT_HEADER_SIZE)
+
+    def detect_format(self, path):
+        """Find the format of the image written.
+
+        :param path: the path of the image, read if the data was not written
+                     through this object (e.g. it was copied with sendfile).
+        :returns: the format of the image, see detect_image_format().
+        """
+        header = self._header
+        if len(header) < IMAGE_FORMAT_HEADER_SIZE:
+            with open(path, 'rb') as image_file:
+                header = image_file.read(IMAGE_FORMAT_HEADER_SIZE)
+        return detect_image_format(header)
+
 
 def _create_root_fs(root_directory, files_info):
     """Creates a filesystem root in given directory.
@@ -104,6 +184,10 @@ def create_vfat_image(output_file, files_info=None, parameters=None,
     root directory (optional), and then creates a vfat image of the root
     directory.
 
+    The image is written by ironic itself, without creating a file system
+    on a loop device and mounting it, so neither root privileges nor the
+    dosfstools are needed.
+
     :param output_file: The path to the file where the fat fs image needs
         to be created.
     :param files_info: A dict containing absolute path of file to be copied
@@ -116,46 +200,30 @@ def create_vfat_image(output_file, files_info=None, parameters=None,
     :param parameters_file: The filename for the parameters file.
     :param fs_size_kib: size of the vfat filesystem in KiB.
     :raises: ImageCreationFailed, if image creation failed while doing any
-        of filesystem manipulation activities like creating dirs, mounting,
-        creating filesystem, copying files, etc.
+        of filesystem manipulation activities like creating the filesystem,
+        copying files, etc.
     """
     try:
-        ironic_utils.dd('/dev/zero', output_file, 'count=1',
-                        "bs=%dKiB" % fs_size_kib)
-    except processutils.ProcessExecutionError as e:
-        raise exception.ImageCreationFailed(image_type='vfat', error=e)
+        # The label helps ramdisks to find the partition containing
+        # the parameters (by using /dev/disk/by-label/ir-vfd-dev).
+        # NOTE: FAT filesystem label can be up to 11 characters long.
+        image = fat.FatImage(fs_size_kib, label="ir-vfd-dev")
 
-    with utils.tempdir() as tmpdir:
+        if files_info:
+            for src_file, path in files_info.items():
+                image.add_file(path, src_file)
 
-        try:
-            # The label helps ramdisks to find the partition containing
-            # the parameters (by using /dev/disk/by-label/ir-vfd-dev).
-            # NOTE: FAT filesystem label can be up to 11 characters long.
-            ironic_utils.mkfs('vfat', output_file, label="ir-vfd-dev")
-            utils.mount(output_file, tmpdir, '-o', 'umask=0')
-        except processutils.ProcessExecutionError as e:
-            raise exception.ImageCreationFailed(image_type='vfat', error=e)
+        if parameters:
+            params_list = ['%(key)s=%(val)s' % {'key': k, 'val': v}
+                           for k, v in parameters.items()]
+            file_contents = '\n'.join(params_list)
+            image.add_data(parameters_file, file_contents)
 
-        try:
-            if files_info:
-                _create_root_fs(tmpdir, files_info)
+        image.write_to_file(output_file)
 
-            if parameters:
-                parameters_file = os.path.join(tmpdir, parameters_file)
-                params_list = ['%(key)s=%(val)s' % {'key': k, 'val': v}
-                               for k, v in parameters.items()]
-                file_contents = '\n'.join(params_list)
-                utils.write_to_file(parameters_file, file_contents)
-
-        except Exception as e:
-            LOG.exception(_LE("vfat image creation failed. Error: %s"), e)
-            raise exception.ImageCreationFailed(image_type='vfat', error=e)
-
-        finally:
-            try:
-                utils.umount(tmpdir)
-            except processutils.ProcessExecutionError as e:
-                raise exception.ImageCreationFailed(image_type='vfat', error=e)
+    except (ValueError, IOError, OSError) as e:
+        LOG.exception(_LE("vfat image creation failed. Error: %s"), e)
+        raise exception.ImageCreationFailed(image_type='vfat', error=e)
 
 
 def _generate_cfg(kernel_params, template, options):
@@ -315,6 +383,15 @@ def create_isolinux_image_for_uefi(output_file, deploy_iso, kernel, ramdisk,
 
 
 def fetch(context, image_href, path, force_raw=False):
+    """Download an image.
+
+    :param context: the request context.
+    :param image_href: the image to download.
+    :param path: where to write the image.
+    :param force_raw: whether to convert the image to the raw format.
+    :returns: the format the image was downloaded in, as detected from its
+              first bytes (see detect_image_format()), or None if unknown.
+    """
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
     #             auth checking in glance, so we assume that access was
@@ -325,15 +402,36 @@ def fetch(context, image_href, path, force_raw=False):
               {'image_service': image_service.__class__,
                'image_href': image_href})
 
-    with fileutils.remove_path_on_error(path):
-        with open(path, "wb") as image_file:
-            image_service.download(image_href, image_file)
+    download_path = "%s.part" % path if force_raw else path
+    with fileutils.remove_path_on_error(download_path):
+        with open(download_path, "wb") as image_file:
+            writer = ImageWriter(image_file)
+            image_service.download(image_href, writer)
+        image_format = writer.detect_format(download_path)
 
     if force_raw:
-        image_to_raw(image_href, path, "%s.part" % path)
+        image_to_raw(image_href, path, download_path,
+                     image_format=image_format)
+    return image_format
+
+
+def image_to_raw(image_href, path, path_tmp, image_format=None):
+    """Convert an image to the raw format.
 
+    :param image_href: the image being converted, for error messages.
+    :param path: where to write the raw image.
+    :param path_tmp: the image to convert. It is removed.
+    :param image_format: the format of the image, if known from its
+                         signature. An image known to be raw is moved to
+                         path as it is, without running "qemu-img info".
+    """
+    if image_format == 'raw':
+        LOG.debug("%(image)s is raw, no conversion needed",
+                  {'image': image_href})
+        with fileutils.remove_path_on_error(path_tmp):
+            os.rename(path_tmp, path)
+        return
 
-def image_to_raw(image_href, path, path_tmp):
     with fileutils.remove_path_on_error(path_tmp):
         data = disk_utils.qemu_img_info(path_tmp)
 
@@ -0,0 +1,83 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""JSON documents read from the database and decoded on demand."""
+
+import json
+
+from oslo_config import cfg
+from oslo_log import log
+from oslo_utils import importutils
+
+from ironic.common.i18n import _
+from ironic.common.i18n import _LW
+
+LOG = log.getLogger(__name__)
+
+opts = [
+    cfg.StrOpt('json_codec',
+               default='json',
+               choices=['json', 'simplejson', 'ujson'],
+               help=_('Python module decoding the JSON columns of the '
+                      'nodes table. "simplejson" and "ujson" decode large '
+                      'documents faster than the standard library, but '
+                      'have to be installed separately. With "simplejson", '
+                      'ASCII strings are decoded as str rather than unicode '
+                      'on Python 2. Falls back to "json" if the module '
+                      'cannot be imported.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group='database')
+
+_DECODERS = {'json': json.loads}
+
+
+def _get_decoder():
+    codec = CONF.database.json_codec
+    try:
+        return _DECODERS[codec]
+    except KeyError:
+        module = importutils.try_import(codec)
+        if module is None:
+            LOG.warning(_LW('The %s module is not installed, JSON columns '
+                            'are decoded by the json module instead.'), codec)
+            decoder = json.loads
+        else:
+            decoder = module.loads
+        _DECODERS[codec] = decoder
+        return decoder
+
+
+def loads(text):
+    """Decode a JSON document with the configured codec."""
+    return _get_decoder()(text)
+
+
+class EncodedJson(object):
+    """A JSON document which is only decoded when its value is needed."""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def decode(self):
+        """Decode the document.
+
+        The result is not cached, the holder of the document is expected to
+        replace it by its value.
+        """
+        return loads(self.text)
+
+    def __repr__(self):
+        return 'EncodedJson(%r)' % self.text
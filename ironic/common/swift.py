@@ -191,6 +191,33 @@ class SwiftAPI(object):
             operation = _("head object")
             raise exception.SwiftOperationError(operation=operation, error=e)
 
+    def copy_object(self, container, source, destination,
+                    object_headers=None):
+        """Copies a Swift object to another object of its container.
+
+        The data is copied by Swift, without going through ironic.
+
+        :param container: The name of the container of the objects.
+        :param source: The name of the object to copy.
+        :param destination: The name of the new object.
+        :param object_headers: the headers for the new object to pass to Swift
+        :raises: SwiftObjectNotFoundError, if the source object is not found.
+        :raises: SwiftOperationError, if operation with Swift fails.
+        """
+        headers = dict(object_headers or {})
+        headers['X-Copy-From'] = '/%s/%s' % (container, source)
+        try:
+            self.connection.put_object(container, destination, None,
+                                       content_length=0, headers=headers)
+        except swift_exceptions.ClientException as e:
+            operation = _("copy object")
+            if e.http_status == http_client.NOT_FOUND:
+                raise exception.SwiftObjectNotFoundError(object=source,
+                                                         container=container,
+                                                         operation=operation)
+
+            raise exception.SwiftOperationError(operation=operation, error=e)
+
     def update_object_meta(self, container, object, object_headers):
         """Update the metadata of a given Swift object.
 
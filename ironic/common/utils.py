@@ -403,6 +403,91 @@ def hash_file(file_like_object, hash_algo='md5'):
     return checksum.hexdigest()
 
 
+class FileWrapper(object):
+    """File object wrapping another file object.
+
+    The image services may write data directly to the plain file under the
+    wrappers (e.g. the byte ranges of an HTTP download), in which case they
+    call written_directly() afterwards.
+    """
+
+    def __init__(self, file_like_object):
+        self._file = file_like_object
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    @property
+    def wrapped_file(self):
+        """The file object under all the wrappers."""
+        if isinstance(self._file, FileWrapper):
+            return self._file.wrapped_file
+        return self._file
+
+    def written_directly(self):
+        """Update the wrappers after data was written to the wrapped file."""
+        if isinstance(self._file, FileWrapper):
+            self._file.written_directly()
+
+
+class HashingWriter(FileWrapper):
+    """File object hashing the data written to it.
+
+    It wraps the file object given to the image services, so that the
+    checksum of an image is computed while it is being downloaded instead of
+    reading the whole file again afterwards. It is only used for the
+    firmware files of the iLO drivers, images.fetch() and the image cache
+    do not verify checksums.
+    """
+
+    def __init__(self, file_like_object, hash_algos=('md5',)):
+        """Wrap a file object.
+
+        :param file_like_object: file like object the data is written to.
+        :param hash_algos: names of the hashing strategies to compute.
+        :raises: InvalidParameterValue, on unsupported or invalid input.
+        """
+        super(HashingWriter, self).__init__(file_like_object)
+        self._hash_algos = hash_algos
+        self._checksums = dict((algo, _get_hash_object(algo))
+                               for algo in hash_algos)
+        self.size = 0
+
+    def write(self, data):
+        for checksum in self._checksums.values():
+            checksum.update(data)
+        self.size += len(data)
+        self._file.write(data)
+
+    def hexdigest(self, hash_algo='md5', path=None):
+        """Get the hash of the data written.
+
+        :param hash_algo: name of the hashing strategy, one of those given
+                          when creating this object.
+        :param path: the path of the file written. If given, and if its size
+                     shows that the data was not all written through this
+                     object (e.g. it was copied with sendfile or the file was
+                     replaced by a hard link), the file is hashed instead.
+        :returns: a condensed digest of the bytes written.
+        """
+        if path is not None and os.path.getsize(path) != self.size:
+            with open(path, 'rb') as written_file:
+                return hash_file(written_file, hash_algo)
+        return self._checksums[hash_algo].hexdigest()
+
+    def written_directly(self):
+        """Hash the wrapped file again, after data was written to it."""
+        super(HashingWriter, self).written_directly()
+        self._checksums = dict((algo, _get_hash_object(algo))
+                               for algo in self._hash_algos)
+        self.size = 0
+        with open(self.wrapped_file.name, 'rb') as written_file:
+            for chunk in iter(lambda: written_file.read(32768), b''):
+                for checksum in self._checksums.values():
+                    checksum.update(chunk)
+                self.size += len(chunk)
+
+
 @contextlib.contextmanager
 def temporary_mutation(obj, **kwargs):
     """Temporarily change object attribute.
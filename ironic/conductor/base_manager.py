@@ -13,6 +13,7 @@
 """Base conductor manager functionality."""
 
 import inspect
+import itertools
 import threading
 
 import eventlet
@@ -35,8 +36,10 @@ from ironic.common.i18n import _LI
 from ironic.common.i18n import _LW
 from ironic.common import rpc
 from ironic.common import states
+from ironic.conductor import heartbeat_buffer
 from ironic.conductor import task_manager
 from ironic.db import api as dbapi
+from ironic.drivers.modules import ipmitool_shell
 from ironic import objects
 
 
@@ -49,6 +52,14 @@ conductor_opts = [
     cfg.IntOpt('heartbeat_interval',
                default=10,
                help=_('Seconds between conductor heart beats.')),
+    cfg.BoolOpt('filter_mapped_nodes_in_db',
+                default=False,
+                help=_('Whether periodic tasks should fetch from the '
+                       'database only the nodes whose hash bucket falls '
+                       'into the partitions of the hash ring served by this '
+                       'conductor, instead of all nodes. This makes the '
+                       'amount of data read scale with the number of nodes '
+                       'per conductor.')),
 ]
 
 
@@ -224,6 +235,9 @@ class BaseConductorManager(object):
         self._periodic_tasks.stop()
         self._periodic_tasks.wait()
         self._executor.shutdown(wait=True)
+        # Write the agent heartbeats received until now
+        heartbeat_buffer.flush(ironic_context.get_admin_context())
+        ipmitool_shell.close_all()
         self._started = False
 
     def _collect_periodic_tasks(self, obj, args):
@@ -266,6 +280,10 @@ class BaseConductorManager(object):
         :return: generator yielding tuples of requested fields
         """
         columns = ['uuid', 'driver'] + list(fields or ())
+        if CONF.conductor.filter_mapped_nodes_in_db:
+            filters = dict(kwargs.get('filters') or {})
+            filters['hash_bucket_ranges'] = self._get_mapped_bucket_ranges()
+            kwargs['filters'] = filters
         node_list = self.dbapi.get_nodeinfo_list(columns=columns, **kwargs)
         for result in node_list:
             if self._mapped_to_this_conductor(*result[:2]):
@@ -311,6 +329,20 @@ class BaseConductorManager(object):
 
         return self.host in ring.get_hosts(node_uuid)
 
+    def _get_mapped_bucket_ranges(self):
+        """Get the hash bucket ranges served by this conductor.
+
+        The result can be used as the hash_bucket_ranges node filter to
+        skip most of the nodes which are not mapped to this conductor. It is
+        not exact, so _mapped_to_this_conductor() still has to be checked.
+
+        :returns: a dict mapping driver names to lists of hash bucket
+                  ranges.
+        """
+        return {driver: ring.get_bucket_ranges(self.host)
+                for driver, ring in self.ring_manager.ring.items()
+                if self.host in ring.hosts}
+
     def _fail_if_in_state(self, context, filters, provision_state,
                           sort_key, callback_method=None,
                           err_handler=None, last_error=None,
@@ -350,35 +382,45 @@ class BaseConductorManager(object):
                                     sort_key=sort_key,
                                     sort_dir='asc')
 
+        # NOTE: the node could have changed its state since it was listed,
+        # acquire() makes sure it is still eligible.
+        acquire_filters = {'maintenance': False,
+                           'provision_state': provision_state}
+        node_uuids = (node_uuid for node_uuid, driver in node_iter)
         workers_count = 0
-        for node_uuid, driver in node_iter:
-            try:
-                with task_manager.acquire(context, node_uuid,
-                                          purpose='node state check') as task:
-                    if (task.node.maintenance or
-                            task.node.provision_state != provision_state):
-                        continue
-
-                    target_state = (None if not keep_target_state else
-                                    task.node.target_provision_state)
-
-                    # timeout has been reached - process the event 'fail'
-                    if callback_method:
-                        task.process_event('fail',
-                                           callback=self._spawn_worker,
-                                           call_args=(callback_method, task),
-                                           err_handler=err_handler,
-                                           target_state=target_state)
-                    else:
-                        task.node.last_error = last_error
-                        task.process_event('fail', target_state=target_state)
-            except exception.NoFreeConductorWorker:
-                break
-            except (exception.NodeLocked, exception.NodeNotFound):
-                continue
-            workers_count += 1
-            if workers_count >= CONF.conductor.periodic_max_workers:
+        # NOTE: the nodes are locked by batches of at most as many nodes as
+        # workers can still be started, locked or vanished nodes are skipped.
+        while workers_count < CONF.conductor.periodic_max_workers:
+            batch = list(itertools.islice(
+                node_uuids,
+                CONF.conductor.periodic_max_workers - workers_count))
+            if not batch:
                 break
+            with task_manager.acquire_many(context, batch,
+                                           purpose='node state check',
+                                           filters=acquire_filters) as tasks:
+                for locked in tasks:
+                    try:
+                        with locked as task:
+                            target_state = (
+                                None if not keep_target_state else
+                                task.node.target_provision_state)
+
+                            # timeout has been reached - process the event
+                            # 'fail'
+                            if callback_method:
+                                task.process_event(
+                                    'fail', callback=self._spawn_worker,
+                                    call_args=(callback_method, task),
+                                    err_handler=err_handler,
+                                    target_state=target_state)
+                            else:
+                                task.node.last_error = last_error
+                                task.process_event('fail',
+                                                   target_state=target_state)
+                    except exception.NoFreeConductorWorker:
+                        return
+                    workers_count += 1
 
     def _start_consoles(self, context):
         """Start consoles if set enabled.
@@ -0,0 +1,117 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Agent heartbeats kept in memory and written to the database by batches.
+
+Most heartbeats of the agents only update timestamps of their nodes: the
+time of the last heartbeat in driver_internal_info, and the time showing
+that the provisioning is still alive. The conductor records them here
+instead of saving each node, and writes them all periodically, and before
+checking the provisioning timeouts.
+"""
+
+import threading
+
+from oslo_config import cfg
+from oslo_log import log
+
+from ironic.common.i18n import _
+from ironic.common.i18n import _LE
+from ironic import objects
+
+LOG = log.getLogger(__name__)
+
+opts = [
+    cfg.IntOpt('agent_heartbeat_flush_interval',
+               default=10,
+               min=1,
+               help=_('Interval between writes of the agent heartbeats '
+                      'which only update timestamps of their nodes, in '
+                      'seconds. These heartbeats are kept in memory and '
+                      'written together. Must be well below '
+                      'deploy_callback_timeout and clean_callback_timeout; '
+                      'the pending heartbeats are always written before '
+                      'checking these timeouts.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group='conductor')
+
+_lock = threading.Lock()
+# Node id -> (agent_last_heartbeat or None, provision state or None)
+_pending = {}
+
+
+def record(node, last_heartbeat=None, touch_provisioning=False):
+    """Record a heartbeat of the agent of a node, to be written later.
+
+    :param node: the Node object.
+    :param last_heartbeat: the time of the heartbeat, to be stored as
+                           agent_last_heartbeat in driver_internal_info.
+                           None if it does not have to be stored.
+    :param touch_provisioning: whether to mark the provisioning of the node
+                               as running, as node.touch_provisioning()
+                               does, if the node is still in its current
+                               provision state when the heartbeat is
+                               written.
+    """
+    provision_state = node.provision_state if touch_provisioning else None
+    with _lock:
+        _merge(node.id, last_heartbeat, provision_state)
+
+
+def _merge(node_id, last_heartbeat, provision_state):
+    previous_heartbeat, previous_state = _pending.get(node_id, (None, None))
+    if last_heartbeat is None or (previous_heartbeat is not None and
+                                  previous_heartbeat > last_heartbeat):
+        last_heartbeat = previous_heartbeat
+    _pending[node_id] = (last_heartbeat, provision_state or previous_state)
+
+
+def flush(context):
+    """Write the recorded heartbeats to the database.
+
+    The heartbeats which cannot be written, and the timestamps of the
+    nodes which are reserved, are kept for the next flush.
+
+    :param context: request context.
+    """
+    with _lock:
+        heartbeats = _pending.copy()
+        _pending.clear()
+    if not heartbeats:
+        return
+
+    try:
+        reserved = objects.Node.update_agent_heartbeats(context, heartbeats)
+    except Exception:
+        LOG.exception(_LE('Failed to write the agent heartbeats of %d '
+                          'nodes, retrying on the next flush.'),
+                      len(heartbeats))
+        with _lock:
+            for node_id, heartbeat in heartbeats.items():
+                _merge(node_id, *heartbeat)
+    else:
+        LOG.debug('Wrote the agent heartbeats of %(count)d nodes, '
+                  '%(reserved)d reserved nodes are retried on the next '
+                  'flush.', {'count': len(heartbeats),
+                             'reserved': len(reserved)})
+        with _lock:
+            for node_id in reserved:
+                # Their provisioning was marked as running already
+                _merge(node_id, heartbeats[node_id][0], None)
+
+
+def reset():
+    """Discard the heartbeats which were not written yet."""
+    with _lock:
+        _pending.clear()
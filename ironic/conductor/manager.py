@@ -43,15 +43,19 @@ a change, etc.
 
 import collections
 import datetime
+import itertools
 import tempfile
 
 import eventlet
 from futurist import periodics
+from futurist import waiters
 from oslo_config import cfg
 from oslo_log import log
 import oslo_messaging as messaging
 from oslo_utils import excutils
+from oslo_utils import timeutils
 from oslo_utils import uuidutils
+from six.moves import queue
 
 from ironic.common import dhcp_factory
 from ironic.common import driver_factory
@@ -65,6 +69,7 @@ from ironic.common import images
 from ironic.common import states
 from ironic.common import swift
 from ironic.conductor import base_manager
+from ironic.conductor import heartbeat_buffer
 from ironic.conductor import task_manager
 from ironic.conductor import utils
 from ironic import objects
@@ -113,6 +118,12 @@ conductor_opts = [
                help=_('Maximum number of worker threads that can be started '
                       'simultaneously by a periodic task. Should be less '
                       'than RPC thread pool size.')),
+    cfg.IntOpt('sync_power_state_workers',
+               default=8, min=1,
+               help=_('The maximum number of worker threads that can be '
+                      'started simultaneously to sync nodes power states '
+                      'from the periodic task. The effective number of '
+                      'workers is also limited by periodic_max_workers.')),
     cfg.IntOpt('node_locked_retry_attempts',
                default=3,
                help=_('Number of attempts to grab a node lock.')),
@@ -180,19 +191,36 @@ conductor_opts = [
 CONF = cfg.CONF
 CONF.register_opts(conductor_opts, 'conductor')
 SYNC_EXCLUDED_STATES = (states.DEPLOYWAIT, states.CLEANWAIT, states.ENROLL)
+# NOTE(deva): we should not acquire a lock on a node in DEPLOYWAIT/CLEANWAIT,
+# as this could cause an error within a deploy ramdisk POSTing back at the
+# same time.
+# NOTE(dtantsur): it's also pointless (and dangerous) to sync power state
+# when a power action is in progress.
+SYNC_FILTERS = {'maintenance': False,
+                'provision_state_not_in': SYNC_EXCLUDED_STATES,
+                'target_power_state': None}
+
+# Interfaces of a driver whose image cache can be warmed up
+PREFETCH_INTERFACES = ('boot', 'deploy')
+# Maximum number of image prefetches whose status is kept by a conductor
+_MAX_PREFETCH_STATUSES = 1000
 
 
 class ConductorManager(base_manager.BaseConductorManager):
     """Ironic Conductor manager main class."""
 
     # NOTE(rloo): This must be in sync with rpcapi.ConductorAPI's.
-    RPC_API_VERSION = '1.33'
+    RPC_API_VERSION = '1.34'
 
     target = messaging.Target(version=RPC_API_VERSION)
 
     def __init__(self, host, topic):
         super(ConductorManager, self).__init__(host, topic)
         self.power_state_sync_count = collections.defaultdict(int)
+        self.power_state_sync_stats = {}
+        # Status of the image prefetches, by (driver, interface, href),
+        # the oldest first
+        self.image_prefetches = collections.OrderedDict()
 
     @messaging.expected_exceptions(exception.InvalidParameterValue,
                                    exception.MissingParameterValue,
@@ -1178,6 +1206,10 @@ class ConductorManager(base_manager.BaseConductorManager):
         3) Node is not in DEPLOYWAIT/CLEANWAIT provision state.
         4) Node doesn't have a reservation
 
+        Nodes are processed concurrently by up to sync_power_state_workers
+        workers (but no more than periodic_max_workers). Statistics of the
+        last sweep are stored in ``power_state_sync_stats``.
+
         NOTE: Grabbing a lock here can cause other methods to fail to
         grab it. We want to avoid trying to grab a lock while a node
         is in the DEPLOYWAIT/CLEANWAIT state so we don't unnecessarily
@@ -1185,43 +1217,94 @@ class ConductorManager(base_manager.BaseConductorManager):
         can do here to avoid failing a brand new deploy to a node that
         we've locked here, though.
         """
-        # FIXME(comstud): Since our initial state checks are outside
-        # of the lock (to try to avoid the lock), some checks are
-        # repeated after grabbing the lock so we can unlock quickly.
-        # The node mapping is not re-checked because it doesn't much
-        # matter if things happened to re-balance.
-        #
-        # This is inefficient and racey. We end up with calling DB API's
-        # get_node() twice (once here, and once in acquire(). Ideally we
-        # add a way to pass constraints to task_manager.acquire()
-        # (through to its DB API call) so that we can eliminate our call
-        # and first set of checks below.
-
+        # NOTE: The initial state checks are done outside of the lock (to
+        # try to avoid the lock), the conditions are then enforced by the
+        # query that fetches the node in acquire(). The node mapping is not
+        # re-checked because it doesn't much matter if things happened to
+        # re-balance.
         filters = {'reserved': False, 'maintenance': False}
-        node_iter = self.iter_nodes(fields=['id'], filters=filters)
-        for (node_uuid, driver, node_id) in node_iter:
+        nodes = queue.Queue()
+        for node_info in self.iter_nodes(fields=['id'], filters=filters):
+            nodes.put(node_info)
+
+        stats = collections.Counter()
+        timer = timeutils.StopWatch().start()
+
+        # NOTE: the current thread is used as one of the workers, so that
+        # the sweep makes progress even if the pool is exhausted.
+        number_of_workers = min(CONF.conductor.sync_power_state_workers,
+                                CONF.conductor.periodic_max_workers,
+                                nodes.qsize())
+        futures = []
+        for worker_number in range(max(0, number_of_workers - 1)):
+            try:
+                futures.append(
+                    self._spawn_worker(self._sync_power_state_nodes_task,
+                                       context, nodes, stats))
+            except exception.NoFreeConductorWorker:
+                LOG.warning(_LW("There are no more conductor workers for "
+                                "power sync task. %(workers)d workers have "
+                                "been already spawned."),
+                            {'workers': worker_number})
+                break
+
+        try:
+            self._sync_power_state_nodes_task(context, nodes, stats)
+        finally:
+            waiters.wait_for_all(futures)
+
+        self.power_state_sync_stats = {
+            'nodes': stats['nodes'],
+            'mismatches': stats['mismatches'],
+            'failures': stats['failures'],
+            'workers': len(futures) + 1,
+            'duration': timer.elapsed(),
+        }
+        if (self.power_state_sync_stats['duration'] >
+                CONF.conductor.sync_power_state_interval):
+            LOG.warning(_LW("Syncing power states of %(nodes)d nodes took "
+                            "%(duration).2f seconds, which is longer than "
+                            "the sync_power_state_interval. Consider "
+                            "increasing sync_power_state_workers."),
+                        self.power_state_sync_stats)
+        else:
+            LOG.debug("Synced power states of %(nodes)d nodes with "
+                      "%(workers)d workers in %(duration).2f seconds: "
+                      "%(mismatches)d mismatches, %(failures)d failures",
+                      self.power_state_sync_stats)
+
+    def _sync_power_state_nodes_task(self, context, nodes, stats):
+        """Invokes power state sync on nodes from synchronized queue.
+
+        Several instances of this method run concurrently, see
+        :meth:`_sync_power_states` for the conditions checked per node.
+
+        :param context: request context.
+        :param nodes: queue with node descriptions, shared between workers.
+        :param stats: collections.Counter with the sweep statistics, shared
+                      between workers.
+        """
+        while True:
+            try:
+                node_uuid, driver, node_id = nodes.get_nowait()
+            except queue.Empty:
+                break
+
             try:
                 # NOTE(dtantsur): start with a shared lock, upgrade if needed
                 with task_manager.acquire(context, node_uuid,
                                           purpose='power state sync',
-                                          shared=True) as task:
-                    # NOTE(deva): we should not acquire a lock on a node in
-                    #             DEPLOYWAIT/CLEANWAIT, as this could cause
-                    #             an error within a deploy ramdisk POSTing back
-                    #             at the same time.
-                    # NOTE(dtantsur): it's also pointless (and dangerous) to
-                    # sync power state when a power action is in progress
-                    if (task.node.provision_state in SYNC_EXCLUDED_STATES or
-                            task.node.maintenance or
-                            task.node.target_power_state):
-                        continue
+                                          shared=True,
+                                          filters=SYNC_FILTERS) as task:
+                    stats['nodes'] += 1
                     count = do_sync_power_state(
-                        task, self.power_state_sync_count[node_uuid])
+                        task, self.power_state_sync_count[node_uuid],
+                        stats=stats)
                     if count:
                         self.power_state_sync_count[node_uuid] = count
                     else:
                         # don't bloat the dict with non-failing nodes
-                        del self.power_state_sync_count[node_uuid]
+                        self.power_state_sync_count.pop(node_uuid, None)
             except exception.NodeNotFound:
                 LOG.info(_LI("During sync_power_state, node %(node)s was not "
                              "found and presumed deleted by another process."),
@@ -1230,6 +1313,10 @@ class ConductorManager(base_manager.BaseConductorManager):
                 LOG.info(_LI("During sync_power_state, node %(node)s was "
                              "already locked by another process. Skip."),
                          {'node': node_uuid})
+            except exception.NodeFilterMismatch:
+                LOG.debug("During sync_power_state, node %(node)s changed "
+                          "its state and is no longer eligible for power "
+                          "state sync. Skip.", {'node': node_uuid})
             finally:
                 # Yield on every iteration
                 eventlet.sleep(0)
@@ -1246,6 +1333,10 @@ class ConductorManager(base_manager.BaseConductorManager):
         if not callback_timeout:
             return
 
+        # NOTE: write the pending agent heartbeats first, for the nodes
+        # which heartbeated recently not to look timed out.
+        heartbeat_buffer.flush(context)
+
         filters = {'reserved': False,
                    'provision_state': states.DEPLOYWAIT,
                    'maintenance': False,
@@ -1256,6 +1347,15 @@ class ConductorManager(base_manager.BaseConductorManager):
         self._fail_if_in_state(context, filters, states.DEPLOYWAIT,
                                sort_key, callback_method, err_handler)
 
+    @periodics.periodic(
+        spacing=CONF.conductor.agent_heartbeat_flush_interval)
+    def _flush_agent_heartbeats(self, context):
+        """Periodically writes the agent heartbeats kept in memory.
+
+        :param context: request context.
+        """
+        heartbeat_buffer.flush(context)
+
     @periodics.periodic(spacing=CONF.conductor.check_provision_state_interval)
     def _check_deploying_status(self, context):
         """Periodically checks the status of nodes in DEPLOYING state.
@@ -1352,6 +1452,10 @@ class ConductorManager(base_manager.BaseConductorManager):
         if not callback_timeout:
             return
 
+        # NOTE: write the pending agent heartbeats first, for the nodes
+        # which heartbeated recently not to look timed out.
+        heartbeat_buffer.flush(context)
+
         filters = {'reserved': False,
                    'provision_state': states.CLEANWAIT,
                    'maintenance': False,
@@ -1377,33 +1481,37 @@ class ConductorManager(base_manager.BaseConductorManager):
         node_iter = self.iter_nodes(fields=['id', 'conductor_affinity'],
                                     filters=filters)
 
+        # Nodes mapped here, but not updated by this conductor last
+        node_uuids = (node_uuid for node_uuid, driver, node_id,
+                      conductor_affinity in node_iter
+                      if conductor_affinity != self.conductor.id)
         workers_count = 0
-        for node_uuid, driver, node_id, conductor_affinity in node_iter:
-            if conductor_affinity == self.conductor.id:
-                continue
-
-            # Node is mapped here, but not updated by this conductor last
-            try:
-                with task_manager.acquire(context, node_uuid,
-                                          purpose='node take over') as task:
-                    # NOTE(deva): now that we have the lock, check again to
-                    # avoid racing with deletes and other state changes
-                    node = task.node
-                    if (node.maintenance or
-                            node.conductor_affinity == self.conductor.id or
-                            node.provision_state != states.ACTIVE):
-                        continue
-
-                    task.spawn_after(self._spawn_worker,
-                                     self._do_takeover, task)
-
-            except exception.NoFreeConductorWorker:
-                break
-            except (exception.NodeLocked, exception.NodeNotFound):
-                continue
-            workers_count += 1
-            if workers_count == CONF.conductor.periodic_max_workers:
+        while workers_count < CONF.conductor.periodic_max_workers:
+            batch = list(itertools.islice(
+                node_uuids,
+                CONF.conductor.periodic_max_workers - workers_count))
+            if not batch:
                 break
+            with task_manager.acquire_many(
+                    context, batch, purpose='node take over',
+                    filters={'maintenance': False,
+                             'provision_state': states.ACTIVE}) as tasks:
+                for locked in tasks:
+                    try:
+                        with locked as task:
+                            # NOTE(deva): now that we have the lock, check
+                            # again to avoid racing with other state changes
+                            # (maintenance and provision state are checked by
+                            # acquire_many())
+                            if (task.node.conductor_affinity ==
+                                    self.conductor.id):
+                                continue
+
+                            task.spawn_after(self._spawn_worker,
+                                             self._do_takeover, task)
+                    except exception.NoFreeConductorWorker:
+                        return
+                    workers_count += 1
 
     @messaging.expected_exceptions(exception.NodeLocked)
     def validate_driver_interfaces(self, context, node_id):
@@ -2140,6 +2248,69 @@ class ConductorManager(base_manager.BaseConductorManager):
 
         return driver.raid.get_logical_disk_properties()
 
+    def prefetch_images(self, context, driver_name, images):
+        """Fetch images into the caches of a driver on this conductor.
+
+        The images are fetched in the background by a worker, one after the
+        other, into the cache of the interface of the driver using them.
+        Conductors without the driver do nothing.
+
+        :param context: request context.
+        :param driver_name: name of the driver.
+        :param images: a list of dictionaries with the "href" of an image and
+                       the "interface" of the driver using it, one of
+                       PREFETCH_INTERFACES.
+        """
+        LOG.debug("RPC prefetch_images called for driver %(driver)s with "
+                  "images %(images)s",
+                  {'driver': driver_name, 'images': images})
+        try:
+            driver = driver_factory.get_driver(driver_name)
+        except exception.DriverNotFound:
+            # NOTE: the request is sent to all the conductors
+            return
+
+        statuses = []
+        for image in images:
+            status = {'href': image['href'],
+                      'interface': image['interface'],
+                      'state': 'waiting',
+                      'error': None,
+                      'updated_at': timeutils.utcnow().isoformat()}
+            key = (driver_name, image['interface'], image['href'])
+            self.image_prefetches.pop(key, None)
+            self.image_prefetches[key] = status
+            statuses.append(status)
+        while len(self.image_prefetches) > _MAX_PREFETCH_STATUSES:
+            self.image_prefetches.popitem(last=False)
+
+        try:
+            self._spawn_worker(_do_prefetch_images, context, driver,
+                               statuses)
+        except exception.NoFreeConductorWorker as e:
+            LOG.warning(_LW("Cannot prefetch images for driver %(driver)s: "
+                            "%(error)s"),
+                        {'driver': driver_name, 'error': e})
+            for status in statuses:
+                _set_prefetch_state(status, 'failed', error=str(e))
+
+    def get_image_prefetch_status(self, context, driver_name):
+        """Get the status of the image prefetches of a driver.
+
+        :param context: request context.
+        :param driver_name: name of the driver.
+        :returns: a list of dictionaries with the "href" and "interface" of
+                  each image, its "state" (one of "waiting", "fetching",
+                  "cached", "skipped" or "failed"), the "error" which made it
+                  fail or be skipped, if any, and when the state was last
+                  updated ("updated_at"), the oldest prefetch first.
+        """
+        LOG.debug("RPC get_image_prefetch_status called for driver %s",
+                  driver_name)
+        return [dict(status)
+                for key, status in self.image_prefetches.items()
+                if key[0] == driver_name]
+
     def _object_dispatch(self, target, method, context, args, kwargs):
         """Dispatch a call to an object method.
 
@@ -2393,7 +2564,7 @@ def handle_sync_power_state_max_retries_exceeded(task, actual_power_state,
     LOG.error(msg)
 
 
-def do_sync_power_state(task, count):
+def do_sync_power_state(task, count, stats=None):
     """Sync the power state for this node, incrementing the counter on failure.
 
     When the limit of power_state_sync_max_retries is reached, the node is put
@@ -2401,11 +2572,17 @@ def do_sync_power_state(task, count):
 
     :param task: a TaskManager instance
     :param count: number of times this node has previously failed a sync
+    :param stats: an optional collections.Counter, in which the power state
+                  mismatches found ('mismatches') and the failures to get
+                  the power state or to correct a mismatch ('failures') are
+                  counted.
     :raises: NodeLocked if unable to upgrade task lock to an exclusive one
     :returns: Count of failed attempts.
               On success, the counter is set to 0.
               On failure, the count is incremented by one
     """
+    if stats is None:
+        stats = collections.Counter()
     node = task.node
     power_state = None
     count += 1
@@ -2430,6 +2607,7 @@ def do_sync_power_state(task, count):
                   "while trying to sync power state."))
     except Exception as e:
         # Stop if any exception is raised when getting the power state
+        stats['failures'] += 1
         if count > max_retries:
             task.upgrade_lock()
             handle_sync_power_state_max_retries_exceeded(task, power_state,
@@ -2469,7 +2647,9 @@ def do_sync_power_state(task, count):
         node.save()
         return 0
 
+    stats['mismatches'] += 1
     if count > max_retries:
+        stats['failures'] += 1
         handle_sync_power_state_max_retries_exceeded(task, power_state)
         return count
 
@@ -2484,6 +2664,7 @@ def do_sync_power_state(task, count):
             # so don't do that again here.
             utils.node_power_action(task, node.power_state)
         except Exception as e:
+            stats['failures'] += 1
             LOG.error(_LE(
                 "Failed to change power state of node %(node)s "
                 "to '%(state)s', attempt %(attempt)s of %(retries)s."),
@@ -2539,3 +2720,41 @@ def _do_inspect_hardware(task):
                    "state %(state)s") % {'state': new_state})
         handle_failure(error)
         raise exception.HardwareInspectionFailure(error=error)
+
+
+def _set_prefetch_state(status, state, error=None):
+    status['state'] = state
+    status['error'] = error
+    status['updated_at'] = timeutils.utcnow().isoformat()
+
+
+def _do_prefetch_images(context, driver, statuses):
+    """Fetch images into the caches of a driver.
+
+    :param context: request context.
+    :param driver: the driver.
+    :param statuses: the status of the prefetch of each image, updated as
+                     the images are fetched.
+    """
+    for status in statuses:
+        interface = getattr(driver, status['interface'], None)
+        cache = interface.get_image_cache() if interface else None
+        if cache is None:
+            _set_prefetch_state(
+                status, 'skipped',
+                error=_('The %s interface of the driver does not cache '
+                        'images.') % status['interface'])
+            continue
+
+        _set_prefetch_state(status, 'fetching')
+        try:
+            cache.prefetch_image(status['href'], ctx=context,
+                                 force_raw=CONF.force_raw_images)
+        except Exception as e:
+            LOG.warning(_LW("Failed to prefetch image %(href)s into the "
+                            "cache %(cache)s: %(error)s"),
+                        {'href': status['href'], 'cache': cache.master_dir,
+                         'error': e})
+            _set_prefetch_state(status, 'failed', error=str(e))
+        else:
+            _set_prefetch_state(status, 'cached')
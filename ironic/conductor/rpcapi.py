@@ -18,9 +18,12 @@
 Client side of the conductor RPC API.
 """
 
+import datetime
 import random
 
+from oslo_config import cfg
 import oslo_messaging as messaging
+from oslo_utils import timeutils
 
 from ironic.common import exception
 from ironic.common import hash_ring
@@ -29,6 +32,8 @@ from ironic.common import rpc
 from ironic.conductor import manager
 from ironic.objects import base as objects_base
 
+CONF = cfg.CONF
+
 
 class ConductorAPI(object):
     """Client side of the conductor RPC API.
@@ -80,11 +85,12 @@ class ConductorAPI(object):
     |           object_backport_versions
     |    1.32 - Add do_node_clean
     |    1.33 - Added update and destroy portgroup.
+    |    1.34 - Added prefetch_images and get_image_prefetch_status
 
     """
 
     # NOTE(rloo): This must be in sync with manager.ConductorManager's.
-    RPC_API_VERSION = '1.33'
+    RPC_API_VERSION = '1.34'
 
     def __init__(self, topic=None):
         super(ConductorAPI, self).__init__()
@@ -101,19 +107,64 @@ class ConductorAPI(object):
         # NOTE(deva): this is going to be buggy
         self.ring_manager = hash_ring.HashRingManager()
 
+    def _get_ring(self, driver_name):
+        """Get the hash ring for a driver.
+
+        Conductor membership is re-read at most once per conductor heartbeat
+        interval, and rings are only rebuilt when their conductors change.
+        If the driver is not found, membership is re-read right away in case
+        a conductor supporting it has just been registered.
+
+        :param driver_name: the name of the driver.
+        :returns: a HashRing object.
+        :raises: DriverNotFound
+        """
+        self.ring_manager.refresh(interval=CONF.conductor.heartbeat_interval)
+        try:
+            return self.ring_manager[driver_name]
+        except exception.DriverNotFound:
+            self.ring_manager.refresh()
+            return self.ring_manager[driver_name]
+
+    def _is_host_expired(self, host):
+        """Check whether a conductor may have stopped since the rings loaded.
+
+        :param host: the hostname of the conductor.
+        :returns: True if the last check-in of the conductor read with the
+                  rings is older than the heartbeat timeout.
+        """
+        heartbeat = self.ring_manager.heartbeats.get(host)
+        limit = timeutils.utcnow() - datetime.timedelta(
+            seconds=CONF.conductor.heartbeat_timeout)
+        return heartbeat is not None and heartbeat < limit
+
     def get_topic_for(self, node):
         """Get the RPC topic for the conductor service the node is mapped to.
 
+        If the conductor the node is mapped to by the cached rings has not
+        checked in for the heartbeat timeout, membership is re-read and the
+        node is mapped again.
+
         :param node: a node object.
         :returns: an RPC topic string.
         :raises: NoValidHost
 
         """
-        self.ring_manager.reset()
-
         try:
-            ring = self.ring_manager[node.driver]
+            ring = self._get_ring(node.driver)
             dest = ring.get_hosts(node.uuid)
+            if self._is_host_expired(dest[0]):
+                self.ring_manager.refresh()
+                ring = self.ring_manager[node.driver]
+                # NOTE: the expired conductors are normally gone from the
+                # new ring, but one can expire right after it is read.
+                ignore_hosts = [host for host in ring.hosts
+                                if self._is_host_expired(host)]
+                if len(ignore_hosts) < len(ring.hosts):
+                    dest = ring.get_hosts(node.uuid,
+                                          ignore_hosts=ignore_hosts)
+                else:
+                    dest = ring.get_hosts(node.uuid)
             return self.topic + "." + dest[0]
         except exception.DriverNotFound:
             reason = (_('No conductor service registered which supports '
@@ -132,9 +183,7 @@ class ConductorAPI(object):
         :raises: DriverNotFound
 
         """
-        self.ring_manager.reset()
-
-        hash_ring = self.ring_manager[driver_name]
+        hash_ring = self._get_ring(driver_name)
         host = random.choice(list(hash_ring.hosts))
         return self.topic + "." + host
 
@@ -627,6 +676,36 @@ class ConductorAPI(object):
         return cctxt.call(context, 'get_raid_logical_disk_properties',
                           driver_name=driver_name)
 
+    def prefetch_images(self, context, driver_name, images):
+        """Asynchronously fetch images into the caches of a driver.
+
+        The request is sent to all the conductors: each conductor supporting
+        the driver fetches the images into its caches.
+
+        :param context: request context.
+        :param driver_name: name of the driver.
+        :param images: a list of dictionaries with the "href" of an image and
+                       the "interface" of the driver using it, "boot" or
+                       "deploy".
+        """
+        cctxt = self.client.prepare(topic=self.topic, fanout=True,
+                                    version='1.34')
+        cctxt.cast(context, 'prefetch_images', driver_name=driver_name,
+                   images=images)
+
+    def get_image_prefetch_status(self, context, driver_name, topic=None):
+        """Get the status of the image prefetches of a driver on a conductor.
+
+        :param context: request context.
+        :param driver_name: name of the driver.
+        :param topic: RPC topic. Defaults to self.topic.
+        :returns: a list of dictionaries with the status of the prefetch of
+                  each image.
+        """
+        cctxt = self.client.prepare(topic=topic or self.topic, version='1.34')
+        return cctxt.call(context, 'get_image_prefetch_status',
+                          driver_name=driver_name)
+
     def do_node_clean(self, context, node_id, clean_steps, topic=None):
         """Signal to conductor service to perform manual cleaning on a node.
 
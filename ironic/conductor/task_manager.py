@@ -49,7 +49,11 @@ attributes that you may access:
     task.node
         The Node object
     task.ports
-        Ports belonging to the Node
+        Ports belonging to the Node, loaded on first access
+    task.portgroups
+        Portgroups belonging to the Node, loaded on first access
+    task.fsm
+        The provision state machine of the Node, built on first access
     task.driver
         The Driver for the Node, or the Driver based on the
         'driver_name' kwarg of TaskManager().
@@ -92,8 +96,22 @@ raised in the background thread.):
         task.spawn_after(self._spawn_worker,
                          utils.node_power_action, task, new_state)
 
+Periodic tasks processing many nodes can lock them by batches, with a
+single database query for each batch. Nodes which are already locked, not
+found or do not match the filters are skipped:
+
+::
+
+    with task_manager.acquire_many(context, node_ids,
+                                   purpose='some work') as tasks:
+        for task in tasks:
+            with task:
+                <do some work>
+
 """
 
+import collections
+
 import futurist
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -114,6 +132,12 @@ LOG = logging.getLogger(__name__)
 
 CONF = cfg.CONF
 
+LAZY_LOAD_COUNTERS = collections.Counter()
+"""Number of created tasks and of lazy loads of their resources.
+
+Keys are 'tasks', 'ports', 'portgroups' and 'fsm'.
+"""
+
 
 def require_exclusive_lock(f):
     """Decorator to require an exclusive lock.
@@ -142,7 +166,7 @@ def require_exclusive_lock(f):
 
 
 def acquire(context, node_id, shared=False, driver_name=None,
-            purpose='unspecified action'):
+            purpose='unspecified action', filters=None):
     """Shortcut for acquiring a lock on a Node.
 
     :param context: Request context.
@@ -151,13 +175,33 @@ def acquire(context, node_id, shared=False, driver_name=None,
                    lock. Default: False.
     :param driver_name: Name of Driver. Default: None.
     :param purpose: human-readable purpose to put to debug logs.
+    :param filters: Filters the node has to match, checked by the same
+                    database query that fetches (and reserves) the node.
+                    Default: None.
     :returns: An instance of :class:`TaskManager`.
 
     """
     # NOTE(lintan): This is a workaround to set the context of periodic tasks.
     context.ensure_thread_contain_context()
     return TaskManager(context, node_id, shared=shared,
-                       driver_name=driver_name, purpose=purpose)
+                       driver_name=driver_name, purpose=purpose,
+                       filters=filters)
+
+
+def acquire_many(context, node_ids, purpose='unspecified action',
+                 filters=None):
+    """Shortcut for acquiring exclusive locks on many Nodes at once.
+
+    :param context: Request context.
+    :param node_ids: list of IDs or UUIDs of nodes to lock.
+    :param purpose: human-readable purpose to put to debug logs.
+    :param filters: Filters the nodes have to match, checked by the same
+                    database query that reserves the nodes. Default: None.
+    :returns: An instance of :class:`TaskSet`.
+
+    """
+    context.ensure_thread_contain_context()
+    return TaskSet(context, node_ids, purpose=purpose, filters=filters)
 
 
 class TaskManager(object):
@@ -169,7 +213,8 @@ class TaskManager(object):
     """
 
     def __init__(self, context, node_id, shared=False, driver_name=None,
-                 purpose='unspecified action'):
+                 purpose='unspecified action', filters=None,
+                 reserved_node=None):
         """Create a new TaskManager.
 
         Acquire a lock on a node. The lock can be either shared or
@@ -184,9 +229,17 @@ class TaskManager(object):
         :param driver_name: The name of the driver to load, if different
                             from the Node's current driver.
         :param purpose: human-readable purpose to put to debug logs.
+        :param filters: Filters (as accepted by dbapi.get_nodeinfo_list())
+                        the node has to match. They are only checked when
+                        the task is created, not when upgrading the lock.
+        :param reserved_node: The Node object, if it is already reserved by
+                              this conductor, e.g. by a :class:`TaskSet`.
+                              The task takes over the reservation, and
+                              releases it.
         :raises: DriverNotFound
         :raises: NodeNotFound
         :raises: NodeLocked
+        :raises: NodeFilterMismatch if the node does not match the filters.
 
         """
 
@@ -198,7 +251,10 @@ class TaskManager(object):
         self.node_id = node_id
         self.shared = shared
 
-        self.fsm = states.machine.copy()
+        self._ports = None
+        self._portgroups = None
+        self._fsm = None
+        self._fsm_states = None
         self._purpose = purpose
         self._debug_timer = timeutils.StopWatch()
 
@@ -207,15 +263,16 @@ class TaskManager(object):
                       "%(purpose)s)",
                       {'type': 'shared' if shared else 'exclusive',
                        'node': node_id, 'purpose': purpose})
-            if not self.shared:
-                self._lock()
+            if reserved_node is not None:
+                self._debug_timer.restart()
+                self.node = reserved_node
+            elif not self.shared:
+                self._lock(filters=filters)
             else:
                 self._debug_timer.restart()
-                self.node = objects.Node.get(context, node_id)
+                self.node = objects.Node.get(context, node_id,
+                                             filters=filters)
 
-            self.ports = objects.Port.list_by_node_id(context, self.node.id)
-            self.portgroups = objects.Portgroup.list_by_node_id(context,
-                                                                self.node.id)
             self.driver = driver_factory.build_driver_for_task(
                 self, driver_name=driver_name)
 
@@ -225,14 +282,60 @@ class TaskManager(object):
                 self.node.provision_state = states.AVAILABLE
                 self.node.save()
 
-            self.fsm.initialize(start_state=self.node.provision_state,
-                                target_state=self.node.target_provision_state)
+            # NOTE: the state machine is only built when needed, but it has
+            # to start from the states the node had when the task was
+            # created.
+            self._fsm_states = (self.node.provision_state,
+                                self.node.target_provision_state)
+            LAZY_LOAD_COUNTERS['tasks'] += 1
 
         except Exception:
             with excutils.save_and_reraise_exception():
                 self.release_resources()
 
-    def _lock(self):
+    @property
+    def ports(self):
+        """Ports belonging to the node, loaded on first access."""
+        if self._ports is None and self.node is not None:
+            self._ports = objects.Port.list_by_node_id(self.context,
+                                                       self.node.id)
+            LAZY_LOAD_COUNTERS['ports'] += 1
+        return self._ports
+
+    @ports.setter
+    def ports(self, ports):
+        self._ports = ports
+
+    @property
+    def portgroups(self):
+        """Portgroups belonging to the node, loaded on first access."""
+        if self._portgroups is None and self.node is not None:
+            self._portgroups = objects.Portgroup.list_by_node_id(
+                self.context, self.node.id)
+            LAZY_LOAD_COUNTERS['portgroups'] += 1
+        return self._portgroups
+
+    @portgroups.setter
+    def portgroups(self, portgroups):
+        self._portgroups = portgroups
+
+    @property
+    def fsm(self):
+        """The provision state machine, built on first access."""
+        if self._fsm is None and self._fsm_states is not None:
+            self._fsm = states.machine.copy()
+            start_state, target_state = self._fsm_states
+            self._fsm.initialize(start_state=start_state,
+                                 target_state=target_state)
+            LAZY_LOAD_COUNTERS['fsm'] += 1
+        return self._fsm
+
+    @fsm.setter
+    def fsm(self, fsm):
+        self._fsm = fsm
+        self._fsm_states = None
+
+    def _lock(self, filters=None):
         self._debug_timer.restart()
 
         # NodeLocked exceptions can be annoying. Let's try to alleviate
@@ -244,7 +347,7 @@ class TaskManager(object):
             wait_fixed=CONF.conductor.node_locked_retry_interval * 1000)
         def reserve_node():
             self.node = objects.Node.reserve(self.context, CONF.host,
-                                             self.node_id)
+                                             self.node_id, filters=filters)
             LOG.debug("Node %(node)s successfully reserved for %(purpose)s "
                       "(took %(time).2f seconds)",
                       {'node': self.node.uuid, 'purpose': self._purpose,
@@ -458,3 +561,72 @@ class TaskManager(object):
                         fut.cancel()
                     self.release_resources()
         self.release_resources()
+
+
+class TaskSet(object):
+    """Context manager for exclusive tasks on many nodes.
+
+    All the nodes are reserved by a single database query when the instance
+    is created. Nodes which are locked, not found or do not match the filters
+    are skipped. Iterating over the instance creates a :class:`TaskManager`
+    for each reserved node, to be used as a context manager. The nodes whose
+    task has not been created when the instance exits are released, again by
+    a single database query.
+
+    """
+
+    def __init__(self, context, node_ids, purpose='unspecified action',
+                 filters=None):
+        """Create a new TaskSet, reserving the nodes.
+
+        :param context: request context
+        :param node_ids: list of IDs or UUIDs of nodes to lock.
+        :param purpose: human-readable purpose to put to debug logs.
+        :param filters: Filters (as accepted by dbapi.get_nodeinfo_list())
+                        the nodes have to match.
+
+        """
+        self.context = context
+        self._purpose = purpose
+        timer = timeutils.StopWatch().start()
+        nodes = objects.Node.reserve_nodes(context, CONF.host, node_ids,
+                                           filters=filters)
+        # Keep the order of the requested nodes
+        by_identity = {}
+        for node in nodes:
+            by_identity[node.id] = by_identity[node.uuid] = node
+        self._nodes = collections.deque(
+            by_identity[node_id] for node_id in node_ids
+            if node_id in by_identity)
+        LOG.debug("Reserved %(reserved)d of %(requested)d nodes for "
+                  "%(purpose)s (took %(time).2f seconds)",
+                  {'reserved': len(self._nodes), 'requested': len(node_ids),
+                   'purpose': purpose, 'time': timer.elapsed()})
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        while self._nodes:
+            node = self._nodes.popleft()
+            # NOTE(lintan): This is a workaround to set the context of
+            # periodic tasks.
+            self.context.ensure_thread_contain_context()
+            yield TaskManager(self.context, node.uuid,
+                              purpose=self._purpose, reserved_node=node)
+
+    def release_resources(self):
+        """Release the nodes whose task has not been created."""
+        if self._nodes:
+            node_ids = [node.id for node in self._nodes]
+            self._nodes.clear()
+            objects.Node.release_nodes(self.context, CONF.host, node_ids)
+            LOG.debug("Released the locks of %(count)d unused nodes for "
+                      "%(purpose)s", {'count': len(node_ids),
+                                      'purpose': self._purpose})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release_resources()
@@ -17,24 +17,29 @@ import ironic.api.app
 import ironic.common.dhcp_factory
 import ironic.common.driver_factory
 import ironic.common.exception
+import ironic.common.glance_service.metadata_cache
 import ironic.common.glance_service.v2.image_service
 import ironic.common.hash_ring
 import ironic.common.image_service
 import ironic.common.images
+import ironic.common.json_utils
 import ironic.common.keystone
 import ironic.common.paths
 import ironic.common.service
 import ironic.common.swift
 import ironic.common.utils
 import ironic.conductor.base_manager
+import ironic.conductor.heartbeat_buffer
 import ironic.conductor.manager
 import ironic.db.sqlalchemy.models
 import ironic.dhcp.neutron
+import ironic.drivers.base
 import ironic.drivers.modules.agent
 import ironic.drivers.modules.agent_base_vendor
 import ironic.drivers.modules.agent_client
 import ironic.drivers.modules.amt.common
 import ironic.drivers.modules.amt.power
+import ironic.drivers.modules.built_image_cache
 import ironic.drivers.modules.cimc.power
 import ironic.drivers.modules.console_utils
 import ironic.drivers.modules.deploy_utils
@@ -46,6 +51,8 @@ import ironic.drivers.modules.ilo.power
 import ironic.drivers.modules.image_cache
 import ironic.drivers.modules.inspector
 import ironic.drivers.modules.ipminative
+import ironic.drivers.modules.ipmitool_scheduler
+import ironic.drivers.modules.ipmitool_shell
 import ironic.drivers.modules.irmc.boot
 import ironic.drivers.modules.irmc.common
 import ironic.drivers.modules.iscsi_deploy
@@ -63,6 +70,7 @@ _default_opt_lists = [
     ironic.common.driver_factory.driver_opts,
     ironic.common.exception.exc_log_opts,
     ironic.common.hash_ring.hash_opts,
+    ironic.common.image_service.http_opts,
     ironic.common.images.image_opts,
     ironic.common.paths.path_opts,
     ironic.common.service.service_opts,
@@ -85,12 +93,18 @@ _opts = [
     ('cisco_ucs', ironic.drivers.modules.ucs.power.opts),
     ('conductor', itertools.chain(
         ironic.conductor.base_manager.conductor_opts,
-        ironic.conductor.manager.conductor_opts)),
+        ironic.conductor.manager.conductor_opts,
+        ironic.conductor.heartbeat_buffer.opts,
+        ironic.drivers.base.power_opts)),
     ('console', ironic.drivers.modules.console_utils.opts),
-    ('database', ironic.db.sqlalchemy.models.sql_opts),
-    ('deploy', ironic.drivers.modules.deploy_utils.deploy_opts),
+    ('database', itertools.chain(ironic.common.json_utils.opts,
+                                 ironic.db.sqlalchemy.models.sql_opts)),
+    ('deploy', itertools.chain(
+        ironic.drivers.modules.built_image_cache.opts,
+        ironic.drivers.modules.deploy_utils.deploy_opts)),
     ('dhcp', ironic.common.dhcp_factory.dhcp_provider_opts),
     ('glance', itertools.chain(
+        ironic.common.glance_service.metadata_cache.opts,
         ironic.common.glance_service.v2.image_service.glance_opts,
         ironic.common.image_service.glance_opts)),
     ('iboot', ironic.drivers.modules.iboot.opts),
@@ -100,7 +114,10 @@ _opts = [
         ironic.drivers.modules.ilo.management.clean_step_opts,
         ironic.drivers.modules.ilo.power.opts)),
     ('inspector', ironic.drivers.modules.inspector.inspector_opts),
-    ('ipmi', ironic.drivers.modules.ipminative.opts),
+    ('ipmi', itertools.chain(
+        ironic.drivers.modules.ipminative.opts,
+        ironic.drivers.modules.ipmitool_scheduler.opts,
+        ironic.drivers.modules.ipmitool_shell.opts)),
     ('irmc', itertools.chain(
         ironic.drivers.modules.irmc.boot.opts,
         ironic.drivers.modules.irmc.common.opts)),
@@ -61,21 +61,32 @@ class Connection(object):
                         :chassis_uuid: uuid of chassis
                         :driver: driver's name
                         :provision_state: provision state of node
+                        :provision_state_not_in:
+                            list of provision states to exclude
                         :provisioned_before:
                             nodes with provision_updated_at field before this
                             interval in seconds
+                        :target_power_state: target power state of node,
+                            None for nodes without a power action in progress
+                        :hash_bucket_ranges:
+                            dict mapping driver names to lists of
+                            (first, last) hash bucket ranges; only nodes
+                            with one of these drivers and a hash bucket in
+                            one of its ranges (or no hash bucket) match
         :param limit: Maximum number of nodes to return.
-        :param marker: the last item of the previous page; we return the next
-                       result set.
+        :param marker: the last item of the previous page, or its UUID; we
+                       return the next result set.
         :param sort_key: Attribute by which results should be sorted.
         :param sort_dir: direction in which results should be sorted.
                          (asc, desc)
         :returns: A list of tuples of the specified columns.
+        :raises: NodeNotFound if the marker is a UUID and the node is not
+                 found.
         """
 
     @abc.abstractmethod
     def get_node_list(self, filters=None, limit=None, marker=None,
-                      sort_key=None, sort_dir=None):
+                      sort_key=None, sort_dir=None, with_tags=False):
         """Return a list of nodes.
 
         :param filters: Filters to apply. Defaults to None.
@@ -90,15 +101,20 @@ class Connection(object):
                             nodes with provision_updated_at field before this
                             interval in seconds
         :param limit: Maximum number of nodes to return.
-        :param marker: the last item of the previous page; we return the next
-                       result set.
+        :param marker: the last item of the previous page, or its UUID; we
+                       return the next result set.
         :param sort_key: Attribute by which results should be sorted.
         :param sort_dir: direction in which results should be sorted.
                          (asc, desc)
+        :param with_tags: Whether to load the tags of the nodes, by a
+                          separate query. Default: False, the tags are not
+                          loaded and must not be accessed.
+        :raises: NodeNotFound if the marker is a UUID and the node is not
+                 found.
         """
 
     @abc.abstractmethod
-    def reserve_node(self, tag, node_id):
+    def reserve_node(self, tag, node_id, filters=None, with_tags=False):
         """Reserve a node.
 
         To prevent other ManagerServices from manipulating the given
@@ -106,9 +122,33 @@ class Connection(object):
 
         :param tag: A string uniquely identifying the reservation holder.
         :param node_id: A node id or uuid.
+        :param filters: Filters the node has to match to be reserved, checked
+                        in the same query that creates the reservation. See
+                        get_nodeinfo_list() for the supported filters.
+        :param with_tags: Whether to load the tags of the node, by a
+                          separate query. Default: False, the tags are not
+                          loaded and must not be accessed.
         :returns: A Node object.
         :raises: NodeNotFound if the node is not found.
         :raises: NodeLocked if the node is already reserved.
+        :raises: NodeFilterMismatch if the node does not match the filters.
+        """
+
+    @abc.abstractmethod
+    def reserve_nodes(self, tag, node_ids, filters=None, with_tags=False):
+        """Reserve as many nodes as possible at once.
+
+        The nodes which are free and match the filters are reserved by a
+        single UPDATE query. The others are skipped.
+
+        :param tag: A string uniquely identifying the reservation holder.
+        :param node_ids: A list of node ids or uuids.
+        :param filters: Filters the nodes have to match to be reserved, see
+                        get_nodeinfo_list() for the supported filters.
+        :param with_tags: Whether to load the tags of the nodes, by a
+                          separate query. Default: False, the tags are not
+                          loaded and must not be accessed.
+        :returns: A list of the reserved nodes, in no particular order.
         """
 
     @abc.abstractmethod
@@ -123,6 +163,16 @@ class Connection(object):
                  reservation at all.
         """
 
+    @abc.abstractmethod
+    def release_nodes(self, tag, node_ids):
+        """Release the reservations on many nodes at once.
+
+        Nodes not found or not reserved by the holder are skipped.
+
+        :param tag: A string uniquely identifying the reservation holder.
+        :param node_ids: A list of node ids or uuids.
+        """
+
     @abc.abstractmethod
     def create_node(self, values):
         """Create a new node.
@@ -147,34 +197,54 @@ class Connection(object):
         """
 
     @abc.abstractmethod
-    def get_node_by_id(self, node_id):
+    def get_node_by_id(self, node_id, filters=None, with_tags=False):
         """Return a node.
 
         :param node_id: The id of a node.
+        :param filters: Filters the node has to match. See
+                        get_nodeinfo_list() for the supported filters.
+        :param with_tags: Whether to load the tags of the node, by a
+                          separate query. Default: False, the tags are not
+                          loaded and must not be accessed.
         :returns: A node.
+        :raises: NodeNotFound if the node is not found.
+        :raises: NodeFilterMismatch if the node does not match the filters.
         """
 
     @abc.abstractmethod
-    def get_node_by_uuid(self, node_uuid):
+    def get_node_by_uuid(self, node_uuid, filters=None, with_tags=False):
         """Return a node.
 
         :param node_uuid: The uuid of a node.
+        :param filters: Filters the node has to match. See
+                        get_nodeinfo_list() for the supported filters.
+        :param with_tags: Whether to load the tags of the node, by a
+                          separate query. Default: False, the tags are not
+                          loaded and must not be accessed.
         :returns: A node.
+        :raises: NodeNotFound if the node is not found.
+        :raises: NodeFilterMismatch if the node does not match the filters.
         """
 
     @abc.abstractmethod
-    def get_node_by_name(self, node_name):
+    def get_node_by_name(self, node_name, with_tags=False):
         """Return a node.
 
         :param node_name: The logical name of a node.
+        :param with_tags: Whether to load the tags of the node, by a
+                          separate query. Default: False, the tags are not
+                          loaded and must not be accessed.
         :returns: A node.
         """
 
     @abc.abstractmethod
-    def get_node_by_instance(self, instance):
+    def get_node_by_instance(self, instance, with_tags=False):
         """Return a node.
 
         :param instance: The instance uuid to search for.
+        :param with_tags: Whether to load the tags of the node, by a
+                          separate query. Default: False, the tags are not
+                          loaded and must not be accessed.
         :returns: A node.
         :raises: InstanceNotFound if the instance is not found.
         :raises: InvalidUUID if the instance uuid is invalid.
@@ -526,6 +596,15 @@ class Connection(object):
                      driverB: set([host2, host3])}
         """
 
+    @abc.abstractmethod
+    def get_active_conductor_heartbeats(self, interval=None):
+        """Retrieve the last check-in of the registered and active conductors.
+
+        :param interval: Seconds since last check-in of a conductor.
+        :returns: A dict which maps the hostnames of the conductors to the
+                  time (UTC) of their last check-in.
+        """
+
     @abc.abstractmethod
     def get_offline_conductors(self):
         """Get a list conductor hostnames that are offline (dead).
@@ -544,6 +623,25 @@ class Connection(object):
         :raises: NodeNotFound
         """
 
+    @abc.abstractmethod
+    def update_agent_heartbeats(self, heartbeats):
+        """Write the timestamps of the agent heartbeats of many nodes.
+
+        For each node, store the time of the last heartbeat as
+        'agent_last_heartbeat' in its 'driver_internal_info', unless the
+        node is reserved, and mark its provisioning as running, as
+        touch_node_provisioning() does, if it is still in the given
+        provision state. Missing nodes are ignored.
+
+        :param heartbeats: A dict mapping node ids to (last_heartbeat,
+                           provision_state) tuples. Either element may be
+                           None to skip the corresponding update. A
+                           last_heartbeat older than the one already stored
+                           is not written.
+        :returns: A list of the ids of the reserved nodes, whose
+                  last_heartbeat was not written.
+        """
+
     @abc.abstractmethod
     def set_node_tags(self, node_id, tags):
         """Replace all of the node tags with specified list of tags.
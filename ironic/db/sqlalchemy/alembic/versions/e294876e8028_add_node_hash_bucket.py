@@ -0,0 +1,58 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add hash_bucket to nodes
+
+Revision ID: e294876e8028
+Revises: f6fdb920c182
+Create Date: 2016-06-20 11:32:04.218641
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e294876e8028'
+down_revision = 'f6fdb920c182'
+
+import hashlib
+
+from alembic import op
+import six
+import sqlalchemy as sa
+from sqlalchemy.sql import table, column
+
+# NOTE: must stay in sync with ironic.common.hash_ring.get_hash_bucket()
+HASH_BUCKET_BITS = 31
+
+node = table('nodes',
+             column('id', sa.Integer()),
+             column('uuid', sa.String(36)),
+             column('hash_bucket', sa.Integer()))
+
+
+def _get_hash_bucket(uuid):
+    if six.PY3:
+        uuid = uuid.encode('utf-8')
+    return int(hashlib.md5(uuid).hexdigest(), 16) >> (128 - HASH_BUCKET_BITS)
+
+
+def upgrade():
+    op.add_column('nodes', sa.Column('hash_bucket', sa.Integer(),
+                                     nullable=True))
+    op.create_index('nodes_driver_hash_bucket_idx', 'nodes',
+                    ['driver', 'hash_bucket'], unique=False)
+
+    connection = op.get_bind()
+    rows = connection.execute(sa.select([node.c.id, node.c.uuid])).fetchall()
+    for row in rows:
+        connection.execute(
+            node.update().where(node.c.id == row['id']).values(
+                hash_bucket=_get_hash_bucket(row['uuid'])))
@@ -0,0 +1,35 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""add indexes for the node filters of periodic tasks
+
+Revision ID: fbcf629ffe9c
+Revises: e294876e8028
+Create Date: 2016-06-27 15:41:08.513627
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'fbcf629ffe9c'
+down_revision = 'e294876e8028'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('nodes_provision_state_sweep_idx', 'nodes',
+                    ['provision_state', 'maintenance', 'reservation',
+                     'provision_updated_at'], unique=False)
+    op.create_index('nodes_reservation_idx', 'nodes', ['reservation'],
+                    unique=False)
+    op.create_index('nodes_console_enabled_idx', 'nodes',
+                    ['console_enabled'], unique=False)
@@ -23,16 +23,19 @@ import threading
 from oslo_config import cfg
 from oslo_db import exception as db_exc
 from oslo_db.sqlalchemy import enginefacade
+from oslo_db.sqlalchemy import types as db_types
 from oslo_db.sqlalchemy import utils as db_utils
 from oslo_log import log
 from oslo_utils import strutils
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
+import six
+from sqlalchemy import orm
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import joinedload
 from sqlalchemy import sql
 
 from ironic.common import exception
+from ironic.common import hash_ring
 from ironic.common.i18n import _
 from ironic.common.i18n import _LW
 from ironic.common import states
@@ -50,6 +53,11 @@ LOG = log.getLogger(__name__)
 
 _CONTEXT = threading.local()
 
+# NOTE: SQLite limits the number of parameters of a query to 999
+_TAGS_QUERY_BATCH_SIZE = 500
+# Number of nodes whose agent heartbeats are written by the same statements
+_HEARTBEATS_BATCH_SIZE = 500
+
 
 def get_backend():
     """The backend is this module itself."""
@@ -64,8 +72,55 @@ def _session_for_write():
     return enginefacade.writer.using(_CONTEXT)
 
 
-def _get_node_query_with_tags():
-    return model_query(models.Node).options(joinedload('tags'))
+def _hash_bucket_ranges_clause(ranges_by_driver):
+    """Build a clause matching nodes by driver and hash bucket ranges.
+
+    :param ranges_by_driver: a dict mapping driver names to lists of
+                             (first, last) hash bucket ranges, inclusive.
+                             Nodes which have no hash bucket yet match
+                             any range of their driver.
+    """
+    clauses = []
+    for driver, ranges in ranges_by_driver.items():
+        bucket_clauses = [models.Node.hash_bucket == sql.null()]
+        bucket_clauses.extend(models.Node.hash_bucket.between(first, last)
+                              for first, last in ranges)
+        clauses.append(sql.and_(models.Node.driver == driver,
+                                sql.or_(*bucket_clauses)))
+    if not clauses:
+        return sql.false()
+    return sql.or_(*clauses)
+
+
+def _get_node_column(name):
+    column = getattr(models.Node, name)
+    if isinstance(column.type, models.LazyJsonEncodedDict):
+        # NOTE: the rows of a column query are returned as they are read,
+        # without the model decoding the JSON documents on access.
+        column = sql.expression.type_coerce(
+            column, db_types.JsonEncodedDict).label(name)
+    return column
+
+
+def _load_node_tags(nodes):
+    """Load the tags of nodes by batches of IN queries.
+
+    Joining the tags to the queries of nodes would return a row for each
+    tag of each node; the tags are rather read separately, when requested.
+
+    :param nodes: a list of Node models.
+    :returns: the list of nodes, with their tags loaded.
+    """
+    ids = [node.id for node in nodes]
+    tags = collections.defaultdict(list)
+    for start in six.moves.range(0, len(ids), _TAGS_QUERY_BATCH_SIZE):
+        query = model_query(models.NodeTag).filter(models.NodeTag.node_id.in_(
+            ids[start:start + _TAGS_QUERY_BATCH_SIZE]))
+        for tag in query:
+            tags[tag.node_id].append(tag)
+    for node in nodes:
+        orm.attributes.set_committed_value(node, 'tags', tags[node.id])
+    return nodes
 
 
 def model_query(model, *args, **kwargs):
@@ -97,6 +152,25 @@ def add_identity_filter(query, value):
         raise exception.InvalidIdentity(identity=value)
 
 
+def add_identities_filter(query, model, values):
+    """Adds a filter on many identities to a query.
+
+    :param query: Initial query to add filter to.
+    :param model: The model whose id and uuid columns are filtered.
+    :param values: IDs and UUIDs, as accepted by add_identity_filter().
+    :return: Modified query.
+    """
+    ids, uuids = [], []
+    for value in values:
+        if strutils.is_int_like(value):
+            ids.append(int(value))
+        elif uuidutils.is_uuid_like(value):
+            uuids.append(value)
+        else:
+            raise exception.InvalidIdentity(identity=value)
+    return query.filter(sql.or_(model.id.in_(ids), model.uuid.in_(uuids)))
+
+
 def add_port_filter(query, value):
     """Adds a port-specific filter to a query.
 
@@ -165,6 +239,47 @@ def add_node_filter_by_chassis(query, value):
         return query.filter(models.Chassis.uuid == value)
 
 
+def _add_marker_uuid_filter(query, model, marker_uuid, sort_keys,
+                            sort_dir=None):
+    """Adds a keyset pagination filter on the rows after a marker.
+
+    The sort values of the marker are read from its row, joined by its UUID,
+    so that the page is fetched without loading the marker first. The rows
+    compared to the marker are the ones db_utils.paginate_query() returns
+    for a marker object; no row is returned if the marker is not found.
+
+    :param query: Initial query to add filter to.
+    :param model: The model of the rows, with a uuid column.
+    :param marker_uuid: The UUID of the last row of the previous page.
+    :param sort_keys: The columns the rows are sorted by, ending with a
+                      unique one.
+    :param sort_dir: direction in which rows are sorted (asc, desc).
+    :raises: InvalidSortKey if a sort key is not a column of the model.
+    :return: Modified query.
+    """
+    marker_row = orm.aliased(model)
+    query = query.join(marker_row, marker_row.uuid == marker_uuid)
+    criteria = []
+    equal_before = []
+    for key in sort_keys:
+        if key not in model.__table__.columns:
+            raise db_exc.InvalidSortKey()
+        column = getattr(model, key)
+        marker_value = getattr(marker_row, key)
+        if sort_dir == 'desc':
+            criteria.append(sql.and_(*(equal_before +
+                                       [column < marker_value])))
+        else:
+            criteria.append(sql.and_(*(equal_before +
+                                       [column > marker_value])))
+        # NOTE: rows with a NULL sort value equal a marker without one,
+        # like the IS NULL criteria built for marker objects.
+        equal_before.append(sql.or_(
+            column == marker_value,
+            sql.and_(column == sql.null(), marker_value == sql.null())))
+    return query.filter(sql.or_(*criteria))
+
+
 def _paginate_query(model, limit=None, marker=None, sort_key=None,
                     sort_dir=None, query=None):
     if not query:
@@ -173,6 +288,10 @@ def _paginate_query(model, limit=None, marker=None, sort_key=None,
     if sort_key and sort_key not in sort_keys:
         sort_keys.insert(0, sort_key)
     try:
+        if isinstance(marker, six.string_types):
+            query = _add_marker_uuid_filter(query, model, marker, sort_keys,
+                                            sort_dir=sort_dir)
+            marker = None
         query = db_utils.paginate_query(query, model, limit, sort_keys,
                                         marker=marker, sort_dir=sort_dir)
     except db_exc.InvalidSortKey:
@@ -185,12 +304,15 @@ def _paginate_query(model, limit=None, marker=None, sort_key=None,
 class Connection(api.Connection):
     """SqlAlchemy connection."""
 
+    _NODE_QUERY_FIELDS = {'console_enabled', 'driver', 'maintenance',
+                          'provision_state', 'target_power_state'}
+
     def __init__(self):
         pass
 
     def _add_nodes_filters(self, query, filters):
         if filters is None:
-            filters = []
+            filters = {}
 
         if 'chassis_uuid' in filters:
             # get_chassis_by_uuid() to raise an exception if the chassis
@@ -210,12 +332,13 @@ class Connection(api.Connection):
         if 'reserved_by_any_of' in filters:
             query = query.filter(models.Node.reservation.in_(
                 filters['reserved_by_any_of']))
-        if 'maintenance' in filters:
-            query = query.filter_by(maintenance=filters['maintenance'])
-        if 'driver' in filters:
-            query = query.filter_by(driver=filters['driver'])
-        if 'provision_state' in filters:
-            query = query.filter_by(provision_state=filters['provision_state'])
+        filter_dict = {k: v for k, v in filters.items()
+                       if k in self._NODE_QUERY_FIELDS}
+        if filter_dict:
+            query = query.filter_by(**filter_dict)
+        if 'provision_state_not_in' in filters:
+            query = query.filter(~models.Node.provision_state.in_(
+                filters['provision_state_not_in']))
         if 'provisioned_before' in filters:
             limit = (timeutils.utcnow() -
                      datetime.timedelta(seconds=filters['provisioned_before']))
@@ -225,8 +348,9 @@ class Connection(api.Connection):
                      (datetime.timedelta(
                          seconds=filters['inspection_started_before'])))
             query = query.filter(models.Node.inspection_started_at < limit)
-        if 'console_enabled' in filters:
-            query = query.filter_by(console_enabled=filters['console_enabled'])
+        if 'hash_bucket_ranges' in filters:
+            query = query.filter(
+                _hash_bucket_ranges_clause(filters['hash_bucket_ranges']))
 
         return query
 
@@ -237,37 +361,81 @@ class Connection(api.Connection):
         if columns is None:
             columns = [models.Node.id]
         else:
-            columns = [getattr(models.Node, c) for c in columns]
+            columns = [_get_node_column(c) for c in columns]
 
         query = model_query(*columns, base_model=models.Node)
         query = self._add_nodes_filters(query, filters)
-        return _paginate_query(models.Node, limit, marker,
-                               sort_key, sort_dir, query)
+        return self._paginate_nodes(limit, marker, sort_key, sort_dir, query)
 
     def get_node_list(self, filters=None, limit=None, marker=None,
-                      sort_key=None, sort_dir=None):
-        query = _get_node_query_with_tags()
+                      sort_key=None, sort_dir=None, with_tags=False):
+        query = model_query(models.Node)
         query = self._add_nodes_filters(query, filters)
-        return _paginate_query(models.Node, limit, marker,
-                               sort_key, sort_dir, query)
+        nodes = self._paginate_nodes(limit, marker, sort_key, sort_dir, query)
+        if with_tags:
+            _load_node_tags(nodes)
+        return nodes
+
+    def _paginate_nodes(self, limit, marker, sort_key, sort_dir, query):
+        result = _paginate_query(models.Node, limit, marker,
+                                 sort_key, sort_dir, query)
+        if not result and isinstance(marker, six.string_types):
+            # NOTE: a page after an unknown marker is empty, tell them apart
+            # only then to save a query on the other pages.
+            self.get_node_by_uuid(marker)
+        return result
 
-    def reserve_node(self, tag, node_id):
+    def reserve_node(self, tag, node_id, filters=None, with_tags=False):
         with _session_for_write():
-            query = _get_node_query_with_tags()
+            query = model_query(models.Node)
             query = add_identity_filter(query, node_id)
+            update_query = self._add_nodes_filters(
+                query.filter_by(reservation=None), filters)
             # be optimistic and assume we usually create a reservation
-            count = query.filter_by(reservation=None).update(
+            count = update_query.update(
                 {'reservation': tag}, synchronize_session=False)
             try:
                 node = query.one()
                 if count != 1:
+                    if filters and node['reservation'] is None:
+                        # Nothing updated and the node is not locked, so
+                        # it does not match the filters.
+                        raise exception.NodeFilterMismatch(node=node.uuid,
+                                                           filters=filters)
                     # Nothing updated and node exists. Must already be
                     # locked.
                     raise exception.NodeLocked(node=node.uuid,
                                                host=node['reservation'])
-                return node
             except NoResultFound:
                 raise exception.NodeNotFound(node_id)
+            if with_tags:
+                _load_node_tags([node])
+            return node
+
+    def reserve_nodes(self, tag, node_ids, filters=None, with_tags=False):
+        if not node_ids:
+            return []
+        with _session_for_write():
+            query = add_identities_filter(model_query(models.Node.id),
+                                          models.Node, node_ids)
+            query = self._add_nodes_filters(
+                query.filter_by(reservation=None), filters)
+            # Lock the free rows first, so that the nodes reserved by
+            # another thread of this host between the UPDATE and the
+            # SELECT below are not mistaken for ours.
+            free_ids = [row[0] for row in query.with_for_update()]
+            if not free_ids:
+                return []
+            model_query(models.Node).filter(
+                models.Node.id.in_(free_ids)).filter_by(
+                reservation=None).update({'reservation': tag},
+                                         synchronize_session=False)
+            nodes = model_query(models.Node).filter(
+                models.Node.id.in_(free_ids)).filter_by(
+                reservation=tag).all()
+            if with_tags:
+                _load_node_tags(nodes)
+            return nodes
 
     def release_node(self, tag, node_id):
         with _session_for_write():
@@ -287,6 +455,15 @@ class Connection(api.Connection):
             except NoResultFound:
                 raise exception.NodeNotFound(node_id)
 
+    def release_nodes(self, tag, node_ids):
+        if not node_ids:
+            return
+        with _session_for_write():
+            query = add_identities_filter(model_query(models.Node),
+                                          models.Node, node_ids)
+            query.filter_by(reservation=tag).update(
+                {'reservation': None}, synchronize_session=False)
+
     def create_node(self, values):
         # ensure defaults are present for new nodes
         if 'uuid' not in values:
@@ -295,6 +472,7 @@ class Connection(api.Connection):
             values['power_state'] = states.NOSTATE
         if 'provision_state' not in values:
             values['provision_state'] = states.ENROLL
+        values['hash_bucket'] = hash_ring.get_hash_bucket(values['uuid'])
 
         # TODO(zhenguo): Support creating node with tags
         if 'tags' in values:
@@ -322,35 +500,53 @@ class Connection(api.Connection):
             node['tags'] = []
             return node
 
-    def get_node_by_id(self, node_id):
-        query = _get_node_query_with_tags()
-        query = query.filter_by(id=node_id)
+    def _get_node_with_filters(self, query, node_id, filters):
         try:
-            return query.one()
+            return self._add_nodes_filters(query, filters).one()
         except NoResultFound:
+            if filters:
+                # Check whether the node exists at all
+                try:
+                    node = query.one()
+                except NoResultFound:
+                    pass
+                else:
+                    raise exception.NodeFilterMismatch(node=node.uuid,
+                                                       filters=filters)
             raise exception.NodeNotFound(node=node_id)
 
-    def get_node_by_uuid(self, node_uuid):
-        query = _get_node_query_with_tags()
+    def get_node_by_id(self, node_id, filters=None, with_tags=False):
+        query = model_query(models.Node)
+        query = query.filter_by(id=node_id)
+        node = self._get_node_with_filters(query, node_id, filters)
+        if with_tags:
+            _load_node_tags([node])
+        return node
+
+    def get_node_by_uuid(self, node_uuid, filters=None, with_tags=False):
+        query = model_query(models.Node)
         query = query.filter_by(uuid=node_uuid)
-        try:
-            return query.one()
-        except NoResultFound:
-            raise exception.NodeNotFound(node=node_uuid)
+        node = self._get_node_with_filters(query, node_uuid, filters)
+        if with_tags:
+            _load_node_tags([node])
+        return node
 
-    def get_node_by_name(self, node_name):
-        query = _get_node_query_with_tags()
+    def get_node_by_name(self, node_name, with_tags=False):
+        query = model_query(models.Node)
         query = query.filter_by(name=node_name)
         try:
-            return query.one()
+            node = query.one()
         except NoResultFound:
             raise exception.NodeNotFound(node=node_name)
+        if with_tags:
+            _load_node_tags([node])
+        return node
 
-    def get_node_by_instance(self, instance):
+    def get_node_by_instance(self, instance, with_tags=False):
         if not uuidutils.is_uuid_like(instance):
             raise exception.InvalidUUID(uuid=instance)
 
-        query = _get_node_query_with_tags()
+        query = model_query(models.Node)
         query = query.filter_by(instance_uuid=instance)
 
         try:
@@ -358,6 +554,8 @@ class Connection(api.Connection):
         except NoResultFound:
             raise exception.InstanceNotFound(instance=instance)
 
+        if with_tags:
+            _load_node_tags([result])
         return result
 
     def destroy_node(self, node_id):
@@ -772,6 +970,19 @@ class Connection(api.Connection):
                 d2c[driver].add(row['hostname'])
         return d2c
 
+    def get_active_conductor_heartbeats(self, interval=None):
+        if interval is None:
+            interval = CONF.conductor.heartbeat_timeout
+
+        limit = timeutils.utcnow() - datetime.timedelta(seconds=interval)
+        result = (model_query(models.Conductor.hostname,
+                              models.Conductor.updated_at)
+                  .filter_by(online=True)
+                  .filter(models.Conductor.updated_at >= limit)
+                  .all())
+        return dict((hostname, updated_at)
+                    for hostname, updated_at in result)
+
     def get_offline_conductors(self):
         interval = CONF.conductor.heartbeat_timeout
         limit = timeutils.utcnow() - datetime.timedelta(seconds=interval)
@@ -788,6 +999,61 @@ class Connection(api.Connection):
             if count == 0:
                 raise exception.NodeNotFound(node_id)
 
+    def update_agent_heartbeats(self, heartbeats):
+        reserved = []
+        if not heartbeats:
+            return reserved
+        now = timeutils.utcnow()
+        nodes = models.Node.__table__
+        # Sort the nodes to lock them in the same order as other callers
+        node_ids = sorted(heartbeats)
+        with _session_for_write() as session:
+            for start in range(0, len(node_ids), _HEARTBEATS_BATCH_SIZE):
+                batch = node_ids[start:start + _HEARTBEATS_BATCH_SIZE]
+
+                info_ids = [node_id for node_id in batch
+                            if heartbeats[node_id][0] is not None]
+                if info_ids:
+                    query = model_query(
+                        models.Node.id, models.Node.reservation,
+                        _get_node_column('driver_internal_info')).filter(
+                        models.Node.id.in_(info_ids))
+                    updates = []
+                    for node_id, reservation, info in query.with_for_update():
+                        if reservation is not None:
+                            # NOTE: the reserved nodes are being worked on,
+                            # their driver_internal_info is left to the
+                            # holder of the lock.
+                            reserved.append(node_id)
+                            continue
+                        info = dict(info or {})
+                        # NOTE: a newer heartbeat may have been saved
+                        # directly since this one was recorded.
+                        info['agent_last_heartbeat'] = max(
+                            info.get('agent_last_heartbeat') or 0,
+                            heartbeats[node_id][0])
+                        updates.append({'node_id': node_id, 'info': info})
+                    if updates:
+                        session.execute(
+                            nodes.update().where(
+                                nodes.c.id == sql.bindparam('node_id')).values(
+                                driver_internal_info=sql.bindparam(
+                                    'info', type_=db_types.JsonEncodedDict)),
+                            updates)
+
+                touched = collections.defaultdict(list)
+                for node_id in batch:
+                    provision_state = heartbeats[node_id][1]
+                    if provision_state is not None:
+                        touched[provision_state].append(node_id)
+                for provision_state, state_ids in touched.items():
+                    model_query(models.Node).filter(
+                        models.Node.id.in_(state_ids)).filter_by(
+                        provision_state=provision_state).update(
+                        {'provision_updated_at': now},
+                        synchronize_session=False)
+        return reserved
+
     def _check_node_exists(self, node_id):
         if not model_query(models.Node).filter_by(id=node_id).scalar():
             raise exception.NodeNotFound(node=node_id)
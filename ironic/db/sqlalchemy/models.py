@@ -30,6 +30,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import orm
 
 from ironic.common.i18n import _
+from ironic.common import json_utils
 from ironic.common import paths
 
 
@@ -69,6 +70,26 @@ class IronicBase(models.TimestampMixin,
 Base = declarative_base(cls=IronicBase)
 
 
+class LazyJsonEncodedDict(db_types.JsonEncodedDict):
+    """A JsonEncodedDict which is decoded when its value is first needed.
+
+    Rows are read with json_utils.EncodedJson values, which the model
+    decodes on first access. Values which were never decoded are written
+    back as they were read.
+    """
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, json_utils.EncodedJson):
+            return value.text
+        return super(LazyJsonEncodedDict, self).process_bind_param(value,
+                                                                   dialect)
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            value = json_utils.EncodedJson(value)
+        return value
+
+
 class Chassis(Base):
     """Represents a hardware chassis."""
 
@@ -106,6 +127,13 @@ class Node(Base):
         schema.UniqueConstraint('instance_uuid',
                                 name='uniq_nodes0instance_uuid'),
         schema.UniqueConstraint('name', name='uniq_nodes0name'),
+        Index('nodes_driver_hash_bucket_idx', 'driver', 'hash_bucket'),
+        # NOTE: matches the filters of the periodic tasks looking for free
+        #       nodes in a provision state, optionally for too long.
+        Index('nodes_provision_state_sweep_idx', 'provision_state',
+              'maintenance', 'reservation', 'provision_updated_at'),
+        Index('nodes_reservation_idx', 'reservation'),
+        Index('nodes_console_enabled_idx', 'console_enabled'),
         table_args())
     id = Column(Integer, primary_key=True)
     uuid = Column(String(36))
@@ -121,15 +149,15 @@ class Node(Base):
     target_provision_state = Column(String(15), nullable=True)
     provision_updated_at = Column(DateTime, nullable=True)
     last_error = Column(Text, nullable=True)
-    instance_info = Column(db_types.JsonEncodedDict)
-    properties = Column(db_types.JsonEncodedDict)
+    instance_info = Column(LazyJsonEncodedDict)
+    properties = Column(LazyJsonEncodedDict)
     driver = Column(String(255))
-    driver_info = Column(db_types.JsonEncodedDict)
-    driver_internal_info = Column(db_types.JsonEncodedDict)
-    clean_step = Column(db_types.JsonEncodedDict)
+    driver_info = Column(LazyJsonEncodedDict)
+    driver_internal_info = Column(LazyJsonEncodedDict)
+    clean_step = Column(LazyJsonEncodedDict)
 
-    raid_config = Column(db_types.JsonEncodedDict)
-    target_raid_config = Column(db_types.JsonEncodedDict)
+    raid_config = Column(LazyJsonEncodedDict)
+    target_raid_config = Column(LazyJsonEncodedDict)
 
     # NOTE(deva): this is the host name of the conductor which has
     #             acquired a TaskManager lock on the node.
@@ -150,7 +178,32 @@ class Node(Base):
     console_enabled = Column(Boolean, default=False)
     inspection_finished_at = Column(DateTime, nullable=True)
     inspection_started_at = Column(DateTime, nullable=True)
-    extra = Column(db_types.JsonEncodedDict)
+    extra = Column(LazyJsonEncodedDict)
+
+    # NOTE: the bucket of the node's UUID on the conductors hash ring,
+    #       see ironic.common.hash_ring.get_hash_bucket(). It lets
+    #       conductors fetch only the nodes which may be mapped to them.
+    hash_bucket = Column(Integer, nullable=True)
+
+    def __getattribute__(self, name):
+        value = super(Node, self).__getattribute__(name)
+        if value.__class__ is json_utils.EncodedJson:
+            value = value.decode()
+            # NOTE: keep the decoded value, without marking it as changed
+            orm.attributes.set_committed_value(self, name, value)
+        return value
+
+    def get_encoded(self, name):
+        """Get the value of a column, without decoding it.
+
+        :param name: The name of the column.
+        :returns: A json_utils.EncodedJson for the JSON columns which were
+                  not accessed yet, else the value of the column.
+        """
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            return getattr(self, name)
 
 
 class Port(Base):
@@ -23,7 +23,10 @@ import copy
 import inspect
 import json
 import os
+import threading
+import time
 
+import futurist
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
@@ -32,14 +35,30 @@ import six
 from ironic.common import exception
 from ironic.common.i18n import _, _LE
 from ironic.common import raid
+from ironic.common import states
 
 LOG = logging.getLogger(__name__)
 
 RAID_CONFIG_SCHEMA = os.path.join(os.path.dirname(__file__),
                                   'raid_config_schema.json')
 
+power_opts = [
+    cfg.IntOpt('power_state_cache_ttl',
+               default=0, min=0,
+               help=_('Time in seconds during which the power state of a '
+                      'node read from its power interface is reused, '
+                      'instead of asking the BMC again. Changing the power '
+                      'state of the node through the power interface drops '
+                      'the cached value, but changes made outside of it '
+                      '(e.g. from another conductor, or by the node '
+                      'itself) are only seen once the value expires. '
+                      'Concurrent requests for the power state of the same '
+                      'node are always sent only once. Set to 0 to disable '
+                      'caching.')),
+]
 
 CONF = cfg.CONF
+CONF.register_opts(power_opts, group='conductor')
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -375,6 +394,14 @@ class DeployInterface(BaseInterface):
         """
         pass
 
+    def get_image_cache(self):
+        """Return the cache of the instance images on the conductor.
+
+        :returns: an ironic.drivers.modules.image_cache.ImageCache instance,
+            or None if the interface does not cache instance images.
+        """
+        return None
+
 
 @six.add_metaclass(abc.ABCMeta)
 class BootInterface(object):
@@ -455,8 +482,143 @@ class BootInterface(object):
         :returns: None
         """
 
+    def get_image_cache(self):
+        """Return the cache of the kernels and ramdisks on the conductor.
 
-@six.add_metaclass(abc.ABCMeta)
+        :returns: an ironic.drivers.modules.image_cache.ImageCache instance,
+            or None if the interface does not cache kernels and ramdisks.
+        """
+        return None
+
+
+class PowerStateCache(object):
+    """Power states recently read by the power interfaces, by node UUID.
+
+    Only one request for the power state of a node is running at a time:
+    callers asking for it in the meantime wait for, and share, its result.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, node_uuid, fetch):
+        """Get the power state of a node.
+
+        :param node_uuid: the UUID of the node.
+        :param fetch: a callable returning the power state of the node, used
+                      when there is no valid cached value.
+        :returns: a power state. One of :mod:`ironic.common.states`.
+        """
+        ttl = CONF.conductor.power_state_cache_ttl
+        with self._lock:
+            cached = self._states.pop(node_uuid, None)
+            if cached is not None and time.time() < cached[1] + ttl:
+                self._states[node_uuid] = cached
+                return cached[0]
+            future = self._pending.get(node_uuid)
+            leader = future is None
+            if leader:
+                future = self._pending[node_uuid] = futurist.Future()
+                future.set_running_or_notify_cancel()
+
+        if not leader:
+            # Another thread is asking the BMC already
+            return future.result()
+
+        try:
+            power_state = fetch()
+        except Exception as e:
+            with self._lock:
+                if self._pending.get(node_uuid) is future:
+                    del self._pending[node_uuid]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            # Do not keep the result if the cache was invalidated meanwhile
+            if self._pending.get(node_uuid) is future:
+                del self._pending[node_uuid]
+                if ttl and power_state in (states.POWER_ON,
+                                           states.POWER_OFF):
+                    self._states[node_uuid] = (power_state, time.time())
+        future.set_result(power_state)
+        return power_state
+
+    def invalidate(self, node_uuid):
+        """Forget the power state of a node.
+
+        :param node_uuid: the UUID of the node.
+        """
+        with self._lock:
+            self._states.pop(node_uuid, None)
+            self._pending.pop(node_uuid, None)
+
+
+POWER_STATE_CACHE = PowerStateCache()
+
+# Set while a method of a power interface is running, so that the methods
+# it calls in turn (e.g. a reboot getting the power state) bypass the cache
+_power_call = threading.local()
+
+
+def _run_power_call(func, self, task, *args, **kwargs):
+    previous = getattr(_power_call, 'active', False)
+    _power_call.active = True
+    try:
+        return func(self, task, *args, **kwargs)
+    finally:
+        _power_call.active = previous
+
+
+def _cache_power_state(func):
+    @six.wraps(func)
+    def get_power_state(self, task, *args, **kwargs):
+        if getattr(_power_call, 'active', False):
+            return func(self, task, *args, **kwargs)
+        return POWER_STATE_CACHE.get(
+            task.node.uuid,
+            lambda: _run_power_call(func, self, task, *args, **kwargs))
+    return get_power_state
+
+
+def _invalidate_power_state(func):
+    @six.wraps(func)
+    def wrapper(self, task, *args, **kwargs):
+        if getattr(_power_call, 'active', False):
+            return func(self, task, *args, **kwargs)
+        POWER_STATE_CACHE.invalidate(task.node.uuid)
+        try:
+            return _run_power_call(func, self, task, *args, **kwargs)
+        finally:
+            POWER_STATE_CACHE.invalidate(task.node.uuid)
+    return wrapper
+
+
+class PowerInterfaceMeta(abc.ABCMeta):
+    """Metaclass of the power interfaces.
+
+    It makes the get_power_state() implementations go through
+    POWER_STATE_CACHE, and the set_power_state() and reboot() ones
+    invalidate it.
+    """
+
+    _wrappers = {'get_power_state': _cache_power_state,
+                 'set_power_state': _invalidate_power_state,
+                 'reboot': _invalidate_power_state}
+
+    def __new__(mcs, name, bases, attrs):
+        for method, wrapper in mcs._wrappers.items():
+            func = attrs.get(method)
+            if (inspect.isfunction(func) and
+                    not getattr(func, '__isabstractmethod__', False)):
+                attrs[method] = wrapper(func)
+        return super(PowerInterfaceMeta, mcs).__new__(mcs, name, bases,
+                                                      attrs)
+
+
+@six.add_metaclass(PowerInterfaceMeta)
 class PowerInterface(BaseInterface):
     """Interface for power-related actions."""
     interface_type = 'power'
@@ -34,6 +34,7 @@ from ironic.common.i18n import _LI
 from ironic.common.i18n import _LW
 from ironic.common import states
 from ironic.common import utils
+from ironic.conductor import heartbeat_buffer
 from ironic.conductor import rpcapi
 from ironic.conductor import task_manager
 from ironic.conductor import utils as manager_utils
@@ -141,6 +142,15 @@ def _get_post_clean_step_hook(node):
         pass
 
 
+def _save_heartbeat(node):
+    """Save the heartbeat of the agent of a node, unless already saved.
+
+    :param node: a node object
+    """
+    if 'driver_internal_info' in node.obj_what_changed():
+        node.save()
+
+
 class BaseAgentVendor(base.VendorInterface):
 
     def __init__(self):
@@ -453,6 +463,11 @@ class BaseAgentVendor(base.VendorInterface):
          }
 
         AGENT_PORT defaults to 9999.
+
+        A heartbeat only updating timestamps of the node is recorded in
+        memory and written later by the conductor, together with others.
+        The node is saved right away if the agent URL changed, or before
+        moving the node to another state.
         """
         node = task.node
         driver_internal_info = node.driver_internal_info
@@ -460,17 +475,22 @@ class BaseAgentVendor(base.VendorInterface):
             'Heartbeat from %(node)s, last heartbeat at %(heartbeat)s.',
             {'node': node.uuid,
              'heartbeat': driver_internal_info.get('agent_last_heartbeat')})
-        driver_internal_info['agent_last_heartbeat'] = int(time.time())
         try:
-            driver_internal_info['agent_url'] = kwargs['agent_url']
+            agent_url = kwargs['agent_url']
         except KeyError:
             raise exception.MissingParameterValue(_('For heartbeat operation, '
                                                     '"agent_url" must be '
                                                     'specified.'))
-
+        last_heartbeat = int(time.time())
+        agent_url_changed = driver_internal_info.get('agent_url') != agent_url
+        driver_internal_info['agent_last_heartbeat'] = last_heartbeat
+        driver_internal_info['agent_url'] = agent_url
         node.driver_internal_info = driver_internal_info
-        node.save()
+        if agent_url_changed:
+            node.save()
 
+        provision_state = node.provision_state
+        touch_provisioning = False
         # Async call backs don't set error state on their own
         # TODO(jimrollenhagen) improve error messages here
         msg = _('Failed checking if deploy is done.')
@@ -483,22 +503,25 @@ class BaseAgentVendor(base.VendorInterface):
             elif (node.provision_state == states.DEPLOYWAIT and
                   not self.deploy_has_started(task)):
                 msg = _('Node failed to get image for deploy.')
+                _save_heartbeat(node)
                 self.continue_deploy(task, **kwargs)
             elif (node.provision_state == states.DEPLOYWAIT and
                   self.deploy_is_done(task)):
                 msg = _('Node failed to move to active state.')
+                _save_heartbeat(node)
                 self.reboot_to_instance(task, **kwargs)
             elif (node.provision_state == states.DEPLOYWAIT and
                   self.deploy_has_started(task)):
-                node.touch_provisioning()
+                touch_provisioning = True
             elif node.provision_state == states.CLEANWAIT:
-                node.touch_provisioning()
+                touch_provisioning = True
                 try:
                     if not node.clean_step:
                         LOG.debug('Node %s just booted to start cleaning.',
                                   node.uuid)
                         msg = _('Node failed to start the first cleaning '
                                 'step.')
+                        _save_heartbeat(node)
                         # First, cache the clean steps
                         self._refresh_clean_steps(task)
                         # Then set/verify node clean steps and start cleaning
@@ -521,6 +544,18 @@ class BaseAgentVendor(base.VendorInterface):
                 manager_utils.cleaning_error_handler(task, last_error)
             elif node.provision_state in (states.DEPLOYING, states.DEPLOYWAIT):
                 deploy_utils.set_failed_state(task, last_error)
+        finally:
+            # NOTE: the heartbeat is written by the next flush, unless a
+            # change of the node above did it already.
+            if 'driver_internal_info' not in node.obj_what_changed():
+                last_heartbeat = None
+            # Moving the node to another state marked it as running already
+            touch_provisioning = (touch_provisioning and
+                                  node.provision_state == provision_state)
+            if last_heartbeat is not None or touch_provisioning:
+                heartbeat_buffer.record(
+                    node, last_heartbeat=last_heartbeat,
+                    touch_provisioning=touch_provisioning)
 
     @base.driver_passthru(['POST'], async=False)
     def lookup(self, context, **kwargs):
@@ -741,6 +776,9 @@ class BaseAgentVendor(base.VendorInterface):
             wait_fixed=wait
         )
         def _wait_until_powered_off(task):
+            # NOTE: the agent powers the node off by itself, the cached
+            # power state is outdated.
+            base.POWER_STATE_CACHE.invalidate(task.node.uuid)
             return task.driver.power.get_power_state(task)
 
         node = task.node
@@ -0,0 +1,256 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache of the images built for the virtual media boot of nodes.
+
+Boot ISOs and floppy images are built for each node from kernels, ramdisks
+and parameters which are often the same for many nodes. A built image is
+stored under a name derived from a hash of the inputs of its build (its key),
+so that the next nodes with the same inputs reuse it instead of building and
+uploading it again.
+
+In a directory (the root of a web server or of a share), the file of each
+node is a hard link to the built image, whose link count is the number of
+nodes using it. In Swift, the object of each node is copied by Swift from
+the built image.
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from ironic_lib import utils as ironic_utils
+from oslo_concurrency import lockutils
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+
+from ironic.common import exception
+from ironic.common.i18n import _
+from ironic.common.i18n import _LI
+from ironic.common import image_service
+from ironic.common import swift
+
+LOG = logging.getLogger(__name__)
+
+opts = [
+    cfg.IntOpt('built_image_cache_ttl',
+               default=0, min=0,
+               help=_('Time in seconds during which a boot ISO or floppy '
+                      'image built for the virtual media boot of a node is '
+                      'kept after its last use, to be reused by the nodes '
+                      'booting the same kernel and ramdisk with the same '
+                      'parameters. Images are built for every node if 0.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group='deploy')
+
+# Prefix of the names of the built images
+BUILT_IMAGE_PREFIX = 'built-'
+
+
+def get_key(*inputs):
+    """Get the key of an image built from some inputs.
+
+    :param inputs: the inputs of the build, e.g. the hrefs of the kernel and
+                   ramdisk and the kernel parameters. They are serialized
+                   to JSON.
+    :returns: a hash of the inputs, as a hexadecimal string.
+    """
+    data = jsonutils.dumps(inputs, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def get_image_version(context, image_href):
+    """Get what identifies the contents of an image, as input of a build.
+
+    An href does not identify the contents of an image alone, e.g. a file
+    served over HTTP can be replaced.
+
+    :param context: the request context.
+    :param image_href: the href of the image.
+    :returns: a dictionary with the href, size, update time and checksum (if
+              known) of the image. Only the href is returned, without any
+              request, if the cache is disabled.
+    :raises: ImageRefValidationFailed if no image service can handle the
+             href or if the image cannot be found.
+    """
+    version = {'href': image_href}
+    if not CONF.deploy.built_image_cache_ttl:
+        return version
+
+    service = image_service.get_image_service(image_href, context=context)
+    properties = service.show(image_href)
+    version['size'] = properties.get('size')
+    version['updated_at'] = properties.get('updated_at')
+    version['checksum'] = properties.get('checksum')
+    return version
+
+
+def _build_in(directory, build):
+    """Build an image into a new file of a directory.
+
+    :param directory: the directory.
+    :param build: function building the image into the path it is given.
+    :returns: the path of the file, readable by all.
+    """
+    fd, path = tempfile.mkstemp(dir=directory)
+    os.close(fd)
+    try:
+        build(path)
+        os.chmod(path, 0o644)
+    except Exception:
+        ironic_utils.unlink_without_raise(path)
+        raise
+    return path
+
+
+def put_in_directory(directory, file_name, key, build):
+    """Put an image in a directory, building it if not cached.
+
+    :param directory: the directory, e.g. the root of a web server or share.
+    :param file_name: the name of the file of the node in the directory.
+    :param key: the key of the image, from get_key().
+    :param build: function building the image into the path it is given.
+    :raises: OSError or IOError if a file operation fails, and the
+             exceptions raised by build.
+    """
+    path = os.path.join(directory, file_name)
+    ttl = CONF.deploy.built_image_cache_ttl
+    if not ttl:
+        os.rename(_build_in(directory, build), path)
+        return
+
+    built_path = os.path.join(
+        directory,
+        BUILT_IMAGE_PREFIX + key + os.path.splitext(file_name)[1])
+    with lockutils.lock('built-image-%s' % key, 'ironic-'):
+        while True:
+            try:
+                # Record the last use
+                os.utime(built_path, None)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                os.rename(_build_in(directory, build), built_path)
+                LOG.info(_LI("Built the image %(built)s for %(file)s"),
+                         {'built': built_path, 'file': file_name})
+            else:
+                LOG.debug("Reusing the image %(built)s built for %(file)s",
+                          {'built': built_path, 'file': file_name})
+
+            ironic_utils.unlink_without_raise(path)
+            try:
+                os.link(built_path, path)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    # NOTE: the lock is internal to this conductor, another
+                    # one sharing the directory deleted the image.
+                    LOG.debug("The image %(built)s was deleted before "
+                              "%(file)s was linked to it, building it again",
+                              {'built': built_path, 'file': file_name})
+                    continue
+                LOG.debug("Cannot link %(file)s to %(built)s, copying it "
+                          "instead: %(error)s",
+                          {'built': built_path, 'file': file_name,
+                           'error': e})
+                shutil.copyfile(built_path, path)
+                os.chmod(path, 0o644)
+            break
+
+    clean_up_directory(directory, ttl)
+
+
+def clean_up_directory(directory, ttl):
+    """Delete the built images of a directory unused for some time.
+
+    Images linked to by the files of nodes are never deleted.
+
+    :param directory: the directory.
+    :param ttl: the time in seconds during which an unused image is kept
+                after its last use.
+    """
+    threshold = time.time() - ttl
+    for file_name in os.listdir(directory):
+        if not file_name.startswith(BUILT_IMAGE_PREFIX):
+            continue
+        built_path = os.path.join(directory, file_name)
+        key = os.path.splitext(file_name[len(BUILT_IMAGE_PREFIX):])[0]
+        with lockutils.lock('built-image-%s' % key, 'ironic-'):
+            try:
+                stat = os.stat(built_path)
+            except OSError:
+                continue
+            if stat.st_nlink == 1 and stat.st_mtime < threshold:
+                LOG.debug("Deleting the unused built image %s", built_path)
+                ironic_utils.unlink_without_raise(built_path)
+
+
+def _copy_built_object(swift_api, container, built_object_name,
+                       object_name, object_headers):
+    swift_api.copy_object(container, built_object_name, object_name,
+                          object_headers=object_headers)
+    headers = dict(object_headers or {})
+    if not any(header.lower() in ('x-delete-at', 'x-delete-after')
+               for header in headers):
+        # NOTE: Swift copies the expiry of the built image, the object of
+        # the node has to stay as long as the node uses it. The metadata
+        # replaced by the POST is passed again.
+        headers['X-Remove-Delete-At'] = 'true'
+        swift_api.update_object_meta(container, object_name, headers)
+
+
+def put_in_swift(container, object_name, key, build, object_headers=None):
+    """Put an image in Swift, building it if not cached.
+
+    :param container: the name of the container.
+    :param object_name: the name of the object of the node.
+    :param key: the key of the image, from get_key().
+    :param build: function building the image into the path it is given.
+    :param object_headers: the headers of the object of the node.
+    :raises: SwiftOperationError, if any operation with Swift fails, and
+             the exceptions raised by build.
+    """
+    swift_api = swift.SwiftAPI()
+    ttl = CONF.deploy.built_image_cache_ttl
+    built_object_name = BUILT_IMAGE_PREFIX + key
+    if ttl:
+        try:
+            _copy_built_object(swift_api, container, built_object_name,
+                               object_name, object_headers)
+        except exception.SwiftObjectNotFoundError:
+            pass
+        else:
+            LOG.debug("Reusing the image %(built)s built for %(object)s",
+                      {'built': built_object_name, 'object': object_name})
+            swift_api.update_object_meta(container, built_object_name,
+                                         {'X-Delete-After': ttl})
+            return
+
+    with tempfile.NamedTemporaryFile(dir=CONF.tempdir) as fileobj:
+        build(fileobj.name)
+        if not ttl:
+            swift_api.create_object(container, object_name, fileobj.name,
+                                    object_headers=object_headers)
+            return
+
+        swift_api.create_object(container, built_object_name, fileobj.name,
+                                object_headers={'X-Delete-After': ttl})
+    LOG.info(_LI("Built the image %(built)s for %(object)s"),
+             {'built': built_object_name, 'object': object_name})
+    _copy_built_object(swift_api, container, built_object_name, object_name,
+                       object_headers)
@@ -16,7 +16,6 @@ Boot Interface for iLO drivers and its supporting methods.
 """
 
 import os
-import tempfile
 
 from ironic_lib import utils as ironic_utils
 from oslo_config import cfg
@@ -36,6 +35,7 @@ from ironic.common import states
 from ironic.common import swift
 from ironic.conductor import utils as manager_utils
 from ironic.drivers import base
+from ironic.drivers.modules import built_image_cache
 from ironic.drivers.modules import deploy_utils
 from ironic.drivers.modules.ilo import common as ilo_common
 
@@ -166,6 +166,8 @@ def _get_boot_iso(task, root_uuid):
     # not implemented as of now. Creation/Deletion of such a shared boot ISO
     # will require synchronisation across conductor nodes for the shared boot
     # ISO.  Such a synchronisation mechanism doesn't exist in ironic as of now.
+    # Instead, the boot ISO of each node is a link to, or a copy of, the boot
+    # ISO built for the same inputs, if it is in the built_image_cache.
 
     # Option 3 - Create boot_iso from kernel/ramdisk, upload to Swift
     # or web server and provide its name.
@@ -173,32 +175,36 @@ def _get_boot_iso(task, root_uuid):
     boot_mode = deploy_utils.get_boot_mode_for_deploy(task.node)
     boot_iso_object_name = _get_boot_iso_object_name(task.node)
     kernel_params = CONF.pxe.pxe_append_params
-    with tempfile.NamedTemporaryFile(dir=CONF.tempdir) as fileobj:
-        boot_iso_tmp_file = fileobj.name
-        images.create_boot_iso(task.context, boot_iso_tmp_file,
+    key = built_image_cache.get_key(
+        'boot_iso',
+        built_image_cache.get_image_version(task.context, kernel_href),
+        built_image_cache.get_image_version(task.context, ramdisk_href),
+        built_image_cache.get_image_version(task.context, deploy_iso_uuid),
+        root_uuid, kernel_params, boot_mode)
+
+    def build(path):
+        images.create_boot_iso(task.context, path,
                                kernel_href, ramdisk_href,
                                deploy_iso_uuid, root_uuid,
                                kernel_params, boot_mode)
 
-        if CONF.ilo.use_web_server_for_images:
-            boot_iso_url = (
-                ilo_common.copy_image_to_web_server(boot_iso_tmp_file,
-                                                    boot_iso_object_name))
-            driver_internal_info = task.node.driver_internal_info
-            driver_internal_info['boot_iso_created_in_web_server'] = True
-            task.node.driver_internal_info = driver_internal_info
-            task.node.save()
-            LOG.debug("Created boot_iso %(boot_iso)s for node %(node)s",
-                      {'boot_iso': boot_iso_url, 'node': task.node.uuid})
-            return boot_iso_url
-        else:
-            container = CONF.ilo.swift_ilo_container
-            swift_api = swift.SwiftAPI()
-            swift_api.create_object(container, boot_iso_object_name,
-                                    boot_iso_tmp_file)
+    if CONF.ilo.use_web_server_for_images:
+        boot_iso_url = ilo_common.put_image_in_web_server(
+            boot_iso_object_name, key, build)
+        driver_internal_info = task.node.driver_internal_info
+        driver_internal_info['boot_iso_created_in_web_server'] = True
+        task.node.driver_internal_info = driver_internal_info
+        task.node.save()
+        LOG.debug("Created boot_iso %(boot_iso)s for node %(node)s",
+                  {'boot_iso': boot_iso_url, 'node': task.node.uuid})
+        return boot_iso_url
+    else:
+        container = CONF.ilo.swift_ilo_container
+        built_image_cache.put_in_swift(container, boot_iso_object_name, key,
+                                       build)
 
-            LOG.debug("Created boot_iso %s in Swift", boot_iso_object_name)
-            return 'swift:%s' % boot_iso_object_name
+        LOG.debug("Created boot_iso %s in Swift", boot_iso_object_name)
+        return 'swift:%s' % boot_iso_object_name
 
 
 def _clean_up_boot_iso_for_instance(node):
@@ -18,7 +18,6 @@ Common functionalities shared between different iLO modules.
 
 import os
 import shutil
-import tempfile
 
 from ironic_lib import utils as ironic_utils
 from oslo_config import cfg
@@ -39,6 +38,7 @@ from ironic.common import images
 from ironic.common import swift
 from ironic.common import utils
 from ironic.conductor import utils as manager_utils
+from ironic.drivers.modules import built_image_cache
 from ironic.drivers.modules import deploy_utils
 
 ilo_client = importutils.try_import('proliantutils.ilo.client')
@@ -136,6 +136,28 @@ def copy_image_to_web_server(source_file_path, destination):
     return image_url
 
 
+def put_image_in_web_server(destination, key, build):
+    """Puts an image built by ironic in the http web server.
+
+    The image is built unless it is cached by built_image_cache.
+
+    :param destination: The name of the file that will contain the image.
+    :param key: The key of the image, from built_image_cache.get_key().
+    :param build: function building the image into the path it is given.
+    :raises: ImageUploadFailed exception if writing the image in the web
+             server fails.
+    :returns: image url of the image.
+    """
+    try:
+        built_image_cache.put_in_directory(CONF.deploy.http_root,
+                                           destination, key, build)
+    except (IOError, OSError) as exc:
+        raise exception.ImageUploadFailed(image_name=destination,
+                                          web_server=CONF.deploy.http_url,
+                                          reason=exc)
+    return urljoin(CONF.deploy.http_url, destination)
+
+
 def remove_image_from_web_server(object_name):
     """Removes the given image from the configured web server.
 
@@ -364,19 +386,21 @@ def _prepare_floppy_image(task, params):
     :raises: SwiftOperationError, if any operation with Swift fails.
     :returns: the HTTP image URL or the Swift temp url for the floppy image.
     """
-    with tempfile.NamedTemporaryFile(
-            dir=CONF.tempdir) as vfat_image_tmpfile_obj:
+    object_name = _get_floppy_image_name(task.node)
+    key = built_image_cache.get_key('floppy', params)
 
-        vfat_image_tmpfile = vfat_image_tmpfile_obj.name
-        images.create_vfat_image(vfat_image_tmpfile, parameters=params)
-        object_name = _get_floppy_image_name(task.node)
-        if CONF.ilo.use_web_server_for_images:
-            image_url = copy_image_to_web_server(vfat_image_tmpfile,
-                                                 object_name)
-        else:
-            image_url = copy_image_to_swift(vfat_image_tmpfile, object_name)
+    def build(path):
+        images.create_vfat_image(path, parameters=params)
 
-        return image_url
+    if CONF.ilo.use_web_server_for_images:
+        return put_image_in_web_server(object_name, key, build)
+
+    container = CONF.ilo.swift_ilo_container
+    timeout = CONF.ilo.swift_object_expiry_timeout
+    built_image_cache.put_in_swift(
+        container, object_name, key, build,
+        object_headers={'X-Delete-After': timeout})
+    return swift.SwiftAPI().get_temp_url(container, object_name, timeout)
 
 
 def destroy_floppy_image_from_web_server(node):
@@ -718,7 +742,8 @@ def remove_single_or_list_of_files(file_location):
         ironic_utils.unlink_without_raise(file_location)
 
 
-def verify_image_checksum(image_location, expected_checksum):
+def verify_image_checksum(image_location, expected_checksum,
+                          actual_checksum=None):
     """Verifies checksum (md5) of image file against the expected one.
 
     This method generates the checksum of the image file on the fly and
@@ -726,17 +751,21 @@ def verify_image_checksum(image_location, expected_checksum):
 
     :param image_location: location of image file whose checksum is verified.
     :param expected_checksum: checksum to be checked against
+    :param actual_checksum: checksum of the image file if it is already
+                            known, e.g. computed while downloading it. The
+                            file is not read in this case.
     :raises: ImageRefValidationFailed, if invalid file path or
              verification fails.
     """
-    try:
-        with open(image_location, 'rb') as fd:
-            actual_checksum = utils.hash_file(fd)
-    except IOError as e:
-        LOG.error(_LE("Error opening file: %(file)s"),
-                  {'file': image_location})
-        raise exception.ImageRefValidationFailed(image_href=image_location,
-                                                 reason=six.text_type(e))
+    if actual_checksum is None:
+        try:
+            with open(image_location, 'rb') as fd:
+                actual_checksum = utils.hash_file(fd)
+        except IOError as e:
+            LOG.error(_LE("Error opening file: %(file)s"),
+                      {'file': image_location})
+            raise exception.ImageRefValidationFailed(
+                image_href=image_location, reason=six.text_type(e))
 
     if actual_checksum != expected_checksum:
         msg = (_('Error verifying image checksum. Image %(image)s failed to '
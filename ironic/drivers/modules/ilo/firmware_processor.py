@@ -31,6 +31,7 @@ from ironic.common import exception
 from ironic.common.i18n import _, _LI
 from ironic.common import image_service
 from ironic.common import swift
+from ironic.common import utils
 from ironic.drivers.modules.ilo import common as ilo_common
 
 # Supported components for firmware update when invoked
@@ -182,7 +183,8 @@ class FirmwareProcessor(object):
 
         # Note(deray): Operations performed in here:
         #
-        #    1. Download the firmware file to the target file.
+        #    1. Download the firmware file to the target file, computing its
+        #       checksum on the way.
         #    2. Verify the checksum of the downloaded file.
         #    3. Extract the raw firmware file from its compact format
         #
@@ -191,10 +193,11 @@ class FirmwareProcessor(object):
                       "%(src_file)s to: %(target_file)s ...",
                       {'src_file': self.parsed_url.geturl(),
                        'target_file': target_file})
-            self._download_fw_to(target_file)
+            actual_checksum = self._download_fw_to(target_file)
             LOG.debug("For firmware update, verifying checksum of file: "
                       "%(target_file)s ...", {'target_file': target_file})
-            ilo_common.verify_image_checksum(target_file, expected_checksum)
+            ilo_common.verify_image_checksum(target_file, expected_checksum,
+                                             actual_checksum=actual_checksum)
             # Extracting raw firmware file from target_file ...
             fw_image_location_obj, is_different_file = (_extract_fw_from_file(
                 node, target_file))
@@ -226,11 +229,16 @@ def _download_file_based_fw_to(self, target_file):
     "file:///tmp/.."
     :param target_file: destination file for copying the original firmware
                         file.
+    :returns: the md5 checksum of the target file.
     :raises: ImageDownloadFailed, on failure to copy the original file.
     """
     src_file = self.parsed_url.path
     with open(target_file, 'wb') as fd:
-        image_service.FileImageService().download(src_file, fd)
+        writer = utils.HashingWriter(fd)
+        image_service.FileImageService().download(src_file, writer)
+    # NOTE: the file is copied with sendfile or hard linked, in which case
+    # the checksum is computed from the target file.
+    return writer.hexdigest(path=target_file)
 
 
 def _download_http_based_fw_to(self, target_file):
@@ -241,11 +249,14 @@ def _download_http_based_fw_to(self, target_file):
     "http://.."
     :param target_file: destination file for downloading the original firmware
                         file.
+    :returns: the md5 checksum of the target file.
     :raises: ImageDownloadFailed, on failure to download the original file.
     """
     src_file = self.parsed_url.geturl()
     with open(target_file, 'wb') as fd:
-        image_service.HttpImageService().download(src_file, fd)
+        writer = utils.HashingWriter(fd)
+        image_service.HttpImageService().download(src_file, writer)
+    return writer.hexdigest()
 
 
 def _download_swift_based_fw_to(self, target_file):
@@ -256,6 +267,7 @@ def _download_swift_based_fw_to(self, target_file):
     Expecting url as swift://containername/objectname
     :param target_file: destination file for downloading the original firmware
                         file.
+    :returns: the md5 checksum of the target file.
     :raises: SwiftOperationError, on failure to download from swift.
     :raises: ImageDownloadFailed, on failure to download the original file.
     """
@@ -272,7 +284,7 @@ def _download_swift_based_fw_to(self, target_file):
     # set the parsed_url attribute to the newly created tempurl from swift and
     # delegate the dowloading job to the http_based downloader
     self.parsed_url = urlparse.urlparse(tempurl)
-    _download_http_based_fw_to(self, target_file)
+    return _download_http_based_fw_to(self, target_file)
 
 
 def _extract_fw_from_file(node, target_file):
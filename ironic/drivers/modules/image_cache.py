@@ -19,10 +19,14 @@ Utility for caching master images.
 """
 
 import os
+import sqlite3
 import tempfile
+import threading
 import time
 import uuid
 
+import futurist
+from futurist import waiters
 from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -56,24 +60,272 @@ CONF.register_opts(img_cache_opts)
 # order of priority.
 _cache_cleanup_list = []
 
+# Directory, inside a master directory, holding the index of its files
+INDEX_DIR_NAME = '.index'
+
+# Images being fetched into a master cache, by master path
+_downloads = {}
+_downloads_lock = threading.Lock()
+
+# How often to report progress while waiting for another request to
+# download an image, in seconds
+_DOWNLOAD_PROGRESS_INTERVAL = 30
+
+# The indexes of the master directories, by path
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Download rate assumed for the files whose download time is not known, in
+# bytes per second
+_ASSUMED_DOWNLOAD_RATE = 100 * 1024 * 1024
+
+
+class LRUPolicy(object):
+    """Evict the least recently used images first."""
+
+    order_by = 'last_used'
+
+
+class GDSFPolicy(object):
+    """Greedy Dual Size Frequency: evict the cheapest images first.
+
+    Every image has a priority, computed when it is added or used as
+    L + uses * cost / size, where cost is the time it took to download it
+    and L is the priority of the last image evicted. Big images downloaded
+    once (e.g. the instance image of a single node) are evicted before small
+    images used by many deployments (e.g. deploy kernels and ramdisks), and
+    L lets images which are not used anymore age out.
+    """
+
+    order_by = 'priority'
+
+
+# The eviction policies, see the [pxe]image_cache_policy option
+EVICTION_POLICIES = {
+    'lru': LRUPolicy(),
+    'gdsf': GDSFPolicy(),
+}
+
+
+class CacheIndex(object):
+    """Size and last use time of the files of a master directory.
+
+    The index is kept in a SQLite database, in the master directory itself,
+    and updated as images are added to, used from and removed from the
+    cache, so that cleaning up does not have to list and stat the whole
+    directory.
+
+    Files added or removed by anything else than the image cache (e.g. by
+    an older version of ironic) are found by listing the directory once,
+    when the index is first used by this process and whenever the directory
+    was modified behind its back.
+
+    The number of uses, download time and GDSF priority of the files are
+    also kept, see GDSFPolicy.
+    """
+
+    def __init__(self, master_dir):
+        self.master_dir = master_dir
+        index_dir = os.path.join(master_dir, INDEX_DIR_NAME)
+        fileutils.ensure_tree(index_dir)
+        self._db = sqlite3.connect(os.path.join(index_dir, 'index.db'),
+                                   check_same_thread=False)
+        # File names are native strings, like what os.listdir() returns
+        self._db.text_factory = str
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS files ('
+                             'name TEXT PRIMARY KEY, '
+                             'size INTEGER NOT NULL, '
+                             'last_used REAL NOT NULL)')
+            columns = set(row[1] for row in
+                          self._db.execute('PRAGMA table_info(files)'))
+            if 'priority' not in columns:
+                # Index created by an older version
+                self._db.execute('ALTER TABLE files ADD COLUMN '
+                                 'uses INTEGER NOT NULL DEFAULT 1')
+                self._db.execute('ALTER TABLE files ADD COLUMN '
+                                 'cost REAL NOT NULL DEFAULT 0')
+                self._db.execute('ALTER TABLE files ADD COLUMN '
+                                 'priority REAL NOT NULL DEFAULT 0')
+                self._db.execute('UPDATE files SET cost = size / ?, '
+                                 'priority = 1.0 / ?',
+                                 (_ASSUMED_DOWNLOAD_RATE,
+                                  _ASSUMED_DOWNLOAD_RATE))
+            self._db.execute('CREATE INDEX IF NOT EXISTS '
+                             'files_last_used_idx ON files (last_used)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS '
+                             'files_priority_idx ON files (priority)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS settings ('
+                             'name TEXT PRIMARY KEY, '
+                             'value REAL NOT NULL)')
+        self._lock = threading.Lock()
+        # The state of the directory when the index was last up to date
+        self._dir_stamp = None
+
+    def _stamp(self):
+        stat = os.stat(self.master_dir)
+        return stat.st_ino, stat.st_mtime
+
+    def _sync(self):
+        """Update the index with the files of the directory."""
+        LOG.debug("Synchronizing the index of master image cache %(dir)s",
+                  {'dir': self.master_dir})
+        stamp = self._stamp()
+        indexed = set(row[0] for row in
+                      self._db.execute('SELECT name FROM files'))
+        found = set()
+        for file_name in os.listdir(self.master_dir):
+            path = os.path.join(self.master_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path):
+                continue
+            found.add(file_name)
+            if file_name not in indexed:
+                # NOTE(dtantsur): Detect most recently accessed files,
+                # seeing atime can be disabled by the mount option
+                # Also include ctime as it changes when image is linked to
+                last_used = max(stat.st_mtime, stat.st_atime, stat.st_ctime)
+                self._insert(file_name, stat.st_size, last_used)
+        self._db.executemany('DELETE FROM files WHERE name = ?',
+                             ((file_name,)
+                              for file_name in indexed - found))
+        self._db.commit()
+        self._dir_stamp = stamp
+
+    def _sync_if_changed(self):
+        if self._dir_stamp != self._stamp():
+            self._sync()
+
+    def _inflation(self):
+        row = self._db.execute('SELECT value FROM settings '
+                               'WHERE name = ?', ('inflation',)).fetchone()
+        return row[0] if row else 0.0
+
+    def _insert(self, file_name, size, last_used, cost=None):
+        if cost is None:
+            cost = float(size) / _ASSUMED_DOWNLOAD_RATE
+        priority = self._inflation() + float(cost) / max(size, 1)
+        self._db.execute('INSERT OR REPLACE INTO files '
+                         '(name, size, last_used, uses, cost, priority) '
+                         'VALUES (?, ?, ?, 1, ?, ?)',
+                         (file_name, size, last_used, cost, priority))
+
+    def entries(self, order_by='last_used'):
+        """List the files of the directory, least recently used first.
+
+        :param order_by: 'last_used' to list the least recently used files
+                         first, 'priority' to list the files with the
+                         lowest GDSF priority first.
+        :returns: a list of tuples (file path, last used time, size).
+        """
+        if order_by not in ('last_used', 'priority'):
+            raise ValueError(order_by)
+        with self._lock:
+            self._sync_if_changed()
+            return [(os.path.join(self.master_dir, name), last_used, size)
+                    for name, size, last_used in self._db.execute(
+                        'SELECT name, size, last_used FROM files '
+                        'ORDER BY %s, name' % order_by)]
+
+    def total_size(self):
+        """Return the total size of the files of the directory, in bytes."""
+        with self._lock:
+            self._sync_if_changed()
+            return self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+
+    def add(self, file_name, cost=None):
+        """Record a file which was just added to the directory.
+
+        :param file_name: the name of the file in the directory.
+        :param cost: the time it took to download the file, in seconds. It
+                     is estimated from the size of the file if None.
+        """
+        size = os.path.getsize(os.path.join(self.master_dir, file_name))
+        with self._lock:
+            with self._db:
+                self._insert(file_name, size, time.time(), cost=cost)
+            if self._dir_stamp is not None:
+                self._dir_stamp = self._stamp()
+
+    def touch(self, file_name):
+        """Record that a file of the directory was just used.
+
+        :param file_name: the name of the file in the directory.
+        """
+        with self._lock:
+            with self._db:
+                self._db.execute('UPDATE files SET last_used = ?, '
+                                 'uses = uses + 1, '
+                                 'priority = ? + (uses + 1) * cost / '
+                                 'MAX(size, 1) '
+                                 'WHERE name = ?',
+                                 (time.time(), self._inflation(), file_name))
+
+    def remove(self, file_name, evicted=False):
+        """Record that a file was just removed from the directory.
+
+        :param file_name: the name of the file in the directory.
+        :param evicted: whether the file was removed to make room in the
+                        cache. The GDSF priority of the files added or used
+                        afterwards starts from its priority.
+        """
+        with self._lock:
+            with self._db:
+                if evicted:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO settings '
+                        'SELECT ?, MAX(priority, ?) FROM files '
+                        'WHERE name = ?',
+                        ('inflation', self._inflation(), file_name))
+                self._db.execute('DELETE FROM files WHERE name = ?',
+                                 (file_name,))
+            if self._dir_stamp is not None:
+                self._dir_stamp = self._stamp()
+
+
+def _get_index(master_dir):
+    """Get the index of a master directory, shared by its ImageCaches."""
+    path = os.path.abspath(master_dir)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = CacheIndex(path)
+        return index
+
 
 class ImageCache(object):
     """Class handling access to cache for master images."""
 
-    def __init__(self, master_dir, cache_size, cache_ttl):
+    def __init__(self, master_dir, cache_size, cache_ttl, policy=None,
+                 pinned=None):
         """Constructor.
 
         :param master_dir: cache directory to work on
                            Value of None disables image caching.
         :param cache_size: desired maximum cache size in bytes
         :param cache_ttl: cache entity TTL in seconds
+        :param policy: name of the policy choosing the images to delete
+                       when the cache is too big, one of EVICTION_POLICIES.
+                       Defaults to 'lru'.
+        :param pinned: hrefs of the images never deleted from the cache
         """
         self.master_dir = master_dir
         self._cache_size = cache_size
         self._cache_ttl = cache_ttl
+        self._policy = EVICTION_POLICIES[policy or 'lru']
+        self._pinned = set(_master_file_name(href)
+                           for href in pinned or ())
         if master_dir is not None:
             fileutils.ensure_tree(master_dir)
 
+    @property
+    def _index(self):
+        return _get_index(self.master_dir)
+
     def fetch_image(self, href, dest_path, ctx=None, force_raw=True):
         """Fetch image by given href to the destination path.
 
@@ -102,23 +354,90 @@ class ImageCache(object):
 
         # TODO(ghe): have hard links and counts the same behaviour in all fs
 
-        # NOTE(vdrok): File name is converted to UUID if it's not UUID already,
-        # so that two images with same file names do not collide
-        if service_utils.is_glance_image(href):
-            master_file_name = service_utils.parse_image_ref(href)[0]
-        else:
-            # NOTE(vdrok): Doing conversion of href in case it's unicode
-            # string, UUID cannot be generated for unicode strings on python 2.
-            href_encoded = href.encode('utf-8') if six.PY2 else href
-            master_file_name = str(uuid.uuid5(uuid.NAMESPACE_URL,
-                                              href_encoded))
+        master_file_name = _master_file_name(href)
         master_path = os.path.join(self.master_dir, master_file_name)
 
         if CONF.parallel_image_downloads:
             img_download_lock_name = 'download-image:%s' % master_file_name
 
+        # NOTE: only one request per image downloads it (or checks whether
+        # the cached copy is up to date), the others wait for its result
+        while True:
+            download, first = _join_download(master_path)
+            if first:
+                break
+            if self._wait_for_download(download, href, master_path,
+                                       dest_path):
+                return
+
+        # NOTE: the download is unregistered even if the thread is killed
+        # (e.g. with GreenletExit), otherwise the other requests for the
+        # image would wait for it forever.
+        error = None
+        try:
+            downloaded = self._fetch_to_master(
+                href, master_path, dest_path, img_download_lock_name,
+                ctx=ctx, force_raw=force_raw)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _finish_download(master_path, download, error=error)
+
+        if downloaded:
+            # NOTE(dtantsur): we increased cache size - time to clean up
+            self.clean_up()
+
+    def prefetch_image(self, href, ctx=None, force_raw=True):
+        """Fetch an image into the master cache without using it.
+
+        The image is fetched as by fetch_image, to a destination which is
+        deleted right away, so that it can be evicted like any other image
+        of the cache.
+
+        :param href: image UUID or href to fetch
+        :param ctx: context
+        :param force_raw: boolean value, whether to convert the image to raw
+                          format
+        :raises: ImageUnacceptable if the image is bigger than the cache.
+        """
+        if self.master_dir is None:
+            LOG.debug("Not prefetching image %(href)s, images are not cached",
+                      {'href': href})
+            return
+
+        size = images.download_size(ctx, href)
+        if size and size > self._cache_size:
+            raise exception.ImageUnacceptable(
+                image_id=href,
+                reason=_("its size of %(size)d bytes is bigger than the "
+                         "size of the cache of %(cache_size)d bytes") %
+                {'size': size, 'cache_size': self._cache_size})
+
+        tmp_dir = tempfile.mkdtemp(dir=self.master_dir)
+        try:
+            self.fetch_image(href, os.path.join(tmp_dir, 'prefetch'),
+                             ctx=ctx, force_raw=force_raw)
+        finally:
+            utils.rmtree_without_raise(tmp_dir)
+
+    def _fetch_to_master(self, href, master_path, dest_path, lock_name,
+                         ctx=None, force_raw=True):
+        """Ensure the image is in the master cache and linked to dest_path.
+
+        :param href: image UUID or href to fetch
+        :param master_path: destination master path
+        :param dest_path: destination file path
+        :param lock_name: name of the lock to take
+        :param ctx: context
+        :param force_raw: boolean value, whether to convert the image to raw
+                          format
+        :returns: True if the image was downloaded, False if the cached copy
+                  was used
+        """
+        master_file_name = os.path.basename(master_path)
         # TODO(dtantsur): lock expiration time
-        with lockutils.lock(img_download_lock_name, 'ironic-'):
+        with lockutils.lock(lock_name, 'ironic-'):
             # NOTE(vdrok): After rebuild requested image can change, so we
             # should ensure that dest_path and master_path (if exists) are
             # pointing to the same file and their content is up to date
@@ -131,24 +450,66 @@ class ImageCache(object):
                 LOG.debug("Destination %(dest)s already exists "
                           "for image %(href)s",
                           {'href': href, 'dest': dest_path})
-                return
+                return False
 
             if cache_up_to_date:
                 # NOTE(dtantsur): ensure we're not in the middle of clean up
                 with lockutils.lock('master_image', 'ironic-'):
                     os.link(master_path, dest_path)
+                self._index.touch(master_file_name)
                 LOG.debug("Master cache hit for image %(href)s",
                           {'href': href})
-                return
+                return False
+
+            self._index.remove(master_file_name)
 
             LOG.info(_LI("Master cache miss for image %(href)s, "
                          "starting download"),
                      {'href': href})
             self._download_image(
                 href, master_path, dest_path, ctx=ctx, force_raw=force_raw)
+            return True
 
-        # NOTE(dtantsur): we increased cache size - time to clean up
-        self.clean_up()
+    def _wait_for_download(self, download, href, master_path, dest_path):
+        """Wait for another request to fetch the image, then link to it.
+
+        :param download: the _Download of the other request
+        :param href: image UUID or href to fetch
+        :param master_path: destination master path
+        :param dest_path: destination file path
+        :returns: True if dest_path now links to the image, False if the
+                  image has to be fetched again
+        :raises: the exception which made the other request fail
+        """
+        LOG.debug("Image %(href)s is being fetched by another request, "
+                  "waiting for it", {'href': href})
+        while True:
+            done, _not_done = waiters.wait_for_all(
+                [download.future], timeout=_DOWNLOAD_PROGRESS_INTERVAL)
+            if done:
+                break
+            LOG.info(_LI("Still waiting for the download of image %(href)s "
+                         "started %(time)d seconds ago, %(size)d bytes "
+                         "downloaded so far"),
+                     {'href': href, 'size': download.downloaded_size(),
+                      'time': time.time() - download.started_at})
+        # Raise the error of the other request, if any
+        download.future.result()
+        if download.interrupted:
+            # The other request was killed, fetch the image again
+            return False
+
+        with lockutils.lock('master_image', 'ironic-'):
+            if not os.path.exists(master_path):
+                # Removed in the meantime
+                return False
+            if not _delete_dest_path_if_stale(master_path, dest_path):
+                os.link(master_path, dest_path)
+        self._index.touch(os.path.basename(master_path))
+        LOG.debug("Image %(href)s was fetched by another request, waited "
+                  "%(time).1f seconds for it",
+                  {'href': href, 'time': time.time() - download.started_at})
+        return True
 
     def _download_image(self, href, master_path, dest_path, ctx=None,
                         force_raw=True):
@@ -167,7 +528,11 @@ class ImageCache(object):
         # TODO(ghe): logging when image cannot be created
         tmp_dir = tempfile.mkdtemp(dir=self.master_dir)
         tmp_path = os.path.join(tmp_dir, href.split('/')[-1])
+        download = _downloads.get(master_path)
+        if download is not None:
+            download.tmp_dir = tmp_dir
 
+        started_at = time.time()
         try:
             _fetch(ctx, href, tmp_path, force_raw)
             # NOTE(dtantsur): no need for global lock here - master_path
@@ -176,12 +541,16 @@ class ImageCache(object):
             os.link(master_path, dest_path)
         finally:
             utils.rmtree_without_raise(tmp_dir)
+        self._index.add(os.path.basename(master_path),
+                        cost=time.time() - started_at)
 
     @lockutils.synchronized('master_image', 'ironic-')
     def clean_up(self, amount=None):
         """Clean up directory with images, keeping cache of the latest images.
 
-        Files with link count >1 are never deleted.
+        Files with link count >1 and pinned images are never deleted. Files
+        older than the TTL are deleted first, then files are deleted in the
+        order given by the eviction policy until the cache is small enough.
         Protected by global lock, so that no one messes with master images
         after we get listing and before we actually delete files.
 
@@ -196,10 +565,15 @@ class ImageCache(object):
                   {'dir': self.master_dir})
 
         amount_copy = amount
-        listing = _find_candidates_for_deletion(self.master_dir)
+        listing = self._index.entries()
         survived, amount = self._clean_up_too_old(listing, amount)
         if amount is not None and amount <= 0:
             return
+        if self._policy.order_by != 'last_used':
+            survived_paths = set(entry[0] for entry in survived)
+            survived = [entry for entry in self._index.entries(
+                        order_by=self._policy.order_by)
+                        if entry[0] in survived_paths]
         amount = self._clean_up_ensure_cache_size(survived, amount)
         if amount is not None and amount > 0:
             LOG.warning(
@@ -216,7 +590,8 @@ class ImageCache(object):
         it starts removing files older than TTL seconds,
         oldest first, until the required 'amount' of space is reclaimed.
 
-        :param listing: list of tuples (file name, last used time)
+        :param listing: list of tuples (file name, last used time, size),
+                        least recently used first
         :param amount: if not None, amount of space to reclaim in bytes,
                        cleaning will stop, if this goal was reached,
                        even if it is possible to clean up more files
@@ -225,57 +600,47 @@ class ImageCache(object):
         """
         threshold = time.time() - self._cache_ttl
         survived = []
-        for file_name, last_used, stat in listing:
-            if last_used < threshold:
-                try:
-                    os.unlink(file_name)
-                except EnvironmentError as exc:
-                    LOG.warning(_LW("Unable to delete file %(name)s from "
-                                    "master image cache: %(exc)s"),
-                                {'name': file_name, 'exc': exc})
-                else:
-                    if amount is not None:
-                        amount -= stat.st_size
-                        if amount <= 0:
-                            amount = 0
-                            break
-            else:
-                survived.append((file_name, last_used, stat))
+        for position, entry in enumerate(listing):
+            file_name, last_used, size = entry
+            if last_used >= threshold:
+                # The other files were used even more recently
+                survived.extend(listing[position:])
+                break
+            if (self._is_pinned(file_name) or
+                    not self._delete_unused(file_name)):
+                survived.append(entry)
+            elif amount is not None:
+                amount -= size
+                if amount <= 0:
+                    amount = 0
+                    break
         return survived, amount
 
     def _clean_up_ensure_cache_size(self, listing, amount):
         """Clean up stage 2: try to ensure cache size < threshold.
 
-        Try to delete the oldest files until conditions is satisfied
-        or no more files are eligible for deletion.
+        Try to delete the files in the order of the listing until
+        conditions is satisfied or no more files are eligible for deletion.
 
-        :param listing: list of tuples (file name, last used time)
+        :param listing: list of tuples (file name, last used time, size),
+                        in the order of the eviction policy
         :param amount: amount of space to reclaim, if possible.
                        if amount is not None, it has higher priority than
                        cache size in settings
         :returns: amount of space still required after clean up
         """
-        # NOTE(dtantsur): Sort listing to delete the oldest files first
-        listing = sorted(listing,
-                         key=lambda entry: entry[1],
-                         reverse=True)
-        total_listing = (os.path.join(self.master_dir, f)
-                         for f in os.listdir(self.master_dir))
-        total_size = sum(os.path.getsize(f)
-                         for f in total_listing)
+        # NOTE(dtantsur): Reverse listing to delete the oldest files first
+        listing = listing[::-1]
+        total_size = self._index.total_size()
         while listing and (total_size > self._cache_size or
                            (amount is not None and amount > 0)):
-            file_name, last_used, stat = listing.pop()
-            try:
-                os.unlink(file_name)
-            except EnvironmentError as exc:
-                LOG.warning(_LW("Unable to delete file %(name)s from "
-                                "master image cache: %(exc)s"),
-                            {'name': file_name, 'exc': exc})
-            else:
-                total_size -= stat.st_size
+            file_name, last_used, size = listing.pop()
+            if self._is_pinned(file_name):
+                continue
+            if self._delete_unused(file_name):
+                total_size -= size
                 if amount is not None:
-                    amount -= stat.st_size
+                    amount -= size
 
         if total_size > self._cache_size:
             LOG.info(_LI("After cleaning up cache dir %(dir)s "
@@ -285,23 +650,117 @@ class ImageCache(object):
                       'expected': self._cache_size})
         return max(amount, 0) if amount is not None else 0
 
+    def _is_pinned(self, file_name):
+        return os.path.basename(file_name) in self._pinned
+
+    def _delete_unused(self, file_name):
+        """Delete a file of the cache, unless it is in use.
+
+        Files with link count >1 are in use.
+
+        :param file_name: path to the file
+        :returns: True if the file was deleted, False otherwise
+        """
+        try:
+            if os.stat(file_name).st_nlink > 1:
+                return False
+            os.unlink(file_name)
+        except EnvironmentError as exc:
+            if not os.path.exists(file_name):
+                # Already gone, the index was out of date
+                self._index.remove(os.path.basename(file_name))
+                return False
+            LOG.warning(_LW("Unable to delete file %(name)s from "
+                            "master image cache: %(exc)s"),
+                        {'name': file_name, 'exc': exc})
+            return False
+        self._index.remove(os.path.basename(file_name), evicted=True)
+        return True
+
+
+def _master_file_name(href):
+    """Get the name of the file of an image in a master directory.
+
+    :param href: image UUID or href
+    """
+    # NOTE(vdrok): File name is converted to UUID if it's not UUID already,
+    # so that two images with same file names do not collide
+    if service_utils.is_glance_image(href):
+        return service_utils.parse_image_ref(href)[0]
+    # NOTE(vdrok): Doing conversion of href in case it's unicode
+    # string, UUID cannot be generated for unicode strings on python 2.
+    href_encoded = href.encode('utf-8') if six.PY2 else href
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, href_encoded))
+
+
+class _Download(object):
+    """An image being fetched into a master cache, for other requests."""
+
+    def __init__(self):
+        self.future = futurist.Future()
+        self.future.set_running_or_notify_cancel()
+        self.started_at = time.time()
+        self.followers = 0
+        # Set once the download itself starts
+        self.tmp_dir = None
+        # Whether the request fetching the image was killed
+        self.interrupted = False
+
+    def downloaded_size(self):
+        """Return the number of bytes downloaded so far."""
+        tmp_dir = self.tmp_dir
+        if tmp_dir is None:
+            return 0
+        size = 0
+        try:
+            for file_name in os.listdir(tmp_dir):
+                size += os.path.getsize(os.path.join(tmp_dir, file_name))
+        except OSError:
+            # The download is over
+            pass
+        return size
+
 
-def _find_candidates_for_deletion(master_dir):
-    """Find files eligible for deletion i.e. with link count ==1.
+def _join_download(master_path):
+    """Register a request for an image of the master cache.
 
-    :param master_dir: directory to operate on
-    :returns: iterator yielding tuples (file name, last used time, stat)
+    :param master_path: path to the image in the master cache
+    :returns: tuple (_Download, True if this is the first request for the
+              image, which has to fetch it)
     """
-    for filename in os.listdir(master_dir):
-        filename = os.path.join(master_dir, filename)
-        stat = os.stat(filename)
-        if not os.path.isfile(filename) or stat.st_nlink > 1:
-            continue
-        # NOTE(dtantsur): Detect most recently accessed files,
-        # seeing atime can be disabled by the mount option
-        # Also include ctime as it changes when image is linked to
-        last_used_time = max(stat.st_mtime, stat.st_atime, stat.st_ctime)
-        yield filename, last_used_time, stat
+    with _downloads_lock:
+        download = _downloads.get(master_path)
+        if download is None:
+            download = _downloads[master_path] = _Download()
+            return download, True
+        download.followers += 1
+        return download, False
+
+
+def _finish_download(master_path, download, error=None):
+    """Unregister the first request for an image and wake the others up.
+
+    :param master_path: path to the image in the master cache
+    :param download: the _Download returned by _join_download
+    :param error: the exception raised while fetching the image, if any
+    """
+    with _downloads_lock:
+        if _downloads.get(master_path) is download:
+            del _downloads[master_path]
+    if download.followers:
+        LOG.info(_LI("%(waiters)d other request(s) waited for image "
+                     "%(path)s, fetched in %(time).1f seconds"),
+                 {'waiters': download.followers, 'path': master_path,
+                  'time': time.time() - download.started_at})
+    if error is None:
+        download.future.set_result(None)
+    elif not isinstance(error, Exception):
+        # NOTE: exceptions like GreenletExit are only meant for the thread
+        # which was killed, the others retry fetching the image.
+        download.interrupted = True
+        download.future.set_result(None)
+    else:
+        download.future.set_exception(error)
 
 
 def _free_disk_space_for(path):
@@ -313,14 +772,18 @@ def _free_disk_space_for(path):
 def _fetch(context, image_href, path, force_raw=False):
     """Fetch image and convert to raw format if needed."""
     path_tmp = "%s.part" % path
-    images.fetch(context, image_href, path_tmp, force_raw=False)
+    image_format = images.fetch(context, image_href, path_tmp,
+                                force_raw=False)
     # Notes(yjiang5): If glance can provide the virtual size information,
     # then we can firstly clean cache and then invoke images.fetch().
     if force_raw:
-        required_space = images.converted_size(path_tmp)
-        directory = os.path.dirname(path_tmp)
-        _clean_up_caches(directory, required_space)
-        images.image_to_raw(image_href, path, path_tmp)
+        if image_format != 'raw':
+            # NOTE: raw images are only renamed, no space is needed
+            required_space = images.converted_size(path_tmp)
+            directory = os.path.dirname(path_tmp)
+            _clean_up_caches(directory, required_space)
+        images.image_to_raw(image_href, path, path_tmp,
+                            image_format=image_format)
     else:
         os.rename(path_tmp, path)
 
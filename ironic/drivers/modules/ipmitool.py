@@ -30,12 +30,14 @@ DRIVER.
 """
 
 import contextlib
+import functools
 import os
 import re
 import subprocess
 import tempfile
 import time
 
+from futurist import periodics
 from ironic_lib import utils as ironic_utils
 from oslo_concurrency import processutils
 from oslo_config import cfg
@@ -56,6 +58,8 @@ from ironic.common import utils
 from ironic.conductor import task_manager
 from ironic.drivers import base
 from ironic.drivers.modules import console_utils
+from ironic.drivers.modules import ipmitool_scheduler
+from ironic.drivers.modules import ipmitool_shell
 from ironic.drivers import utils as driver_utils
 
 
@@ -66,6 +70,15 @@ CONF.import_opt('retry_timeout',
 CONF.import_opt('min_command_interval',
                 'ironic.drivers.modules.ipminative',
                 group='ipmi')
+CONF.import_opt('use_shell_sessions',
+                'ironic.drivers.modules.ipmitool_shell',
+                group='ipmi')
+CONF.import_opt('shell_session_idle_timeout',
+                'ironic.drivers.modules.ipmitool_shell',
+                group='ipmi')
+CONF.import_opt('use_command_scheduler',
+                'ironic.drivers.modules.ipmitool_scheduler',
+                group='ipmi')
 
 LOG = logging.getLogger(__name__)
 
@@ -135,6 +148,10 @@ ipmitool_command_options = {
 # form regardless of locale.
 IPMITOOL_RETRYABLE_FAILURES = ['insufficient resources for session']
 
+# Commands without side effects, which can be sent once for all the callers
+# waiting for them (see _exec_ipmitool_async)
+COALESCED_COMMANDS = ('power status',)
+
 
 def _check_option_support(options):
     """Checks if the specific ipmitool options are supported on host.
@@ -355,8 +372,36 @@ def _parse_driver_info(node):
     }
 
 
-def _exec_ipmitool(driver_info, command):
-    """Execute the ipmitool command.
+def _run_ipmitool(args, password, command):
+    """Run an ipmitool command once, without any retry.
+
+    :param args: the ipmitool command line, without the password and the
+                 command to execute.
+    :param password: the IPMI password.
+    :param command: the ipmitool command to be executed.
+    :returns: (stdout, stderr) from executing the command.
+    :raises: PasswordFileFailedToCreate from creating or writing to the
+             temporary file.
+    :raises: processutils.ProcessExecutionError from executing the command.
+    """
+    if CONF.ipmi.use_shell_sessions:
+        return ipmitool_shell.execute(args, password, command)
+
+    # Resetting the list that will be utilized so the password arguments
+    # from any previous execution are preserved.
+    cmd_args = args[:]
+    # 'ipmitool' command will prompt password if there is no '-f'
+    # option, we set it to '\0' to write a password file to support
+    # empty password
+    with _make_password_file(password or '\0') as pw_file:
+        cmd_args.append('-f')
+        cmd_args.append(pw_file)
+        cmd_args.extend(command.split(" "))
+        return utils.execute(*cmd_args)
+
+
+def _exec_ipmitool_now(driver_info, command):
+    """Execute the ipmitool command in the current thread.
 
     :param driver_info: the ipmitool parameters for accessing a node.
     :param command: the ipmitool command to be executed.
@@ -411,41 +456,77 @@ def _exec_ipmitool(driver_info, command):
             time.time() - LAST_CMD_TIME.get(driver_info['address'], 0))
         if time_till_next_poll > 0:
             time.sleep(time_till_next_poll)
-        # Resetting the list that will be utilized so the password arguments
-        # from any previous execution are preserved.
-        cmd_args = args[:]
-        # 'ipmitool' command will prompt password if there is no '-f'
-        # option, we set it to '\0' to write a password file to support
-        # empty password
-        with _make_password_file(driver_info['password'] or '\0') as pw_file:
-            cmd_args.append('-f')
-            cmd_args.append(pw_file)
-            cmd_args.extend(command.split(" "))
-            try:
-                out, err = utils.execute(*cmd_args)
-                return out, err
-            except processutils.ProcessExecutionError as e:
-                with excutils.save_and_reraise_exception() as ctxt:
-                    err_list = [x for x in IPMITOOL_RETRYABLE_FAILURES
-                                if x in six.text_type(e)]
-                    if ((time.time() > end_time) or
-                        (num_tries == 0) or
-                        not err_list):
-                        LOG.error(_LE('IPMI Error while attempting "%(cmd)s"'
-                                      'for node %(node)s. Error: %(error)s'), {
-                                  'node': driver_info['uuid'],
-                                  'cmd': e.cmd, 'error': e
-                                  })
-                    else:
-                        ctxt.reraise = False
-                        LOG.warning(_LW('IPMI Error encountered, retrying '
-                                        '"%(cmd)s" for node %(node)s. '
-                                        'Error: %(error)s'), {
-                                    'node': driver_info['uuid'],
-                                    'cmd': e.cmd, 'error': e
-                                    })
-            finally:
-                LAST_CMD_TIME[driver_info['address']] = time.time()
+        try:
+            out, err = _run_ipmitool(args, driver_info['password'], command)
+            return out, err
+        except processutils.ProcessExecutionError as e:
+            with excutils.save_and_reraise_exception() as ctxt:
+                err_list = [x for x in IPMITOOL_RETRYABLE_FAILURES
+                            if x in six.text_type(e)]
+                if ((time.time() > end_time) or
+                    (num_tries == 0) or
+                    not err_list):
+                    LOG.error(_LE('IPMI Error while attempting "%(cmd)s"'
+                                  'for node %(node)s. Error: %(error)s'), {
+                              'node': driver_info['uuid'],
+                              'cmd': e.cmd, 'error': e
+                              })
+                else:
+                    ctxt.reraise = False
+                    LOG.warning(_LW('IPMI Error encountered, retrying '
+                                    '"%(cmd)s" for node %(node)s. '
+                                    'Error: %(error)s'), {
+                                'node': driver_info['uuid'],
+                                'cmd': e.cmd, 'error': e
+                                })
+        finally:
+            LAST_CMD_TIME[driver_info['address']] = time.time()
+
+
+def _exec_ipmitool_async(driver_info, command):
+    """Queue the ipmitool command for the node's BMC.
+
+    The command is run by the BMC's queue once the commands queued before
+    it are done. A command in COALESCED_COMMANDS is not queued again if the
+    same one is already the last command waiting for the node.
+
+    :param driver_info: the ipmitool parameters for accessing a node.
+    :param command: the ipmitool command to be executed.
+    :returns: a future holding the (stdout, stderr) from executing the
+              command, or the exceptions raised by _exec_ipmitool_now.
+
+    """
+    coalesce_key = None
+    if command in COALESCED_COMMANDS:
+        # NOTE: the password is not part of the key, the address and the
+        # username identify the BMC session and the UUID the node.
+        coalesce_key = (command, driver_info['address'],
+                        driver_info['username'], driver_info['uuid'])
+    return ipmitool_scheduler.submit(
+        driver_info['address'],
+        functools.partial(_exec_ipmitool_now, driver_info, command),
+        coalesce_key=coalesce_key)
+
+
+def _exec_ipmitool(driver_info, command):
+    """Execute the ipmitool command.
+
+    With [ipmi]use_command_scheduler, the command is queued for the BMC and
+    the calling thread waits for its result. Only the serialization per BMC
+    and the coalescing of identical commands differ, the callers (e.g. the
+    power state sync) are not made asynchronous.
+
+    :param driver_info: the ipmitool parameters for accessing a node.
+    :param command: the ipmitool command to be executed.
+    :returns: (stdout, stderr) from executing the command.
+    :raises: PasswordFileFailedToCreate from creating or writing to the
+             temporary file.
+    :raises: processutils.ProcessExecutionError from executing the command.
+
+    """
+    if CONF.ipmi.use_command_scheduler:
+        return _exec_ipmitool_async(driver_info, command).result()
+    return _exec_ipmitool_now(driver_info, command)
 
 
 def _sleep_time(iter):
@@ -743,6 +824,12 @@ class IPMIPower(base.PowerInterface):
     def get_properties(self):
         return COMMON_PROPERTIES
 
+    @periodics.periodic(spacing=CONF.ipmi.shell_session_idle_timeout,
+                        enabled=CONF.ipmi.use_shell_sessions)
+    def _close_idle_shell_sessions(self, manager, context):
+        """Periodic task closing the unused ipmitool shell sessions."""
+        ipmitool_shell.close_idle()
+
     def validate(self, task):
         """Validate driver_info for ipmitool driver.
 
@@ -0,0 +1,162 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Per-BMC queues of ipmitool commands.
+
+Commands sent to a BMC have to be serialized and separated by
+[ipmi]min_command_interval. Commands are queued per BMC address and run
+one after the other by a single green thread per busy BMC, which does the
+waiting and the retries. Callers get a future, which the ipmitool driver
+waits for.
+
+A request which is identical to the last one waiting in the queue of its
+BMC (e.g. two 'power status' of the same node) can be coalesced with it:
+both callers then share the same future and the command is only sent once.
+"""
+
+import collections
+import threading
+
+import eventlet
+import futurist
+from oslo_concurrency import processutils
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from ironic.common.i18n import _
+from ironic.common.i18n import _LW
+
+opts = [
+    cfg.BoolOpt('use_command_scheduler',
+                default=False,
+                help=_('Whether the ipmitool drivers should queue the '
+                       'commands sent to each BMC and run them from a single '
+                       'green thread per BMC, instead of having every caller '
+                       'wait for [ipmi]min_command_interval on its own. '
+                       'Identical "power status" requests waiting for the '
+                       'same BMC are sent only once.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group='ipmi')
+
+LOG = logging.getLogger(__name__)
+
+
+class _Command(object):
+
+    __slots__ = ('func', 'coalesce_key', 'future')
+
+    def __init__(self, func, coalesce_key):
+        self.func = func
+        self.coalesce_key = coalesce_key
+        self.future = futurist.Future()
+
+
+class CommandScheduler(object):
+    """Queues of commands, indexed by BMC address."""
+
+    def __init__(self):
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of commands waiting to be run."""
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, address, func, coalesce_key=None):
+        """Queue a command for a BMC.
+
+        :param address: the address of the BMC. Commands for the same
+                        address are run in order, one at a time.
+        :param func: a callable running the command.
+        :param coalesce_key: if not None, and the last command waiting for
+                             this BMC was submitted with the same key, do
+                             not queue func and return the future of that
+                             command instead.
+        :returns: a futurist.Future holding the result of func.
+        """
+        with self._lock:
+            queue = self._queues.get(address)
+            start = queue is None
+            if start:
+                queue = self._queues[address] = collections.deque()
+            elif (coalesce_key is not None and queue and
+                  queue[-1].coalesce_key == coalesce_key):
+                LOG.debug('Coalescing command for BMC %s with a pending one',
+                          address)
+                return queue[-1].future
+
+            command = _Command(func, coalesce_key)
+            queue.append(command)
+
+        if start:
+            eventlet.spawn_n(self._run, address, queue)
+        return command.future
+
+    def _run(self, address, queue):
+        command = None
+        try:
+            while True:
+                with self._lock:
+                    if not queue:
+                        del self._queues[address]
+                        return
+                    command = queue.popleft()
+
+                if not command.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = command.func()
+                except Exception as e:
+                    command.future.set_exception(e)
+                else:
+                    command.future.set_result(result)
+        finally:
+            # NOTE: if the thread is killed (e.g. with GreenletExit), the
+            # commands left would never run and their callers would wait
+            # forever.
+            self._abort(address, queue, command)
+
+    def _abort(self, address, queue, current):
+        with self._lock:
+            if self._queues.get(address) is queue:
+                del self._queues[address]
+            commands = list(queue)
+            queue.clear()
+        if current is not None:
+            commands.insert(0, current)
+
+        commands = [command for command in commands
+                    if not command.future.done()]
+        if not commands:
+            return
+        LOG.warning(_LW('The queue of commands for BMC %(address)s was '
+                        'stopped, failing its %(count)d pending command(s)'),
+                    {'address': address, 'count': len(commands)})
+        for command in commands:
+            command.future.set_exception(processutils.ProcessExecutionError(
+                description=_('The queue of commands for BMC %s was '
+                              'stopped') % address))
+
+
+_SCHEDULER = CommandScheduler()
+
+
+def submit(address, func, coalesce_key=None):
+    """Queue a command for a BMC.
+
+    See CommandScheduler.submit().
+    """
+    return _SCHEDULER.submit(address, func, coalesce_key=coalesce_key)
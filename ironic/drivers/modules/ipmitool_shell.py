@@ -0,0 +1,337 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Long-lived ipmitool sessions.
+
+Starting ipmitool for every command means a new process and a new IPMI
+session (an RMCP+ handshake) with the BMC every time. Instead, this module
+can keep 'ipmitool shell' running for each BMC and send commands to it
+through a pseudo-terminal, reading the output up to a marker echoed after
+every command.
+
+Sessions are kept in a pool, closed when they have not been used for a
+while, and discarded after any error so that the next command starts a
+fresh one.
+"""
+
+import collections
+import errno
+import os
+import pty
+import re
+import select
+import subprocess
+import termios
+import threading
+import time
+import uuid
+
+from oslo_concurrency import processutils
+from oslo_config import cfg
+
+from ironic.common.i18n import _
+
+opts = [
+    cfg.BoolOpt('use_shell_sessions',
+                default=False,
+                help=_('Whether the ipmitool drivers should keep an '
+                       '"ipmitool shell" process open for every BMC and send '
+                       'commands through it, instead of starting a new '
+                       'ipmitool process and IPMI session for every command. '
+                       'Commands sent to the same BMC are still separated by '
+                       '[ipmi]min_command_interval.')),
+    cfg.IntOpt('shell_session_idle_timeout',
+               default=30, min=1,
+               help=_('Time in seconds after which an unused ipmitool shell '
+                      'session is closed. This should be lower than the '
+                      'session inactivity timeout of the BMCs. With the '
+                      'default value, which is lower than '
+                      '[conductor]sync_power_state_interval, the sessions '
+                      'are not kept between two power state syncs.')),
+    cfg.IntOpt('shell_session_max',
+               default=100, min=1,
+               help=_('Maximum number of ipmitool shell sessions kept open '
+                      'by a conductor. The least recently used session is '
+                      'closed when a new one would exceed this number.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(opts, group='ipmi')
+CONF.import_opt('retry_timeout',
+                'ironic.drivers.modules.ipminative',
+                group='ipmi')
+
+PROMPT = 'ipmitool> '
+
+# NOTE: in shell mode ipmitool does not return an exit code for each
+# command, errors are only reported as messages in the output. Messages
+# like "Set Chassis Power Control to Up/On failed: ..." end with "failed",
+# unlike the rows of sensor tables (separated by "|") which may contain it.
+_ERROR_RE = re.compile(r'^(Error|Unable to|Invalid)|^[^|\n]*\bfailed(:|$)',
+                       re.MULTILINE)
+_PROMPT_RE = re.compile('^(%s)+' % re.escape(PROMPT))
+
+
+class SessionDiscarded(Exception):
+    """The session was discarded by the pool before running a command."""
+
+
+class Session(object):
+    """An 'ipmitool shell' process talking to one BMC.
+
+    Commands are serialized: a session only runs one command at a time.
+    """
+
+    def __init__(self, args, password):
+        """Prepare a session, the process is only started on first use.
+
+        :param args: the ipmitool command line, without the password and
+                     the command to execute.
+        :param password: the IPMI password. It is passed to ipmitool
+                         through the environment.
+        """
+        self.args = list(args) + ['-E', 'shell']
+        self._password = password
+        self._process = None
+        self._fd = None
+        self._lock = threading.Lock()
+        self._discarded = False
+        self.last_used = time.time()
+
+    @property
+    def is_alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def _start(self):
+        master, slave = pty.openpty()
+        # Do not echo the commands back, only their output is wanted
+        attrs = termios.tcgetattr(slave)
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(slave, termios.TCSANOW, attrs)
+
+        env = dict(os.environ, IPMI_PASSWORD=self._password or '')
+        try:
+            self._process = subprocess.Popen(
+                self.args, stdin=slave, stdout=slave, stderr=slave,
+                env=env, close_fds=True)
+        except OSError as e:
+            os.close(master)
+            raise processutils.ProcessExecutionError(
+                cmd=' '.join(self.args), description=str(e))
+        finally:
+            os.close(slave)
+        self._fd = master
+
+    def _read_until(self, marker, deadline):
+        # The marker has to be on a line of its own, as the shell may
+        # echo the command which printed it.
+        marker_re = re.compile(r'(?:^|\n)(?:%s)*%s\n'
+                               % (re.escape(PROMPT), re.escape(marker)))
+        output = ''
+        while True:
+            match = marker_re.search(output)
+            if match:
+                return output[:match.start()]
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise processutils.ProcessExecutionError(
+                    stdout=output, cmd=' '.join(self.args),
+                    description=_('Timed out waiting for ipmitool'))
+            ready, _w, _x = select.select([self._fd], [], [], remaining)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._fd, 4096)
+            except OSError as e:
+                # Linux reports EIO once the other end of the pty is closed
+                if e.errno != errno.EIO:
+                    raise
+                data = b''
+            if not data:
+                raise processutils.ProcessExecutionError(
+                    stdout=output, cmd=' '.join(self.args),
+                    description=_('ipmitool exited unexpectedly'))
+            output += data.decode('utf-8', 'replace').replace('\r', '')
+
+    def execute(self, command, timeout):
+        """Run a command in this session.
+
+        :param command: the ipmitool command, e.g. 'power status'.
+        :param timeout: the maximum time to wait for the output, in seconds.
+        :returns: (stdout, stderr) like processutils.execute(); errors
+                  reported by ipmitool are found in stderr.
+        :raises: processutils.ProcessExecutionError if ipmitool reported an
+                 error, could not be started, exited or timed out. The
+                 session is closed in this case.
+        :raises: SessionDiscarded if the session was discarded while
+                 waiting for the previous command to finish.
+        """
+        with self._lock:
+            if self._discarded:
+                raise SessionDiscarded()
+            self.last_used = time.time()
+            try:
+                if not self.is_alive:
+                    self.close()
+                    self._start()
+                marker = 'ironic-%s' % uuid.uuid4().hex
+                os.write(self._fd, ('%s\necho %s\n' % (command, marker))
+                         .encode('utf-8'))
+                output = self._read_until(marker, time.time() + timeout)
+            except Exception:
+                self.close()
+                raise
+            finally:
+                self.last_used = time.time()
+
+            lines = [_PROMPT_RE.sub('', line) for line in output.split('\n')]
+            output = '\n'.join(line for line in lines if line != command)
+            if _ERROR_RE.search(output):
+                self.close()
+                raise processutils.ProcessExecutionError(
+                    stderr=output,
+                    cmd='%s %s' % (' '.join(self.args), command))
+        return output, ''
+
+    def discard(self, blocking=True):
+        """Close the session for good, unless it is running a command.
+
+        :param blocking: whether to wait for the running command to finish,
+                         instead of leaving the session open.
+        :returns: whether the session was discarded.
+        """
+        if not self._lock.acquire(blocking):
+            return False
+        try:
+            self._discarded = True
+            self.close()
+        finally:
+            self._lock.release()
+        return True
+
+    def close(self):
+        """Stop the ipmitool process, if any."""
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+        if self._process is not None:
+            if self._process.poll() is None:
+                try:
+                    self._process.kill()
+                except OSError:
+                    pass
+                self._process.wait()
+            self._process = None
+
+
+class SessionPool(object):
+    """Sessions indexed by their ipmitool arguments and password."""
+
+    def __init__(self):
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, args, password):
+        """Get a session, opening a new one if needed.
+
+        Idle sessions are closed first, and the least recently used one is
+        closed if the pool is full. Sessions running a command are never
+        closed, the pool may exceed its size if they are all busy.
+
+        :param args: the ipmitool command line, without the password and
+                     the command to execute.
+        :param password: the IPMI password.
+        :returns: a Session object.
+        """
+        key = (tuple(args), password)
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.pop(key, None)
+            if session is None:
+                self._evict_least_recently_used()
+                session = Session(args, password)
+            # Keep the most recently used session at the end
+            self._sessions[key] = session
+            session.last_used = time.time()
+        return session
+
+    def close_idle(self):
+        """Close the sessions which have not been used for a while."""
+        with self._lock:
+            self._evict_idle()
+
+    def _evict_idle(self):
+        limit = time.time() - CONF.ipmi.shell_session_idle_timeout
+        for key, session in list(self._sessions.items()):
+            if (session.last_used < limit and
+                    session.discard(blocking=False)):
+                del self._sessions[key]
+
+    def _evict_least_recently_used(self):
+        while len(self._sessions) >= CONF.ipmi.shell_session_max:
+            for key, session in self._sessions.items():
+                if session.discard(blocking=False):
+                    del self._sessions[key]
+                    break
+            else:
+                # All the sessions are running a command
+                return
+
+    def close_all(self):
+        """Close all sessions of the pool.
+
+        The commands running are waited for.
+        """
+        with self._lock:
+            while self._sessions:
+                _key, session = self._sessions.popitem()
+                session.discard()
+
+
+_POOL = SessionPool()
+
+
+def close_idle():
+    """Close the pooled sessions which have not been used for a while."""
+    _POOL.close_idle()
+
+
+def close_all():
+    """Close all the pooled sessions."""
+    _POOL.close_all()
+
+
+def execute(args, password, command):
+    """Run an ipmitool command through a pooled shell session.
+
+    :param args: the ipmitool command line, without the password and the
+                 command to execute.
+    :param password: the IPMI password.
+    :param command: the ipmitool command, e.g. 'power status'.
+    :returns: (stdout, stderr)
+    :raises: processutils.ProcessExecutionError on failure.
+    """
+    while True:
+        session = _POOL.get(args, password)
+        try:
+            return session.execute(command, CONF.ipmi.retry_timeout)
+        except SessionDiscarded:
+            # The pool closed the session before the command could run,
+            # get a new one.
+            continue
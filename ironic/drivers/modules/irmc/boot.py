@@ -17,8 +17,6 @@ iRMC Boot Driver
 """
 
 import os
-import shutil
-import tempfile
 
 from ironic_lib import utils as ironic_utils
 from oslo_config import cfg
@@ -35,6 +33,7 @@ from ironic.common import images
 from ironic.common import states
 from ironic.conductor import utils as manager_utils
 from ironic.drivers import base
+from ironic.drivers.modules import built_image_cache
 from ironic.drivers.modules import deploy_utils
 from ironic.drivers.modules.irmc import common as irmc_common
 
@@ -215,14 +214,33 @@ def _setup_deploy_iso(task, ramdisk_options):
         deploy_iso_file = deploy_iso_href
     else:
         deploy_iso_file = _get_deploy_iso_name(task.node)
-        deploy_iso_fullpathname = os.path.join(
-            CONF.irmc.remote_image_share_root, deploy_iso_file)
-        images.fetch(task.context, deploy_iso_href, deploy_iso_fullpathname)
+        _put_in_share(deploy_iso_file,
+                      built_image_cache.get_key(
+                          'image', built_image_cache.get_image_version(
+                              task.context, deploy_iso_href)),
+                      lambda path: images.fetch(task.context,
+                                                deploy_iso_href, path))
 
     _setup_vmedia_for_boot(task, deploy_iso_file, ramdisk_options)
     manager_utils.node_set_boot_device(task, boot_devices.CDROM)
 
 
+def _put_in_share(share_filename, key, build):
+    """Put an image in the share file system, building it if not cached.
+
+    :param share_filename: the name of the file of the node in the share.
+    :param key: the key of the image, from built_image_cache.get_key().
+    :param build: function building the image into the path it is given.
+    :raises: IRMCOperationError, if writing the file failed.
+    """
+    try:
+        built_image_cache.put_in_directory(CONF.irmc.remote_image_share_root,
+                                           share_filename, key, build)
+    except (IOError, OSError) as e:
+        operation = _("Writing file %s in the share") % share_filename
+        raise exception.IRMCOperationError(operation=operation, error=e)
+
+
 def _get_deploy_iso_name(node):
     """Returns the deploy ISO file name for a given node.
 
@@ -261,9 +279,12 @@ def _prepare_boot_iso(task, root_uuid):
             driver_internal_info['irmc_boot_iso'] = boot_iso_href
         else:
             boot_iso_filename = _get_boot_iso_name(task.node)
-            boot_iso_fullpathname = os.path.join(
-                CONF.irmc.remote_image_share_root, boot_iso_filename)
-            images.fetch(task.context, boot_iso_href, boot_iso_fullpathname)
+            _put_in_share(boot_iso_filename,
+                          built_image_cache.get_key(
+                              'image', built_image_cache.get_image_version(
+                                  task.context, boot_iso_href)),
+                          lambda path: images.fetch(task.context,
+                                                    boot_iso_href, path))
 
             driver_internal_info['irmc_boot_iso'] = boot_iso_filename
 
@@ -285,13 +306,22 @@ def _prepare_boot_iso(task, root_uuid):
         kernel_params = CONF.pxe.pxe_append_params
 
         boot_iso_filename = _get_boot_iso_name(task.node)
-        boot_iso_fullpathname = os.path.join(
-            CONF.irmc.remote_image_share_root, boot_iso_filename)
-
-        images.create_boot_iso(task.context, boot_iso_fullpathname,
-                               kernel_href, ramdisk_href,
-                               deploy_iso, root_uuid,
-                               kernel_params, boot_mode)
+        # NOTE: the deploy ISO of the node is identified by its href, not by
+        # its path in the share which depends on the node
+        key = built_image_cache.get_key(
+            'boot_iso',
+            built_image_cache.get_image_version(task.context, kernel_href),
+            built_image_cache.get_image_version(task.context, ramdisk_href),
+            built_image_cache.get_image_version(
+                task.context, task.node.driver_info['irmc_deploy_iso']),
+            root_uuid, kernel_params, boot_mode)
+
+        _put_in_share(
+            boot_iso_filename, key,
+            lambda path: images.create_boot_iso(task.context, path,
+                                                kernel_href, ramdisk_href,
+                                                deploy_iso, root_uuid,
+                                                kernel_params, boot_mode))
 
         driver_internal_info['irmc_boot_iso'] = boot_iso_filename
 
@@ -323,20 +353,10 @@ def _prepare_floppy_image(task, params):
     :raises: IRMCOperationError, if copying floppy image file failed.
     """
     floppy_filename = _get_floppy_image_name(task.node)
-    floppy_fullpathname = os.path.join(
-        CONF.irmc.remote_image_share_root, floppy_filename)
-
-    with tempfile.NamedTemporaryFile() as vfat_image_tmpfile_obj:
-        images.create_vfat_image(vfat_image_tmpfile_obj.name,
-                                 parameters=params)
-        try:
-            shutil.copyfile(vfat_image_tmpfile_obj.name,
-                            floppy_fullpathname)
-        except IOError as e:
-            operation = _("Copying floppy image file")
-            raise exception.IRMCOperationError(
-                operation=operation, error=e)
-
+    _put_in_share(floppy_filename,
+                  built_image_cache.get_key('floppy', params),
+                  lambda path: images.create_vfat_image(path,
+                                                        parameters=params))
     return floppy_filename
 
 
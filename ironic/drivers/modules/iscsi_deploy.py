@@ -69,6 +69,24 @@ pxe_opts = [
                default=10080,
                help=_('Maximum TTL (in minutes) for old master images in '
                       'cache.')),
+    cfg.StrOpt('image_cache_policy',
+               default='lru',
+               choices=['lru', 'gdsf'],
+               help=_('Policy choosing the master images deleted when a '
+                      'cache is larger than image_cache_size. "lru" deletes '
+                      'the least recently used images first. "gdsf" (Greedy '
+                      'Dual Size Frequency) deletes first the images which '
+                      'are the cheapest to keep out of the cache, given how '
+                      'big they are, how often they are used and how long '
+                      'they took to download, so that e.g. a big image used '
+                      'once does not push the deploy kernels and ramdisks '
+                      'out of the cache.')),
+    cfg.ListOpt('image_cache_pinned_images',
+                default=[],
+                help=_('A list of images (Glance UUIDs or URLs) never '
+                       'deleted from the master image caches once '
+                       'downloaded, for example the deploy kernel and '
+                       'ramdisk used by most nodes.')),
     cfg.StrOpt('disk_devices',
                default='cciss/c0d0,sda,hda,vda',
                help=_('The disk devices to scan while doing the deploy.')),
@@ -97,7 +115,9 @@ class InstanceImageCache(image_cache.ImageCache):
             # MiB -> B
             cache_size=CONF.pxe.image_cache_size * 1024 * 1024,
             # min -> sec
-            cache_ttl=CONF.pxe.image_cache_ttl * 60)
+            cache_ttl=CONF.pxe.image_cache_ttl * 60,
+            policy=CONF.pxe.image_cache_policy,
+            pinned=CONF.pxe.image_cache_pinned_images)
 
 
 def _get_image_dir_path(node_uuid):
@@ -409,6 +429,10 @@ class ISCSIDeploy(base.DeployInterface):
     def get_properties(self):
         return {}
 
+    def get_image_cache(self):
+        """Return the cache of the instance images on the conductor."""
+        return InstanceImageCache()
+
     def validate(self, task):
         """Validate the deployment information for the task's node.
 
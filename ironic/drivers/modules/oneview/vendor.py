@@ -22,6 +22,7 @@ from ironic.common.i18n import _LI
 from ironic.common.i18n import _LW
 from ironic.common import states
 from ironic.conductor import utils as manager_utils
+from ironic.drivers import base
 from ironic.drivers.modules import agent
 from ironic.drivers.modules import deploy_utils
 
@@ -83,6 +84,9 @@ class AgentVendorInterface(agent.AgentVendorInterface):
             wait_fixed=wait
         )
         def _wait_until_powered_off(task):
+            # NOTE: the agent powers the node off by itself, the cached
+            # power state is outdated.
+            base.POWER_STATE_CACHE.invalidate(task.node.uuid)
             return task.driver.power.get_power_state(task)
 
         node = task.node
@@ -294,7 +294,9 @@ class TFTPImageCache(image_cache.ImageCache):
             # MiB -> B
             cache_size=CONF.pxe.image_cache_size * 1024 * 1024,
             # min -> sec
-            cache_ttl=CONF.pxe.image_cache_ttl * 60)
+            cache_ttl=CONF.pxe.image_cache_ttl * 60,
+            policy=CONF.pxe.image_cache_policy,
+            pinned=CONF.pxe.image_cache_pinned_images)
 
 
 def _cache_ramdisk_kernel(ctx, node, pxe_info):
@@ -335,6 +337,10 @@ class PXEBoot(base.BootInterface):
         """
         return COMMON_PROPERTIES
 
+    def get_image_cache(self):
+        """Return the cache of the kernels and ramdisks on the conductor."""
+        return TFTPImageCache()
+
     def validate(self, task):
         """Validate the PXE-specific info for booting deploy/instance images.
 
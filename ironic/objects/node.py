@@ -19,6 +19,7 @@ from oslo_versionedobjects import base as object_base
 
 from ironic.common import exception
 from ironic.common.i18n import _
+from ironic.common import json_utils
 from ironic.db import api as db_api
 from ironic.objects import base
 from ironic.objects import fields as object_fields
@@ -103,6 +104,72 @@ class Node(base.IronicObject, object_base.VersionedObjectDictCompat):
         'extra': object_fields.FlexibleDictField(nullable=True),
     }
 
+    def __init__(self, context=None, **kwargs):
+        # NOTE: the JSON fields read from the database are kept encoded
+        # until they are accessed, see _from_db_object() and obj_load_attr().
+        self._encoded_fields = {}
+        super(Node, self).__init__(context, **kwargs)
+
+    def __setattr__(self, name, value):
+        if name in self.fields:
+            self._encoded_fields.pop(name, None)
+        super(Node, self).__setattr__(name, value)
+
+    @staticmethod
+    def _from_db_object(obj, db_node):
+        """Converts a database entity to a formal object.
+
+        The JSON fields which the database returns still encoded are only
+        decoded when they are first accessed.
+
+        :param obj: A Node object.
+        :param db_node: A DB model of the node.
+        :return: The Node object with the database entity added.
+        """
+        get_encoded = getattr(db_node, 'get_encoded', db_node.__getitem__)
+        for field in obj.fields:
+            value = get_encoded(field)
+            if isinstance(value, json_utils.EncodedJson):
+                # NOTE: the field may be held only encoded, which the
+                # overridden obj_attr_is_set() reports as set as well.
+                if super(Node, obj).obj_attr_is_set(field):
+                    delattr(obj, field)
+                obj._encoded_fields[field] = value
+            else:
+                obj[field] = value
+
+        obj.obj_reset_changes()
+        return obj
+
+    def obj_load_attr(self, attrname):
+        try:
+            encoded = self._encoded_fields[attrname]
+        except KeyError:
+            return super(Node, self).obj_load_attr(attrname)
+        setattr(self, attrname, encoded.decode())
+        self.obj_reset_changes([attrname])
+
+    def obj_attr_is_set(self, attrname):
+        return (attrname in self._encoded_fields or
+                super(Node, self).obj_attr_is_set(attrname))
+
+    def obj_what_changed(self):
+        # NOTE: the base class looks for changed sub-objects in all the set
+        # fields, which would decode the JSON fields; Node has none.
+        return set(field for field in self._changed_fields
+                   if field in self.fields)
+
+    def obj_refresh(self, loaded_object):
+        for field in self.fields:
+            if (field in self._encoded_fields and
+                    field in loaded_object._encoded_fields):
+                # Neither value was decoded, take the new one as is
+                self._encoded_fields[field] = (
+                    loaded_object._encoded_fields[field])
+            elif (self.obj_attr_is_set(field) and
+                    self[field] != loaded_object[field]):
+                self[field] = loaded_object[field]
+
     def _validate_property_values(self, properties):
         """Check if the input of local_gb, cpus and memory_mb are valid.
 
@@ -135,16 +202,19 @@ class Node(base.IronicObject, object_base.VersionedObjectDictCompat):
     # Implications of calling new remote procedures should be thought through.
     # @object_base.remotable_classmethod
     @classmethod
-    def get(cls, context, node_id):
+    def get(cls, context, node_id, filters=None):
         """Find a node based on its id or uuid and return a Node object.
 
         :param node_id: the id *or* uuid of a node.
+        :param filters: optional filters the node has to match, see
+                        dbapi.get_nodeinfo_list() for the supported ones.
+        :raises: NodeFilterMismatch if the node does not match the filters.
         :returns: a :class:`Node` object.
         """
         if strutils.is_int_like(node_id):
-            return cls.get_by_id(context, node_id)
+            return cls.get_by_id(context, node_id, filters=filters)
         elif uuidutils.is_uuid_like(node_id):
-            return cls.get_by_uuid(context, node_id)
+            return cls.get_by_uuid(context, node_id, filters=filters)
         else:
             raise exception.InvalidIdentity(identity=node_id)
 
@@ -153,13 +223,14 @@ class Node(base.IronicObject, object_base.VersionedObjectDictCompat):
     # Implications of calling new remote procedures should be thought through.
     # @object_base.remotable_classmethod
     @classmethod
-    def get_by_id(cls, context, node_id):
+    def get_by_id(cls, context, node_id, filters=None):
         """Find a node based on its integer id and return a Node object.
 
         :param node_id: the id of a node.
+        :param filters: optional filters the node has to match.
         :returns: a :class:`Node` object.
         """
-        db_node = cls.dbapi.get_node_by_id(node_id)
+        db_node = cls.dbapi.get_node_by_id(node_id, filters=filters)
         node = Node._from_db_object(cls(context), db_node)
         return node
 
@@ -168,13 +239,14 @@ class Node(base.IronicObject, object_base.VersionedObjectDictCompat):
     # Implications of calling new remote procedures should be thought through.
     # @object_base.remotable_classmethod
     @classmethod
-    def get_by_uuid(cls, context, uuid):
+    def get_by_uuid(cls, context, uuid, filters=None):
         """Find a node based on uuid and return a Node object.
 
         :param uuid: the uuid of a node.
+        :param filters: optional filters the node has to match.
         :returns: a :class:`Node` object.
         """
-        db_node = cls.dbapi.get_node_by_uuid(uuid)
+        db_node = cls.dbapi.get_node_by_uuid(uuid, filters=filters)
         node = Node._from_db_object(cls(context), db_node)
         return node
 
@@ -219,11 +291,14 @@ class Node(base.IronicObject, object_base.VersionedObjectDictCompat):
 
         :param context: Security context.
         :param limit: maximum number of resources to return in a single result.
-        :param marker: pagination marker for large data sets.
+        :param marker: pagination marker for large data sets, the last node
+                       of the previous page or its UUID.
         :param sort_key: column to sort results by.
         :param sort_dir: direction to sort. "asc" or "desc".
         :param filters: Filters to apply.
         :returns: a list of :class:`Node` object.
+        :raises: NodeNotFound if the marker is a UUID and the node is not
+                 found.
 
         """
         db_nodes = cls.dbapi.get_node_list(filters=filters, limit=limit,
@@ -236,7 +311,7 @@ class Node(base.IronicObject, object_base.VersionedObjectDictCompat):
     # Implications of calling new remote procedures should be thought through.
     # @object_base.remotable_classmethod
     @classmethod
-    def reserve(cls, context, tag, node_id):
+    def reserve(cls, context, tag, node_id, filters=None):
         """Get and reserve a node.
 
         To prevent other ManagerServices from manipulating the given
@@ -245,14 +320,76 @@ class Node(base.IronicObject, object_base.VersionedObjectDictCompat):
         :param context: Security context.
         :param tag: A string uniquely identifying the reservation holder.
         :param node_id: A node id or uuid.
+        :param filters: optional filters the node has to match to be
+                        reserved, see dbapi.get_nodeinfo_list() for the
+                        supported ones.
         :raises: NodeNotFound if the node is not found.
+        :raises: NodeFilterMismatch if the node does not match the filters.
         :returns: a :class:`Node` object.
 
         """
-        db_node = cls.dbapi.reserve_node(tag, node_id)
+        db_node = cls.dbapi.reserve_node(tag, node_id, filters=filters)
         node = Node._from_db_object(cls(context), db_node)
         return node
 
+    # NOTE(xek): We don't want to enable RPC on this call just yet. Remotable
+    # methods can be used in the future to replace current explicit RPC calls.
+    # Implications of calling new remote procedures should be thought through.
+    # @object_base.remotable_classmethod
+    @classmethod
+    def reserve_nodes(cls, context, tag, node_ids, filters=None):
+        """Get and reserve as many nodes as possible at once.
+
+        The nodes which are locked, not found or do not match the filters
+        are skipped.
+
+        :param context: Security context.
+        :param tag: A string uniquely identifying the reservation holder.
+        :param node_ids: A list of node ids or uuids.
+        :param filters: optional filters the nodes have to match to be
+                        reserved, see dbapi.get_nodeinfo_list() for the
+                        supported ones.
+        :returns: a list of the reserved :class:`Node` objects, in no
+                  particular order.
+
+        """
+        db_nodes = cls.dbapi.reserve_nodes(tag, node_ids, filters=filters)
+        return [Node._from_db_object(cls(context), db_node)
+                for db_node in db_nodes]
+
+    # NOTE(xek): We don't want to enable RPC on this call just yet. Remotable
+    # methods can be used in the future to replace current explicit RPC calls.
+    # Implications of calling new remote procedures should be thought through.
+    # @object_base.remotable_classmethod
+    @classmethod
+    def release_nodes(cls, context, tag, node_ids):
+        """Release the reservations on many nodes at once.
+
+        :param context: Security context.
+        :param tag: A string uniquely identifying the reservation holder.
+        :param node_ids: A list of node ids or uuids.
+
+        """
+        cls.dbapi.release_nodes(tag, node_ids)
+
+    # NOTE(xek): We don't want to enable RPC on this call just yet. Remotable
+    # methods can be used in the future to replace current explicit RPC calls.
+    # Implications of calling new remote procedures should be thought through.
+    # @object_base.remotable_classmethod
+    @classmethod
+    def update_agent_heartbeats(cls, context, heartbeats):
+        """Write the timestamps of the agent heartbeats of many nodes.
+
+        :param context: Security context.
+        :param heartbeats: A dict mapping node ids to (last_heartbeat,
+                           provision_state) tuples, see
+                           dbapi.update_agent_heartbeats().
+        :returns: A list of the ids of the reserved nodes, whose
+                  last_heartbeat was not written.
+
+        """
+        return cls.dbapi.update_agent_heartbeats(heartbeats)
+
     # NOTE(xek): We don't want to enable RPC on this call just yet. Remotable
     # methods can be used in the future to replace current explicit RPC calls.
     # Implications of calling new remote procedures should be thought through.
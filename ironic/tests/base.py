@@ -37,6 +37,7 @@ import testtools
 from ironic.common import config as ironic_config
 from ironic.common import context as ironic_context
 from ironic.common import hash_ring
+from ironic.conductor import heartbeat_buffer
 from ironic.objects import base as objects_base
 from ironic.tests.unit import policy_fixture
 
@@ -107,6 +108,7 @@ class TestCase(testtools.TestCase):
 
         self.addCleanup(self._clear_attrs)
         self.addCleanup(hash_ring.HashRingManager().reset)
+        self.addCleanup(heartbeat_buffer.reset)
         self.useFixture(fixtures.EnvironmentVariable('http_proxy'))
         self.policy = self.useFixture(policy_fixture.PolicyFixture())
 
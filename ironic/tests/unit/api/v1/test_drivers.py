@@ -272,6 +272,77 @@ class TestListDrivers(base.BaseApiTest):
                                                topic=mock.ANY)
 
 
+class TestDriverImageCache(base.BaseApiTest):
+
+    def setUp(self):
+        super(TestDriverImageCache, self).setUp()
+        for host in ('fake-host1', 'fake-host2'):
+            self.dbapi.register_conductor({'hostname': host,
+                                           'drivers': ['fake-driver']})
+        self.path = '/drivers/fake-driver/image_cache'
+        self.headers = {api_base.Version.string: "1.17"}
+        self.images = [{'href': 'fake-href', 'interface': 'deploy'}]
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'prefetch_images')
+    def test_prefetch_images(self, mock_prefetch):
+        ret = self.post_json(self.path, {'images': self.images},
+                             headers=self.headers)
+        self.assertEqual(http_client.ACCEPTED, ret.status_code)
+        mock_prefetch.assert_called_once_with(mock.ANY, 'fake-driver',
+                                              self.images)
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'prefetch_images')
+    def test_prefetch_images_older_version(self, mock_prefetch):
+        ret = self.post_json(self.path, {'images': self.images},
+                             headers={api_base.Version.string: "1.16"},
+                             expect_errors=True)
+        self.assertEqual(http_client.NOT_ACCEPTABLE, ret.status_code)
+        self.assertFalse(mock_prefetch.called)
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'prefetch_images')
+    def test_prefetch_images_invalid(self, mock_prefetch):
+        for body in ({}, {'images': []}, {'images': 'fake-href'},
+                     {'images': [{'href': 'fake-href'}]},
+                     {'images': [{'href': 'fake-href', 'interface': 'power'}]},
+                     {'images': [{'href': 42, 'interface': 'boot'}]}):
+            ret = self.post_json(self.path, body, headers=self.headers,
+                                 expect_errors=True)
+            self.assertEqual(http_client.BAD_REQUEST, ret.status_code)
+            self.assertTrue(ret.json['error_message'])
+        self.assertFalse(mock_prefetch.called)
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'prefetch_images')
+    def test_prefetch_images_driver_not_found(self, mock_prefetch):
+        ret = self.post_json('/drivers/bad-driver/image_cache',
+                             {'images': self.images}, headers=self.headers,
+                             expect_errors=True)
+        self.assertEqual(http_client.NOT_FOUND, ret.status_code)
+        self.assertFalse(mock_prefetch.called)
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'get_image_prefetch_status')
+    def test_get_image_prefetch_status(self, mock_status):
+        status = [{'href': 'fake-href', 'interface': 'deploy',
+                   'state': 'cached', 'error': None,
+                   'updated_at': '2016-01-01T00:00:00'}]
+        mock_status.side_effect = [status, []]
+        data = self.get_json(self.path, headers=self.headers)
+        self.assertEqual({'conductors': {'fake-host1': status,
+                                         'fake-host2': []}}, data)
+        mock_status.assert_has_calls([
+            mock.call(mock.ANY, 'fake-driver',
+                      topic='ironic.conductor_manager.fake-host1'),
+            mock.call(mock.ANY, 'fake-driver',
+                      topic='ironic.conductor_manager.fake-host2')])
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'get_image_prefetch_status')
+    def test_get_image_prefetch_status_older_version(self, mock_status):
+        ret = self.get_json(self.path,
+                            headers={api_base.Version.string: "1.16"},
+                            expect_errors=True)
+        self.assertEqual(http_client.NOT_ACCEPTABLE, ret.status_code)
+        self.assertFalse(mock_status.called)
+
+
 @mock.patch.object(rpcapi.ConductorAPI, 'get_driver_properties')
 @mock.patch.object(rpcapi.ConductorAPI, 'get_topic_for_driver')
 class TestDriverProperties(base.BaseApiTest):
@@ -34,6 +34,7 @@ from ironic.api.controllers.v1 import node as api_node
 from ironic.api.controllers.v1 import utils as api_utils
 from ironic.common import boot_devices
 from ironic.common import exception
+from ironic.common import json_utils
 from ironic.common import states
 from ironic.conductor import rpcapi
 from ironic import objects
@@ -184,6 +185,19 @@ class TestListNodes(test_api_base.BaseApiTest):
         self.assertEqual('application/json', response.content_type)
         self.assertIn('spongebob', response.json['error_message'])
 
+    @mock.patch.object(json_utils.EncodedJson, 'decode', autospec=True)
+    def test_get_custom_fields_decodes_only_requested(self, mock_decode):
+        mock_decode.side_effect = lambda encoded: json.loads(encoded.text)
+        node = obj_utils.create_test_node(self.context,
+                                          chassis_id=self.chassis.id,
+                                          extra={'foo': 'bar'})
+        fields = 'uuid,extra'
+        data = self.get_json(
+            '/nodes/%s?fields=%s' % (node.uuid, fields),
+            headers={api_base.Version.string: str(api_v1.MAX_VER)})
+        self.assertEqual({'foo': 'bar'}, data['extra'])
+        self.assertEqual(1, mock_decode.call_count)
+
     def test_get_custom_fields_invalid_api_version(self):
         node = obj_utils.create_test_node(self.context,
                                           chassis_id=self.chassis.id)
@@ -369,6 +383,23 @@ class TestListNodes(test_api_base.BaseApiTest):
         next_marker = data['nodes'][-1]['uuid']
         self.assertIn(next_marker, data['next'])
 
+    def test_collection_links_follow_marker(self):
+        uuids = sorted(uuidutils.generate_uuid() for i in range(5))
+        for uuid in uuids:
+            obj_utils.create_test_node(self.context, uuid=uuid)
+        data = self.get_json('/nodes/?limit=3&sort_key=uuid')
+        next_url = data['next'].split('/v1', 1)[1]
+
+        data = self.get_json(next_url)
+        self.assertEqual(uuids[3:], [n['uuid'] for n in data['nodes']])
+
+    def test_collection_marker_not_found(self):
+        obj_utils.create_test_node(self.context)
+        response = self.get_json(
+            '/nodes/?marker=%s' % uuidutils.generate_uuid(),
+            expect_errors=True)
+        self.assertEqual(http_client.NOT_FOUND, response.status_int)
+
     def test_collection_links_default_limit(self):
         cfg.CONF.set_override('max_limit', 3, 'api')
         nodes = []
@@ -0,0 +1,251 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the writer of FAT file system images."""
+
+import datetime
+import os
+import shutil
+import struct
+import tempfile
+
+from ironic.common import fat
+from ironic.tests import base
+
+
+class _Reader(object):
+    """Minimal reader of FAT12 and FAT16 images, to check written images."""
+
+    def __init__(self, data):
+        self.data = data
+        (self.sector_size, self.sectors_per_cluster, reserved, num_fats,
+         self.root_entries, total_16, self.media, fat_sectors) = (
+            struct.unpack('<HBHBHHBH', data[11:24]))
+        self.total_sectors = (total_16 or
+                              struct.unpack('<L', data[32:36])[0])
+        self.volume_id = struct.unpack('<L', data[39:43])[0]
+        self.label = data[43:54]
+        self.fs_type = data[54:62]
+        self.signature = data[510:512]
+        fat_start = reserved * self.sector_size
+        fat_size = fat_sectors * self.sector_size
+        self.fats = [data[fat_start + i * fat_size:
+                          fat_start + (i + 1) * fat_size]
+                     for i in range(num_fats)]
+        self.root_start = fat_start + num_fats * fat_size
+        self.data_start = (self.root_start +
+                           self.root_entries * fat.DIR_ENTRY_SIZE)
+        self.cluster_size = self.sectors_per_cluster * self.sector_size
+        data_sectors = self.total_sectors - self.data_start // 512
+        clusters = data_sectors // self.sectors_per_cluster
+        self.fat_bits = 12 if clusters <= fat.MAX_FAT12_CLUSTERS else 16
+
+    def fat_entry(self, cluster):
+        table = self.fats[0]
+        if self.fat_bits == 16:
+            return struct.unpack('<H', table[cluster * 2:cluster * 2 + 2])[0]
+        offset = cluster * 3 // 2
+        value = struct.unpack('<H', table[offset:offset + 2])[0]
+        return value >> 4 if cluster % 2 else value & 0xfff
+
+    def chain(self, cluster):
+        clusters = []
+        while 2 <= cluster < (1 << self.fat_bits) - 8:
+            clusters.append(cluster)
+            cluster = self.fat_entry(cluster)
+        return clusters
+
+    def read_clusters(self, cluster):
+        return b''.join(
+            self.data[self.data_start + (c - 2) * self.cluster_size:
+                      self.data_start + (c - 1) * self.cluster_size]
+            for c in self.chain(cluster))
+
+    def list_dir(self, cluster=None):
+        """Get the entries of a directory, by name.
+
+        :returns: a dict of (attributes, cluster, size, short name) tuples,
+                  and of the volume label as name None.
+        """
+        if cluster is None:
+            raw = self.data[self.root_start:self.data_start]
+        else:
+            raw = self.read_clusters(cluster)
+        entries = {}
+        long_name = []
+        for offset in range(0, len(raw), fat.DIR_ENTRY_SIZE):
+            entry = raw[offset:offset + fat.DIR_ENTRY_SIZE]
+            if entry[0:1] == b'\0':
+                break
+            attributes = struct.unpack('<B', entry[11:12])[0]
+            if attributes == fat.ATTR_LONG_NAME:
+                chars = entry[1:11] + entry[14:26] + entry[28:32]
+                long_name.insert(0, (entry[13:14], chars))
+                continue
+            if attributes & fat.ATTR_VOLUME_ID:
+                entries[None] = entry[0:11]
+                continue
+            short_name = entry[0:11]
+            if long_name:
+                checksum = struct.pack(
+                    'B', fat._short_name_checksum(short_name))
+                assert all(c == checksum for c, chars in long_name)
+                name = b''.join(chars for c, chars in long_name)
+                name = name.decode('utf-16-le').split(u'\0')[0]
+            else:
+                base = short_name[:8].decode('ascii').rstrip()
+                ext = short_name[8:].decode('ascii').rstrip()
+                name = base + ('.' + ext if ext else '')
+            long_name = []
+            cluster_hi, cluster_lo, size = struct.unpack('<H4xHL',
+                                                         entry[20:32])
+            entries[name] = (attributes, (cluster_hi << 16) | cluster_lo,
+                             size, short_name)
+        return entries
+
+    def read_file(self, path):
+        cluster = None
+        for name in path.split('/'):
+            attributes, cluster, size, short_name = self.list_dir(
+                cluster)[name]
+        return self.read_clusters(cluster)[:size]
+
+
+class FatImageTestCase(base.TestCase):
+
+    def test_empty_image(self):
+        image = fat.FatImage(100, label='ir-vfd-dev', volume_id=0x1234)
+        data = image.to_bytes()
+        reader = _Reader(data)
+
+        self.assertEqual(100 * 1024, len(data))
+        self.assertEqual(b'\x55\xaa', reader.signature)
+        self.assertEqual(200, reader.total_sectors)
+        self.assertEqual(0xf8, reader.media)
+        self.assertEqual(b'FAT12   ', reader.fs_type)
+        self.assertEqual(b'ir-vfd-dev ', reader.label)
+        self.assertEqual(0x1234, reader.volume_id)
+        self.assertEqual(reader.fats[0], reader.fats[1])
+        self.assertEqual(0xff8, reader.fat_entry(0))
+        self.assertEqual(0xfff, reader.fat_entry(1))
+        self.assertEqual({None: b'ir-vfd-dev '}, reader.list_dir())
+
+    def test_files(self):
+        image = fat.FatImage(100, label='ir-vfd-dev',
+                             when=datetime.datetime(2016, 2, 29, 13, 14, 15))
+        image.add_data('parameters.txt', u'a=b\nc=d')
+        image.add_data('README.TXT', b'x' * 1500)
+        image.add_data('empty', b'')
+        reader = _Reader(image.to_bytes())
+
+        entries = reader.list_dir()
+        self.assertEqual(set([None, 'parameters.txt', 'README.TXT',
+                              'empty']), set(entries))
+        self.assertEqual(b'PARAME~1TXT', entries['parameters.txt'][3])
+        self.assertEqual(b'README  TXT', entries['README.TXT'][3])
+        self.assertEqual((fat.ATTR_ARCHIVE, 0, 0, b'EMPTY~1    '),
+                         entries['empty'])
+        self.assertEqual(b'a=b\nc=d', reader.read_file('parameters.txt'))
+        self.assertEqual(b'x' * 1500, reader.read_file('README.TXT'))
+        self.assertEqual(3, len(reader.chain(entries['README.TXT'][1])))
+
+    def test_directories(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        source = os.path.join(tmpdir, 'source')
+        with open(source, 'wb') as f:
+            f.write(b'grub config')
+        image = fat.FatImage(1024)
+        image.add_file('EFI/BOOT/grub.cfg', source)
+        image.add_data('EFI/BOOT/BOOTX64.EFI', b'efi')
+        image.add_data('/EFI/other', b'other')
+        path = os.path.join(tmpdir, 'image')
+        image.write_to_file(path)
+        with open(path, 'rb') as f:
+            reader = _Reader(f.read())
+
+        self.assertEqual(b'grub config', reader.read_file('EFI/BOOT/grub.cfg'))
+        self.assertEqual(b'efi', reader.read_file('EFI/BOOT/BOOTX64.EFI'))
+        self.assertEqual(b'other', reader.read_file('EFI/other'))
+        efi = reader.list_dir()['EFI']
+        self.assertEqual(fat.ATTR_DIRECTORY, efi[0])
+        boot = reader.list_dir(efi[1])['BOOT']
+        boot_entries = reader.list_dir(boot[1])
+        self.assertEqual(boot[1], boot_entries['.'][1])
+        self.assertEqual(efi[1], boot_entries['..'][1])
+        # ".." of a directory of the root refers to cluster 0
+        self.assertEqual(0, reader.list_dir(efi[1])['..'][1])
+
+    def test_long_names(self):
+        image = fat.FatImage(100)
+        names = [u'a very long file name.txt', u'a very long file name.cfg',
+                 u'a very long file name.txt.old', u'caf\xe9']
+        for name in names:
+            image.add_data(name, name.encode('utf-8'))
+        reader = _Reader(image.to_bytes())
+
+        entries = reader.list_dir()
+        self.assertEqual(b'AVERYL~1TXT', entries[names[0]][3])
+        self.assertEqual(b'AVERYL~1CFG', entries[names[1]][3])
+        self.assertEqual(b'AVERYL~1OLD', entries[names[2]][3])
+        self.assertEqual(b'CAF_~1     ', entries[names[3]][3])
+        for name in names:
+            self.assertEqual(name.encode('utf-8'), reader.read_file(name))
+
+    def test_fat16(self):
+        image = fat.FatImage(16 * 1024)
+        image.add_data('big', b'y' * (1024 * 1024))
+        reader = _Reader(image.to_bytes())
+
+        self.assertEqual(b'FAT16   ', reader.fs_type)
+        self.assertEqual(16, reader.fat_bits)
+        self.assertEqual(0xfff8, reader.fat_entry(0))
+        self.assertEqual(512, reader.root_entries)
+        self.assertEqual(b'y' * (1024 * 1024), reader.read_file('big'))
+
+    def test_large_image(self):
+        image = fat.FatImage(256 * 1024)
+        reader = _Reader(image.to_bytes())
+
+        self.assertEqual(256 * 1024 * 2, reader.total_sectors)
+        self.assertLessEqual(
+            (reader.total_sectors * 512 - reader.data_start) //
+            reader.cluster_size, fat.MAX_FAT16_CLUSTERS)
+
+    def test_no_space(self):
+        image = fat.FatImage(100)
+        image.add_data('big', b'z' * (100 * 1024))
+        self.assertRaises(ValueError, image.to_bytes)
+
+    def test_too_many_root_entries(self):
+        image = fat.FatImage(100)
+        for index in range(224):
+            image.add_data('F%d' % index, b'')
+        self.assertRaises(ValueError, image.to_bytes)
+
+    def test_too_big(self):
+        self.assertRaises(ValueError, fat.FatImage, 4 * 1024 * 1024)
+
+    def test_too_small(self):
+        self.assertRaises(ValueError, fat.FatImage, 8)
+
+    def test_label_too_long(self):
+        self.assertRaises(ValueError, fat.FatImage, 100, label='x' * 12)
+
+    def test_invalid_paths(self):
+        image = fat.FatImage(100)
+        image.add_data('dir/file', b'')
+        self.assertRaises(ValueError, image.add_data, 'DIR/FILE', b'')
+        self.assertRaises(ValueError, image.add_data, 'dir/file/x', b'')
+        self.assertRaises(ValueError, image.add_data, '/', b'')
+        self.assertRaises(ValueError, image.add_data, '../x', b'')
+        self.assertRaises(ValueError, image.add_data, 'x' * 256, b'')
@@ -29,6 +29,7 @@ import testtools
 from ironic.common import context
 from ironic.common import exception
 from ironic.common.glance_service import base_image_service
+from ironic.common.glance_service import metadata_cache
 from ironic.common.glance_service import service_utils
 from ironic.common.glance_service.v2 import image_service as glance_v2
 from ironic.common import image_service as service
@@ -905,6 +906,10 @@ class TestSwiftTempUrlCache(base.TestCase):
                     group='glance')
         self.glance_service = service.GlanceImageService(client, version=2,
                                                          context=self.context)
+        patcher = mock.patch.object(glance_v2.GlanceImageService, '_cache',
+                                    glance_v2.TempUrlCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     @mock.patch('swiftclient.utils.generate_temp_url', autospec=True)
     def test_add_items_to_cache(self, tempurl_mock):
@@ -1029,8 +1034,9 @@ class TestSwiftTempUrlCache(base.TestCase):
                 int(time.time()) + 2000
             )
         }
-        self.glance_service._cache.update(expired_items)
-        self.glance_service._cache.update(valid_items)
+        for uuid, element in list(expired_items.items()) + list(
+                valid_items.items()):
+            self.glance_service._cache[uuid] = element
         self.glance_service._remove_expired_items_from_cache()
         for uuid in valid_items:
             self.assertEqual(valid_items[uuid],
@@ -1086,6 +1092,148 @@ class TestSwiftTempUrlCache(base.TestCase):
         self.assertFalse(rm_expired.called)
         self.assertNotIn(fake_image['id'], self.glance_service._cache)
 
+    def test_cache_shared_between_services(self):
+        fake_image = {
+            'id': uuidutils.generate_uuid()
+        }
+        self._test__generate_temp_url(fake_image)
+        other_service = service.GlanceImageService(
+            stubs.StubGlanceClient(), version=2, context=self.context)
+        self.assertIn(fake_image['id'], other_service._cache)
+
+    def test_cache_hits_and_misses(self):
+        cache = glance_v2.TempUrlCache()
+        cache['image'] = glance_v2.TempUrlCacheElement(
+            'fake-url', int(time.time()) + 1000)
+        self.assertEqual('fake-url', cache.get('image'))
+        self.assertIsNone(cache.get('other-image'))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_cache_size_bounded(self):
+        self.config(swift_temp_url_cache_size=2, group='glance')
+        now = int(time.time())
+        cache = glance_v2.TempUrlCache()
+        cache['image1'] = glance_v2.TempUrlCacheElement('url-1', now + 3000)
+        cache['image2'] = glance_v2.TempUrlCacheElement('url-2', now + 1000)
+        cache['image3'] = glance_v2.TempUrlCacheElement('url-3', now + 2000)
+        # The URL expiring first is dropped
+        self.assertEqual(2, len(cache))
+        self.assertNotIn('image2', cache)
+        self.assertIn('image1', cache)
+        self.assertIn('image3', cache)
+
+    def test_cache_replaced_url(self):
+        now = int(time.time())
+        cache = glance_v2.TempUrlCache()
+        cache['image'] = glance_v2.TempUrlCacheElement('old-url', now - 10)
+        cache['image'] = glance_v2.TempUrlCacheElement('new-url', now + 1000)
+        cache.remove_expired(now)
+        self.assertEqual('new-url', cache.get('image'))
+        for i in range(10):
+            cache['image'] = glance_v2.TempUrlCacheElement('url', now + i)
+        self.assertEqual(1, len(cache))
+        self.assertLessEqual(len(cache._heap), 2)
+
+
+class TestImageMetadataCache(base.TestCase):
+
+    def setUp(self):
+        super(TestImageMetadataCache, self).setUp()
+        self.config(image_metadata_cache_ttl=60, group='glance')
+        self.cache = metadata_cache.ImageMetadataCache()
+        self.context = context.RequestContext(auth_token=True,
+                                              tenant='project')
+        self.fetch = mock.Mock(side_effect=lambda: {'size': 42,
+                                                    'properties': {}})
+
+    def test_get(self):
+        self.assertEqual({'size': 42, 'properties': {}},
+                         self.cache.get('image', 1, self.context, self.fetch))
+        image_meta = self.cache.get('image', 1, self.context, self.fetch)
+        self.assertEqual({'size': 42, 'properties': {}}, image_meta)
+        self.assertEqual(1, self.fetch.call_count)
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+        # The cached metadata is not changed by callers
+        image_meta['properties']['kernel_id'] = 'kernel'
+        self.assertEqual({'size': 42, 'properties': {}},
+                         self.cache.get('image', 1, self.context, self.fetch))
+
+    def test_get_disabled(self):
+        self.config(image_metadata_cache_ttl=0, group='glance')
+        self.cache.get('image', 1, self.context, self.fetch)
+        self.cache.get('image', 1, self.context, self.fetch)
+        self.assertEqual(2, self.fetch.call_count)
+        self.assertEqual(0, len(self.cache))
+
+    def test_get_per_project_and_version(self):
+        other_context = context.RequestContext(tenant='other')
+        self.cache.get('image', 1, self.context, self.fetch)
+        self.cache.get('image', 1, other_context, self.fetch)
+        self.cache.get('image', 2, self.context, self.fetch)
+        self.cache.get('image', 1, None, self.fetch)
+        self.assertEqual(4, self.fetch.call_count)
+
+    def test_get_expired(self):
+        self.cache.get('image', 1, self.context, self.fetch)
+        expired = time.time() + 61
+        with mock.patch.object(time, 'time', autospec=True) as time_mock:
+            time_mock.return_value = expired
+            self.cache.get('image', 1, self.context, self.fetch)
+        self.assertEqual(2, self.fetch.call_count)
+
+    def test_get_error_not_cached(self):
+        self.fetch.side_effect = exception.ImageNotFound(image_id='image')
+        self.assertRaises(exception.ImageNotFound, self.cache.get,
+                          'image', 1, self.context, self.fetch)
+        self.assertRaises(exception.ImageNotFound, self.cache.get,
+                          'image', 1, self.context, self.fetch)
+        self.assertEqual(2, self.fetch.call_count)
+        self.assertEqual(0, len(self.cache))
+
+    def test_get_size_bounded(self):
+        self.config(image_metadata_cache_size=2, group='glance')
+        self.cache.get('image1', 1, self.context, self.fetch)
+        self.cache.get('image2', 1, self.context, self.fetch)
+        # image1 is now the most recently used entry
+        self.cache.get('image1', 1, self.context, self.fetch)
+        self.cache.get('image3', 1, self.context, self.fetch)
+        self.assertEqual(2, len(self.cache))
+        self.cache.get('image1', 1, self.context, self.fetch)
+        self.assertEqual(3, self.fetch.call_count)
+        self.cache.get('image2', 1, self.context, self.fetch)
+        self.assertEqual(4, self.fetch.call_count)
+
+    def test_invalidate(self):
+        other_context = context.RequestContext(tenant='other')
+        self.cache.get('image1', 1, self.context, self.fetch)
+        self.cache.get('image1', 1, other_context, self.fetch)
+        self.cache.get('image2', 1, self.context, self.fetch)
+        self.cache.invalidate('image1')
+        self.assertEqual(1, len(self.cache))
+        self.cache.invalidate()
+        self.assertEqual(0, len(self.cache))
+
+    def test_glance_service(self):
+        patcher = mock.patch.object(metadata_cache, 'IMAGE_METADATA_CACHE',
+                                    self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        client = stubs.StubGlanceClient()
+        glance_service = service.GlanceImageService(client, 1, self.context)
+        image_id = glance_service.create({'name': 'image', 'properties': {},
+                                          'is_public': True})['id']
+        with mock.patch.object(client.images, 'get',
+                               wraps=client.images.get) as get_mock:
+            glance_service.show(image_id)
+            glance_service.show('glance://%s' % image_id)
+            self.assertEqual(1, get_mock.call_count)
+            glance_service.update(image_id, {'name': 'new name'})
+            self.assertEqual('new name', glance_service.show(image_id)['name'])
+            self.assertEqual(2, get_mock.call_count)
+            glance_service.delete(image_id)
+            glance_service.show(image_id)
+            self.assertEqual(3, get_mock.call_count)
+
 
 class TestGlanceUrl(base.TestCase):
 
@@ -48,8 +48,8 @@ class HashRingTestCase(base.TestCase):
         replicas = 1
         ring = hash_ring.HashRing(hosts, replicas=replicas)
 
-        self.assertIn(int(r1, 16), ring._host_hashes)
-        self.assertIn(int(r2, 16), ring._host_hashes)
+        self.assertIn(int(r1, 16), ring._partitions)
+        self.assertIn(int(r2, 16), ring._partitions)
 
     def test_create_ring(self):
         hosts = ['foo', 'bar']
@@ -211,6 +211,86 @@ class HashRingTestCase(base.TestCase):
                           ring.get_hosts,
                           None)
 
+    def test_get_hosts_many(self):
+        hosts = ['foo', 'bar', 'baz']
+        data = ['fake', 'fake-again', 'another']
+        for replicas in (1, 2, 3):
+            ring = hash_ring.HashRing(hosts, replicas=replicas)
+            self.assertEqual([ring.get_hosts(d) for d in data],
+                             ring.get_hosts_many(data))
+
+    def test_get_hosts_many_ignore_hosts(self):
+        hosts = ['foo', 'bar', 'baz']
+        data = ['fake', 'fake-again', 'another']
+        ring = hash_ring.HashRing(hosts, replicas=2)
+        self.assertEqual(
+            [ring.get_hosts(d, ignore_hosts=['foo']) for d in data],
+            ring.get_hosts_many(data, ignore_hosts=['foo']))
+        self.assertEqual([[], [], []],
+                         ring.get_hosts_many(data, ignore_hosts=hosts))
+
+    def test_get_hosts_many_empty(self):
+        ring = hash_ring.HashRing(['foo', 'bar'])
+        self.assertEqual([], ring.get_hosts_many([]))
+
+    def test_get_hosts_many_invalid_data(self):
+        ring = hash_ring.HashRing(['foo', 'bar'])
+        self.assertRaises(exception.Invalid,
+                          ring.get_hosts_many,
+                          ['fake', None])
+
+    def test_get_hash_bucket(self):
+        data = 'fake-again'
+        expected = int(hashlib.md5(data.encode('utf-8')).hexdigest()[:8],
+                       16) >> 1
+        self.assertEqual(expected, hash_ring.get_hash_bucket(data))
+        self.assertLess(hash_ring.get_hash_bucket(data),
+                        2 ** hash_ring.HASH_BUCKET_BITS)
+
+    def _assert_buckets_in_ranges(self, ring):
+        ranges = dict((host, ring.get_bucket_ranges(host))
+                      for host in ring.hosts)
+        for i in range(500):
+            data = str(i)
+            bucket = hash_ring.get_hash_bucket(data)
+            for host in ring.get_hosts(data):
+                self.assertTrue(
+                    any(first <= bucket <= last
+                        for first, last in ranges[host]),
+                    '%s (%d) not in ranges of %s' % (data, bucket, host))
+        return ranges
+
+    def test_get_bucket_ranges(self):
+        ring = hash_ring.HashRing(['foo', 'bar', 'baz'], replicas=1)
+        ranges = self._assert_buckets_in_ranges(ring)
+        covered = sum(last - first + 1
+                      for host_ranges in ranges.values()
+                      for first, last in host_ranges)
+        # Buckets on partition boundaries are served by both hosts
+        self.assertGreaterEqual(covered, 2 ** hash_ring.HASH_BUCKET_BITS)
+        self.assertLess(covered, 2 ** hash_ring.HASH_BUCKET_BITS +
+                        len(ring._partitions))
+        for host_ranges in ranges.values():
+            self.assertEqual(sorted(host_ranges), host_ranges)
+
+    def test_get_bucket_ranges_replicas(self):
+        ring = hash_ring.HashRing(['foo', 'bar', 'baz'], replicas=2)
+        self._assert_buckets_in_ranges(ring)
+
+    def test_get_bucket_ranges_single_host(self):
+        ring = hash_ring.HashRing(['foo'])
+        self.assertEqual([(0, 2 ** hash_ring.HASH_BUCKET_BITS - 1)],
+                         ring.get_bucket_ranges('foo'))
+
+    def test_get_bucket_ranges_unknown_host(self):
+        ring = hash_ring.HashRing(['foo', 'bar'])
+        self.assertEqual([], ring.get_bucket_ranges('baz'))
+
+    def test_get_bucket_ranges_cached(self):
+        ring = hash_ring.HashRing(['foo', 'bar'])
+        self.assertIs(ring.get_bucket_ranges('foo'),
+                      ring.get_bucket_ranges('foo'))
+
 
 class HashRingManagerTestCase(db_base.DbTestCase):
 
@@ -261,3 +341,46 @@ class HashRingManagerTestCase(db_base.DbTestCase):
         self.register_conductors()
         self.ring_manager.updated_at = time.time() - 31
         self.ring_manager.__getitem__('driver1')
+
+    def test_hash_ring_manager_refresh_keeps_unchanged_rings(self):
+        self.register_conductors()
+        ring1 = self.ring_manager['driver1']
+        ring2 = self.ring_manager['driver2']
+        self.dbapi.register_conductor({
+            'hostname': 'host3',
+            'drivers': ['driver2'],
+        })
+        self.ring_manager.refresh()
+        self.assertIs(ring1, self.ring_manager['driver1'])
+        new_ring2 = self.ring_manager['driver2']
+        self.assertIsNot(ring2, new_ring2)
+        self.assertEqual(set(['host1', 'host3']), new_ring2.hosts)
+
+    def test_hash_ring_manager_refresh_rebuilds_on_config_change(self):
+        self.register_conductors()
+        ring = self.ring_manager['driver1']
+        CONF.set_override('hash_partition_exponent', 2)
+        self.ring_manager.refresh()
+        new_ring = self.ring_manager['driver1']
+        self.assertIsNot(ring, new_ring)
+        self.assertEqual(2 ** 2 * 2, len(new_ring._partitions))
+
+    def test_hash_ring_manager_refresh_interval(self):
+        self.register_conductors()
+        self.ring_manager['driver1']
+        with mock.patch.object(self.dbapi, 'get_active_driver_dict',
+                               autospec=True) as get_dict_mock:
+            self.ring_manager.refresh(interval=30)
+            self.assertFalse(get_dict_mock.called)
+
+            self.ring_manager.__class__.updated_at = time.time() - 31
+            get_dict_mock.return_value = {'driver1': set(['host1'])}
+            self.ring_manager.refresh(interval=30)
+            get_dict_mock.assert_called_once_with()
+        self.assertEqual(set(['host1']), self.ring_manager['driver1'].hosts)
+
+    def test_hash_ring_manager_shared_updated_at(self):
+        self.register_conductors()
+        self.ring_manager['driver1']
+        other = hash_ring.HashRingManager()
+        self.assertEqual(self.ring_manager.updated_at, other.updated_at)
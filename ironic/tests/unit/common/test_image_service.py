@@ -11,21 +11,29 @@
 #    under the License.
 
 import datetime
+import hashlib
 import os
 import shutil
+import tempfile
+import threading
 
+import eventlet
 import mock
 from oslo_config import cfg
 import requests
 import sendfile
 import six
+from six.moves import BaseHTTPServer
 import six.moves.builtins as __builtin__
 from six.moves import http_client
+from six.moves import socketserver
 
 from ironic.common import exception
 from ironic.common.glance_service.v1 import image_service as glance_v1_service
 from ironic.common import image_service
+from ironic.common import images
 from ironic.common import keystone
+from ironic.common import utils
 from ironic.tests import base
 
 if six.PY3:
@@ -33,6 +41,77 @@ if six.PY3:
     file = io.BytesIO
 
 
+class FakeHttpServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local HTTP server serving one image, used to test downloads.
+
+    :param data: the content of the image.
+    :param accept_ranges: whether range requests are supported.
+    :param drop_after: if set, the number of bytes sent before closing the
+        connection, for the first request of each range.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, data, accept_ranges=True, drop_after=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           FakeHttpHandler)
+        self.data = data
+        self.accept_ranges = accept_ranges
+        self.drop_after = drop_after
+        self.dropped = set()
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/image' % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeHttpHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _send_headers(self, code, length, content_range=None):
+        self.send_response(code)
+        self.send_header('Content-Length', str(length))
+        if self.server.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.server.requests.append(('HEAD', None))
+        self._send_headers(http_client.OK, len(self.server.data))
+
+    def do_GET(self):
+        data = self.server.data
+        header = self.headers.get('Range')
+        self.server.requests.append(('GET', header))
+        if header and self.server.accept_ranges:
+            start, end = [int(x) for x in header[6:].split('-')]
+            body = data[start:end + 1]
+            self._send_headers(http_client.PARTIAL_CONTENT, len(body),
+                               'bytes %d-%d/%d' % (start, end, len(data)))
+            if (self.server.drop_after is not None and
+                    end not in self.server.dropped):
+                self.server.dropped.add(end)
+                body = body[:self.server.drop_after]
+        else:
+            body = data
+            self._send_headers(http_client.OK, len(body))
+        self.wfile.write(body)
+
+
 class HttpImageServiceTestCase(base.TestCase):
     def setUp(self):
         super(HttpImageServiceTestCase, self).setUp()
@@ -133,6 +212,119 @@ class HttpImageServiceTestCase(base.TestCase):
                           self.service.download, self.href, file_mock)
         req_get_mock.assert_called_once_with(self.href, stream=True)
 
+    def _download_from_server(self, server, image_file=None):
+        server.start()
+        self.addCleanup(server.stop)
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'image')
+        with open(path, 'wb') as f:
+            self.service.download(server.url, image_file or f)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _get_ranges(self, server):
+        return sorted(r for method, r in server.requests
+                      if method == 'GET' and r)
+
+    def test_download_ranges(self):
+        self.config(http_download_segments=3,
+                    http_download_min_segment_size=1)
+        data = os.urandom(3 * 1024 * 1024 + 5)
+        server = FakeHttpServer(data)
+        self.assertEqual(data, self._download_from_server(server))
+        self.assertEqual(['bytes=0-1048576', 'bytes=1048577-2097154',
+                          'bytes=2097155-3145732'], self._get_ranges(server))
+        self.assertIn(('HEAD', None), server.requests)
+
+    def test_download_ranges_small_image(self):
+        self.config(http_download_segments=3,
+                    http_download_min_segment_size=1)
+        data = b'Mary had a little lamb, its fleece as white as snow'
+        server = FakeHttpServer(data)
+        self.assertEqual(data, self._download_from_server(server))
+        self.assertEqual(['bytes=0-%d' % (len(data) - 1)],
+                         self._get_ranges(server))
+
+    def test_download_ranges_resume(self):
+        self.config(http_download_segments=2,
+                    http_download_min_segment_size=1,
+                    http_download_retries=1)
+        data = os.urandom(2 * 1024 * 1024)
+        server = FakeHttpServer(data, drop_after=1000)
+        self.assertEqual(data, self._download_from_server(server))
+        self.assertEqual(['bytes=0-1048575', 'bytes=1000-1048575',
+                          'bytes=1048576-2097151', 'bytes=1049576-2097151'],
+                         self._get_ranges(server))
+
+    def test_download_ranges_resume_fail(self):
+        self.config(http_download_segments=2,
+                    http_download_min_segment_size=1)
+        data = os.urandom(2 * 1024 * 1024)
+        server = FakeHttpServer(data, drop_after=1000)
+        self.assertRaises(exception.ImageDownloadFailed,
+                          self._download_from_server, server)
+
+    def test_download_ranges_unsupported(self):
+        self.config(http_download_segments=3,
+                    http_download_retries=1)
+        data = b'Mary had a little lamb, its fleece as white as snow'
+        server = FakeHttpServer(data, accept_ranges=False)
+        self.assertEqual(data, self._download_from_server(server))
+        self.assertEqual([('HEAD', None), ('GET', None)], server.requests)
+
+    def test_download_ranges_hashing_writer(self):
+        self.config(http_download_segments=2,
+                    http_download_min_segment_size=1)
+        data = os.urandom(2 * 1024 * 1024)
+        server = FakeHttpServer(data)
+        server.start()
+        self.addCleanup(server.stop)
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'image')
+        with open(path, 'wb') as image_file:
+            writer = images.ImageWriter(utils.HashingWriter(image_file))
+            self.service.download(server.url, writer)
+        with open(path, 'rb') as image_file:
+            self.assertEqual(data, image_file.read())
+        # The ranges are written to the plain file, and the writers are
+        # updated from it
+        self.assertEqual(['bytes=0-1048575', 'bytes=1048576-2097151'],
+                         self._get_ranges(server))
+        self.assertEqual(hashlib.md5(data).hexdigest(), writer.hexdigest())
+        self.assertEqual(data[:images.IMAGE_FORMAT_HEADER_SIZE],
+                         writer._header)
+
+    def test_download_ranges_open_fails(self):
+        self.config(http_download_segments=2,
+                    http_download_min_segment_size=1)
+        data = os.urandom(2 * 1024 * 1024)
+        server = FakeHttpServer(data)
+        with mock.patch.object(image_service, 'open', create=True,
+                               side_effect=IOError('boom')):
+            self.assertRaises(exception.ImageDownloadFailed,
+                              self._download_from_server, server)
+
+    @mock.patch.object(image_service.HttpImageService, '_download_range',
+                       autospec=True)
+    def test_download_ranges_kills_on_error(self, mock_range):
+        self.config(http_download_segments=2,
+                    http_download_min_segment_size=1)
+        finished = []
+
+        def download_range(service, image_href, path, start, end):
+            if start == 0:
+                raise RuntimeError('boom')
+            eventlet.sleep(1)
+            finished.append(start)
+
+        mock_range.side_effect = download_range
+        server = FakeHttpServer(os.urandom(2 * 1024 * 1024))
+        self.assertRaises(RuntimeError, self._download_from_server, server)
+        eventlet.sleep(1.5)
+        self.assertEqual([], finished)
+
 
 class FileImageServiceTestCase(base.TestCase):
     def setUp(self):
@@ -17,9 +17,9 @@
 
 import os
 import shutil
+import tempfile
 
 from ironic_lib import disk_utils
-from ironic_lib import utils as ironic_utils
 import mock
 from oslo_concurrency import processutils
 from oslo_config import cfg
@@ -27,6 +27,7 @@ import six
 import six.moves.builtins as __builtin__
 
 from ironic.common import exception
+from ironic.common import fat
 from ironic.common.glance_service import service_utils as glance_utils
 from ironic.common import image_service
 from ironic.common import images
@@ -45,37 +46,113 @@ class IronicImagesTestCase(base.TestCase):
     class FakeImgInfo(object):
         pass
 
+    @mock.patch.object(images.ImageWriter, 'detect_format', autospec=True)
     @mock.patch.object(image_service, 'get_image_service', autospec=True)
     @mock.patch.object(__builtin__, 'open', autospec=True)
-    def test_fetch_image_service(self, open_mock, image_service_mock):
+    def test_fetch_image_service(self, open_mock, image_service_mock,
+                                 detect_mock):
         mock_file_handle = mock.MagicMock(spec=file)
         mock_file_handle.__enter__.return_value = 'file'
         open_mock.return_value = mock_file_handle
+        detect_mock.return_value = 'qcow2'
 
-        images.fetch('context', 'image_href', 'path')
+        self.assertEqual('qcow2', images.fetch('context', 'image_href',
+                                               'path'))
 
         open_mock.assert_called_once_with('path', 'wb')
         image_service_mock.assert_called_once_with('image_href',
                                                    context='context')
-        image_service_mock.return_value.download.assert_called_once_with(
-            'image_href', 'file')
-
+        download_mock = image_service_mock.return_value.download
+        download_mock.assert_called_once_with('image_href', mock.ANY)
+        writer = download_mock.call_args[0][1]
+        self.assertIsInstance(writer, images.ImageWriter)
+        self.assertEqual('file', writer._file)
+        detect_mock.assert_called_once_with(writer, 'path')
+
+    @mock.patch.object(images.ImageWriter, 'detect_format', autospec=True)
     @mock.patch.object(image_service, 'get_image_service', autospec=True)
     @mock.patch.object(images, 'image_to_raw', autospec=True)
     @mock.patch.object(__builtin__, 'open', autospec=True)
     def test_fetch_image_service_force_raw(self, open_mock, image_to_raw_mock,
-                                           image_service_mock):
+                                           image_service_mock, detect_mock):
         mock_file_handle = mock.MagicMock(spec=file)
         mock_file_handle.__enter__.return_value = 'file'
         open_mock.return_value = mock_file_handle
+        detect_mock.return_value = 'qcow2'
 
         images.fetch('context', 'image_href', 'path', force_raw=True)
 
-        open_mock.assert_called_once_with('path', 'wb')
+        open_mock.assert_called_once_with('path.part', 'wb')
         image_service_mock.return_value.download.assert_called_once_with(
-            'image_href', 'file')
+            'image_href', mock.ANY)
+        detect_mock.assert_called_once_with(mock.ANY, 'path.part')
         image_to_raw_mock.assert_called_once_with(
-            'image_href', 'path', 'path.part')
+            'image_href', 'path', 'path.part', image_format='qcow2')
+
+    def test_fetch_real_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'image')
+
+        class FakeImageService(object):
+            def download(self, image_href, image_file):
+                image_file.write(b'QFI\xfb')
+                image_file.write(b'\0' * 1000)
+
+        with mock.patch.object(image_service, 'get_image_service',
+                               return_value=FakeImageService(),
+                               autospec=True):
+            self.assertEqual('qcow2', images.fetch('context', 'image_href',
+                                                   path))
+        self.assertEqual(1004, os.path.getsize(path))
+
+    def test_detect_image_format(self):
+        self.assertEqual('qcow2',
+                         images.detect_image_format(b'QFI\xfb\0\0\0\x03'))
+        self.assertEqual('vdi', images.detect_image_format(
+            b'<<< Oracle VM VirtualBox Disk Image >>>\n'.ljust(0x40, b'\0') +
+            b'\x7f\x10\xda\xbe'))
+        self.assertEqual('raw', images.detect_image_format(
+            b'\xeb\x63\x90'.ljust(510, b'\0') + b'\x55\xaa'))
+        # e.g. dmg, only identified by its trailer
+        self.assertIsNone(images.detect_image_format(b'\x78\xda\x63\x60'))
+        self.assertIsNone(images.detect_image_format(b''))
+
+    def test_image_writer(self):
+        image_file = mock.Mock(spec=['write', 'fileno'])
+        writer = images.ImageWriter(image_file)
+        writer.write(b'QFI')
+        writer.write(b'\xfb' + b'\0' * 1000)
+
+        image_file.write.assert_has_calls(
+            [mock.call(b'QFI'), mock.call(b'\xfb' + b'\0' * 1000)])
+        self.assertEqual(image_file.fileno, writer.fileno)
+        self.assertEqual(images.IMAGE_FORMAT_HEADER_SIZE, len(writer._header))
+        with mock.patch.object(__builtin__, 'open',
+                               autospec=True) as open_mock:
+            self.assertEqual('qcow2', writer.detect_format('path'))
+            self.assertFalse(open_mock.called)
+
+    def test_image_writer_data_not_written(self):
+        # e.g. sendfile() was used
+        tmp_file = tempfile.NamedTemporaryFile()
+        self.addCleanup(tmp_file.close)
+        tmp_file.write(b'vhdxfile')
+        tmp_file.flush()
+        writer = images.ImageWriter(mock.Mock())
+        self.assertEqual('vhdx', writer.detect_format(tmp_file.name))
+
+    def test_image_writer_written_directly(self):
+        tmp_file = tempfile.NamedTemporaryFile()
+        self.addCleanup(tmp_file.close)
+        writer = images.ImageWriter(tmp_file)
+        writer.write(b'QFI\xfb')
+        writer.flush()
+        with open(tmp_file.name, 'wb') as other_file:
+            other_file.write(b'vhdxfile')
+        writer.written_directly()
+        self.assertEqual(b'vhdxfile', writer._header)
+        self.assertEqual('vhdx', writer.detect_format(tmp_file.name))
 
     @mock.patch.object(disk_utils, 'qemu_img_info', autospec=True)
     def test_image_to_raw_no_file_format(self, qemu_img_info_mock):
@@ -159,6 +236,31 @@ class IronicImagesTestCase(base.TestCase):
         qemu_img_info_mock.assert_called_once_with('path_tmp')
         rename_mock.assert_called_once_with('path_tmp', 'path')
 
+    @mock.patch.object(os, 'rename', autospec=True)
+    @mock.patch.object(disk_utils, 'qemu_img_info', autospec=True)
+    def test_image_to_raw_known_raw_format(self, qemu_img_info_mock,
+                                           rename_mock):
+        images.image_to_raw('image_href', 'path', 'path_tmp',
+                            image_format='raw')
+
+        self.assertFalse(qemu_img_info_mock.called)
+        rename_mock.assert_called_once_with('path_tmp', 'path')
+
+    @mock.patch.object(os, 'rename', autospec=True)
+    @mock.patch.object(disk_utils, 'qemu_img_info', autospec=True)
+    def test_image_to_raw_known_other_format(self, qemu_img_info_mock,
+                                             rename_mock):
+        info = self.FakeImgInfo()
+        info.file_format = 'qcow2'
+        info.backing_file = 'backing_file'
+        qemu_img_info_mock.return_value = info
+
+        self.assertRaises(exception.ImageUnacceptable, images.image_to_raw,
+                          'image_href', 'path', 'path_tmp',
+                          image_format='qcow2')
+        qemu_img_info_mock.assert_called_once_with('path_tmp')
+        self.assertFalse(rename_mock.called)
+
     @mock.patch.object(image_service, 'get_image_service', autospec=True)
     def test_image_show_no_image_service(self, image_service_mock):
         images.image_show('context', 'image_href')
@@ -282,101 +384,55 @@ class FsImageTestCase(base.TestCase):
         dirname_mock.assert_any_call('root_dir/sub_dir/b3')
         mkdir_mock.assert_called_once_with('root_dir/sub_dir')
 
-    @mock.patch.object(images, '_create_root_fs', autospec=True)
-    @mock.patch.object(utils, 'tempdir', autospec=True)
-    @mock.patch.object(utils, 'write_to_file', autospec=True)
-    @mock.patch.object(ironic_utils, 'dd', autospec=True)
-    @mock.patch.object(utils, 'umount', autospec=True)
-    @mock.patch.object(utils, 'mount', autospec=True)
-    @mock.patch.object(ironic_utils, 'mkfs', autospec=True)
-    def test_create_vfat_image(
-            self, mkfs_mock, mount_mock, umount_mock, dd_mock, write_mock,
-            tempdir_mock, create_root_fs_mock):
-
-        mock_file_handle = mock.MagicMock(spec=file)
-        mock_file_handle.__enter__.return_value = 'tempdir'
-        tempdir_mock.return_value = mock_file_handle
-
+    @mock.patch.object(fat, 'FatImage', autospec=True)
+    def test_create_vfat_image(self, fat_image_mock):
         parameters = {'p1': 'v1'}
         files_info = {'a': 'b'}
         images.create_vfat_image('tgt_file', parameters=parameters,
                                  files_info=files_info, parameters_file='qwe',
                                  fs_size_kib=1000)
 
-        dd_mock.assert_called_once_with('/dev/zero',
-                                        'tgt_file',
-                                        'count=1',
-                                        'bs=1000KiB')
+        fat_image_mock.assert_called_once_with(1000, label="ir-vfd-dev")
+        image = fat_image_mock.return_value
+        image.add_file.assert_called_once_with('b', 'a')
+        image.add_data.assert_called_once_with('qwe', 'p1=v1')
+        image.write_to_file.assert_called_once_with('tgt_file')
 
-        mkfs_mock.assert_called_once_with('vfat', 'tgt_file',
-                                          label="ir-vfd-dev")
-        mount_mock.assert_called_once_with('tgt_file', 'tempdir',
-                                           '-o', 'umask=0')
+    @mock.patch.object(fat, 'FatImage', autospec=True)
+    def test_create_vfat_image_no_files(self, fat_image_mock):
+        images.create_vfat_image('tgt_file')
 
-        parameters_file_path = os.path.join('tempdir', 'qwe')
-        write_mock.assert_called_once_with(parameters_file_path, 'p1=v1')
-        create_root_fs_mock.assert_called_once_with('tempdir', files_info)
-        umount_mock.assert_called_once_with('tempdir')
+        image = fat_image_mock.return_value
+        self.assertFalse(image.add_file.called)
+        self.assertFalse(image.add_data.called)
+        image.write_to_file.assert_called_once_with('tgt_file')
 
-    @mock.patch.object(images, '_create_root_fs', autospec=True)
-    @mock.patch.object(utils, 'tempdir', autospec=True)
-    @mock.patch.object(ironic_utils, 'dd', autospec=True)
-    @mock.patch.object(utils, 'umount', autospec=True)
-    @mock.patch.object(utils, 'mount', autospec=True)
-    @mock.patch.object(ironic_utils, 'mkfs', autospec=True)
-    def test_create_vfat_image_always_umount(
-            self, mkfs_mock, mount_mock, umount_mock, dd_mock,
-            tempdir_mock, create_root_fs_mock):
-
-        mock_file_handle = mock.MagicMock(spec=file)
-        mock_file_handle.__enter__.return_value = 'tempdir'
-        tempdir_mock.return_value = mock_file_handle
-        files_info = {'a': 'b'}
-        create_root_fs_mock.side_effect = OSError()
+    @mock.patch.object(fat, 'FatImage', autospec=True)
+    def test_create_vfat_image_too_small(self, fat_image_mock):
+        fat_image_mock.return_value.write_to_file.side_effect = ValueError()
         self.assertRaises(exception.ImageCreationFailed,
                           images.create_vfat_image, 'tgt_file',
-                          files_info=files_info)
-
-        umount_mock.assert_called_once_with('tempdir')
-
-    @mock.patch.object(ironic_utils, 'dd', autospec=True)
-    def test_create_vfat_image_dd_fails(self, dd_mock):
-
-        dd_mock.side_effect = processutils.ProcessExecutionError
-        self.assertRaises(exception.ImageCreationFailed,
-                          images.create_vfat_image, 'tgt_file')
-
-    @mock.patch.object(utils, 'tempdir', autospec=True)
-    @mock.patch.object(ironic_utils, 'dd', autospec=True)
-    @mock.patch.object(ironic_utils, 'mkfs', autospec=True)
-    def test_create_vfat_image_mkfs_fails(self, mkfs_mock, dd_mock,
-                                          tempdir_mock):
-
-        mock_file_handle = mock.MagicMock(spec=file)
-        mock_file_handle.__enter__.return_value = 'tempdir'
-        tempdir_mock.return_value = mock_file_handle
+                          parameters={'p1': 'v1'})
 
-        mkfs_mock.side_effect = processutils.ProcessExecutionError
+    @mock.patch.object(fat, 'FatImage', autospec=True)
+    def test_create_vfat_image_write_fails(self, fat_image_mock):
+        fat_image_mock.return_value.write_to_file.side_effect = IOError()
         self.assertRaises(exception.ImageCreationFailed,
-                          images.create_vfat_image, 'tgt_file')
+                          images.create_vfat_image, 'tgt_file',
+                          files_info={'a': 'b'})
 
-    @mock.patch.object(images, '_create_root_fs', autospec=True)
-    @mock.patch.object(utils, 'tempdir', autospec=True)
-    @mock.patch.object(ironic_utils, 'dd', autospec=True)
-    @mock.patch.object(utils, 'umount', autospec=True)
-    @mock.patch.object(utils, 'mount', autospec=True)
-    @mock.patch.object(ironic_utils, 'mkfs', autospec=True)
-    def test_create_vfat_image_umount_fails(
-            self, mkfs_mock, mount_mock, umount_mock, dd_mock,
-            tempdir_mock, create_root_fs_mock):
+    def test_create_vfat_image_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        output_file = os.path.join(tmpdir, 'image')
 
-        mock_file_handle = mock.MagicMock(spec=file)
-        mock_file_handle.__enter__.return_value = 'tempdir'
-        tempdir_mock.return_value = mock_file_handle
-        umount_mock.side_effect = processutils.ProcessExecutionError
+        images.create_vfat_image(output_file, parameters={'p1': 'v1'})
 
-        self.assertRaises(exception.ImageCreationFailed,
-                          images.create_vfat_image, 'tgt_file')
+        with open(output_file, 'rb') as f:
+            data = f.read()
+        self.assertEqual(100 * 1024, len(data))
+        self.assertEqual(b'ir-vfd-dev ', data[43:54])
+        self.assertIn(b'p1=v1', data)
 
     @mock.patch.object(utils, 'umount', autospec=True)
     def test__umount_without_raise(self, umount_mock):
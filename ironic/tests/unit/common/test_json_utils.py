@@ -0,0 +1,54 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+import mock
+from oslo_utils import importutils
+
+from ironic.common import json_utils
+from ironic.tests import base
+
+
+@mock.patch.dict(json_utils._DECODERS, {'json': json.loads}, clear=True)
+class JsonUtilsTestCase(base.TestCase):
+
+    def test_loads(self):
+        self.assertEqual({'foo': [1, 2]}, json_utils.loads('{"foo": [1, 2]}'))
+
+    @mock.patch.object(importutils, 'try_import', autospec=True)
+    def test_loads_codec(self, mock_import):
+        self.config(json_codec='ujson', group='database')
+        mock_import.return_value.loads.return_value = {'foo': 'bar'}
+
+        self.assertEqual({'foo': 'bar'}, json_utils.loads('{"foo": "bar"}'))
+        self.assertEqual({'foo': 'bar'}, json_utils.loads('{"foo": "bar"}'))
+        mock_import.assert_called_once_with('ujson')
+        self.assertEqual(
+            [mock.call('{"foo": "bar"}')] * 2,
+            mock_import.return_value.loads.call_args_list)
+
+    @mock.patch.object(json_utils.LOG, 'warning', autospec=True)
+    @mock.patch.object(importutils, 'try_import', autospec=True)
+    def test_loads_codec_not_installed(self, mock_import, mock_log):
+        self.config(json_codec='simplejson', group='database')
+        mock_import.return_value = None
+
+        self.assertEqual({'foo': 'bar'}, json_utils.loads('{"foo": "bar"}'))
+        self.assertEqual({'foo': 'bar'}, json_utils.loads('{"foo": "bar"}'))
+        mock_import.assert_called_once_with('simplejson')
+        self.assertEqual(1, mock_log.call_count)
+
+    def test_encoded_json(self):
+        encoded = json_utils.EncodedJson('{"foo": "bar"}')
+        self.assertEqual({'foo': 'bar'}, encoded.decode())
+        self.assertEqual('{"foo": "bar"}', encoded.text)
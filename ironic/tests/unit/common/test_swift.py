@@ -172,6 +172,35 @@ class SwiftTestCase(base.TestCase):
                                                                 'object')
         self.assertEqual(expected_head_result, actual_head_result)
 
+    def test_copy_object(self, connection_mock):
+        swiftapi = swift.SwiftAPI()
+        connection_obj_mock = connection_mock.return_value
+        swiftapi.copy_object('container', 'source', 'destination',
+                             object_headers={'X-Delete-After': 10})
+        connection_obj_mock.put_object.assert_called_once_with(
+            'container', 'destination', None, content_length=0,
+            headers={'X-Delete-After': 10,
+                     'X-Copy-From': '/container/source'})
+
+    def test_copy_object_exc_resource_not_found(self, connection_mock):
+        swiftapi = swift.SwiftAPI()
+        exc = swift_exception.ClientException(
+            "Resource not found", http_status=http_client.NOT_FOUND)
+        connection_obj_mock = connection_mock.return_value
+        connection_obj_mock.put_object.side_effect = exc
+        self.assertRaises(exception.SwiftObjectNotFoundError,
+                          swiftapi.copy_object, 'container', 'source',
+                          'destination')
+
+    def test_copy_object_exc(self, connection_mock):
+        swiftapi = swift.SwiftAPI()
+        exc = swift_exception.ClientException("Operation error")
+        connection_obj_mock = connection_mock.return_value
+        connection_obj_mock.put_object.side_effect = exc
+        self.assertRaises(exception.SwiftOperationError,
+                          swiftapi.copy_object, 'container', 'source',
+                          'destination')
+
     def test_update_object_meta(self, connection_mock):
         swiftapi = swift.SwiftAPI()
         connection_obj_mock = connection_mock.return_value
@@ -324,6 +324,72 @@ class GenericUtilsTestCase(base.TestCase):
         self.assertRaises(exception.InvalidParameterValue, utils.hash_file,
                           file_like_object, 'hickory-dickory-dock')
 
+    def test_hashing_writer(self):
+        # | GIVEN |
+        data = b'Mary had a little lamb, its fleece as white as snow'
+        file_like_object = six.BytesIO()
+        writer = utils.HashingWriter(file_like_object, ('md5', 'sha256'))
+        # | WHEN |
+        writer.write(data[:10])
+        writer.write(data[10:])
+        # | THEN |
+        self.assertEqual(data, file_like_object.getvalue())
+        self.assertEqual(len(data), writer.size)
+        self.assertEqual(hashlib.md5(data).hexdigest(), writer.hexdigest())
+        self.assertEqual(hashlib.sha256(data).hexdigest(),
+                         writer.hexdigest('sha256'))
+
+    @mock.patch.object(utils, 'hash_file', autospec=True)
+    def test_hashing_writer_does_not_read_file(self, hash_file_mock):
+        # | GIVEN |
+        data = b'Mary had a little lamb, its fleece as white as snow'
+        with tempfile.NamedTemporaryFile() as f:
+            writer = utils.HashingWriter(f)
+            # | WHEN |
+            writer.write(data)
+            writer.flush()
+            actual = writer.hexdigest(path=f.name)
+        # | THEN |
+        self.assertEqual(hashlib.md5(data).hexdigest(), actual)
+        self.assertFalse(hash_file_mock.called)
+
+    def test_hashing_writer_reads_file_written_directly(self):
+        # | GIVEN |
+        data = b'Mary had a little lamb, its fleece as white as snow'
+        with tempfile.NamedTemporaryFile() as f:
+            writer = utils.HashingWriter(f)
+            # | WHEN |
+            # Bypass write(), like sendfile does
+            os.write(writer.fileno(), data)
+            actual = writer.hexdigest(path=writer.name)
+        # | THEN |
+        self.assertEqual(0, writer.size)
+        self.assertEqual(hashlib.md5(data).hexdigest(), actual)
+
+    def test_hashing_writer_written_directly(self):
+        # | GIVEN |
+        data = b'Mary had a little lamb, its fleece as white as snow'
+        with tempfile.NamedTemporaryFile() as f:
+            writer = utils.HashingWriter(utils.FileWrapper(f),
+                                         ('md5', 'sha256'))
+            writer.write(b'garbage')
+            writer.flush()
+            # | WHEN |
+            with open(f.name, 'wb') as other_file:
+                other_file.write(data)
+            writer.written_directly()
+        # | THEN |
+        self.assertIs(f, writer.wrapped_file)
+        self.assertEqual(len(data), writer.size)
+        self.assertEqual(hashlib.md5(data).hexdigest(), writer.hexdigest())
+        self.assertEqual(hashlib.sha256(data).hexdigest(),
+                         writer.hexdigest('sha256'))
+
+    def test_hashing_writer_throws_for_invalid_or_unsupported_hash(self):
+        self.assertRaises(exception.InvalidParameterValue,
+                          utils.HashingWriter, six.BytesIO(),
+                          ('hickory-dickory-dock',))
+
     def test_is_valid_boolstr(self):
         self.assertTrue(utils.is_valid_boolstr('true'))
         self.assertTrue(utils.is_valid_boolstr('false'))
@@ -86,8 +86,9 @@ class CommonMixIn(object):
         if node is None:
             node = self._create_node(**node_attrs)
         task = mock.Mock(spec_set=['node', 'release_resources',
-                                   'spawn_after', 'process_event'])
+                                   'spawn_after', 'process_event', 'shared'])
         task.node = node
+        task.shared = True
         return task
 
     def _get_nodeinfo_list_response(self, nodes=None):
@@ -97,6 +98,23 @@ class CommonMixIn(object):
             nodes = [nodes]
         return [tuple(getattr(n, c) for c in self.columns) for n in nodes]
 
+    @staticmethod
+    def _node_matches_filters(node, filters):
+        filters = filters or {}
+        if ('maintenance' in filters and
+                node.maintenance != filters['maintenance']):
+            return False
+        if ('provision_state' in filters and
+                node.provision_state != filters['provision_state']):
+            return False
+        if (node.provision_state in
+                filters.get('provision_state_not_in', ())):
+            return False
+        if ('target_power_state' in filters and
+                node.target_power_state != filters['target_power_state']):
+            return False
+        return True
+
     def _get_acquire_side_effect(self, task_infos):
         """Helper method to generate a task_manager.acquire() side effect.
 
@@ -136,11 +154,18 @@ class CommonMixIn(object):
                 # node_id so we can assert we're returning the correct node
                 # in __enter__().
                 fa_self.node_id = node_id
+                fa_self.filters = kwargs.get('filters')
 
             def __enter__(fa_self):
                 task = tasks.pop(0)
                 if isinstance(task, Exception):
                     raise task
+                # NOTE: emulate the database checking the filters passed to
+                # acquire()
+                if not self._node_matches_filters(task.node, fa_self.filters):
+                    exit_exceptions.pop(0)
+                    raise exception.NodeFilterMismatch(
+                        node=task.node.uuid, filters=fa_self.filters)
                 # NOTE(comstud): Not ideal to throw this into
                 # a helper, however it's the cleanest way
                 # to verify we're dealing with the correct task/node.
@@ -157,6 +182,68 @@ class CommonMixIn(object):
 
         return FakeAcquire
 
+    def _get_acquire_many_side_effect(self, task_infos):
+        """Helper method to generate a task_manager.acquire_many() side effect.
+
+        This accepts the same task_infos as _get_acquire_side_effect(), one
+        for each node requested from acquire_many(), in order. A task which
+        is an exception, e.g. NodeLocked, or whose node does not match the
+        filters, emulates a node which is not reserved and is skipped.
+        The node ids of the reserved nodes which are not iterated over are
+        added to the released list of the returned class.
+        """
+        task_infos = self._get_task_infos(task_infos)
+
+        class FakeLockedTask(object):
+            def __init__(flt_self, task, exit_exception):
+                flt_self.task = task
+                flt_self.exit_exception = exit_exception
+
+            def __enter__(flt_self):
+                return flt_self.task
+
+            def __exit__(flt_self, exc_typ, exc_val, exc_tb):
+                if exc_typ is None and flt_self.exit_exception is not None:
+                    raise flt_self.exit_exception
+
+        class FakeTaskSet(object):
+            released = []
+
+            def __init__(fts_self, context, node_ids, *args, **kwargs):
+                filters = kwargs.get('filters')
+                fts_self.locked = []
+                for node_id in node_ids:
+                    task, exc = task_infos.pop(0)
+                    if (isinstance(task, Exception) or
+                            not self._node_matches_filters(task.node,
+                                                           filters)):
+                        continue
+                    if strutils.is_int_like(node_id):
+                        self.assertEqual(node_id, task.node.id)
+                    else:
+                        self.assertEqual(node_id, task.node.uuid)
+                    fts_self.locked.append(FakeLockedTask(task, exc))
+
+            def __iter__(fts_self):
+                while fts_self.locked:
+                    yield fts_self.locked.pop(0)
+
+            def __enter__(fts_self):
+                return fts_self
+
+            def __exit__(fts_self, exc_typ, exc_val, exc_tb):
+                FakeTaskSet.released.extend(
+                    locked.task.node.id for locked in fts_self.locked)
+
+        return FakeTaskSet
+
+    @staticmethod
+    def _get_task_infos(task_infos):
+        if not isinstance(task_infos, list):
+            task_infos = [task_infos]
+        return [task_info if isinstance(task_info, tuple)
+                else (task_info, None) for task_info in task_infos]
+
 
 class ServiceSetUpMixin(object):
     def setUp(self):
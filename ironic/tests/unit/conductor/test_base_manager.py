@@ -25,6 +25,7 @@ from ironic.common import exception
 from ironic.conductor import base_manager
 from ironic.conductor import manager
 from ironic.conductor import task_manager
+from ironic.drivers.modules import ipmitool_shell
 from ironic import objects
 from ironic.tests import base as tests_base
 from ironic.tests.unit.conductor import mgr_utils
@@ -170,6 +171,12 @@ class StartStopTestCase(mgr_utils.ServiceSetUpMixin, tests_db_base.DbTestCase):
         self.service.del_host()
         self.assertTrue(wait_mock.called)
 
+    @mock.patch.object(ipmitool_shell, 'close_all', autospec=True)
+    def test_del_host_closes_ipmitool_shell_sessions(self, close_all_mock):
+        self._start_service()
+        self.service.del_host()
+        close_all_mock.assert_called_once_with()
+
 
 class KeepAliveTestCase(mgr_utils.ServiceSetUpMixin, tests_db_base.DbTestCase):
     def test__conductor_service_record_keepalive(self):
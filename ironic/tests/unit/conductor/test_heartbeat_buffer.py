@@ -0,0 +1,125 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the buffer of agent heartbeats."""
+
+import datetime
+
+import mock
+
+from ironic.common import states
+from ironic.conductor import heartbeat_buffer
+from ironic import objects
+from ironic.tests.unit.db import base as db_base
+from ironic.tests.unit.objects import utils as obj_utils
+
+
+class HeartbeatBufferTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(HeartbeatBufferTestCase, self).setUp()
+        self.node = obj_utils.create_test_node(
+            self.context, provision_state=states.CLEANWAIT,
+            provision_updated_at=datetime.datetime(2000, 1, 1, 0, 0),
+            driver_internal_info={'agent_url': 'http://127.0.0.1:9999',
+                                  'clean_step_index': 1})
+
+    def test_record_and_flush(self):
+        heartbeat_buffer.record(self.node, last_heartbeat=1234)
+        heartbeat_buffer.record(self.node, touch_provisioning=True)
+        with mock.patch.object(objects.Node, 'update_agent_heartbeats',
+                               return_value=[]) as mock_update:
+            heartbeat_buffer.flush(self.context)
+            heartbeat_buffer.flush(self.context)
+
+        mock_update.assert_called_once_with(
+            self.context, {self.node.id: (1234, states.CLEANWAIT)})
+
+    def test_flush_writes_heartbeats(self):
+        heartbeat_buffer.record(self.node, last_heartbeat=1234,
+                                touch_provisioning=True)
+        heartbeat_buffer.flush(self.context)
+
+        self.node.refresh()
+        self.assertEqual({'agent_url': 'http://127.0.0.1:9999',
+                          'clean_step_index': 1,
+                          'agent_last_heartbeat': 1234},
+                         self.node.driver_internal_info)
+        self.assertGreater(self.node.provision_updated_at.replace(tzinfo=None),
+                           datetime.datetime(2000, 1, 1, 0, 0))
+
+    def test_flush_after_state_change(self):
+        heartbeat_buffer.record(self.node, touch_provisioning=True)
+        self.node.provision_state = states.CLEANING
+        self.node.save()
+        self.node.refresh()
+        provision_updated_at = self.node.provision_updated_at
+        heartbeat_buffer.flush(self.context)
+
+        self.node.refresh()
+        self.assertEqual(provision_updated_at, self.node.provision_updated_at)
+
+    def test_flush_keeps_reserved(self):
+        objects.Node.reserve(self.context, 'host', self.node.id)
+        heartbeat_buffer.record(self.node, last_heartbeat=1234,
+                                touch_provisioning=True)
+        heartbeat_buffer.flush(self.context)
+
+        self.node.refresh()
+        self.assertNotIn('agent_last_heartbeat',
+                         self.node.driver_internal_info)
+        self.assertGreater(self.node.provision_updated_at.replace(tzinfo=None),
+                           datetime.datetime(2000, 1, 1, 0, 0))
+
+        objects.Node.release(self.context, 'host', self.node.id)
+        with mock.patch.object(objects.Node, 'update_agent_heartbeats',
+                               return_value=[]) as mock_update:
+            heartbeat_buffer.flush(self.context)
+        # The provisioning is not marked as running again
+        mock_update.assert_called_once_with(
+            self.context, {self.node.id: (1234, None)})
+
+    def test_flush_keeps_newest_heartbeat(self):
+        heartbeat_buffer.record(self.node, last_heartbeat=1234)
+        # Saved directly meanwhile
+        self.node.driver_internal_info = dict(
+            self.node.driver_internal_info, agent_last_heartbeat=1240)
+        self.node.save()
+        heartbeat_buffer.flush(self.context)
+
+        self.node.refresh()
+        self.assertEqual(1240,
+                         self.node.driver_internal_info[
+                             'agent_last_heartbeat'])
+
+    @mock.patch.object(heartbeat_buffer.LOG, 'exception', autospec=True)
+    @mock.patch.object(objects.Node, 'update_agent_heartbeats')
+    def test_flush_fails(self, mock_update, mock_log):
+        mock_update.side_effect = [Exception('boom'), []]
+        heartbeat_buffer.record(self.node, last_heartbeat=1234)
+        heartbeat_buffer.flush(self.context)
+        heartbeat_buffer.record(self.node, touch_provisioning=True)
+        heartbeat_buffer.flush(self.context)
+
+        self.assertEqual(1, mock_log.call_count)
+        self.assertEqual(
+            [mock.call(self.context, {self.node.id: (1234, None)}),
+             mock.call(self.context,
+                       {self.node.id: (1234, states.CLEANWAIT)})],
+            mock_update.call_args_list)
+
+    @mock.patch.object(objects.Node, 'update_agent_heartbeats')
+    def test_reset(self, mock_update):
+        heartbeat_buffer.record(self.node, last_heartbeat=1234)
+        heartbeat_buffer.reset()
+        heartbeat_buffer.flush(self.context)
+        self.assertFalse(mock_update.called)
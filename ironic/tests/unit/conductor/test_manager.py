@@ -18,6 +18,7 @@
 
 """Test class for Ironic ManagerService."""
 
+import collections
 import datetime
 
 import eventlet
@@ -34,6 +35,7 @@ from ironic.common import exception
 from ironic.common import images
 from ironic.common import states
 from ironic.common import swift
+from ironic.conductor import heartbeat_buffer
 from ironic.conductor import manager
 from ironic.conductor import task_manager
 from ironic.conductor import utils as conductor_utils
@@ -1126,6 +1128,22 @@ class DoNodeDeployTearDownTestCase(mgr_utils.ServiceSetUpMixin,
     def test__check_cleanwait_timeouts_manual_clean(self):
         self._check_cleanwait_timeouts(manual=True)
 
+    def test__check_cleanwait_timeouts_pending_heartbeat(self):
+        self._start_service()
+        CONF.set_override('clean_callback_timeout', 1, group='conductor')
+        node = obj_utils.create_test_node(
+            self.context, driver='fake',
+            provision_state=states.CLEANWAIT,
+            target_provision_state=states.AVAILABLE,
+            provision_updated_at=datetime.datetime(2000, 1, 1, 0, 0))
+        heartbeat_buffer.record(node, touch_provisioning=True)
+
+        self.service._check_cleanwait_timeouts(self.context)
+        self._stop_service()
+        node.refresh()
+        self.assertEqual(states.CLEANWAIT, node.provision_state)
+        self.assertIsNone(node.last_error)
+
     def test_do_node_tear_down_invalid_state(self):
         self._start_service()
         # test node.provision_state is incorrect for tear_down
@@ -2384,6 +2402,53 @@ class MiscTestCase(mgr_utils.ServiceSetUpMixin, mgr_utils.CommonMixIn,
             'deploying', 'provision_updated_at',
             last_error=mock.ANY)
 
+    @mock.patch.object(manager.ConductorManager, '_mapped_to_this_conductor')
+    @mock.patch.object(dbapi.IMPL, 'get_nodeinfo_list')
+    def test_iter_nodes_filter_mapped_nodes_in_db(self, mock_nodeinfo_list,
+                                                  mock_mapped):
+        self.config(filter_mapped_nodes_in_db=True, group='conductor')
+        self.dbapi.register_conductor({'hostname': 'other-host',
+                                       'drivers': ['fake']})
+        self._start_service()
+        # ignore the calls made on start up
+        mock_nodeinfo_list.reset_mock()
+        mock_nodeinfo_list.return_value = [('uuid1', 'fake', 1),
+                                           ('uuid2', 'fake', 2)]
+        mock_mapped.side_effect = [True, False]
+
+        result = list(self.service.iter_nodes(fields=['id'],
+                                              filters={'maintenance': False}))
+        self.assertEqual([('uuid1', 'fake', 1)], result)
+        ring = self.service.ring_manager['fake']
+        mock_nodeinfo_list.assert_called_once_with(
+            columns=['uuid', 'driver', 'id'],
+            filters={'maintenance': False,
+                     'hash_bucket_ranges': {
+                         'fake': ring.get_bucket_ranges(self.hostname)}})
+        self.assertEqual(2, mock_mapped.call_count)
+
+    def test_iter_nodes_filter_mapped_nodes_in_db_real(self):
+        self.config(filter_mapped_nodes_in_db=True, group='conductor')
+        self.dbapi.register_conductor({'hostname': 'other-host',
+                                       'drivers': ['fake']})
+        self._start_service()
+        nodes = [obj_utils.create_test_node(
+            self.context, uuid=uuidutils.generate_uuid(), driver='fake')
+            for i in range(20)]
+        expected = [n.uuid for n in nodes
+                    if self.service._mapped_to_this_conductor(n.uuid, 'fake')]
+
+        result = [r[0] for r in self.service.iter_nodes()]
+        self.assertEqual(sorted(expected), sorted(result))
+
+    def test__get_mapped_bucket_ranges(self):
+        self.dbapi.register_conductor({'hostname': 'other-host',
+                                       'drivers': ['other-driver']})
+        self._start_service()
+        ring = self.service.ring_manager['fake']
+        self.assertEqual({'fake': ring.get_bucket_ranges(self.hostname)},
+                         self.service._get_mapped_bucket_ranges())
+
 
 @mgr_utils.mock_record_keepalive
 class ConsoleTestCase(mgr_utils.ServiceSetUpMixin, tests_db_base.DbTestCase):
@@ -2476,7 +2541,11 @@ class ConsoleTestCase(mgr_utils.ServiceSetUpMixin, tests_db_base.DbTestCase):
     def test_enable_console_already_enabled(self):
         node = obj_utils.create_test_node(self.context, driver='fake',
                                           console_enabled=True)
-        self._start_service()
+        # Do not restart the console of this node on conductor start up,
+        # it would race with set_console_mode() below.
+        with mock.patch.object(self.service, '_start_consoles',
+                               autospec=True):
+            self._start_service()
         with mock.patch.object(self.driver.console,
                                'start_console') as mock_sc:
             self.service.set_console_mode(self.context, node.uuid, True)
@@ -3155,6 +3224,81 @@ class RaidTestCases(mgr_utils.ServiceSetUpMixin, tests_db_base.DbTestCase):
         self.assertEqual(exception.InvalidParameterValue, exc.exc_info[0])
 
 
+class PrefetchImagesTestCase(mgr_utils.ServiceSetUpMixin,
+                             tests_db_base.DbTestCase):
+
+    def setUp(self):
+        super(PrefetchImagesTestCase, self).setUp()
+        self.images = [{'href': 'image-1', 'interface': 'deploy'},
+                       {'href': 'image-2', 'interface': 'boot'}]
+        self._start_service()
+        spawn_patcher = mock.patch.object(self.service, '_spawn_worker',
+                                          autospec=True)
+        self.mock_spawn = spawn_patcher.start()
+        self.addCleanup(spawn_patcher.stop)
+
+    def _get_status(self):
+        return [(status['href'], status['state'], status['error'])
+                for status in self.service.get_image_prefetch_status(
+                    self.context, 'fake')]
+
+    def test_prefetch_images(self):
+        self.service.prefetch_images(self.context, 'fake', self.images)
+        self.mock_spawn.assert_called_once_with(manager._do_prefetch_images,
+                                                self.context, self.driver,
+                                                mock.ANY)
+        self.assertEqual([('image-1', 'waiting', None),
+                          ('image-2', 'waiting', None)], self._get_status())
+        self.assertEqual([], self.service.get_image_prefetch_status(
+            self.context, 'other-driver'))
+
+    def test_prefetch_images_driver_not_loaded(self):
+        self.service.prefetch_images(self.context, 'other-driver',
+                                     self.images)
+        self.assertFalse(self.mock_spawn.called)
+        self.assertEqual({}, self.service.image_prefetches)
+
+    def test_prefetch_images_no_free_worker(self):
+        self.mock_spawn.side_effect = exception.NoFreeConductorWorker()
+        self.service.prefetch_images(self.context, 'fake', self.images)
+        self.assertEqual(['failed', 'failed'],
+                         [state for _href, state, _error
+                          in self._get_status()])
+
+    @mock.patch.object(manager, '_MAX_PREFETCH_STATUSES', 2)
+    def test_prefetch_images_statuses_bounded(self):
+        self.service.prefetch_images(self.context, 'fake', self.images)
+        self.service.prefetch_images(
+            self.context, 'fake',
+            [{'href': 'image-3', 'interface': 'deploy'},
+             {'href': 'image-1', 'interface': 'deploy'}])
+        self.assertEqual(['image-3', 'image-1'],
+                         [href for href, _state, _error
+                          in self._get_status()])
+
+    def test__do_prefetch_images(self):
+        mock_cache = mock.Mock(master_dir='/fake')
+        mock_cache.prefetch_image.side_effect = [
+            None, exception.ImageUnacceptable(image_id='image-3',
+                                              reason='too big')]
+        self.driver.deploy.get_image_cache = mock.Mock(
+            return_value=mock_cache)
+        self.driver.boot = None
+        self.mock_spawn.side_effect = lambda func, *args: func(*args)
+        images = self.images + [{'href': 'image-3', 'interface': 'deploy'}]
+        self.service.prefetch_images(self.context, 'fake', images)
+
+        status = self._get_status()
+        self.assertEqual(('image-1', 'cached', None), status[0])
+        self.assertEqual(('image-2', 'skipped'), status[1][:2])
+        self.assertIn('boot interface', status[1][2])
+        self.assertEqual(('image-3', 'failed'), status[2][:2])
+        self.assertIn('too big', status[2][2])
+        mock_cache.prefetch_image.assert_has_calls(
+            [mock.call('image-1', ctx=self.context, force_raw=True),
+             mock.call('image-3', ctx=self.context, force_raw=True)])
+
+
 @mock.patch.object(conductor_utils, 'node_power_action')
 class ManagerDoSyncPowerStateTestCase(tests_db_base.DbTestCase):
     def setUp(self):
@@ -3171,6 +3315,7 @@ class ManagerDoSyncPowerStateTestCase(tests_db_base.DbTestCase):
         self.task.driver = self.driver
         self.task.node = self.node
         self.task.shared = False
+        self.stats = collections.Counter()
         self.config(force_power_state_during_sync=False, group='conductor')
 
     def _do_sync_power_state(self, old_power_state, new_power_states,
@@ -3188,7 +3333,8 @@ class ManagerDoSyncPowerStateTestCase(tests_db_base.DbTestCase):
             else:
                 self.power.get_power_state.return_value = new_power_state
             count = manager.do_sync_power_state(
-                self.task, self.service.power_state_sync_count[self.node.uuid])
+                self.task, self.service.power_state_sync_count[self.node.uuid],
+                stats=self.stats)
             self.service.power_state_sync_count[self.node.uuid] = count
 
     def test_state_unchanged(self, node_power_action):
@@ -3199,6 +3345,7 @@ class ManagerDoSyncPowerStateTestCase(tests_db_base.DbTestCase):
         self.assertEqual('fake-power', self.node.power_state)
         self.assertFalse(node_power_action.called)
         self.assertFalse(self.task.upgrade_lock.called)
+        self.assertEqual({}, dict(self.stats))
 
     def test_state_not_set(self, node_power_action):
         self._do_sync_power_state(None, states.POWER_ON)
@@ -3208,6 +3355,7 @@ class ManagerDoSyncPowerStateTestCase(tests_db_base.DbTestCase):
         self.assertFalse(node_power_action.called)
         self.assertEqual(states.POWER_ON, self.node.power_state)
         self.task.upgrade_lock.assert_called_once_with()
+        self.assertEqual({}, dict(self.stats))
 
     def test_validate_fail(self, node_power_action):
         self._do_sync_power_state(None, states.POWER_ON,
@@ -3228,6 +3376,7 @@ class ManagerDoSyncPowerStateTestCase(tests_db_base.DbTestCase):
         self.assertEqual('fake', self.node.power_state)
         self.assertEqual(1,
                          self.service.power_state_sync_count[self.node.uuid])
+        self.assertEqual({'failures': 1}, dict(self.stats))
 
     def test_get_power_state_error(self, node_power_action):
         self._do_sync_power_state('fake', states.ERROR)
@@ -3246,6 +3395,7 @@ class ManagerDoSyncPowerStateTestCase(tests_db_base.DbTestCase):
         self.assertFalse(node_power_action.called)
         self.assertEqual(states.POWER_OFF, self.node.power_state)
         self.task.upgrade_lock.assert_called_once_with()
+        self.assertEqual({'mismatches': 1}, dict(self.stats))
 
     def test_state_changed_sync(self, node_power_action):
         self.config(force_power_state_during_sync=True, group='conductor')
@@ -3258,6 +3408,7 @@ class ManagerDoSyncPowerStateTestCase(tests_db_base.DbTestCase):
         node_power_action.assert_called_once_with(self.task, states.POWER_ON)
         self.assertEqual(states.POWER_ON, self.node.power_state)
         self.task.upgrade_lock.assert_called_once_with()
+        self.assertEqual({'mismatches': 1}, dict(self.stats))
 
     def test_state_changed_sync_failed(self, node_power_action):
         self.config(force_power_state_during_sync=True, group='conductor')
@@ -3272,6 +3423,7 @@ class ManagerDoSyncPowerStateTestCase(tests_db_base.DbTestCase):
         self.assertEqual(states.POWER_ON, self.node.power_state)
         self.assertEqual(1,
                          self.service.power_state_sync_count[self.node.uuid])
+        self.assertEqual({'mismatches': 1, 'failures': 1}, dict(self.stats))
 
     def test_max_retries_exceeded(self, node_power_action):
         self.config(force_power_state_during_sync=True, group='conductor')
@@ -3381,6 +3533,7 @@ class ManagerDoSyncPowerStateTestCase(tests_db_base.DbTestCase):
         self.power.get_power_state.assert_called_once_with(self.task)
         self.assertFalse(node_power_action.called)
         self.task.upgrade_lock.assert_called_once_with()
+        self.assertEqual({}, dict(self.stats))
 
 
 @mock.patch.object(manager, 'do_sync_power_state')
@@ -3426,7 +3579,8 @@ class ManagerSyncPowerStatesTestCase(mgr_utils.CommonMixIn,
                                             self.node.driver)
         acquire_mock.assert_called_once_with(self.context, self.node.uuid,
                                              purpose=mock.ANY,
-                                             shared=True)
+                                             shared=True,
+                                             filters=manager.SYNC_FILTERS)
         self.assertFalse(sync_mock.called)
 
     def test_node_in_deploywait_on_acquire(self, get_nodeinfo_mock,
@@ -3448,7 +3602,8 @@ class ManagerSyncPowerStatesTestCase(mgr_utils.CommonMixIn,
                                             self.node.driver)
         acquire_mock.assert_called_once_with(self.context, self.node.uuid,
                                              purpose=mock.ANY,
-                                             shared=True)
+                                             shared=True,
+                                             filters=manager.SYNC_FILTERS)
         self.assertFalse(sync_mock.called)
 
     def test_node_in_enroll_on_acquire(self, get_nodeinfo_mock, mapped_mock,
@@ -3469,7 +3624,8 @@ class ManagerSyncPowerStatesTestCase(mgr_utils.CommonMixIn,
                                             self.node.driver)
         acquire_mock.assert_called_once_with(self.context, self.node.uuid,
                                              purpose=mock.ANY,
-                                             shared=True)
+                                             shared=True,
+                                             filters=manager.SYNC_FILTERS)
         self.assertFalse(sync_mock.called)
 
     def test_node_in_power_transition_on_acquire(self, get_nodeinfo_mock,
@@ -3490,7 +3646,8 @@ class ManagerSyncPowerStatesTestCase(mgr_utils.CommonMixIn,
                                             self.node.driver)
         acquire_mock.assert_called_once_with(self.context, self.node.uuid,
                                              purpose=mock.ANY,
-                                             shared=True)
+                                             shared=True,
+                                             filters=manager.SYNC_FILTERS)
         self.assertFalse(sync_mock.called)
 
     def test_node_in_maintenance_on_acquire(self, get_nodeinfo_mock,
@@ -3510,7 +3667,8 @@ class ManagerSyncPowerStatesTestCase(mgr_utils.CommonMixIn,
                                             self.node.driver)
         acquire_mock.assert_called_once_with(self.context, self.node.uuid,
                                              purpose=mock.ANY,
-                                             shared=True)
+                                             shared=True,
+                                             filters=manager.SYNC_FILTERS)
         self.assertFalse(sync_mock.called)
 
     def test_node_disappears_on_acquire(self, get_nodeinfo_mock,
@@ -3528,7 +3686,8 @@ class ManagerSyncPowerStatesTestCase(mgr_utils.CommonMixIn,
                                             self.node.driver)
         acquire_mock.assert_called_once_with(self.context, self.node.uuid,
                                              purpose=mock.ANY,
-                                             shared=True)
+                                             shared=True,
+                                             filters=manager.SYNC_FILTERS)
         self.assertFalse(sync_mock.called)
 
     def test_single_node(self, get_nodeinfo_mock,
@@ -3546,8 +3705,9 @@ class ManagerSyncPowerStatesTestCase(mgr_utils.CommonMixIn,
                                             self.node.driver)
         acquire_mock.assert_called_once_with(self.context, self.node.uuid,
                                              purpose=mock.ANY,
-                                             shared=True)
-        sync_mock.assert_called_once_with(task, mock.ANY)
+                                             shared=True,
+                                             filters=manager.SYNC_FILTERS)
+        sync_mock.assert_called_once_with(task, mock.ANY, stats=mock.ANY)
 
     def test__sync_power_state_multiple_nodes(self, get_nodeinfo_mock,
                                               mapped_mock, acquire_mock,
@@ -3591,6 +3751,9 @@ class ManagerSyncPowerStatesTestCase(mgr_utils.CommonMixIn,
         mapped_mock.side_effect = lambda x, y: mapped_map[x]
         acquire_mock.side_effect = self._get_acquire_side_effect(tasks)
         sync_mock.side_effect = sync_results
+        # NOTE: process all nodes in the current thread to make the order
+        # of calls predictable
+        self.config(sync_power_state_workers=1, group='conductor')
 
         with mock.patch.object(eventlet, 'sleep') as sleep_mock:
             self.service._sync_power_states(self.context)
@@ -3604,16 +3767,127 @@ class ManagerSyncPowerStatesTestCase(mgr_utils.CommonMixIn,
         self.assertEqual(mapped_calls, mapped_mock.call_args_list)
         acquire_calls = [mock.call(self.context, x.uuid,
                                    purpose=mock.ANY,
-                                   shared=True)
+                                   shared=True,
+                                   filters=manager.SYNC_FILTERS)
                          for x in nodes if x.id != 2]
         self.assertEqual(acquire_calls, acquire_mock.call_args_list)
         # Nodes 1 and 7 (5 = index of Node7 after removing Node2)
-        sync_calls = [mock.call(tasks[0], mock.ANY),
-                      mock.call(tasks[5], mock.ANY)]
+        sync_calls = [mock.call(tasks[0], mock.ANY, stats=mock.ANY),
+                      mock.call(tasks[5], mock.ANY, stats=mock.ANY)]
         self.assertEqual(sync_calls, sync_mock.call_args_list)
 
+    @mock.patch.object(manager.ConductorManager, '_spawn_worker')
+    def test_spawns_workers(self, spawn_mock, get_nodeinfo_mock,
+                            mapped_mock, acquire_mock, sync_mock):
+        nodes = [self._create_node(id=i, uuid=uuidutils.generate_uuid())
+                 for i in range(1, 5)]
+        tasks = [self._create_task(node=n) for n in nodes]
+        get_nodeinfo_mock.return_value = (
+            self._get_nodeinfo_list_response(nodes))
+        mapped_mock.return_value = True
+        acquire_mock.side_effect = self._get_acquire_side_effect(tasks)
+        sync_mock.return_value = 0
+        self.config(sync_power_state_workers=3, group='conductor')
+        spawn_mock.side_effect = [mock.sentinel.future1,
+                                  mock.sentinel.future2]
+
+        with mock.patch.object(manager.waiters, 'wait_for_all',
+                               autospec=True) as wait_mock:
+            self.service._sync_power_states(self.context)
 
-@mock.patch.object(task_manager, 'acquire')
+        spawn_mock.assert_called_with(
+            self.service._sync_power_state_nodes_task, self.context,
+            mock.ANY, mock.ANY)
+        self.assertEqual(2, spawn_mock.call_count)
+        wait_mock.assert_called_once_with([mock.sentinel.future1,
+                                           mock.sentinel.future2])
+        # Spawning is mocked, so the current thread handles all nodes
+        self.assertEqual([mock.call(t, mock.ANY, stats=mock.ANY)
+                          for t in tasks],
+                         sync_mock.call_args_list)
+        self.assertEqual(4, self.service.power_state_sync_stats['nodes'])
+        self.assertEqual(3, self.service.power_state_sync_stats['workers'])
+
+    @mock.patch.object(manager.ConductorManager, '_spawn_worker')
+    def test_workers_limited_by_periodic_max_workers(
+            self, spawn_mock, get_nodeinfo_mock, mapped_mock, acquire_mock,
+            sync_mock):
+        nodes = [self._create_node(id=i, uuid=uuidutils.generate_uuid())
+                 for i in range(1, 5)]
+        tasks = [self._create_task(node=n) for n in nodes]
+        get_nodeinfo_mock.return_value = (
+            self._get_nodeinfo_list_response(nodes))
+        mapped_mock.return_value = True
+        acquire_mock.side_effect = self._get_acquire_side_effect(tasks)
+        sync_mock.return_value = 0
+        self.config(sync_power_state_workers=8, group='conductor')
+        self.config(periodic_max_workers=2, group='conductor')
+
+        with mock.patch.object(manager.waiters, 'wait_for_all',
+                               autospec=True):
+            self.service._sync_power_states(self.context)
+
+        self.assertEqual(1, spawn_mock.call_count)
+        self.assertEqual(4, sync_mock.call_count)
+
+    @mock.patch.object(manager.ConductorManager, '_spawn_worker')
+    def test_no_free_workers(self, spawn_mock, get_nodeinfo_mock,
+                             mapped_mock, acquire_mock, sync_mock):
+        nodes = [self._create_node(id=i, uuid=uuidutils.generate_uuid())
+                 for i in range(1, 4)]
+        tasks = [self._create_task(node=n) for n in nodes]
+        get_nodeinfo_mock.return_value = (
+            self._get_nodeinfo_list_response(nodes))
+        mapped_mock.return_value = True
+        acquire_mock.side_effect = self._get_acquire_side_effect(tasks)
+        sync_mock.return_value = 0
+        spawn_mock.side_effect = exception.NoFreeConductorWorker()
+
+        self.service._sync_power_states(self.context)
+
+        spawn_mock.assert_called_once_with(
+            self.service._sync_power_state_nodes_task, self.context,
+            mock.ANY, mock.ANY)
+        self.assertEqual([mock.call(t, mock.ANY, stats=mock.ANY)
+                          for t in tasks],
+                         sync_mock.call_args_list)
+
+    def test_stats(self, get_nodeinfo_mock, mapped_mock, acquire_mock,
+                   sync_mock):
+        nodes = [self._create_node(id=i, uuid=uuidutils.generate_uuid())
+                 for i in range(1, 4)]
+        tasks = [self._create_task(node=n) for n in nodes]
+        get_nodeinfo_mock.return_value = (
+            self._get_nodeinfo_list_response(nodes))
+        mapped_mock.return_value = True
+        acquire_mock.side_effect = self._get_acquire_side_effect(tasks)
+        self.config(sync_power_state_workers=1, group='conductor')
+
+        def _fake_sync(task, count, stats):
+            if task is tasks[1]:
+                # power state mismatch, corrected
+                stats['mismatches'] += 1
+                return count + 1
+            elif task is tasks[2]:
+                stats['failures'] += 1
+                return count + 1
+            return 0
+
+        sync_mock.side_effect = _fake_sync
+
+        self.service._sync_power_states(self.context)
+
+        stats = self.service.power_state_sync_stats
+        self.assertEqual(3, stats['nodes'])
+        self.assertEqual(1, stats['mismatches'])
+        self.assertEqual(1, stats['failures'])
+        self.assertEqual(1, stats['workers'])
+        self.assertIn('duration', stats)
+        self.assertEqual({nodes[1].uuid: 1, nodes[2].uuid: 1},
+                         dict(self.service.power_state_sync_count))
+
+
+@mock.patch.object(task_manager, 'acquire_many')
 @mock.patch.object(manager.ConductorManager, '_mapped_to_this_conductor')
 @mock.patch.object(dbapi.IMPL, 'get_nodeinfo_list')
 class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
@@ -3665,14 +3939,17 @@ class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
     def test_timeout(self, get_nodeinfo_mock, mapped_mock, acquire_mock):
         get_nodeinfo_mock.return_value = self._get_nodeinfo_list_response()
         mapped_mock.return_value = True
-        acquire_mock.side_effect = self._get_acquire_side_effect(self.task)
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
+            self.task)
 
         self.service._check_deploy_timeouts(self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
         mapped_mock.assert_called_once_with(self.node.uuid, self.node.driver)
-        acquire_mock.assert_called_once_with(self.context, self.node.uuid,
-                                             purpose=mock.ANY)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid], purpose=mock.ANY,
+            filters={'maintenance': False,
+                     'provision_state': states.DEPLOYWAIT})
         self.task.process_event.assert_called_with(
             'fail',
             callback=self.service._spawn_worker,
@@ -3684,36 +3961,41 @@ class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
                                      acquire_mock):
         get_nodeinfo_mock.return_value = self._get_nodeinfo_list_response()
         mapped_mock.return_value = True
-        acquire_mock.side_effect = exception.NodeNotFound(node='fake')
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
+            exception.NodeNotFound(node='fake'))
 
-        # Exception eaten
         self.service._check_deploy_timeouts(self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
         mapped_mock.assert_called_once_with(
             self.node.uuid, self.node.driver)
         acquire_mock.assert_called_once_with(self.context,
-                                             self.node.uuid,
-                                             purpose=mock.ANY)
+                                             [self.node.uuid],
+                                             purpose=mock.ANY,
+                                             filters=mock.ANY)
         self.assertFalse(self.task.spawn_after.called)
 
     def test_acquire_node_locked(self, get_nodeinfo_mock, mapped_mock,
                                  acquire_mock):
-        get_nodeinfo_mock.return_value = self._get_nodeinfo_list_response()
+        get_nodeinfo_mock.return_value = (
+            self._get_nodeinfo_list_response([self.node, self.node2]))
         mapped_mock.return_value = True
-        acquire_mock.side_effect = exception.NodeLocked(node='fake',
-                                                        host='fake')
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
+            [exception.NodeLocked(node='fake', host='fake'), self.task2])
 
-        # Exception eaten
         self.service._check_deploy_timeouts(self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
-        mapped_mock.assert_called_once_with(
-            self.node.uuid, self.node.driver)
-        acquire_mock.assert_called_once_with(self.context,
-                                             self.node.uuid,
-                                             purpose=mock.ANY)
-        self.assertFalse(self.task.spawn_after.called)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid, self.node2.uuid],
+            purpose=mock.ANY, filters=mock.ANY)
+        self.assertFalse(self.task.process_event.called)
+        self.task2.process_event.assert_called_with(
+            'fail',
+            callback=self.service._spawn_worker,
+            call_args=(conductor_utils.cleanup_after_timeout, self.task2),
+            err_handler=conductor_utils.provisioning_error_handler,
+            target_state=None)
 
     def test_no_deploywait_after_lock(self, get_nodeinfo_mock, mapped_mock,
                                       acquire_mock):
@@ -3722,7 +4004,7 @@ class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
                             uuid=self.node.uuid))
         get_nodeinfo_mock.return_value = self._get_nodeinfo_list_response()
         mapped_mock.return_value = True
-        acquire_mock.side_effect = self._get_acquire_side_effect(task)
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(task)
 
         self.service._check_deploy_timeouts(self.context)
 
@@ -3730,8 +4012,9 @@ class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
         mapped_mock.assert_called_once_with(
             self.node.uuid, self.node.driver)
         acquire_mock.assert_called_once_with(self.context,
-                                             self.node.uuid,
-                                             purpose=mock.ANY)
+                                             [self.node.uuid],
+                                             purpose=mock.ANY,
+                                             filters=mock.ANY)
         self.assertFalse(task.spawn_after.called)
 
     def test_maintenance_after_lock(self, get_nodeinfo_mock, mapped_mock,
@@ -3745,7 +4028,7 @@ class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
             self._get_nodeinfo_list_response([task.node, self.node2]))
         mapped_mock.return_value = True
         acquire_mock.side_effect = (
-            self._get_acquire_side_effect([task, self.task2]))
+            self._get_acquire_many_side_effect([task, self.task2]))
 
         self.service._check_deploy_timeouts(self.context)
 
@@ -3753,11 +4036,9 @@ class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
         self.assertEqual([mock.call(self.node.uuid, task.node.driver),
                           mock.call(self.node2.uuid, self.node2.driver)],
                          mapped_mock.call_args_list)
-        self.assertEqual([mock.call(self.context, self.node.uuid,
-                                    purpose=mock.ANY),
-                          mock.call(self.context, self.node2.uuid,
-                                    purpose=mock.ANY)],
-                         acquire_mock.call_args_list)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid, self.node2.uuid],
+            purpose=mock.ANY, filters=mock.ANY)
         # First node skipped
         self.assertFalse(task.spawn_after.called)
         # Second node spawned
@@ -3773,33 +4054,35 @@ class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
         get_nodeinfo_mock.return_value = (
             self._get_nodeinfo_list_response([self.node, self.node2]))
         mapped_mock.return_value = True
-        acquire_mock.side_effect = self._get_acquire_side_effect(
+        self.node2.id = 2
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
             [(self.task, exception.NoFreeConductorWorker()), self.task2])
 
         # Exception should be nuked
         self.service._check_deploy_timeouts(self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
-        # mapped should be only called for the first node as we should
-        # have exited the loop early due to NoFreeConductorWorker
-        mapped_mock.assert_called_once_with(
-            self.node.uuid, self.node.driver)
-        acquire_mock.assert_called_once_with(self.context,
-                                             self.node.uuid,
-                                             purpose=mock.ANY)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid, self.node2.uuid],
+            purpose=mock.ANY, filters=mock.ANY)
         self.task.process_event.assert_called_with(
             'fail',
             callback=self.service._spawn_worker,
             call_args=(conductor_utils.cleanup_after_timeout, self.task),
             err_handler=conductor_utils.provisioning_error_handler,
             target_state=None)
+        # The loop exited early due to NoFreeConductorWorker, the second
+        # node was released without being processed
+        self.assertFalse(self.task2.process_event.called)
+        self.assertEqual([2], acquire_mock.side_effect.released)
 
     def test_exiting_with_other_exception(self, get_nodeinfo_mock,
                                           mapped_mock, acquire_mock):
         get_nodeinfo_mock.return_value = (
             self._get_nodeinfo_list_response([self.node, self.node2]))
         mapped_mock.return_value = True
-        acquire_mock.side_effect = self._get_acquire_side_effect(
+        self.node2.id = 2
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
             [(self.task, exception.IronicException('foo')), self.task2])
 
         # Should re-raise
@@ -3808,18 +4091,17 @@ class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
                           self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
-        # mapped should be only called for the first node as we should
-        # have exited the loop early due to unknown exception
-        mapped_mock.assert_called_once_with(self.node.uuid, self.node.driver)
-        acquire_mock.assert_called_once_with(self.context,
-                                             self.node.uuid,
-                                             purpose=mock.ANY)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid, self.node2.uuid],
+            purpose=mock.ANY, filters=mock.ANY)
         self.task.process_event.assert_called_with(
             'fail',
             callback=self.service._spawn_worker,
             call_args=(conductor_utils.cleanup_after_timeout, self.task),
             err_handler=conductor_utils.provisioning_error_handler,
             target_state=None)
+        self.assertFalse(self.task2.process_event.called)
+        self.assertEqual([2], acquire_mock.side_effect.released)
 
     def test_worker_limit(self, get_nodeinfo_mock, mapped_mock, acquire_mock):
         self.config(periodic_max_workers=2, group='conductor')
@@ -3831,16 +4113,16 @@ class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
             self._get_nodeinfo_list_response([self.node] * 3))
         mapped_mock.return_value = True
         acquire_mock.side_effect = (
-            self._get_acquire_side_effect([self.task] * 3))
+            self._get_acquire_many_side_effect([self.task] * 3))
 
         self.service._check_deploy_timeouts(self.context)
 
         # Should only have ran 2.
         self.assertEqual([mock.call(self.node.uuid, self.node.driver)] * 2,
                          mapped_mock.call_args_list)
-        self.assertEqual([mock.call(self.context, self.node.uuid,
-                                    purpose=mock.ANY)] * 2,
-                         acquire_mock.call_args_list)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid] * 2, purpose=mock.ANY,
+            filters=mock.ANY)
         process_event_call = mock.call(
             'fail',
             callback=self.service._spawn_worker,
@@ -3850,18 +4132,47 @@ class ManagerCheckDeployTimeoutsTestCase(mgr_utils.CommonMixIn,
         self.assertEqual([process_event_call] * 2,
                          self.task.process_event.call_args_list)
 
+    def test_locked_nodes_skipped_in_next_batch(self, get_nodeinfo_mock,
+                                                mapped_mock, acquire_mock):
+        self.config(periodic_max_workers=2, group='conductor')
+        node3 = self._create_node(id=3, provision_state=states.DEPLOYWAIT,
+                                  target_provision_state=states.ACTIVE)
+        task3 = self._create_task(node=node3)
+        get_nodeinfo_mock.return_value = (
+            self._get_nodeinfo_list_response([self.node, self.node2, node3]))
+        mapped_mock.return_value = True
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
+            [self.task, exception.NodeLocked(node='fake', host='fake'),
+             task3])
+
+        self.service._check_deploy_timeouts(self.context)
+
+        # The locked node is replaced by the next one in another batch
+        self.assertEqual(
+            [mock.call(self.context, [self.node.uuid, self.node2.uuid],
+                       purpose=mock.ANY, filters=mock.ANY),
+             mock.call(self.context, [node3.uuid],
+                       purpose=mock.ANY, filters=mock.ANY)],
+            acquire_mock.call_args_list)
+        self.assertTrue(self.task.process_event.called)
+        self.assertTrue(task3.process_event.called)
+
+    @mock.patch.object(task_manager, 'acquire')
     @mock.patch.object(dbapi.IMPL, 'update_port')
     @mock.patch('ironic.dhcp.neutron.NeutronDHCPApi.update_port_address')
-    def test_update_port_duplicate_mac(self, get_nodeinfo_mock, mapped_mock,
-                                       acquire_mock, mac_update_mock, mock_up):
-        node = utils.create_test_node(driver='fake')
+    def test_update_port_duplicate_mac(self, mac_update_mock, mock_up,
+                                       acquire_mock, get_nodeinfo_mock,
+                                       mapped_mock, acquire_many_mock):
+        node = obj_utils.create_test_node(self.context, driver='fake')
         port = obj_utils.create_test_port(self.context, node_id=node.id)
+        acquire_mock.return_value.__enter__.return_value.node = node
         mock_up.side_effect = exception.MACAlreadyExists(mac=port.address)
         exc = self.assertRaises(messaging.rpc.ExpectedException,
                                 self.service.update_port,
                                 self.context, port)
         # Compare true exception hidden by @messaging.expected_exceptions
         self.assertEqual(exception.MACAlreadyExists, exc.exc_info[0])
+        self.assertTrue(mock_up.called)
         # ensure Neutron wasn't updated
         self.assertFalse(mac_update_mock.called)
 
@@ -3994,7 +4305,7 @@ class ManagerTestProperties(tests_db_base.DbTestCase):
         self.assertEqual(exception.DriverNotFound, exc.exc_info[0])
 
 
-@mock.patch.object(task_manager, 'acquire')
+@mock.patch.object(task_manager, 'acquire_many')
 @mock.patch.object(manager.ConductorManager, '_mapped_to_this_conductor')
 @mock.patch.object(dbapi.IMPL, 'get_nodeinfo_list')
 class ManagerSyncLocalStateTestCase(mgr_utils.CommonMixIn,
@@ -4050,14 +4361,17 @@ class ManagerSyncLocalStateTestCase(mgr_utils.CommonMixIn,
     def test_good(self, get_nodeinfo_mock, mapped_mock, acquire_mock):
         get_nodeinfo_mock.return_value = self._get_nodeinfo_list_response()
         mapped_mock.return_value = True
-        acquire_mock.side_effect = self._get_acquire_side_effect(self.task)
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
+            self.task)
 
         self.service._sync_local_state(self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
         mapped_mock.assert_called_once_with(self.node.uuid, self.node.driver)
-        acquire_mock.assert_called_once_with(self.context, self.node.uuid,
-                                             purpose=mock.ANY)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid], purpose=mock.ANY,
+            filters={'maintenance': False,
+                     'provision_state': states.ACTIVE})
         # assert spawn_after has been called
         self.task.spawn_after.assert_called_once_with(
             self.service._spawn_worker,
@@ -4067,7 +4381,7 @@ class ManagerSyncLocalStateTestCase(mgr_utils.CommonMixIn,
                             acquire_mock):
         mapped_mock.return_value = True
         acquire_mock.side_effect = (
-            self._get_acquire_side_effect([self.task] * 3))
+            self._get_acquire_many_side_effect([self.task] * 3))
         self.task.spawn_after.side_effect = [
             None,
             exception.NoFreeConductorWorker('error')
@@ -4081,26 +4395,22 @@ class ManagerSyncLocalStateTestCase(mgr_utils.CommonMixIn,
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
 
-        # assert  _mapped_to_this_conductor() gets called 2 times only
-        # instead of 3. When NoFreeConductorWorker is raised the loop
-        # should be broken
-        expected = [mock.call(self.node.uuid, self.node.driver)] * 2
-        self.assertEqual(expected, mapped_mock.call_args_list)
-
-        # assert  acquire() gets called 2 times only instead of 3. When
-        # NoFreeConductorWorker is raised the loop should be broken
-        expected = [mock.call(self.context, self.node.uuid,
-                              purpose=mock.ANY)] * 2
-        self.assertEqual(expected, acquire_mock.call_args_list)
+        # assert acquire_many() locks the 3 nodes at once
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid] * 3, purpose=mock.ANY,
+            filters=mock.ANY)
 
-        # assert spawn_after has been called twice
+        # assert spawn_after has been called twice. When
+        # NoFreeConductorWorker is raised the loop should be broken and the
+        # last node released
         expected = [mock.call(self.service._spawn_worker,
                     self.service._do_takeover, self.task)] * 2
         self.assertEqual(expected, self.task.spawn_after.call_args_list)
+        self.assertEqual([self.node.id], acquire_mock.side_effect.released)
 
     def test_node_locked(self, get_nodeinfo_mock, mapped_mock, acquire_mock,):
         mapped_mock.return_value = True
-        acquire_mock.side_effect = self._get_acquire_side_effect(
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
             [self.task, exception.NodeLocked('error'), self.task])
         self.task.spawn_after.side_effect = [None, None]
 
@@ -4116,22 +4426,39 @@ class ManagerSyncLocalStateTestCase(mgr_utils.CommonMixIn,
         expected = [mock.call(self.node.uuid, self.node.driver)] * 3
         self.assertEqual(expected, mapped_mock.call_args_list)
 
-        # assert acquire() gets called 3 times
-        expected = [mock.call(self.context, self.node.uuid,
-                              purpose=mock.ANY)] * 3
-        self.assertEqual(expected, acquire_mock.call_args_list)
+        # assert acquire_many() gets called once for the 3 nodes
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid] * 3, purpose=mock.ANY,
+            filters=mock.ANY)
 
         # assert spawn_after has been called only 2 times
         expected = [mock.call(self.service._spawn_worker,
                     self.service._do_takeover, self.task)] * 2
         self.assertEqual(expected, self.task.spawn_after.call_args_list)
 
+    def test_affinity_changed_after_lock(self, get_nodeinfo_mock, mapped_mock,
+                                         acquire_mock):
+        self.service.conductor.id = 123
+        task = self._create_task(
+            node_attrs=dict(provision_state=states.ACTIVE,
+                            uuid=self.node.uuid, conductor_affinity=123))
+        get_nodeinfo_mock.return_value = self._get_nodeinfo_list_response()
+        mapped_mock.return_value = True
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(task)
+
+        self.service._sync_local_state(self.context)
+
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid], purpose=mock.ANY,
+            filters=mock.ANY)
+        self.assertFalse(task.spawn_after.called)
+
     def test_worker_limit(self, get_nodeinfo_mock, mapped_mock, acquire_mock):
         # Limit to only 1 worker
         self.config(periodic_max_workers=1, group='conductor')
         mapped_mock.return_value = True
         acquire_mock.side_effect = (
-            self._get_acquire_side_effect([self.task] * 3))
+            self._get_acquire_many_side_effect([self.task] * 3))
         self.task.spawn_after.side_effect = [None] * 3
 
         # 3 nodes to be checked
@@ -4146,9 +4473,11 @@ class ManagerSyncLocalStateTestCase(mgr_utils.CommonMixIn,
         # because of the worker limit
         mapped_mock.assert_called_once_with(self.node.uuid, self.node.driver)
 
-        # assert acquire() gets called only once because of the worker limit
-        acquire_mock.assert_called_once_with(self.context, self.node.uuid,
-                                             purpose=mock.ANY)
+        # assert acquire_many() gets called only once, for one node,
+        # because of the worker limit
+        acquire_mock.assert_called_once_with(self.context, [self.node.uuid],
+                                             purpose=mock.ANY,
+                                             filters=mock.ANY)
 
         # assert spawn_after has been called
         self.task.spawn_after.assert_called_once_with(
@@ -4328,7 +4657,7 @@ class NodeInspectHardware(mgr_utils.ServiceSetUpMixin,
         self.assertTrue(mock_inspect.called)
 
 
-@mock.patch.object(task_manager, 'acquire')
+@mock.patch.object(task_manager, 'acquire_many')
 @mock.patch.object(manager.ConductorManager, '_mapped_to_this_conductor')
 @mock.patch.object(dbapi.IMPL, 'get_nodeinfo_list')
 class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
@@ -4383,14 +4712,16 @@ class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
                                     mapped_mock, acquire_mock):
         get_nodeinfo_mock.return_value = self._get_nodeinfo_list_response()
         mapped_mock.return_value = True
-        acquire_mock.side_effect = self._get_acquire_side_effect(self.task)
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
+            self.task)
 
         self.service._check_inspect_timeouts(self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
         mapped_mock.assert_called_once_with(self.node.uuid, self.node.driver)
-        acquire_mock.assert_called_once_with(self.context, self.node.uuid,
-                                             purpose=mock.ANY)
+        acquire_mock.assert_called_once_with(self.context, [self.node.uuid],
+                                             purpose=mock.ANY,
+                                             filters=mock.ANY)
         self.task.process_event.assert_called_with('fail', target_state=None)
 
     def test__check_inspect_timeouts_acquire_node_disappears(self,
@@ -4399,17 +4730,18 @@ class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
                                                              acquire_mock):
         get_nodeinfo_mock.return_value = self._get_nodeinfo_list_response()
         mapped_mock.return_value = True
-        acquire_mock.side_effect = exception.NodeNotFound(node='fake')
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
+            exception.NodeNotFound(node='fake'))
 
-        # Exception eaten
         self.service._check_inspect_timeouts(self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
         mapped_mock.assert_called_once_with(self.node.uuid,
                                             self.node.driver)
         acquire_mock.assert_called_once_with(self.context,
-                                             self.node.uuid,
-                                             purpose=mock.ANY)
+                                             [self.node.uuid],
+                                             purpose=mock.ANY,
+                                             filters=mock.ANY)
         self.assertFalse(self.task.process_event.called)
 
     def test__check_inspect_timeouts_acquire_node_locked(self,
@@ -4418,18 +4750,18 @@ class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
                                                          acquire_mock):
         get_nodeinfo_mock.return_value = self._get_nodeinfo_list_response()
         mapped_mock.return_value = True
-        acquire_mock.side_effect = exception.NodeLocked(node='fake',
-                                                        host='fake')
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
+            exception.NodeLocked(node='fake', host='fake'))
 
-        # Exception eaten
         self.service._check_inspect_timeouts(self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
         mapped_mock.assert_called_once_with(self.node.uuid,
                                             self.node.driver)
         acquire_mock.assert_called_once_with(self.context,
-                                             self.node.uuid,
-                                             purpose=mock.ANY)
+                                             [self.node.uuid],
+                                             purpose=mock.ANY,
+                                             filters=mock.ANY)
         self.assertFalse(self.task.process_event.called)
 
     def test__check_inspect_timeouts_no_acquire_after_lock(self,
@@ -4441,7 +4773,7 @@ class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
                             uuid=self.node.uuid))
         get_nodeinfo_mock.return_value = self._get_nodeinfo_list_response()
         mapped_mock.return_value = True
-        acquire_mock.side_effect = self._get_acquire_side_effect(task)
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(task)
 
         self.service._check_inspect_timeouts(self.context)
 
@@ -4449,8 +4781,9 @@ class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
         mapped_mock.assert_called_once_with(
             self.node.uuid, self.node.driver)
         acquire_mock.assert_called_once_with(self.context,
-                                             self.node.uuid,
-                                             purpose=mock.ANY)
+                                             [self.node.uuid],
+                                             purpose=mock.ANY,
+                                             filters=mock.ANY)
         self.assertFalse(task.process_event.called)
 
     def test__check_inspect_timeouts_to_maintenance_after_lock(
@@ -4464,7 +4797,7 @@ class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
             self._get_nodeinfo_list_response([task.node, self.node2]))
         mapped_mock.return_value = True
         acquire_mock.side_effect = (
-            self._get_acquire_side_effect([task, self.task2]))
+            self._get_acquire_many_side_effect([task, self.task2]))
 
         self.service._check_inspect_timeouts(self.context)
 
@@ -4472,11 +4805,9 @@ class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
         self.assertEqual([mock.call(self.node.uuid, task.node.driver),
                           mock.call(self.node2.uuid, self.node2.driver)],
                          mapped_mock.call_args_list)
-        self.assertEqual([mock.call(self.context, self.node.uuid,
-                                    purpose=mock.ANY),
-                          mock.call(self.context, self.node2.uuid,
-                                    purpose=mock.ANY)],
-                         acquire_mock.call_args_list)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid, self.node2.uuid],
+            purpose=mock.ANY, filters=mock.ANY)
         # First node skipped
         self.assertFalse(task.process_event.called)
         # Second node spawned
@@ -4487,28 +4818,30 @@ class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
         get_nodeinfo_mock.return_value = (
             self._get_nodeinfo_list_response([self.node, self.node2]))
         mapped_mock.return_value = True
-        acquire_mock.side_effect = self._get_acquire_side_effect(
+        self.node2.id = 2
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
             [(self.task, exception.NoFreeConductorWorker()), self.task2])
 
         # Exception should be nuked
         self.service._check_inspect_timeouts(self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
-        # mapped should be only called for the first node as we should
-        # have exited the loop early due to NoFreeConductorWorker
-        mapped_mock.assert_called_once_with(
-            self.node.uuid, self.node.driver)
-        acquire_mock.assert_called_once_with(self.context,
-                                             self.node.uuid,
-                                             purpose=mock.ANY)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid, self.node2.uuid],
+            purpose=mock.ANY, filters=mock.ANY)
         self.task.process_event.assert_called_with('fail', target_state=None)
+        # The loop exited early due to NoFreeConductorWorker, the second
+        # node was released without being processed
+        self.assertFalse(self.task2.process_event.called)
+        self.assertEqual([2], acquire_mock.side_effect.released)
 
     def test__check_inspect_timeouts_exit_with_other_exception(
             self, get_nodeinfo_mock, mapped_mock, acquire_mock):
         get_nodeinfo_mock.return_value = (
             self._get_nodeinfo_list_response([self.node, self.node2]))
         mapped_mock.return_value = True
-        acquire_mock.side_effect = self._get_acquire_side_effect(
+        self.node2.id = 2
+        acquire_mock.side_effect = self._get_acquire_many_side_effect(
             [(self.task, exception.IronicException('foo')), self.task2])
 
         # Should re-raise
@@ -4517,14 +4850,14 @@ class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
                           self.context)
 
         self._assert_get_nodeinfo_args(get_nodeinfo_mock)
-        # mapped should be only called for the first node as we should
-        # have exited the loop early due to unknown exception
-        mapped_mock.assert_called_once_with(
-            self.node.uuid, self.node.driver)
-        acquire_mock.assert_called_once_with(self.context,
-                                             self.node.uuid,
-                                             purpose=mock.ANY)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid, self.node2.uuid],
+            purpose=mock.ANY, filters=mock.ANY)
         self.task.process_event.assert_called_with('fail', target_state=None)
+        # The loop exited early due to unknown exception, the second
+        # node was released without being processed
+        self.assertFalse(self.task2.process_event.called)
+        self.assertEqual([2], acquire_mock.side_effect.released)
 
     def test__check_inspect_timeouts_worker_limit(self, get_nodeinfo_mock,
                                                   mapped_mock, acquire_mock):
@@ -4537,16 +4870,16 @@ class ManagerCheckInspectTimeoutsTestCase(mgr_utils.CommonMixIn,
             self._get_nodeinfo_list_response([self.node] * 3))
         mapped_mock.return_value = True
         acquire_mock.side_effect = (
-            self._get_acquire_side_effect([self.task] * 3))
+            self._get_acquire_many_side_effect([self.task] * 3))
 
         self.service._check_inspect_timeouts(self.context)
 
         # Should only have ran 2.
         self.assertEqual([mock.call(self.node.uuid, self.node.driver)] * 2,
                          mapped_mock.call_args_list)
-        self.assertEqual([mock.call(self.context, self.node.uuid,
-                                    purpose=mock.ANY)] * 2,
-                         acquire_mock.call_args_list)
+        acquire_mock.assert_called_once_with(
+            self.context, [self.node.uuid] * 2, purpose=mock.ANY,
+            filters=mock.ANY)
         process_event_call = mock.call('fail', target_state=None)
         self.assertEqual([process_event_call] * 2,
                          self.task.process_event.call_args_list)
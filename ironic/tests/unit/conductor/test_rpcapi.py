@@ -19,14 +19,18 @@ Unit Tests for :py:class:`ironic.conductor.rpcapi.ConductorAPI`.
 """
 
 import copy
+import datetime
+import time
 
 import mock
 from oslo_config import cfg
 import oslo_messaging as messaging
 from oslo_messaging import _utils as messaging_utils
+from oslo_utils import timeutils
 
 from ironic.common import boot_devices
 from ironic.common import exception
+from ironic.common import hash_ring
 from ironic.common import states
 from ironic.conductor import manager as conductor_manager
 from ironic.conductor import rpcapi as conductor_rpcapi
@@ -130,6 +134,94 @@ class RPCAPITestCase(base.DbTestCase):
         self.assertEqual('fake-topic.fake-host',
                          rpcapi.get_topic_for_driver('fake-driver'))
 
+    def test_get_topic_for_doesnt_rebuild_rings(self):
+        CONF.set_override('host', 'fake-host')
+        self.dbapi.register_conductor({'hostname': 'fake-host',
+                                       'drivers': ['fake-driver']})
+        rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
+        rpcapi.get_topic_for(self.fake_node_obj)
+
+        with mock.patch.object(hash_ring, 'HashRing',
+                               autospec=True) as ring_mock:
+            with mock.patch.object(self.dbapi, 'get_active_driver_dict',
+                                   autospec=True) as get_dict_mock:
+                rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
+                self.assertEqual('fake-topic.fake-host',
+                                 rpcapi.get_topic_for(self.fake_node_obj))
+                self.assertEqual('fake-topic.fake-host',
+                                 rpcapi.get_topic_for_driver('fake-driver'))
+        self.assertFalse(get_dict_mock.called)
+        self.assertFalse(ring_mock.called)
+
+    def test_get_topic_for_rereads_membership_after_interval(self):
+        CONF.set_override('host', 'fake-host')
+        self.dbapi.register_conductor({'hostname': 'fake-host',
+                                       'drivers': ['fake-driver']})
+        rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
+        rpcapi.get_topic_for(self.fake_node_obj)
+
+        self.dbapi.unregister_conductor('fake-host')
+        self.dbapi.register_conductor({'hostname': 'other-host',
+                                       'drivers': ['fake-driver']})
+        hash_ring.HashRingManager.updated_at = (
+            time.time() - CONF.conductor.heartbeat_interval - 1)
+        self.assertEqual('fake-topic.other-host',
+                         rpcapi.get_topic_for(self.fake_node_obj))
+
+    def _register_and_expire(self, utcnow_mock):
+        self.config(heartbeat_timeout=60, group='conductor')
+        now = datetime.datetime(2000, 1, 1, 0, 0)
+        utcnow_mock.return_value = now
+        for host in ('host1', 'host2'):
+            self.dbapi.register_conductor({'hostname': host,
+                                           'drivers': ['fake-driver']})
+        rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
+        dest = rpcapi.get_topic_for(self.fake_node_obj).split('.')[1]
+        other = 'host2' if dest == 'host1' else 'host1'
+
+        # Only the other conductor keeps checking in
+        utcnow_mock.return_value = now + datetime.timedelta(seconds=50)
+        self.dbapi.touch_conductor(other)
+        utcnow_mock.return_value = now + datetime.timedelta(seconds=61)
+        return rpcapi, other
+
+    @mock.patch.object(timeutils, 'utcnow', autospec=True)
+    def test_get_topic_for_expired_host(self, utcnow_mock):
+        rpcapi, other = self._register_and_expire(utcnow_mock)
+
+        self.assertEqual('fake-topic.%s' % other,
+                         rpcapi.get_topic_for(self.fake_node_obj))
+        self.assertEqual(set([other]),
+                         rpcapi.ring_manager['fake-driver'].hosts)
+
+    @mock.patch.object(hash_ring.HashRingManager, 'refresh', autospec=True)
+    @mock.patch.object(timeutils, 'utcnow', autospec=True)
+    def test_get_topic_for_expired_host_still_in_ring(self, utcnow_mock,
+                                                      refresh_mock):
+        rpcapi, other = self._register_and_expire(utcnow_mock)
+        heartbeats = dict(hash_ring.HashRingManager.heartbeats)
+        heartbeats[other] = utcnow_mock.return_value
+
+        with mock.patch.object(hash_ring.HashRingManager, 'heartbeats',
+                               heartbeats):
+            self.assertEqual('fake-topic.%s' % other,
+                             rpcapi.get_topic_for(self.fake_node_obj))
+        refresh_mock.assert_called_with(rpcapi.ring_manager)
+
+    @mock.patch.object(hash_ring.HashRingManager, 'refresh', autospec=True)
+    def test_get_topic_for_driver_not_found_refreshes(self, refresh_mock):
+        rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
+        with mock.patch.object(hash_ring.HashRingManager, '__getitem__',
+                               autospec=True) as getitem_mock:
+            getitem_mock.side_effect = [exception.DriverNotFound('meow'),
+                                        mock.Mock(hosts=['fake-host'])]
+            self.assertEqual('fake-topic.fake-host',
+                             rpcapi.get_topic_for_driver('fake-driver'))
+        refresh_mock.assert_has_calls([
+            mock.call(rpcapi.ring_manager,
+                      interval=CONF.conductor.heartbeat_interval),
+            mock.call(rpcapi.ring_manager)])
+
     def _test_rpcapi(self, method, rpc_method, **kwargs):
         rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
 
@@ -393,3 +485,20 @@ class RPCAPITestCase(base.DbTestCase):
                           'call',
                           version='1.33',
                           portgroup=self.fake_portgroup)
+
+    def test_prefetch_images(self):
+        rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
+        images = [{'href': 'fake-href', 'interface': 'deploy'}]
+        with mock.patch.object(rpcapi.client, 'prepare') as mock_prepare:
+            rpcapi.prefetch_images(self.context, 'fake-driver', images)
+            mock_prepare.assert_called_once_with(topic='fake-topic',
+                                                 fanout=True, version='1.34')
+            mock_prepare.return_value.cast.assert_called_once_with(
+                self.context, 'prefetch_images', driver_name='fake-driver',
+                images=images)
+
+    def test_get_image_prefetch_status(self):
+        self._test_rpcapi('get_image_prefetch_status',
+                          'call',
+                          version='1.34',
+                          driver_name='fake-driver')
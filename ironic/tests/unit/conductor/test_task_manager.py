@@ -17,6 +17,9 @@
 
 """Tests for :class:`ironic.conductor.task_manager`."""
 
+import collections
+
+import fixtures
 import futurist
 import mock
 from oslo_utils import uuidutils
@@ -62,7 +65,7 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
             build_driver_mock.assert_called_once_with(task, driver_name=None)
 
         reserve_mock.assert_called_once_with(self.context, self.host,
-                                             'fake-node-id')
+                                             'fake-node-id', filters=None)
         get_ports_mock.assert_called_once_with(self.context, self.node.id)
         get_portgroups_mock.assert_called_once_with(self.context, self.node.id)
         release_mock.assert_called_once_with(self.context, self.host,
@@ -85,7 +88,7 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
                 task, driver_name='fake-driver')
 
         reserve_mock.assert_called_once_with(self.context, self.host,
-                                             'fake-node-id')
+                                             'fake-node-id', filters=None)
         get_ports_mock.assert_called_once_with(self.context, self.node.id)
         get_portgroups_mock.assert_called_once_with(self.context, self.node.id)
         release_mock.assert_called_once_with(self.context, self.host,
@@ -105,6 +108,8 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
         build_driver_mock.return_value = mock.sentinel.driver1
 
         with task_manager.TaskManager(self.context, 'node-id1') as task:
+            self.assertEqual(mock.sentinel.ports1, task.ports)
+            self.assertEqual(mock.sentinel.portgroups1, task.portgroups)
             reserve_mock.return_value = node2
             get_ports_mock.return_value = mock.sentinel.ports2
             get_portgroups_mock.return_value = mock.sentinel.portgroups2
@@ -112,8 +117,6 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
             with task_manager.TaskManager(self.context, 'node-id2') as task2:
                 self.assertEqual(self.context, task.context)
                 self.assertEqual(self.node, task.node)
-                self.assertEqual(mock.sentinel.ports1, task.ports)
-                self.assertEqual(mock.sentinel.portgroups1, task.portgroups)
                 self.assertEqual(mock.sentinel.driver1, task.driver)
                 self.assertFalse(task.shared)
                 self.assertEqual(self.context, task2.context)
@@ -127,8 +130,10 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
                                   mock.call(task2, driver_name=None)],
                                  build_driver_mock.call_args_list)
 
-        self.assertEqual([mock.call(self.context, self.host, 'node-id1'),
-                          mock.call(self.context, self.host, 'node-id2')],
+        self.assertEqual([mock.call(self.context, self.host, 'node-id1',
+                                    filters=None),
+                          mock.call(self.context, self.host, 'node-id2',
+                                    filters=None)],
                          reserve_mock.call_args_list)
         self.assertEqual([mock.call(self.context, self.node.id),
                           mock.call(self.context, node2.id)],
@@ -155,7 +160,7 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
             self.assertFalse(task.shared)
 
         expected_calls = [mock.call(self.context, self.host,
-                                    'fake-node-id')] * 2
+                                    'fake-node-id', filters=None)] * 2
         reserve_mock.assert_has_calls(expected_calls)
         self.assertEqual(2, reserve_mock.call_count)
 
@@ -174,7 +179,7 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
                           'fake-node-id')
 
         reserve_mock.assert_called_with(self.context, self.host,
-                                        'fake-node-id')
+                                        'fake-node-id', filters=None)
         self.assertEqual(retry_attempts, reserve_mock.call_count)
         self.assertFalse(get_ports_mock.called)
         self.assertFalse(get_portgroups_mock.called)
@@ -188,15 +193,18 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
         reserve_mock.return_value = self.node
         get_ports_mock.side_effect = exception.IronicException('foo')
 
-        self.assertRaises(exception.IronicException,
-                          task_manager.TaskManager,
-                          self.context,
-                          'fake-node-id')
+        task = task_manager.TaskManager(self.context, 'fake-node-id')
+        self.assertFalse(get_ports_mock.called)
+        self.assertRaises(exception.IronicException, getattr, task,
+                          'ports')
+        # The lock is kept until the task is released
+        self.assertFalse(release_mock.called)
+        self.assertIs(self.node, task.node)
 
+        task.release_resources()
         reserve_mock.assert_called_once_with(self.context, self.host,
-                                             'fake-node-id')
+                                             'fake-node-id', filters=None)
         get_ports_mock.assert_called_once_with(self.context, self.node.id)
-        self.assertFalse(build_driver_mock.called)
         release_mock.assert_called_once_with(self.context, self.host,
                                              self.node.id)
         self.assertFalse(node_get_mock.called)
@@ -207,15 +215,18 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
         reserve_mock.return_value = self.node
         get_portgroups_mock.side_effect = exception.IronicException('foo')
 
-        self.assertRaises(exception.IronicException,
-                          task_manager.TaskManager,
-                          self.context,
-                          'fake-node-id')
+        task = task_manager.TaskManager(self.context, 'fake-node-id')
+        self.assertFalse(get_portgroups_mock.called)
+        self.assertRaises(exception.IronicException, getattr, task,
+                          'portgroups')
+        # The lock is kept until the task is released
+        self.assertFalse(release_mock.called)
+        self.assertIs(self.node, task.node)
 
+        task.release_resources()
         reserve_mock.assert_called_once_with(self.context, self.host,
-                                             'fake-node-id')
+                                             'fake-node-id', filters=None)
         get_portgroups_mock.assert_called_once_with(self.context, self.node.id)
-        self.assertFalse(build_driver_mock.called)
         release_mock.assert_called_once_with(self.context, self.host,
                                              self.node.id)
         self.assertFalse(node_get_mock.called)
@@ -233,9 +244,9 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
                           'fake-node-id')
 
         reserve_mock.assert_called_once_with(self.context, self.host,
-                                             'fake-node-id')
-        get_ports_mock.assert_called_once_with(self.context, self.node.id)
-        get_portgroups_mock.assert_called_once_with(self.context, self.node.id)
+                                             'fake-node-id', filters=None)
+        self.assertFalse(get_ports_mock.called)
+        self.assertFalse(get_portgroups_mock.called)
         build_driver_mock.assert_called_once_with(mock.ANY, driver_name=None)
         release_mock.assert_called_once_with(self.context, self.host,
                                              self.node.id)
@@ -258,7 +269,8 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
 
         self.assertFalse(reserve_mock.called)
         self.assertFalse(release_mock.called)
-        node_get_mock.assert_called_once_with(self.context, 'fake-node-id')
+        node_get_mock.assert_called_once_with(self.context, 'fake-node-id',
+                                              filters=None)
         get_ports_mock.assert_called_once_with(self.context, self.node.id)
         get_portgroups_mock.assert_called_once_with(self.context, self.node.id)
 
@@ -282,7 +294,8 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
 
         self.assertFalse(reserve_mock.called)
         self.assertFalse(release_mock.called)
-        node_get_mock.assert_called_once_with(self.context, 'fake-node-id')
+        node_get_mock.assert_called_once_with(self.context, 'fake-node-id',
+                                              filters=None)
         get_ports_mock.assert_called_once_with(self.context, self.node.id)
         get_portgroups_mock.assert_called_once_with(self.context, self.node.id)
 
@@ -299,7 +312,8 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
 
         self.assertFalse(reserve_mock.called)
         self.assertFalse(release_mock.called)
-        node_get_mock.assert_called_once_with(self.context, 'fake-node-id')
+        node_get_mock.assert_called_once_with(self.context, 'fake-node-id',
+                                              filters=None)
         self.assertFalse(get_ports_mock.called)
         self.assertFalse(get_portgroups_mock.called)
         self.assertFalse(build_driver_mock.called)
@@ -310,17 +324,16 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
         node_get_mock.return_value = self.node
         get_ports_mock.side_effect = exception.IronicException('foo')
 
-        self.assertRaises(exception.IronicException,
-                          task_manager.TaskManager,
-                          self.context,
-                          'fake-node-id',
-                          shared=True)
+        task = task_manager.TaskManager(self.context, 'fake-node-id',
+                                        shared=True)
+        self.assertRaises(exception.IronicException, getattr, task, 'ports')
 
         self.assertFalse(reserve_mock.called)
         self.assertFalse(release_mock.called)
-        node_get_mock.assert_called_once_with(self.context, 'fake-node-id')
+        node_get_mock.assert_called_once_with(self.context, 'fake-node-id',
+                                              filters=None)
         get_ports_mock.assert_called_once_with(self.context, self.node.id)
-        self.assertFalse(build_driver_mock.called)
+        self.assertIs(self.node, task.node)
 
     def test_shared_lock_get_portgroups_exception(
             self, get_portgroups_mock, get_ports_mock, build_driver_mock,
@@ -328,17 +341,17 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
         node_get_mock.return_value = self.node
         get_portgroups_mock.side_effect = exception.IronicException('foo')
 
-        self.assertRaises(exception.IronicException,
-                          task_manager.TaskManager,
-                          self.context,
-                          'fake-node-id',
-                          shared=True)
+        task = task_manager.TaskManager(self.context, 'fake-node-id',
+                                        shared=True)
+        self.assertRaises(exception.IronicException, getattr, task,
+                          'portgroups')
 
         self.assertFalse(reserve_mock.called)
         self.assertFalse(release_mock.called)
-        node_get_mock.assert_called_once_with(self.context, 'fake-node-id')
+        node_get_mock.assert_called_once_with(self.context, 'fake-node-id',
+                                              filters=None)
         get_portgroups_mock.assert_called_once_with(self.context, self.node.id)
-        self.assertFalse(build_driver_mock.called)
+        self.assertIs(self.node, task.node)
 
     def test_shared_lock_build_driver_exception(
             self, get_portgroups_mock, get_ports_mock, build_driver_mock,
@@ -355,11 +368,58 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
 
         self.assertFalse(reserve_mock.called)
         self.assertFalse(release_mock.called)
-        node_get_mock.assert_called_once_with(self.context, 'fake-node-id')
-        get_ports_mock.assert_called_once_with(self.context, self.node.id)
-        get_portgroups_mock.assert_called_once_with(self.context, self.node.id)
+        node_get_mock.assert_called_once_with(self.context, 'fake-node-id',
+                                              filters=None)
+        self.assertFalse(get_ports_mock.called)
+        self.assertFalse(get_portgroups_mock.called)
         build_driver_mock.assert_called_once_with(mock.ANY, driver_name=None)
 
+    def test_excl_lock_with_filters(
+            self, get_portgroups_mock, get_ports_mock, build_driver_mock,
+            reserve_mock, release_mock, node_get_mock):
+        reserve_mock.return_value = self.node
+        filters = {'maintenance': False}
+        with task_manager.acquire(self.context, 'fake-node-id',
+                                  filters=filters) as task:
+            self.assertFalse(task.shared)
+
+        reserve_mock.assert_called_once_with(self.context, self.host,
+                                             'fake-node-id', filters=filters)
+        self.assertFalse(node_get_mock.called)
+
+    def test_excl_lock_filter_mismatch(
+            self, get_portgroups_mock, get_ports_mock, build_driver_mock,
+            reserve_mock, release_mock, node_get_mock):
+        reserve_mock.side_effect = exception.NodeFilterMismatch(
+            node='fake-node-id', filters={})
+
+        self.assertRaises(exception.NodeFilterMismatch,
+                          task_manager.TaskManager,
+                          self.context, 'fake-node-id',
+                          filters={'maintenance': False})
+
+        # no retries on filter mismatch
+        self.assertEqual(1, reserve_mock.call_count)
+        self.assertFalse(get_ports_mock.called)
+        self.assertFalse(release_mock.called)
+
+    def test_shared_lock_with_filters(
+            self, get_portgroups_mock, get_ports_mock, build_driver_mock,
+            reserve_mock, release_mock, node_get_mock):
+        node_get_mock.return_value = self.node
+        filters = {'maintenance': False}
+        with task_manager.acquire(self.context, 'fake-node-id', shared=True,
+                                  filters=filters) as task:
+            self.assertTrue(task.shared)
+            # filters are not re-checked when upgrading the lock
+            reserve_mock.return_value = self.node
+            task.upgrade_lock()
+
+        node_get_mock.assert_called_once_with(self.context, 'fake-node-id',
+                                              filters=filters)
+        reserve_mock.assert_called_once_with(self.context, self.host,
+                                             'fake-node-id', filters=None)
+
     def test_upgrade_lock(
             self, get_portgroups_mock, get_ports_mock, build_driver_mock,
             reserve_mock, release_mock, node_get_mock):
@@ -386,10 +446,11 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
 
         # make sure reserve() was called only once
         reserve_mock.assert_called_once_with(self.context, self.host,
-                                             'fake-node-id')
+                                             'fake-node-id', filters=None)
         release_mock.assert_called_once_with(self.context, self.host,
                                              self.node.id)
-        node_get_mock.assert_called_once_with(self.context, 'fake-node-id')
+        node_get_mock.assert_called_once_with(self.context, 'fake-node-id',
+                                              filters=None)
         get_ports_mock.assert_called_once_with(self.context, self.node.id)
         get_portgroups_mock.assert_called_once_with(self.context, self.node.id)
 
@@ -525,12 +586,131 @@ class TaskManagerTestCase(tests_db_base.DbTestCase):
         reserve_mock.return_value = self.node
         copy_mock.return_value = m
         t = task_manager.TaskManager('fake', 'fake')
-        copy_mock.assert_called_once_with()
+        self.assertFalse(copy_mock.called)
         self.assertIs(m, t.fsm)
+        copy_mock.assert_called_once_with()
         m.initialize.assert_called_once_with(
             start_state=self.node.provision_state,
             target_state=self.node.target_provision_state)
 
+    @mock.patch.object(states.machine, 'copy')
+    def test_fsm_uses_initial_states(
+            self, copy_mock, get_portgroups_mock, get_ports_mock,
+            build_driver_mock, reserve_mock, release_mock, node_get_mock):
+        m = mock.Mock(spec=fsm.FSM)
+        self.node.provision_state = states.DEPLOYING
+        self.node.target_provision_state = states.ACTIVE
+        reserve_mock.return_value = self.node
+        copy_mock.return_value = m
+        t = task_manager.TaskManager('fake', 'fake')
+        t.node.provision_state = states.DEPLOYWAIT
+        self.assertIs(m, t.fsm)
+        # second access does not rebuild the state machine
+        self.assertIs(m, t.fsm)
+        copy_mock.assert_called_once_with()
+        m.initialize.assert_called_once_with(start_state=states.DEPLOYING,
+                                             target_state=states.ACTIVE)
+
+    def test_lazy_load_counters(
+            self, get_portgroups_mock, get_ports_mock, build_driver_mock,
+            reserve_mock, release_mock, node_get_mock):
+        self.useFixture(fixtures.MonkeyPatch(
+            'ironic.conductor.task_manager.LAZY_LOAD_COUNTERS',
+            collections.Counter()))
+        reserve_mock.return_value = self.node
+        with task_manager.acquire(self.context, 'fake-node-id') as task:
+            task.ports
+            task.ports
+        with task_manager.acquire(self.context, 'fake-node-id') as task:
+            pass
+
+        self.assertEqual({'tasks': 2, 'ports': 1},
+                         dict(task_manager.LAZY_LOAD_COUNTERS))
+        get_ports_mock.assert_called_once_with(self.context, self.node.id)
+        self.assertFalse(get_portgroups_mock.called)
+
+
+@mock.patch.object(driver_factory, 'build_driver_for_task', autospec=True)
+class TaskSetTestCase(tests_db_base.DbTestCase):
+    def setUp(self):
+        super(TaskSetTestCase, self).setUp()
+        self.host = 'test-host'
+        self.config(host=self.host)
+        self.nodes = [
+            obj_utils.create_test_node(self.context,
+                                       uuid=uuidutils.generate_uuid(),
+                                       provision_state=states.DEPLOYWAIT)
+            for i in range(3)]
+
+    def _reservations(self):
+        return [objects.Node.get_by_id(self.context, node.id).reservation
+                for node in self.nodes]
+
+    def test_acquire_many(self, build_driver_mock):
+        node_ids = [self.nodes[2].uuid, self.nodes[0].id]
+        with task_manager.acquire_many(self.context, node_ids) as tasks:
+            self.assertEqual(2, len(tasks))
+            self.assertEqual([self.host, None, self.host],
+                             self._reservations())
+            uuids = []
+            for locked in tasks:
+                with locked as task:
+                    self.assertFalse(task.shared)
+                    self.assertEqual(self.host, task.node.reservation)
+                    uuids.append(task.node.uuid)
+            self.assertEqual([self.nodes[2].uuid, self.nodes[0].uuid], uuids)
+            self.assertEqual(0, len(tasks))
+
+        self.assertEqual([None, None, None], self._reservations())
+        self.assertEqual(2, build_driver_mock.call_count)
+
+    def test_acquire_many_skips_nodes(self, build_driver_mock):
+        self.dbapi.reserve_node('other-host', self.nodes[0].id)
+        self.nodes[1].provision_state = states.ACTIVE
+        self.nodes[1].save()
+        node_ids = [node.uuid for node in self.nodes]
+        node_ids.append(uuidutils.generate_uuid())
+
+        with task_manager.acquire_many(
+                self.context, node_ids,
+                filters={'provision_state': states.DEPLOYWAIT}) as tasks:
+            self.assertEqual([self.nodes[2].uuid],
+                             [locked.node.uuid for locked in tasks])
+
+        self.assertEqual(['other-host', None, self.host],
+                         self._reservations())
+
+    def test_acquire_many_releases_unused_nodes(self, build_driver_mock):
+        node_ids = [node.id for node in self.nodes]
+        with task_manager.acquire_many(self.context, node_ids) as tasks:
+            for locked in tasks:
+                with locked:
+                    break
+
+        self.assertEqual([None, None, None], self._reservations())
+        self.assertEqual(1, build_driver_mock.call_count)
+
+    def test_acquire_many_releases_on_error(self, build_driver_mock):
+        node_ids = [node.id for node in self.nodes]
+
+        def _fail():
+            with task_manager.acquire_many(self.context, node_ids) as tasks:
+                for locked in tasks:
+                    with locked:
+                        raise exception.IronicException('fail')
+
+        self.assertRaises(exception.IronicException, _fail)
+        self.assertEqual([None, None, None], self._reservations())
+
+    def test_acquire_many_driver_fails(self, build_driver_mock):
+        build_driver_mock.side_effect = exception.DriverNotFound(
+            driver_name='foo')
+        node_ids = [node.id for node in self.nodes]
+        with task_manager.acquire_many(self.context, node_ids) as tasks:
+            self.assertRaises(exception.DriverNotFound, next, iter(tasks))
+
+        self.assertEqual([None, None, None], self._reservations())
+
 
 class TaskManagerStateModelTestCases(tests_base.TestCase):
     def setUp(self):
@@ -48,6 +48,7 @@ from oslo_utils import uuidutils
 import sqlalchemy
 import sqlalchemy.exc
 
+from ironic.common import hash_ring
 from ironic.common.i18n import _LE
 from ironic.db.sqlalchemy import migration
 from ironic.db.sqlalchemy import models
@@ -414,6 +415,37 @@ class MigrationCheckersMixin(object):
             if _was_inserted(row['uuid']):
                 self.assertTrue(row['pxe_enabled'])
 
+    def _pre_upgrade_e294876e8028(self, engine):
+        nodes = db_utils.get_table(engine, 'nodes')
+        data = [{'uuid': uuidutils.generate_uuid()},
+                {'uuid': uuidutils.generate_uuid()}]
+        nodes.insert().values(data).execute()
+        return data
+
+    def _check_e294876e8028(self, engine, data):
+        nodes = db_utils.get_table(engine, 'nodes')
+        col_names = [column.name for column in nodes.c]
+        self.assertIn('hash_bucket', col_names)
+        self.assertIsInstance(nodes.c.hash_bucket.type,
+                              sqlalchemy.types.Integer)
+
+        uuids = [row['uuid'] for row in data]
+        result = engine.execute(nodes.select(nodes.c.uuid.in_(uuids)))
+        for row in result:
+            self.assertEqual(hash_ring.get_hash_bucket(row['uuid']),
+                             row['hash_bucket'])
+
+    def _check_fbcf629ffe9c(self, engine, data):
+        nodes = db_utils.get_table(engine, 'nodes')
+        indexes = dict((index.name, [column.name for column in index.columns])
+                       for index in nodes.indexes)
+        self.assertEqual(['provision_state', 'maintenance', 'reservation',
+                          'provision_updated_at'],
+                         indexes['nodes_provision_state_sweep_idx'])
+        self.assertEqual(['reservation'], indexes['nodes_reservation_idx'])
+        self.assertEqual(['console_enabled'],
+                         indexes['nodes_console_enabled_idx'])
+
     def test_upgrade_and_version(self):
         with patch_with_engine(self.engine):
             self.migration_api.upgrade('head')
@@ -201,6 +201,25 @@ class DbConductorTestCase(base.DbTestCase):
         result = self.dbapi.get_active_driver_dict(interval=two_minute)
         self.assertEqual(expected, result)
 
+    @mock.patch.object(timeutils, 'utcnow', autospec=True)
+    def test_get_active_conductor_heartbeats(self, mock_utcnow):
+        self.config(heartbeat_timeout=60, group='conductor')
+        past = datetime.datetime(2000, 1, 1, 0, 0)
+        present = past + datetime.timedelta(seconds=90)
+
+        mock_utcnow.return_value = past
+        self._create_test_cdr(id=1, hostname='old-host')
+        mock_utcnow.return_value = present
+        self._create_test_cdr(id=2, hostname='new-host')
+        self._create_test_cdr(id=3, hostname='offline-host')
+        self.dbapi.unregister_conductor('offline-host')
+
+        self.assertEqual({'new-host': present},
+                         self.dbapi.get_active_conductor_heartbeats())
+        self.assertEqual({'old-host': past, 'new-host': present},
+                         self.dbapi.get_active_conductor_heartbeats(
+                             interval=120))
+
     @mock.patch.object(timeutils, 'utcnow', autospec=True)
     def test_get_offline_conductors(self, mock_utcnow):
         self.config(heartbeat_timeout=60, group='conductor')
@@ -23,6 +23,8 @@ from oslo_utils import uuidutils
 import six
 
 from ironic.common import exception
+from ironic.common import hash_ring
+from ironic.common import json_utils
 from ironic.common import states
 from ironic.db.sqlalchemy import api
 from ironic.tests.unit.db import base
@@ -62,7 +64,7 @@ class DbNodeTestCase(base.DbTestCase):
     def test_get_node_by_id(self):
         node = utils.create_test_node()
         self.dbapi.set_node_tags(node.id, ['tag1', 'tag2'])
-        res = self.dbapi.get_node_by_id(node.id)
+        res = self.dbapi.get_node_by_id(node.id, with_tags=True)
         self.assertEqual(node.id, res.id)
         self.assertEqual(node.uuid, res.uuid)
         self.assertItemsEqual(['tag1', 'tag2'], [tag.tag for tag in res.tags])
@@ -70,15 +72,37 @@ class DbNodeTestCase(base.DbTestCase):
     def test_get_node_by_uuid(self):
         node = utils.create_test_node()
         self.dbapi.set_node_tags(node.id, ['tag1', 'tag2'])
-        res = self.dbapi.get_node_by_uuid(node.uuid)
+        res = self.dbapi.get_node_by_uuid(node.uuid, with_tags=True)
         self.assertEqual(node.id, res.id)
         self.assertEqual(node.uuid, res.uuid)
         self.assertItemsEqual(['tag1', 'tag2'], [tag.tag for tag in res.tags])
 
+    def test_get_node_by_id_with_filters(self):
+        node = utils.create_test_node(provision_state=states.ACTIVE)
+        res = self.dbapi.get_node_by_id(
+            node.id, filters={'provision_state': states.ACTIVE,
+                              'maintenance': False})
+        self.assertEqual(node.uuid, res.uuid)
+        self.assertRaises(exception.NodeFilterMismatch,
+                          self.dbapi.get_node_by_id, node.id,
+                          filters={'maintenance': True})
+        self.assertRaises(exception.NodeNotFound,
+                          self.dbapi.get_node_by_id, 99,
+                          filters={'maintenance': False})
+
+    def test_get_node_by_uuid_with_filters(self):
+        node = utils.create_test_node(provision_state=states.ACTIVE)
+        res = self.dbapi.get_node_by_uuid(
+            node.uuid, filters={'provision_state_not_in': [states.ENROLL]})
+        self.assertEqual(node.id, res.id)
+        self.assertRaises(exception.NodeFilterMismatch,
+                          self.dbapi.get_node_by_uuid, node.uuid,
+                          filters={'provision_state_not_in': [states.ACTIVE]})
+
     def test_get_node_by_name(self):
         node = utils.create_test_node()
         self.dbapi.set_node_tags(node.id, ['tag1', 'tag2'])
-        res = self.dbapi.get_node_by_name(node.name)
+        res = self.dbapi.get_node_by_name(node.name, with_tags=True)
         self.assertEqual(node.id, res.id)
         self.assertEqual(node.uuid, res.uuid)
         self.assertEqual(node.name, res.name)
@@ -189,6 +213,68 @@ class DbNodeTestCase(base.DbTestCase):
                                                     states.DEPLOYWAIT})
         self.assertEqual([node2.id], [r[0] for r in res])
 
+    def test_get_nodeinfo_list_provision_state_not_in(self):
+        node1 = utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                                       provision_state=states.ACTIVE)
+        utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                               provision_state=states.DEPLOYWAIT)
+        utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                               provision_state=states.CLEANWAIT)
+
+        res = self.dbapi.get_nodeinfo_list(
+            filters={'provision_state_not_in': [states.DEPLOYWAIT,
+                                                states.CLEANWAIT]})
+        self.assertEqual([node1.id], [r[0] for r in res])
+
+    def test_get_nodeinfo_list_target_power_state(self):
+        node1 = utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                                       target_power_state=None)
+        node2 = utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                                       target_power_state=states.POWER_ON)
+
+        res = self.dbapi.get_nodeinfo_list(
+            filters={'target_power_state': None})
+        self.assertEqual([node1.id], [r[0] for r in res])
+
+        res = self.dbapi.get_nodeinfo_list(
+            filters={'target_power_state': states.POWER_ON})
+        self.assertEqual([node2.id], [r[0] for r in res])
+
+    def test_create_node_sets_hash_bucket(self):
+        node = utils.create_test_node()
+        self.assertEqual(hash_ring.get_hash_bucket(node.uuid),
+                         node.hash_bucket)
+
+    def test_get_nodeinfo_list_hash_bucket_ranges(self):
+        node1 = utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                                       driver='driver1')
+        node2 = utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                                       driver='driver1')
+        node3 = utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                                       driver='driver2')
+        # node created before hash buckets were introduced
+        node4 = utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                                       driver='driver1')
+        self.dbapi.update_node(node4.id, {'hash_bucket': None})
+
+        bucket1 = node1.hash_bucket
+        res = self.dbapi.get_nodeinfo_list(
+            filters={'hash_bucket_ranges': {
+                'driver1': [(bucket1, bucket1)],
+                'driver2': [(0, 2 ** hash_ring.HASH_BUCKET_BITS - 1)]}})
+        expected = set([node1.id, node3.id, node4.id])
+        if node2.hash_bucket == bucket1:
+            expected.add(node2.id)
+        self.assertEqual(expected, set(r[0] for r in res))
+
+        res = self.dbapi.get_nodeinfo_list(
+            filters={'hash_bucket_ranges': {'driver2': []}})
+        self.assertEqual([], [r[0] for r in res])
+
+        res = self.dbapi.get_nodeinfo_list(
+            filters={'hash_bucket_ranges': {}})
+        self.assertEqual([], [r[0] for r in res])
+
     @mock.patch.object(timeutils, 'utcnow', autospec=True)
     def test_get_nodeinfo_list_inspection(self, mock_utcnow):
         past = datetime.datetime(2000, 1, 1, 0, 0)
@@ -220,12 +306,60 @@ class DbNodeTestCase(base.DbTestCase):
         for i in range(1, 6):
             node = utils.create_test_node(uuid=uuidutils.generate_uuid())
             uuids.append(six.text_type(node['uuid']))
-        res = self.dbapi.get_node_list()
+        res = self.dbapi.get_node_list(with_tags=True)
         res_uuids = [r.uuid for r in res]
         six.assertCountEqual(self, uuids, res_uuids)
         for r in res:
             self.assertEqual([], r.tags)
 
+    @mock.patch.object(api, '_TAGS_QUERY_BATCH_SIZE', 2)
+    def test_get_node_list_with_tags(self):
+        nodes = [utils.create_test_node(uuid=uuidutils.generate_uuid())
+                 for i in range(5)]
+        for node in nodes[:3]:
+            self.dbapi.set_node_tags(node.id, ['tag1', node.uuid])
+
+        res = self.dbapi.get_node_list(with_tags=True)
+
+        tags = {r.id: sorted(tag.tag for tag in r.tags) for r in res}
+        self.assertEqual(
+            dict([(node.id, sorted(['tag1', node.uuid]))
+                  for node in nodes[:3]] +
+                 [(node.id, []) for node in nodes[3:]]), tags)
+
+    def test_get_node_list_without_tags(self):
+        node = utils.create_test_node()
+        self.dbapi.set_node_tags(node.id, ['tag1'])
+
+        res = self.dbapi.get_node_list()
+        self.assertEqual([node.id], [r.id for r in res])
+        self.assertNotIn('tags', res[0].__dict__)
+        res = self.dbapi.get_node_by_id(node.id)
+        self.assertNotIn('tags', res.__dict__)
+
+    def test_json_fields_decoded_on_access(self):
+        node = utils.create_test_node(driver_internal_info={'foo': 'bar'})
+
+        res = self.dbapi.get_node_by_id(node.id)
+        self.assertIsInstance(res.__dict__['driver_internal_info'],
+                              json_utils.EncodedJson)
+        self.assertEqual({'foo': 'bar'}, res.driver_internal_info)
+        self.assertEqual({'foo': 'bar'}, res.__dict__['driver_internal_info'])
+        self.assertIsInstance(res.get_encoded('extra'),
+                              json_utils.EncodedJson)
+
+    def test_update_node_keeps_encoded_json_fields(self):
+        node = utils.create_test_node(driver_internal_info={'foo': 'bar'})
+
+        with mock.patch.object(json_utils.EncodedJson, 'decode',
+                               autospec=True) as mock_decode:
+            res = self.dbapi.update_node(node.id, {'extra': {'a': 'b'}})
+            self.assertFalse(mock_decode.called)
+        self.assertEqual({'a': 'b'}, res.extra)
+        res = self.dbapi.get_node_by_id(node.id)
+        self.assertEqual({'foo': 'bar'}, res.driver_internal_info)
+        self.assertEqual({'a': 'b'}, res.extra)
+
     def test_get_node_list_with_filters(self):
         ch1 = utils.create_test_chassis(uuid=uuidutils.generate_uuid())
         ch2 = utils.create_test_chassis(uuid=uuidutils.generate_uuid())
@@ -272,6 +406,56 @@ class DbNodeTestCase(base.DbTestCase):
         res = self.dbapi.get_node_list(filters={'maintenance': False})
         self.assertEqual([node1.id], [r.id for r in res])
 
+    def test_get_node_list_marker_uuid(self):
+        for driver in ('b', 'a', 'b', 'a', 'c'):
+            utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                                   driver=driver)
+        for sort_key in ('id', 'uuid', 'driver'):
+            for sort_dir in ('asc', 'desc'):
+                expected = self.dbapi.get_node_list(sort_key=sort_key,
+                                                    sort_dir=sort_dir)
+                for index, marker in enumerate(expected):
+                    res = self.dbapi.get_node_list(
+                        limit=2, marker=marker.uuid, sort_key=sort_key,
+                        sort_dir=sort_dir)
+                    self.assertEqual(
+                        [n.id for n in expected[index + 1:index + 3]],
+                        [r.id for r in res])
+                    res = self.dbapi.get_node_list(
+                        limit=2, marker=marker, sort_key=sort_key,
+                        sort_dir=sort_dir)
+                    self.assertEqual(
+                        [n.id for n in expected[index + 1:index + 3]],
+                        [r.id for r in res])
+
+    def test_get_node_list_marker_uuid_with_filters(self):
+        nodes = [utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                                        maintenance=maintenance)
+                 for maintenance in (False, True, False, False)]
+        res = self.dbapi.get_nodeinfo_list(
+            columns=['uuid'], filters={'maintenance': False},
+            marker=nodes[0].uuid, limit=1)
+        self.assertEqual([(nodes[2].uuid,)], res)
+        # the marker itself does not need to match the filters
+        res = self.dbapi.get_node_list(filters={'maintenance': False},
+                                       marker=nodes[1].uuid)
+        self.assertEqual([nodes[2].id, nodes[3].id], [r.id for r in res])
+
+    def test_get_node_list_marker_not_found(self):
+        utils.create_test_node()
+        self.assertRaises(exception.NodeNotFound,
+                          self.dbapi.get_node_list,
+                          marker=uuidutils.generate_uuid())
+        self.assertRaises(exception.NodeNotFound,
+                          self.dbapi.get_nodeinfo_list,
+                          marker=uuidutils.generate_uuid())
+
+    def test_get_node_list_marker_uuid_invalid_sort_key(self):
+        node = utils.create_test_node()
+        self.assertRaises(exception.InvalidParameterValue,
+                          self.dbapi.get_node_list, marker=node.uuid,
+                          sort_key='foo')
+
     def test_get_node_list_chassis_not_found(self):
         self.assertRaises(exception.ChassisNotFound,
                           self.dbapi.get_node_list,
@@ -282,7 +466,8 @@ class DbNodeTestCase(base.DbTestCase):
             instance_uuid='12345678-9999-0000-aaaa-123456789012')
         self.dbapi.set_node_tags(node.id, ['tag1', 'tag2'])
 
-        res = self.dbapi.get_node_by_instance(node.instance_uuid)
+        res = self.dbapi.get_node_by_instance(node.instance_uuid,
+                                              with_tags=True)
         self.assertEqual(node.uuid, res.uuid)
         self.assertItemsEqual(['tag1', 'tag2'], [tag.tag for tag in res.tags])
 
@@ -462,13 +647,96 @@ class DbNodeTestCase(base.DbTestCase):
         r1 = 'fake-reservation'
 
         # reserve the node
-        res = self.dbapi.reserve_node(r1, uuid)
+        res = self.dbapi.reserve_node(r1, uuid, with_tags=True)
         self.assertItemsEqual(['tag1', 'tag2'], [tag.tag for tag in res.tags])
 
         # check reservation
         res = self.dbapi.get_node_by_uuid(uuid)
         self.assertEqual(r1, res.reservation)
 
+    def test_reserve_node_with_filters(self):
+        node = utils.create_test_node(provision_state=states.ACTIVE)
+
+        res = self.dbapi.reserve_node(
+            'fake-reservation', node.uuid,
+            filters={'provision_state': states.ACTIVE, 'maintenance': False})
+        self.assertEqual('fake-reservation', res.reservation)
+
+    def test_reserve_node_filter_mismatch(self):
+        node = utils.create_test_node(provision_state=states.ACTIVE)
+
+        self.assertRaises(exception.NodeFilterMismatch,
+                          self.dbapi.reserve_node, 'fake-reservation',
+                          node.uuid,
+                          filters={'provision_state': states.DEPLOYWAIT})
+        # the reservation was not created
+        res = self.dbapi.get_node_by_uuid(node.uuid)
+        self.assertIsNone(res.reservation)
+
+    def test_reserve_node_with_filters_locked(self):
+        node = utils.create_test_node(provision_state=states.ACTIVE)
+        self.dbapi.reserve_node('fake-reservation', node.uuid)
+
+        self.assertRaises(exception.NodeLocked,
+                          self.dbapi.reserve_node, 'another', node.uuid,
+                          filters={'provision_state': states.ACTIVE})
+
+    def test_reserve_nodes(self):
+        nodes = [utils.create_test_node(uuid=uuidutils.generate_uuid(),
+                                        provision_state=states.ACTIVE)
+                 for i in range(4)]
+        self.dbapi.set_node_tags(nodes[0].id, ['tag1'])
+        self.dbapi.reserve_node('another', nodes[1].id)
+        self.dbapi.update_node(nodes[2].id,
+                               {'provision_state': states.DEPLOYWAIT})
+
+        res = self.dbapi.reserve_nodes(
+            'fake-reservation',
+            [nodes[0].uuid, nodes[1].uuid, nodes[2].id, nodes[3].id],
+            filters={'provision_state': states.ACTIVE}, with_tags=True)
+
+        self.assertItemsEqual([nodes[0].id, nodes[3].id],
+                              [node.id for node in res])
+        tags = {node.id: [tag.tag for tag in node.tags] for node in res}
+        self.assertEqual(['tag1'], tags[nodes[0].id])
+        for node in res:
+            self.assertEqual('fake-reservation', node.reservation)
+        reservations = [self.dbapi.get_node_by_id(node.id).reservation
+                        for node in nodes]
+        self.assertEqual(['fake-reservation', 'another', None,
+                          'fake-reservation'], reservations)
+
+    def test_reserve_nodes_already_reserved_by_same_tag(self):
+        node = utils.create_test_node()
+        self.dbapi.reserve_node('fake-reservation', node.id)
+
+        self.assertEqual([], self.dbapi.reserve_nodes('fake-reservation',
+                                                      [node.id]))
+
+    def test_reserve_nodes_empty(self):
+        self.assertEqual([], self.dbapi.reserve_nodes('fake-reservation',
+                                                      []))
+
+    def test_reserve_nodes_invalid_identity(self):
+        self.assertRaises(exception.InvalidIdentity,
+                          self.dbapi.reserve_nodes, 'fake-reservation',
+                          ['not-a-uuid'])
+
+    def test_release_nodes(self):
+        nodes = [utils.create_test_node(uuid=uuidutils.generate_uuid())
+                 for i in range(3)]
+        self.dbapi.reserve_nodes('fake-reservation',
+                                 [nodes[0].id, nodes[1].id])
+        self.dbapi.reserve_node('another', nodes[2].id)
+
+        self.dbapi.release_nodes('fake-reservation',
+                                 [nodes[0].uuid, nodes[1].id, nodes[2].id,
+                                  12345])
+
+        reservations = [self.dbapi.get_node_by_id(node.id).reservation
+                        for node in nodes]
+        self.assertEqual([None, None, 'another'], reservations)
+
     def test_release_reservation(self):
         node = utils.create_test_node()
         uuid = node.uuid
@@ -570,3 +838,49 @@ class DbNodeTestCase(base.DbTestCase):
         self.assertRaises(
             exception.NodeNotFound,
             self.dbapi.touch_node_provisioning, uuidutils.generate_uuid())
+
+    @mock.patch.object(api, '_HEARTBEATS_BATCH_SIZE', 2)
+    @mock.patch.object(timeutils, 'utcnow', autospec=True)
+    def test_update_agent_heartbeats(self, mock_utcnow):
+        test_time = datetime.datetime(2000, 1, 1, 0, 0)
+        mock_utcnow.return_value = test_time
+        nodes = [utils.create_test_node(id=index,
+                                        uuid=uuidutils.generate_uuid(),
+                                        provision_state=states.CLEANWAIT,
+                                        driver_internal_info={'foo': index})
+                 for index in range(5)]
+        self.dbapi.reserve_node('host', nodes[1].id)
+
+        reserved = self.dbapi.update_agent_heartbeats({
+            nodes[0].id: (100, states.CLEANWAIT),
+            nodes[1].id: (101, states.CLEANWAIT),
+            nodes[2].id: (102, None),
+            nodes[3].id: (None, states.DEPLOYWAIT),
+            nodes[4].id: (None, states.CLEANWAIT),
+            42: (142, states.CLEANWAIT)})
+
+        self.assertEqual([nodes[1].id], reserved)
+
+        res = [self.dbapi.get_node_by_id(node.id) for node in nodes]
+        self.assertEqual([{'foo': 0, 'agent_last_heartbeat': 100},
+                          {'foo': 1},
+                          {'foo': 2, 'agent_last_heartbeat': 102},
+                          {'foo': 3}, {'foo': 4}],
+                         [node.driver_internal_info for node in res])
+        self.assertEqual([test_time, test_time, None, None, test_time],
+                         [node.provision_updated_at and
+                          timeutils.normalize_time(node.provision_updated_at)
+                          for node in res])
+
+    def test_update_agent_heartbeats_keeps_newer(self):
+        node = utils.create_test_node(
+            driver_internal_info={'agent_last_heartbeat': 200})
+
+        self.dbapi.update_agent_heartbeats({node.id: (100, None)})
+
+        res = self.dbapi.get_node_by_id(node.id)
+        self.assertEqual({'agent_last_heartbeat': 200},
+                         res.driver_internal_info)
+
+    def test_update_agent_heartbeats_empty(self):
+        self.assertEqual([], self.dbapi.update_agent_heartbeats({}))
@@ -0,0 +1,80 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A stand-in for 'ipmitool ... shell' talking to a BMC, used in tests.
+
+It understands a few commands, keeps the power state of the fake machine
+in memory and reports errors the way ipmitool does. The password given
+through the IPMI_PASSWORD environment variable (ipmitool -E) must match
+FAKE_BMC_PASSWORD, if set.
+
+Special commands:
+
+* 'busy' fails with the error reported by BMCs out of session slots.
+* 'hang' never answers.
+* 'crash' exits immediately.
+"""
+
+import os
+import sys
+import time
+
+PROMPT = 'ipmitool> '
+
+POWER_ON = {'on': True, 'off': False}
+
+
+def main():
+    if '-E' not in sys.argv or 'IPMI_PASSWORD' not in os.environ:
+        sys.stderr.write('Unable to read password from environment\n')
+        return 1
+    expected = os.environ.get('FAKE_BMC_PASSWORD')
+    if expected is not None and os.environ['IPMI_PASSWORD'] != expected:
+        sys.stderr.write('Error: Unable to establish IPMI v2 / RMCP+ '
+                         'session\n')
+        return 1
+
+    powered_on = False
+    while True:
+        sys.stdout.write(PROMPT)
+        sys.stdout.flush()
+        line = sys.stdin.readline()
+        if not line:
+            return 0
+        command = line.strip()
+
+        if command in ('exit', 'quit'):
+            return 0
+        elif command.startswith('echo '):
+            sys.stdout.write(command[5:] + '\n')
+        elif command == 'power status':
+            sys.stdout.write('Chassis Power is %s\n' %
+                             ('on' if powered_on else 'off'))
+        elif command.startswith('power ') and command[6:] in POWER_ON:
+            powered_on = POWER_ON[command[6:]]
+            sys.stdout.write('Chassis Power Control: %s\n' %
+                             ('Up/On' if powered_on else 'Down/Off'))
+        elif command == 'busy':
+            sys.stderr.write('Error: Unable to establish IPMI v2 / RMCP+ '
+                             'session: insufficient resources for '
+                             'session\n')
+        elif command == 'hang':
+            time.sleep(3600)
+        elif command == 'crash':
+            return 1
+        else:
+            sys.stderr.write('Invalid command: %s\n' % command)
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -31,6 +31,7 @@ from ironic.common import states
 from ironic.common import swift
 from ironic.conductor import task_manager
 from ironic.conductor import utils as manager_utils
+from ironic.drivers.modules import built_image_cache
 from ironic.drivers.modules import deploy_utils
 from ironic.drivers.modules.ilo import boot as ilo_boot
 from ironic.drivers.modules.ilo import common as ilo_common
@@ -221,15 +222,12 @@ class IloBootPrivateMethodsTestCase(db_base.DbTestCase):
                                                          'root-uuid',
                                                          'kernel-params',
                                                          'uefi')
-            swift_obj_mock.create_object.assert_called_once_with('ilo-cont',
-                                                                 'abcdef',
-                                                                 'tmpfile')
+            swift_obj_mock.create_object.assert_called_once_with(
+                'ilo-cont', 'abcdef', 'tmpfile', object_headers=None)
             boot_iso_expected = 'swift:abcdef'
             self.assertEqual(boot_iso_expected, boot_iso_actual)
 
-    @mock.patch.object(ilo_common, 'copy_image_to_web_server', spec_set=True,
-                       autospec=True)
-    @mock.patch.object(tempfile, 'NamedTemporaryFile', spec_set=True,
+    @mock.patch.object(ilo_common, 'put_image_in_web_server', spec_set=True,
                        autospec=True)
     @mock.patch.object(images, 'create_boot_iso', spec_set=True, autospec=True)
     @mock.patch.object(ilo_boot, '_get_boot_iso_object_name', spec_set=True,
@@ -243,20 +241,13 @@ class IloBootPrivateMethodsTestCase(db_base.DbTestCase):
     def test__get_boot_iso_recreate_boot_iso_use_webserver(
             self, deploy_info_mock, image_props_mock,
             capability_mock, boot_object_name_mock,
-            create_boot_iso_mock, tempfile_mock,
-            copy_file_mock):
+            create_boot_iso_mock, copy_file_mock):
         CONF.ilo.swift_ilo_container = 'ilo-cont'
         CONF.ilo.use_web_server_for_images = True
         CONF.deploy.http_url = "http://10.10.1.30/httpboot"
         CONF.deploy.http_root = "/httpboot"
         CONF.pxe.pxe_append_params = 'kernel-params'
 
-        fileobj_mock = mock.MagicMock(spec=file)
-        fileobj_mock.name = 'tmpfile'
-        mock_file_handle = mock.MagicMock(spec=file)
-        mock_file_handle.__enter__.return_value = fileobj_mock
-        tempfile_mock.return_value = mock_file_handle
-
         ramdisk_href = "http://10.10.1.30/httpboot/ramdisk"
         kernel_href = "http://10.10.1.30/httpboot/kernel"
         deploy_info_mock.return_value = {'image_source': 'image-uuid',
@@ -282,6 +273,16 @@ class IloBootPrivateMethodsTestCase(db_base.DbTestCase):
                 task.context, 'image-uuid',
                 ['boot_iso', 'kernel_id', 'ramdisk_id'])
             boot_object_name_mock.assert_called_once_with(task.node)
+            boot_iso_expected = 'http://10.10.1.30/httpboot/new_boot_iso'
+            self.assertEqual(boot_iso_expected, boot_iso_actual)
+            key = built_image_cache.get_key(
+                'boot_iso', {'href': kernel_href}, {'href': ramdisk_href},
+                {'href': 'deploy_iso_uuid'}, 'root-uuid', 'kernel-params',
+                'uefi')
+            copy_file_mock.assert_called_once_with('new_boot_iso', key,
+                                                   mock.ANY)
+            # The boot ISO is built by the function given
+            copy_file_mock.call_args[0][2]('tmpfile')
             create_boot_iso_mock.assert_called_once_with(task.context,
                                                          'tmpfile',
                                                          kernel_href,
@@ -290,14 +291,8 @@ class IloBootPrivateMethodsTestCase(db_base.DbTestCase):
                                                          'root-uuid',
                                                          'kernel-params',
                                                          'uefi')
-            boot_iso_expected = 'http://10.10.1.30/httpboot/new_boot_iso'
-            self.assertEqual(boot_iso_expected, boot_iso_actual)
-            copy_file_mock.assert_called_once_with(fileobj_mock.name,
-                                                   'new_boot_iso')
 
-    @mock.patch.object(ilo_common, 'copy_image_to_web_server', spec_set=True,
-                       autospec=True)
-    @mock.patch.object(tempfile, 'NamedTemporaryFile', spec_set=True,
+    @mock.patch.object(ilo_common, 'put_image_in_web_server', spec_set=True,
                        autospec=True)
     @mock.patch.object(images, 'create_boot_iso', spec_set=True, autospec=True)
     @mock.patch.object(ilo_boot, '_get_boot_iso_object_name', spec_set=True,
@@ -311,20 +306,13 @@ class IloBootPrivateMethodsTestCase(db_base.DbTestCase):
     def test__get_boot_iso_create_use_webserver_true_ramdisk_webserver(
             self, deploy_info_mock, image_props_mock,
             capability_mock, boot_object_name_mock,
-            create_boot_iso_mock, tempfile_mock,
-            copy_file_mock):
+            create_boot_iso_mock, copy_file_mock):
         CONF.ilo.swift_ilo_container = 'ilo-cont'
         CONF.ilo.use_web_server_for_images = True
         CONF.deploy.http_url = "http://10.10.1.30/httpboot"
         CONF.deploy.http_root = "/httpboot"
         CONF.pxe.pxe_append_params = 'kernel-params'
 
-        fileobj_mock = mock.MagicMock(spec=file)
-        fileobj_mock.name = 'tmpfile'
-        mock_file_handle = mock.MagicMock(spec=file)
-        mock_file_handle.__enter__.return_value = fileobj_mock
-        tempfile_mock.return_value = mock_file_handle
-
         ramdisk_href = "http://10.10.1.30/httpboot/ramdisk"
         kernel_href = "http://10.10.1.30/httpboot/kernel"
         deploy_info_mock.return_value = {'image_source': 'image-uuid',
@@ -345,6 +333,15 @@ class IloBootPrivateMethodsTestCase(db_base.DbTestCase):
                 task.context, 'image-uuid',
                 ['boot_iso', 'kernel_id', 'ramdisk_id'])
             boot_object_name_mock.assert_called_once_with(task.node)
+            boot_iso_expected = 'http://10.10.1.30/httpboot/abcdef'
+            self.assertEqual(boot_iso_expected, boot_iso_actual)
+            key = built_image_cache.get_key(
+                'boot_iso', {'href': kernel_href}, {'href': ramdisk_href},
+                {'href': 'deploy_iso_uuid'}, 'root-uuid', 'kernel-params',
+                'uefi')
+            copy_file_mock.assert_called_once_with('abcdef', key, mock.ANY)
+            # The boot ISO is built by the function given
+            copy_file_mock.call_args[0][2]('tmpfile')
             create_boot_iso_mock.assert_called_once_with(task.context,
                                                          'tmpfile',
                                                          kernel_href,
@@ -353,10 +350,6 @@ class IloBootPrivateMethodsTestCase(db_base.DbTestCase):
                                                          'root-uuid',
                                                          'kernel-params',
                                                          'uefi')
-            boot_iso_expected = 'http://10.10.1.30/httpboot/abcdef'
-            self.assertEqual(boot_iso_expected, boot_iso_actual)
-            copy_file_mock.assert_called_once_with(fileobj_mock.name,
-                                                   'abcdef')
 
     @mock.patch.object(ilo_boot, '_get_boot_iso_object_name', spec_set=True,
                        autospec=True)
@@ -33,6 +33,7 @@ from ironic.common import images
 from ironic.common import swift
 from ironic.conductor import task_manager
 from ironic.conductor import utils as manager_utils
+from ironic.drivers.modules import built_image_cache
 from ironic.drivers.modules import deploy_utils
 from ironic.drivers.modules.ilo import common as ilo_common
 from ironic.tests.unit.conductor import mgr_utils
@@ -230,38 +231,50 @@ class IloCommonMethodsTestCase(db_base.DbTestCase):
             'ilo_cont', object_name, timeout)
         self.assertEqual('temp-url', temp_url)
 
-    @mock.patch.object(ilo_common, 'copy_image_to_web_server',
+    @mock.patch.object(ilo_common, 'put_image_in_web_server',
                        spec_set=True, autospec=True)
     @mock.patch.object(images, 'create_vfat_image', spec_set=True,
                        autospec=True)
-    @mock.patch.object(tempfile, 'NamedTemporaryFile', spec_set=True,
-                       autospec=True)
-    def test__prepare_floppy_image_use_webserver(self, tempfile_mock,
-                                                 fatimage_mock,
-                                                 copy_mock):
-        mock_image_file_handle = mock.MagicMock(spec=file)
-        mock_image_file_obj = mock.MagicMock(spec=file)
-        mock_image_file_obj.name = 'image-tmp-file'
-        mock_image_file_handle.__enter__.return_value = mock_image_file_obj
-
-        tempfile_mock.return_value = mock_image_file_handle
+    def test__prepare_floppy_image_use_webserver(self, fatimage_mock,
+                                                 put_mock):
         self.config(use_web_server_for_images=True, group='ilo')
         deploy_args = {'arg1': 'val1', 'arg2': 'val2'}
-        CONF.deploy.http_url = "http://abc.com/httpboot"
-        CONF.deploy.http_root = "/httpboot"
 
         with task_manager.acquire(self.context, self.node.uuid,
                                   shared=False) as task:
-            node_uuid = task.node.uuid
-            object_name = 'image-' + node_uuid
-            http_url = CONF.deploy.http_url + '/' + object_name
-            copy_mock.return_value = "http://abc.com/httpboot/" + object_name
+            object_name = 'image-' + task.node.uuid
+            put_mock.return_value = "http://abc.com/httpboot/" + object_name
             temp_url = ilo_common._prepare_floppy_image(task, deploy_args)
 
+        put_mock.assert_called_once_with(
+            object_name, built_image_cache.get_key('floppy', deploy_args),
+            mock.ANY)
+        self.assertEqual(put_mock.return_value, temp_url)
+        # The image is built by the function given
+        put_mock.call_args[0][2]('image-tmp-file')
         fatimage_mock.assert_called_once_with('image-tmp-file',
                                               parameters=deploy_args)
-        copy_mock.assert_called_once_with('image-tmp-file', object_name)
-        self.assertEqual(http_url, temp_url)
+
+    @mock.patch.object(built_image_cache, 'put_in_directory', spec_set=True,
+                       autospec=True)
+    def test_put_image_in_web_server(self, put_mock):
+        CONF.deploy.http_url = "http://x.com/httpboot/"
+        CONF.deploy.http_root = "/httpboot"
+        build = mock.Mock()
+        url = ilo_common.put_image_in_web_server('image-uuid', 'key', build)
+        put_mock.assert_called_once_with('/httpboot', 'image-uuid', 'key',
+                                         build)
+        self.assertEqual('http://x.com/httpboot/image-uuid', url)
+
+    @mock.patch.object(built_image_cache, 'put_in_directory', spec_set=True,
+                       autospec=True)
+    def test_put_image_in_web_server_exception(self, put_mock):
+        CONF.deploy.http_url = "http://x.com/httpboot"
+        CONF.deploy.http_root = "/httpboot"
+        put_mock.side_effect = IOError
+        self.assertRaises(exception.ImageUploadFailed,
+                          ilo_common.put_image_in_web_server,
+                          'image-uuid', 'key', mock.Mock())
 
     @mock.patch.object(ilo_common, 'get_ilo_object', spec_set=True,
                        autospec=True)
@@ -943,3 +956,25 @@ class IloCommonMethodsTestCase(db_base.DbTestCase):
                           ilo_common.verify_image_checksum,
                           file_like_object,
                           invalid_hash)
+
+    @mock.patch.object(__builtin__, 'open', autospec=True)
+    def test_verify_image_checksum_with_actual_checksum(self, open_mock):
+        # | GIVEN |
+        actual_hash = hashlib.md5(b'any data').hexdigest()
+        # | WHEN |
+        ilo_common.verify_image_checksum('/any/path', actual_hash,
+                                         actual_checksum=actual_hash)
+        # | THEN |
+        self.assertFalse(open_mock.called)
+
+    @mock.patch.object(__builtin__, 'open', autospec=True)
+    def test_verify_image_checksum_with_actual_checksum_fails(self,
+                                                              open_mock):
+        # | GIVEN |
+        actual_hash = hashlib.md5(b'any data').hexdigest()
+        # | WHEN | & | THEN |
+        self.assertRaises(exception.ImageRefValidationFailed,
+                          ilo_common.verify_image_checksum,
+                          '/any/path', 'invalid_hash_value',
+                          actual_checksum=actual_hash)
+        self.assertFalse(open_mock.called)
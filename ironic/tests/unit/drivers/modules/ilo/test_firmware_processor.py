@@ -14,6 +14,11 @@
 
 """Test class for Firmware Processor used by iLO management interface."""
 
+import hashlib
+import os
+import shutil
+import tempfile
+
 import mock
 from oslo_utils import importutils
 import six
@@ -28,6 +33,7 @@ from ironic.common import exception
 from ironic.drivers.modules.ilo import common as ilo_common
 from ironic.drivers.modules.ilo import firmware_processor as ilo_fw_processor
 from ironic.tests import base
+from ironic.tests.unit.common import test_image_service
 
 ilo_error = importutils.try_import('proliantutils.exception')
 
@@ -250,7 +256,8 @@ class FirmwareProcessorTestCase(base.TestCase):
         _download_fw_to_mock.assert_called_once_with(
             os_mock.path.join.return_value)
         verify_checksum_mock.assert_called_once_with(
-            os_mock.path.join.return_value, checksum_fake)
+            os_mock.path.join.return_value, checksum_fake,
+            actual_checksum=_download_fw_to_mock.return_value)
         self.assertEqual(expected_return_location.fw_image_location,
                          actual_return_location.fw_image_location)
         self.assertEqual(expected_return_location.fw_image_filename,
@@ -317,11 +324,13 @@ class FirmwareProcessorTestCase(base.TestCase):
         shutil_mock.rmtree.assert_called_once_with(
             tempfile_mock.mkdtemp(), ignore_errors=True)
 
+    @mock.patch.object(ilo_fw_processor.utils, 'HashingWriter',
+                       autospec=True)
     @mock.patch.object(__builtin__, 'open', autospec=True)
     @mock.patch.object(
         ilo_fw_processor.image_service, 'FileImageService', autospec=True)
     def test__download_file_based_fw_to_copies_file_to_target(
-            self, file_image_service_mock, open_mock):
+            self, file_image_service_mock, open_mock, hashing_writer_mock):
         # | GIVEN |
         fd_mock = mock.MagicMock(spec=file)
         open_mock.return_value = fd_mock
@@ -330,17 +339,40 @@ class FirmwareProcessorTestCase(base.TestCase):
         firmware_file_path = '/tmp/any_file_path'
         self.fw_processor_fake.parsed_url = urlparse.urlparse(
             any_file_based_firmware_file)
+        writer_mock = hashing_writer_mock.return_value
         # | WHEN |
-        ilo_fw_processor._download_file_based_fw_to(self.fw_processor_fake,
-                                                    'target_file')
+        actual_checksum = ilo_fw_processor._download_file_based_fw_to(
+            self.fw_processor_fake, 'target_file')
         # | THEN |
+        hashing_writer_mock.assert_called_once_with(fd_mock)
         file_image_service_mock.return_value.download.assert_called_once_with(
-            firmware_file_path, fd_mock)
+            firmware_file_path, writer_mock)
+        writer_mock.hexdigest.assert_called_once_with(path='target_file')
+        self.assertEqual(writer_mock.hexdigest.return_value, actual_checksum)
+
+    def test__download_file_based_fw_to_returns_checksum(self):
+        # | GIVEN |
+        data = b'Yankee Doodle went to town riding on a pony;'
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        source_file = os.path.join(temp_dir, 'source')
+        target_file = os.path.join(temp_dir, 'target')
+        with open(source_file, 'wb') as f:
+            f.write(data)
+        self.fw_processor_fake.parsed_url = urlparse.urlparse(
+            'file://' + source_file)
+        # | WHEN |
+        actual_checksum = ilo_fw_processor._download_file_based_fw_to(
+            self.fw_processor_fake, target_file)
+        # | THEN |
+        self.assertEqual(hashlib.md5(data).hexdigest(), actual_checksum)
 
+    @mock.patch.object(ilo_fw_processor.utils, 'HashingWriter',
+                       autospec=True)
     @mock.patch.object(__builtin__, 'open', autospec=True)
     @mock.patch.object(ilo_fw_processor, 'image_service', autospec=True)
     def test__download_http_based_fw_to_downloads_the_fw_file(
-            self, image_service_mock, open_mock):
+            self, image_service_mock, open_mock, hashing_writer_mock):
         # | GIVEN |
         fd_mock = mock.MagicMock(spec=file)
         open_mock.return_value = fd_mock
@@ -349,12 +381,59 @@ class FirmwareProcessorTestCase(base.TestCase):
         any_target_file = 'any_target_file'
         self.fw_processor_fake.parsed_url = urlparse.urlparse(
             any_http_based_firmware_file)
+        writer_mock = hashing_writer_mock.return_value
         # | WHEN |
-        ilo_fw_processor._download_http_based_fw_to(self.fw_processor_fake,
-                                                    any_target_file)
+        actual_checksum = ilo_fw_processor._download_http_based_fw_to(
+            self.fw_processor_fake, any_target_file)
         # | THEN |
+        hashing_writer_mock.assert_called_once_with(fd_mock)
         image_service_mock.HttpImageService().download.assert_called_once_with(
-            any_http_based_firmware_file, fd_mock)
+            any_http_based_firmware_file, writer_mock)
+        writer_mock.hexdigest.assert_called_once_with()
+        self.assertEqual(writer_mock.hexdigest.return_value, actual_checksum)
+
+    @mock.patch.object(ilo_fw_processor.image_service, 'HttpImageService',
+                       autospec=True)
+    def test__download_http_based_fw_to_returns_checksum(
+            self, http_image_service_mock):
+        # | GIVEN |
+        data = b'Yankee Doodle went to town riding on a pony;'
+        http_image_service_mock.return_value.download.side_effect = (
+            lambda href, image_file: image_file.write(data))
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        target_file = os.path.join(temp_dir, 'target')
+        self.fw_processor_fake.parsed_url = urlparse.urlparse(
+            'http://netloc/path_to_firmware_file')
+        # | WHEN |
+        actual_checksum = ilo_fw_processor._download_http_based_fw_to(
+            self.fw_processor_fake, target_file)
+        # | THEN |
+        self.assertEqual(hashlib.md5(data).hexdigest(), actual_checksum)
+        with open(target_file, 'rb') as f:
+            self.assertEqual(data, f.read())
+
+    def test__download_http_based_fw_to_ranges_returns_checksum(self):
+        # | GIVEN |
+        self.config(http_download_segments=2,
+                    http_download_min_segment_size=1)
+        data = os.urandom(2 * 1024 * 1024)
+        server = test_image_service.FakeHttpServer(data)
+        server.start()
+        self.addCleanup(server.stop)
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        target_file = os.path.join(temp_dir, 'target')
+        self.fw_processor_fake.parsed_url = urlparse.urlparse(server.url)
+        # | WHEN |
+        # Download by byte ranges, which are not written through the writer
+        actual_checksum = ilo_fw_processor._download_http_based_fw_to(
+            self.fw_processor_fake, target_file)
+        # | THEN |
+        self.assertIn(('GET', 'bytes=0-1048575'), server.requests)
+        self.assertEqual(hashlib.md5(data).hexdigest(), actual_checksum)
+        with open(target_file, 'rb') as f:
+            self.assertEqual(data, f.read())
 
     @mock.patch.object(ilo_fw_processor, 'urlparse', autospec=True)
     @mock.patch.object(
@@ -17,8 +17,6 @@ Test class for iRMC Boot Driver
 """
 
 import os
-import shutil
-import tempfile
 
 from ironic_lib import utils as ironic_utils
 import mock
@@ -33,6 +31,7 @@ from ironic.common import images
 from ironic.common import states
 from ironic.conductor import task_manager
 from ironic.conductor import utils as manager_utils
+from ironic.drivers.modules import built_image_cache
 from ironic.drivers.modules import deploy_utils
 from ironic.drivers.modules.irmc import boot as irmc_boot
 from ironic.drivers.modules.irmc import common as irmc_common
@@ -280,11 +279,14 @@ class IRMCDeployPrivateMethodsTestCase(db_base.DbTestCase):
                        autospec=True)
     @mock.patch.object(irmc_boot, '_setup_vmedia_for_boot', spec_set=True,
                        autospec=True)
+    @mock.patch.object(built_image_cache, 'put_in_directory', spec_set=True,
+                       autospec=True)
     @mock.patch.object(images, 'fetch', spec_set=True,
                        autospec=True)
     def test_setup_deploy_iso_with_image_service(
             self,
             fetch_mock,
+            put_in_directory_mock,
             setup_vmedia_mock,
             set_boot_device_mock):
         CONF.irmc.remote_image_share_root = '/'
@@ -295,10 +297,15 @@ class IRMCDeployPrivateMethodsTestCase(db_base.DbTestCase):
             ramdisk_opts = {'a': 'b'}
             irmc_boot._setup_deploy_iso(task, ramdisk_opts)
 
+            put_in_directory_mock.assert_called_once_with(
+                '/', "deploy-%s.iso" % self.node.uuid,
+                built_image_cache.get_key('image',
+                                          {'href': 'glance://deploy_iso'}),
+                mock.ANY)
+            build = put_in_directory_mock.call_args[0][3]
+            build('tmp-path')
             fetch_mock.assert_called_once_with(
-                task.context,
-                'glance://deploy_iso',
-                "/deploy-%s.iso" % self.node.uuid)
+                task.context, 'glance://deploy_iso', 'tmp-path')
 
             setup_vmedia_mock.assert_called_once_with(
                 task,
@@ -345,6 +352,8 @@ class IRMCDeployPrivateMethodsTestCase(db_base.DbTestCase):
             self.assertEqual('irmc_boot.iso',
                              task.node.driver_internal_info['irmc_boot_iso'])
 
+    @mock.patch.object(built_image_cache, 'put_in_directory', spec_set=True,
+                       autospec=True)
     @mock.patch.object(images, 'create_boot_iso', spec_set=True, autospec=True)
     @mock.patch.object(deploy_utils, 'get_boot_mode_for_deploy', spec_set=True,
                        autospec=True)
@@ -362,7 +371,8 @@ class IRMCDeployPrivateMethodsTestCase(db_base.DbTestCase):
                                         fetch_mock,
                                         image_props_mock,
                                         boot_mode_mock,
-                                        create_boot_iso_mock):
+                                        create_boot_iso_mock,
+                                        put_in_directory_mock):
 
         CONF.irmc.remote_image_share_root = '/'
         image = '733d1c44-a2ea-414b-aca7-69decf20d810'
@@ -375,10 +385,14 @@ class IRMCDeployPrivateMethodsTestCase(db_base.DbTestCase):
             irmc_boot._prepare_boot_iso(task, 'root-uuid')
 
             deploy_info_mock.assert_called_once_with(task.node)
-            fetch_mock.assert_called_once_with(
-                task.context,
-                image,
-                "/boot-%s.iso" % self.node.uuid)
+            put_in_directory_mock.assert_called_once_with(
+                '/', "boot-%s.iso" % self.node.uuid,
+                built_image_cache.get_key('image', {'href': image}),
+                mock.ANY)
+            build = put_in_directory_mock.call_args[0][3]
+            build('tmp-path')
+            fetch_mock.assert_called_once_with(task.context, image,
+                                               'tmp-path')
             self.assertFalse(image_props_mock.called)
             self.assertFalse(boot_mode_mock.called)
             self.assertFalse(create_boot_iso_mock.called)
@@ -386,6 +400,8 @@ class IRMCDeployPrivateMethodsTestCase(db_base.DbTestCase):
             self.assertEqual("boot-%s.iso" % self.node.uuid,
                              task.node.driver_internal_info['irmc_boot_iso'])
 
+    @mock.patch.object(built_image_cache, 'put_in_directory', spec_set=True,
+                       autospec=True)
     @mock.patch.object(images, 'create_boot_iso', spec_set=True, autospec=True)
     @mock.patch.object(deploy_utils, 'get_boot_mode_for_deploy', spec_set=True,
                        autospec=True)
@@ -400,28 +416,38 @@ class IRMCDeployPrivateMethodsTestCase(db_base.DbTestCase):
                                          fetch_mock,
                                          image_props_mock,
                                          boot_mode_mock,
-                                         create_boot_iso_mock):
+                                         create_boot_iso_mock,
+                                         put_in_directory_mock):
         CONF.pxe.pxe_append_params = 'kernel-params'
 
         deploy_info_mock.return_value = {'image_source': 'image-uuid'}
         image_props_mock.return_value = {'kernel_id': 'kernel_uuid',
                                          'ramdisk_id': 'ramdisk_uuid'}
 
+        CONF.irmc.remote_image_share_root = '/remote_image_share_root'
         CONF.irmc.remote_image_share_name = '/remote_image_share_root'
         boot_mode_mock.return_value = 'uefi'
 
         with task_manager.acquire(self.context, self.node.uuid,
                                   shared=False) as task:
+            task.node.driver_info['irmc_deploy_iso'] = 'deploy_iso_uuid'
             irmc_boot._prepare_boot_iso(task, 'root-uuid')
 
             self.assertFalse(fetch_mock.called)
             deploy_info_mock.assert_called_once_with(task.node)
             image_props_mock.assert_called_once_with(
                 task.context, 'image-uuid', ['kernel_id', 'ramdisk_id'])
+            key = built_image_cache.get_key(
+                'boot_iso', {'href': 'kernel_uuid'}, {'href': 'ramdisk_uuid'},
+                {'href': 'deploy_iso_uuid'}, 'root-uuid', 'kernel-params',
+                'uefi')
+            put_in_directory_mock.assert_called_once_with(
+                '/remote_image_share_root', "boot-%s.iso" % self.node.uuid,
+                key, mock.ANY)
+            build = put_in_directory_mock.call_args[0][3]
+            build('tmp-path')
             create_boot_iso_mock.assert_called_once_with(
-                task.context,
-                '/remote_image_share_root/' +
-                "boot-%s.iso" % self.node.uuid,
+                task.context, 'tmp-path',
                 'kernel_uuid', 'ramdisk_uuid',
                 'file:///remote_image_share_root/' +
                 "deploy-%s.iso" % self.node.uuid,
@@ -435,52 +461,36 @@ class IRMCDeployPrivateMethodsTestCase(db_base.DbTestCase):
         expected = "image-%s.img" % self.node.uuid
         self.assertEqual(expected, actual)
 
-    @mock.patch.object(shutil, 'copyfile', spec_set=True, autospec=True)
-    @mock.patch.object(images, 'create_vfat_image', spec_set=True,
+    @mock.patch.object(built_image_cache, 'put_in_directory', spec_set=True,
                        autospec=True)
-    @mock.patch.object(tempfile, 'NamedTemporaryFile', spec_set=True,
+    @mock.patch.object(images, 'create_vfat_image', spec_set=True,
                        autospec=True)
     def test__prepare_floppy_image(self,
-                                   tempfile_mock,
                                    create_vfat_image_mock,
-                                   copyfile_mock):
-        mock_image_file_handle = mock.MagicMock(spec=file)
-        mock_image_file_obj = mock.MagicMock()
-        mock_image_file_obj.name = 'image-tmp-file'
-        mock_image_file_handle.__enter__.return_value = mock_image_file_obj
-        tempfile_mock.side_effect = iter([mock_image_file_handle])
-
+                                   put_in_directory_mock):
         deploy_args = {'arg1': 'val1', 'arg2': 'val2'}
-        CONF.irmc.remote_image_share_name = '/remote_image_share_root'
+        CONF.irmc.remote_image_share_root = '/remote_image_share_root'
 
         with task_manager.acquire(self.context, self.node.uuid,
                                   shared=False) as task:
-            irmc_boot._prepare_floppy_image(task, deploy_args)
-
+            floppy_filename = irmc_boot._prepare_floppy_image(task,
+                                                              deploy_args)
+
+        self.assertEqual("image-%s.img" % self.node.uuid, floppy_filename)
+        put_in_directory_mock.assert_called_once_with(
+            '/remote_image_share_root', "image-%s.img" % self.node.uuid,
+            built_image_cache.get_key('floppy', deploy_args), mock.ANY)
+        build = put_in_directory_mock.call_args[0][3]
+        build('tmp-path')
         create_vfat_image_mock.assert_called_once_with(
-            'image-tmp-file', parameters=deploy_args)
-        copyfile_mock.assert_called_once_with(
-            'image-tmp-file',
-            '/remote_image_share_root/' + "image-%s.img" % self.node.uuid)
+            'tmp-path', parameters=deploy_args)
 
-    @mock.patch.object(shutil, 'copyfile', spec_set=True, autospec=True)
-    @mock.patch.object(images, 'create_vfat_image', spec_set=True,
+    @mock.patch.object(built_image_cache, 'put_in_directory', spec_set=True,
                        autospec=True)
-    @mock.patch.object(tempfile, 'NamedTemporaryFile', spec_set=True,
-                       autospec=True)
-    def test__prepare_floppy_image_exception(self,
-                                             tempfile_mock,
-                                             create_vfat_image_mock,
-                                             copyfile_mock):
-        mock_image_file_handle = mock.MagicMock(spec=file)
-        mock_image_file_obj = mock.MagicMock()
-        mock_image_file_obj.name = 'image-tmp-file'
-        mock_image_file_handle.__enter__.return_value = mock_image_file_obj
-        tempfile_mock.side_effect = iter([mock_image_file_handle])
-
+    def test__prepare_floppy_image_exception(self, put_in_directory_mock):
         deploy_args = {'arg1': 'val1', 'arg2': 'val2'}
-        CONF.irmc.remote_image_share_name = '/remote_image_share_root'
-        copyfile_mock.side_effect = iter([IOError("fake error")])
+        CONF.irmc.remote_image_share_root = '/remote_image_share_root'
+        put_in_directory_mock.side_effect = IOError("fake error")
 
         with task_manager.acquire(self.context, self.node.uuid,
                                   shared=False) as task:
@@ -489,12 +499,6 @@ class IRMCDeployPrivateMethodsTestCase(db_base.DbTestCase):
                               task,
                               deploy_args)
 
-        create_vfat_image_mock.assert_called_once_with(
-            'image-tmp-file', parameters=deploy_args)
-        copyfile_mock.assert_called_once_with(
-            'image-tmp-file',
-            '/remote_image_share_root/' + "image-%s.img" % self.node.uuid)
-
     @mock.patch.object(manager_utils, 'node_set_boot_device', spec_set=True,
                        autospec=True)
     @mock.patch.object(irmc_boot, '_setup_vmedia_for_boot', spec_set=True,
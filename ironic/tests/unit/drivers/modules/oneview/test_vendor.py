@@ -24,6 +24,7 @@ from ironic.common import exception
 from ironic.common import states
 from ironic.conductor import task_manager
 from ironic.conductor import utils as manager_utils
+from ironic.drivers import base as driver_base
 from ironic.drivers.modules import agent_client
 from ironic.drivers.modules.oneview import power
 from ironic.drivers.modules.oneview import vendor
@@ -53,6 +54,8 @@ class TestBaseAgentVendor(db_base.DbTestCase):
             driver_info=db_utils.get_test_oneview_driver_info(),
         )
 
+    @mock.patch.object(driver_base.PowerStateCache, 'invalidate',
+                       autospec=True)
     @mock.patch.object(time, 'sleep', lambda seconds: None)
     @mock.patch.object(manager_utils, 'node_power_action', autospec=True)
     @mock.patch.object(power.OneViewPower, 'get_power_state',
@@ -62,7 +65,8 @@ class TestBaseAgentVendor(db_base.DbTestCase):
     @mock.patch('ironic.conductor.utils.node_set_boot_device', autospec=True)
     def test_reboot_and_finish_deploy(self, set_bootdev_mock, power_off_mock,
                                       get_power_state_mock,
-                                      node_power_action_mock):
+                                      node_power_action_mock,
+                                      invalidate_mock):
         self.node.provision_state = states.DEPLOYING
         self.node.target_provision_state = states.ACTIVE
         self.node.save()
@@ -73,6 +77,10 @@ class TestBaseAgentVendor(db_base.DbTestCase):
             self.passthru.reboot_and_finish_deploy(task)
             power_off_mock.assert_called_once_with(task.node)
             self.assertEqual(2, get_power_state_mock.call_count)
+            # The cached power state is dropped before each request
+            invalidate_mock.assert_has_calls(
+                [mock.call(driver_base.POWER_STATE_CACHE, task.node.uuid)] *
+                2)
             set_bootdev_mock.assert_called_once_with(task, 'disk',
                                                      persistent=True)
             node_power_action_mock.assert_called_once_with(
@@ -23,8 +23,10 @@ import mock
 from ironic.common import boot_devices
 from ironic.common import exception
 from ironic.common import states
+from ironic.conductor import heartbeat_buffer
 from ironic.conductor import task_manager
 from ironic.conductor import utils as manager_utils
+from ironic.drivers import base as driver_base
 from ironic.drivers.modules import agent_base_vendor
 from ironic.drivers.modules import agent_client
 from ironic.drivers.modules import deploy_utils
@@ -357,14 +359,14 @@ class TestBaseAgentVendor(db_base.DbTestCase):
             '1be26c0b-03f2-4d2e-ae87-c02d7f33c123: Failed checking if deploy '
             'is done. Exception: LlamaException')
 
-    @mock.patch.object(objects.node.Node, 'touch_provisioning', autospec=True)
+    @mock.patch.object(heartbeat_buffer, 'record', autospec=True)
     @mock.patch.object(agent_base_vendor.BaseAgentVendor,
                        '_refresh_clean_steps', autospec=True)
     @mock.patch.object(manager_utils, 'set_node_cleaning_steps', autospec=True)
     @mock.patch.object(agent_base_vendor.BaseAgentVendor,
                        'notify_conductor_resume_clean', autospec=True)
     def test_heartbeat_resume_clean(self, mock_notify, mock_set_steps,
-                                    mock_refresh, mock_touch):
+                                    mock_refresh, mock_record):
         kwargs = {
             'agent_url': 'http://127.0.0.1:9999/bar'
         }
@@ -375,20 +377,21 @@ class TestBaseAgentVendor(db_base.DbTestCase):
                 self.context, self.node.uuid, shared=False) as task:
             self.passthru.heartbeat(task, **kwargs)
 
-        mock_touch.assert_called_once_with(mock.ANY)
+        mock_record.assert_called_once_with(
+            mock.ANY, last_heartbeat=None, touch_provisioning=True)
         mock_refresh.assert_called_once_with(mock.ANY, task)
         mock_notify.assert_called_once_with(mock.ANY, task)
         mock_set_steps.assert_called_once_with(task)
 
     @mock.patch.object(manager_utils, 'cleaning_error_handler')
-    @mock.patch.object(objects.node.Node, 'touch_provisioning', autospec=True)
+    @mock.patch.object(heartbeat_buffer, 'record', autospec=True)
     @mock.patch.object(agent_base_vendor.BaseAgentVendor,
                        '_refresh_clean_steps', autospec=True)
     @mock.patch.object(manager_utils, 'set_node_cleaning_steps', autospec=True)
     @mock.patch.object(agent_base_vendor.BaseAgentVendor,
                        'notify_conductor_resume_clean', autospec=True)
     def test_heartbeat_resume_clean_fails(self, mock_notify, mock_set_steps,
-                                          mock_refresh, mock_touch,
+                                          mock_refresh, mock_record,
                                           mock_handler):
         mocks = [mock_refresh, mock_set_steps, mock_notify]
         kwargs = {
@@ -406,7 +409,8 @@ class TestBaseAgentVendor(db_base.DbTestCase):
                     self.context, self.node.uuid, shared=False) as task:
                 self.passthru.heartbeat(task, **kwargs)
 
-            mock_touch.assert_called_once_with(mock.ANY)
+            mock_record.assert_called_once_with(
+                mock.ANY, last_heartbeat=None, touch_provisioning=True)
             mock_handler.assert_called_once_with(task, mock.ANY)
             for called in before_failed_mocks + [failed_mock]:
                 self.assertTrue(called.called)
@@ -414,14 +418,14 @@ class TestBaseAgentVendor(db_base.DbTestCase):
                 self.assertFalse(not_called.called)
 
             # Reset mocks for the next interaction
-            for m in mocks + [mock_touch, mock_handler]:
+            for m in mocks + [mock_record, mock_handler]:
                 m.reset_mock()
             failed_mock.side_effect = None
 
-    @mock.patch.object(objects.node.Node, 'touch_provisioning', autospec=True)
+    @mock.patch.object(heartbeat_buffer, 'record', autospec=True)
     @mock.patch.object(agent_base_vendor.BaseAgentVendor,
                        'continue_cleaning', autospec=True)
-    def test_heartbeat_continue_cleaning(self, mock_continue, mock_touch):
+    def test_heartbeat_continue_cleaning(self, mock_continue, mock_record):
         kwargs = {
             'agent_url': 'http://127.0.0.1:9999/bar'
         }
@@ -437,7 +441,8 @@ class TestBaseAgentVendor(db_base.DbTestCase):
                 self.context, self.node.uuid, shared=False) as task:
             self.passthru.heartbeat(task, **kwargs)
 
-        mock_touch.assert_called_once_with(mock.ANY)
+        mock_record.assert_called_once_with(
+            mock.ANY, last_heartbeat=None, touch_provisioning=True)
         mock_continue.assert_called_once_with(mock.ANY, task, **kwargs)
 
     @mock.patch.object(manager_utils, 'cleaning_error_handler')
@@ -517,11 +522,11 @@ class TestBaseAgentVendor(db_base.DbTestCase):
         self.assertEqual(0, rti_mock.call_count)
         self.assertEqual(0, cd_mock.call_count)
 
-    @mock.patch.object(objects.node.Node, 'touch_provisioning', autospec=True)
+    @mock.patch.object(heartbeat_buffer, 'record', autospec=True)
     @mock.patch.object(agent_base_vendor.BaseAgentVendor, 'deploy_has_started',
                        autospec=True)
     def test_heartbeat_touch_provisioning(self, mock_deploy_started,
-                                          mock_touch):
+                                          mock_record):
         mock_deploy_started.return_value = True
         kwargs = {
             'agent_url': 'http://127.0.0.1:9999/bar'
@@ -533,7 +538,99 @@ class TestBaseAgentVendor(db_base.DbTestCase):
                 self.context, self.node.uuid, shared=False) as task:
             self.passthru.heartbeat(task, **kwargs)
 
-        mock_touch.assert_called_once_with(mock.ANY)
+        mock_record.assert_called_once_with(
+            mock.ANY, last_heartbeat=None, touch_provisioning=True)
+
+    def _set_heartbeat_state(self, provision_state, maintenance=False):
+        info = dict(self.node.driver_internal_info,
+                    agent_url='http://127.0.0.1:9999/bar')
+        self.dbapi.update_node(self.node.id,
+                               {'provision_state': provision_state,
+                                'maintenance': maintenance,
+                                'driver_internal_info': info})
+
+    @mock.patch.object(heartbeat_buffer, 'record', autospec=True)
+    @mock.patch.object(objects.node.Node, 'save', autospec=True)
+    @mock.patch.object(agent_base_vendor.BaseAgentVendor, 'deploy_is_done',
+                       autospec=True)
+    @mock.patch.object(agent_base_vendor.BaseAgentVendor, 'deploy_has_started',
+                       autospec=True)
+    def test_heartbeat_write_behind(self, mock_deploy_started, mock_done,
+                                    mock_save, mock_record):
+        mock_deploy_started.return_value = True
+        mock_done.return_value = False
+        self._set_heartbeat_state(states.DEPLOYWAIT)
+        with task_manager.acquire(
+                self.context, self.node.uuid, shared=False) as task:
+            self.passthru.heartbeat(task,
+                                    agent_url='http://127.0.0.1:9999/bar')
+            last_heartbeat = (
+                task.node.driver_internal_info['agent_last_heartbeat'])
+
+        self.assertFalse(mock_save.called)
+        mock_record.assert_called_once_with(
+            mock.ANY, last_heartbeat=last_heartbeat, touch_provisioning=True)
+
+    @mock.patch.object(heartbeat_buffer, 'record', autospec=True)
+    @mock.patch.object(objects.node.Node, 'save', autospec=True)
+    def test_heartbeat_write_behind_maintenance(self, mock_save, mock_record):
+        self._set_heartbeat_state(states.CLEANWAIT, maintenance=True)
+        with task_manager.acquire(
+                self.context, self.node.uuid, shared=False) as task:
+            self.passthru.heartbeat(task,
+                                    agent_url='http://127.0.0.1:9999/bar')
+            last_heartbeat = (
+                task.node.driver_internal_info['agent_last_heartbeat'])
+
+        self.assertFalse(mock_save.called)
+        mock_record.assert_called_once_with(
+            mock.ANY, last_heartbeat=last_heartbeat, touch_provisioning=False)
+
+    @mock.patch.object(heartbeat_buffer, 'record', autospec=True)
+    @mock.patch.object(agent_base_vendor.BaseAgentVendor, 'deploy_is_done',
+                       autospec=True)
+    @mock.patch.object(agent_base_vendor.BaseAgentVendor, 'deploy_has_started',
+                       autospec=True)
+    def test_heartbeat_agent_url_changed(self, mock_deploy_started,
+                                         mock_done, mock_record):
+        mock_deploy_started.return_value = True
+        mock_done.return_value = False
+        self._set_heartbeat_state(states.DEPLOYWAIT)
+        with task_manager.acquire(
+                self.context, self.node.uuid, shared=False) as task:
+            self.passthru.heartbeat(task,
+                                    agent_url='http://127.0.0.2:9999/bar')
+
+        self.node.refresh()
+        self.assertEqual('http://127.0.0.2:9999/bar',
+                         self.node.driver_internal_info['agent_url'])
+        self.assertIn('agent_last_heartbeat', self.node.driver_internal_info)
+        mock_record.assert_called_once_with(
+            mock.ANY, last_heartbeat=None, touch_provisioning=True)
+
+    @mock.patch.object(heartbeat_buffer, 'record', autospec=True)
+    @mock.patch.object(agent_base_vendor.BaseAgentVendor, 'continue_deploy',
+                       autospec=True)
+    @mock.patch.object(agent_base_vendor.BaseAgentVendor, 'deploy_has_started',
+                       autospec=True)
+    def test_heartbeat_saved_before_deploy(self, mock_deploy_started,
+                                           mock_continue, mock_record):
+        mock_deploy_started.return_value = False
+        self._set_heartbeat_state(states.DEPLOYWAIT)
+
+        def check_saved(vendor, task, **kwargs):
+            node = objects.Node.get_by_uuid(self.context, self.node.uuid)
+            self.assertIn('agent_last_heartbeat', node.driver_internal_info)
+
+        mock_continue.side_effect = check_saved
+        with task_manager.acquire(
+                self.context, self.node.uuid, shared=False) as task:
+            self.passthru.heartbeat(task,
+                                    agent_url='http://127.0.0.1:9999/bar')
+
+        mock_continue.assert_called_once_with(
+            mock.ANY, task, agent_url='http://127.0.0.1:9999/bar')
+        self.assertFalse(mock_record.called)
 
     def test_vendor_passthru_vendor_routes(self):
         expected = ['heartbeat']
@@ -551,6 +648,8 @@ class TestBaseAgentVendor(db_base.DbTestCase):
             self.assertIsInstance(driver_routes, dict)
             self.assertEqual(expected, list(driver_routes))
 
+    @mock.patch.object(driver_base.PowerStateCache, 'invalidate',
+                       autospec=True)
     @mock.patch.object(time, 'sleep', lambda seconds: None)
     @mock.patch.object(manager_utils, 'node_power_action', autospec=True)
     @mock.patch.object(fake.FakePower, 'get_power_state',
@@ -559,7 +658,8 @@ class TestBaseAgentVendor(db_base.DbTestCase):
                        spec=types.FunctionType)
     def test_reboot_and_finish_deploy(self, power_off_mock,
                                       get_power_state_mock,
-                                      node_power_action_mock):
+                                      node_power_action_mock,
+                                      invalidate_mock):
         self.node.provision_state = states.DEPLOYING
         self.node.target_provision_state = states.ACTIVE
         self.node.save()
@@ -570,6 +670,10 @@ class TestBaseAgentVendor(db_base.DbTestCase):
             self.passthru.reboot_and_finish_deploy(task)
             power_off_mock.assert_called_once_with(task.node)
             self.assertEqual(2, get_power_state_mock.call_count)
+            # The cached power state is dropped before each request
+            invalidate_mock.assert_has_calls(
+                [mock.call(driver_base.POWER_STATE_CACHE, task.node.uuid)] *
+                2)
             node_power_action_mock.assert_called_once_with(
                 task, states.REBOOT)
             self.assertEqual(states.ACTIVE, task.node.provision_state)
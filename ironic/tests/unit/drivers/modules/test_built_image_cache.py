@@ -0,0 +1,265 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the cache of the images built for virtual media boot."""
+
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+from oslo_config import cfg
+
+from ironic.common import exception
+from ironic.common import image_service
+from ironic.common import swift
+from ironic.drivers.modules import built_image_cache
+from ironic.tests import base
+
+CONF = cfg.CONF
+
+
+def _build(path):
+    with open(path, 'w') as f:
+        f.write('image')
+
+
+class GetKeyTestCase(base.TestCase):
+
+    def test_get_key(self):
+        key = built_image_cache.get_key('floppy', {'a': 1, 'b': 2})
+        self.assertEqual(64, len(key))
+        self.assertEqual(key,
+                         built_image_cache.get_key('floppy', {'b': 2, 'a': 1}))
+        self.assertNotEqual(key,
+                            built_image_cache.get_key('floppy', {'a': 2}))
+
+    @mock.patch.object(image_service, 'get_image_service', autospec=True)
+    def test_get_image_version(self, get_service_mock):
+        self.config(built_image_cache_ttl=600, group='deploy')
+        show_mock = get_service_mock.return_value.show
+        show_mock.return_value = {'size': 42, 'updated_at': 'yesterday',
+                                  'checksum': 'abc', 'properties': {}}
+
+        self.assertEqual({'href': 'http://image', 'size': 42,
+                          'updated_at': 'yesterday', 'checksum': 'abc'},
+                         built_image_cache.get_image_version(
+                             self.context, 'http://image'))
+        get_service_mock.assert_called_once_with('http://image',
+                                                 context=self.context)
+        show_mock.assert_called_once_with('http://image')
+
+    @mock.patch.object(image_service, 'get_image_service', autospec=True)
+    def test_get_image_version_disabled(self, get_service_mock):
+        self.assertEqual({'href': 'http://image'},
+                         built_image_cache.get_image_version(
+                             self.context, 'http://image'))
+        self.assertFalse(get_service_mock.called)
+
+
+class PutInDirectoryTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PutInDirectoryTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.build = mock.Mock(side_effect=_build)
+
+    def _built_path(self, key):
+        return os.path.join(self.directory,
+                            built_image_cache.BUILT_IMAGE_PREFIX + key +
+                            '.iso')
+
+    def test_put_in_directory_disabled(self):
+        built_image_cache.put_in_directory(self.directory, 'boot-1.iso',
+                                           'key', self.build)
+
+        self.assertEqual(['boot-1.iso'], os.listdir(self.directory))
+        path = os.path.join(self.directory, 'boot-1.iso')
+        self.build.assert_called_once_with(mock.ANY)
+        with open(path) as f:
+            self.assertEqual('image', f.read())
+        self.assertEqual(0o644, os.stat(path).st_mode & 0o777)
+
+    def test_put_in_directory_build_fails(self):
+        self.build.side_effect = IOError('fail')
+
+        self.assertRaises(IOError, built_image_cache.put_in_directory,
+                          self.directory, 'boot-1.iso', 'key', self.build)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_put_in_directory_cached(self):
+        self.config(built_image_cache_ttl=600, group='deploy')
+
+        built_image_cache.put_in_directory(self.directory, 'boot-1.iso',
+                                           'key', self.build)
+        built_image_cache.put_in_directory(self.directory, 'boot-2.iso',
+                                           'key', self.build)
+
+        self.build.assert_called_once_with(mock.ANY)
+        self.assertEqual(3, os.stat(self._built_path('key')).st_nlink)
+        for file_name in ('boot-1.iso', 'boot-2.iso'):
+            with open(os.path.join(self.directory, file_name)) as f:
+                self.assertEqual('image', f.read())
+
+    def test_put_in_directory_replaces_file(self):
+        self.config(built_image_cache_ttl=600, group='deploy')
+        built_image_cache.put_in_directory(self.directory, 'boot-1.iso',
+                                           'key1', self.build)
+
+        built_image_cache.put_in_directory(self.directory, 'boot-1.iso',
+                                           'key2', self.build)
+
+        self.assertEqual(2, self.build.call_count)
+        self.assertEqual(1, os.stat(self._built_path('key1')).st_nlink)
+        self.assertEqual(2, os.stat(self._built_path('key2')).st_nlink)
+
+    @mock.patch.object(os, 'link', autospec=True)
+    def test_put_in_directory_cannot_link(self, link_mock):
+        self.config(built_image_cache_ttl=600, group='deploy')
+        link_mock.side_effect = OSError('cross-device link')
+
+        built_image_cache.put_in_directory(self.directory, 'boot-1.iso',
+                                           'key', self.build)
+
+        path = os.path.join(self.directory, 'boot-1.iso')
+        with open(path) as f:
+            self.assertEqual('image', f.read())
+        self.assertEqual(1, os.stat(self._built_path('key')).st_nlink)
+
+    def test_put_in_directory_deleted_before_link(self):
+        self.config(built_image_cache_ttl=600, group='deploy')
+        built_image_cache.put_in_directory(self.directory, 'boot-1.iso',
+                                           'key', self.build)
+        link = os.link
+
+        def _link(source, destination):
+            if self.build.call_count == 1:
+                # Deleted by another conductor sharing the directory
+                os.unlink(source)
+            return link(source, destination)
+
+        with mock.patch.object(os, 'link', autospec=True,
+                               side_effect=_link):
+            built_image_cache.put_in_directory(self.directory, 'boot-2.iso',
+                                               'key', self.build)
+
+        self.assertEqual(2, self.build.call_count)
+        self.assertEqual(2, os.stat(self._built_path('key')).st_nlink)
+        with open(os.path.join(self.directory, 'boot-2.iso')) as f:
+            self.assertEqual('image', f.read())
+
+    def test_clean_up_directory(self):
+        self.config(built_image_cache_ttl=600, group='deploy')
+        for file_name, key in (('boot-1.iso', 'old-used'),
+                               ('boot-2.iso', 'old-unused'),
+                               ('boot-3.iso', 'new-unused')):
+            built_image_cache.put_in_directory(self.directory, file_name,
+                                               key, self.build)
+        os.unlink(os.path.join(self.directory, 'boot-2.iso'))
+        os.unlink(os.path.join(self.directory, 'boot-3.iso'))
+        old = time.time() - 1000
+        for key in ('old-used', 'old-unused'):
+            os.utime(self._built_path(key), (old, old))
+
+        built_image_cache.clean_up_directory(self.directory, 600)
+
+        self.assertTrue(os.path.exists(self._built_path('old-used')))
+        self.assertFalse(os.path.exists(self._built_path('old-unused')))
+        self.assertTrue(os.path.exists(self._built_path('new-unused')))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, 'boot-1.iso')))
+
+
+@mock.patch.object(swift, 'SwiftAPI', autospec=True)
+class PutInSwiftTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PutInSwiftTestCase, self).setUp()
+        self.build = mock.Mock(side_effect=_build)
+        self.built_object_name = built_image_cache.BUILT_IMAGE_PREFIX + 'key'
+
+    def test_put_in_swift_disabled(self, swift_api_mock):
+        swift_obj_mock = swift_api_mock.return_value
+
+        built_image_cache.put_in_swift('container', 'object', 'key',
+                                       self.build,
+                                       object_headers={'X-Delete-After': 60})
+
+        self.build.assert_called_once_with(mock.ANY)
+        swift_obj_mock.create_object.assert_called_once_with(
+            'container', 'object', mock.ANY,
+            object_headers={'X-Delete-After': 60})
+        self.assertFalse(swift_obj_mock.copy_object.called)
+
+    def test_put_in_swift_hit(self, swift_api_mock):
+        self.config(built_image_cache_ttl=600, group='deploy')
+        swift_obj_mock = swift_api_mock.return_value
+
+        built_image_cache.put_in_swift('container', 'object', 'key',
+                                       self.build)
+
+        self.assertFalse(self.build.called)
+        self.assertFalse(swift_obj_mock.create_object.called)
+        swift_obj_mock.copy_object.assert_called_once_with(
+            'container', self.built_object_name, 'object',
+            object_headers=None)
+        # The copy does not expire with the built image
+        self.assertEqual(
+            [mock.call('container', 'object', {'X-Remove-Delete-At': 'true'}),
+             mock.call('container', self.built_object_name,
+                       {'X-Delete-After': 600})],
+            swift_obj_mock.update_object_meta.call_args_list)
+
+    def test_put_in_swift_miss_keeps_headers(self, swift_api_mock):
+        self.config(built_image_cache_ttl=600, group='deploy')
+        swift_obj_mock = swift_api_mock.return_value
+        swift_obj_mock.copy_object.side_effect = [
+            exception.SwiftObjectNotFoundError(object=self.built_object_name,
+                                               container='container',
+                                               operation='copy'),
+            None]
+
+        built_image_cache.put_in_swift(
+            'container', 'object', 'key', self.build,
+            object_headers={'X-Object-Meta-Node': 'node1'})
+
+        swift_obj_mock.create_object.assert_called_once_with(
+            'container', self.built_object_name, mock.ANY,
+            object_headers={'X-Delete-After': 600})
+        swift_obj_mock.update_object_meta.assert_called_once_with(
+            'container', 'object', {'X-Object-Meta-Node': 'node1',
+                                    'X-Remove-Delete-At': 'true'})
+
+    def test_put_in_swift_miss(self, swift_api_mock):
+        self.config(built_image_cache_ttl=600, group='deploy')
+        swift_obj_mock = swift_api_mock.return_value
+        swift_obj_mock.copy_object.side_effect = [
+            exception.SwiftObjectNotFoundError(object=self.built_object_name,
+                                               container='container',
+                                               operation='copy'),
+            None]
+
+        built_image_cache.put_in_swift('container', 'object', 'key',
+                                       self.build,
+                                       object_headers={'X-Delete-After': 60})
+
+        self.build.assert_called_once_with(mock.ANY)
+        swift_obj_mock.create_object.assert_called_once_with(
+            'container', self.built_object_name, mock.ANY,
+            object_headers={'X-Delete-After': 600})
+        copy_call = mock.call('container', self.built_object_name, 'object',
+                              object_headers={'X-Delete-After': 60})
+        self.assertEqual([copy_call, copy_call],
+                         swift_obj_mock.copy_object.call_args_list)
+        self.assertFalse(swift_obj_mock.update_object_meta.called)
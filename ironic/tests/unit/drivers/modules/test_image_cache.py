@@ -18,10 +18,12 @@
 
 import datetime
 import os
+import sqlite3
 import tempfile
 import time
 import uuid
 
+import eventlet
 import mock
 from oslo_utils import uuidutils
 import six
@@ -173,6 +175,318 @@ class TestImageCacheFetch(base.TestCase):
                          os.stat(self.master_path).st_ino)
         with open(self.dest_path) as fp:
             self.assertEqual("TEST", fp.read())
+        self.assertEqual([(self.master_path, mock.ANY, 4)],
+                         self.cache._index.entries())
+
+    @mock.patch.object(image_cache.CacheIndex, 'touch', autospec=True)
+    @mock.patch.object(image_cache.ImageCache, 'clean_up', autospec=True)
+    @mock.patch.object(os, 'link', autospec=True)
+    @mock.patch.object(image_cache, '_delete_dest_path_if_stale',
+                       return_value=False, autospec=True)
+    @mock.patch.object(image_cache, '_delete_master_path_if_stale',
+                       return_value=True, autospec=True)
+    def test_fetch_image_cache_hit_updates_index(
+            self, mock_cache_upd, mock_dest_upd, mock_link, mock_clean_up,
+            mock_touch):
+        self.cache.fetch_image(self.uuid, self.dest_path)
+        mock_touch.assert_called_once_with(self.cache._index, self.uuid)
+
+    def _fake_download(self, cache, href, master_path, dest_path,
+                       ctx=None, force_raw=True):
+        # Let the other requests come in
+        eventlet.sleep(0)
+        with open(master_path, 'w') as fp:
+            fp.write('TEST')
+        os.link(master_path, dest_path)
+
+    @mock.patch.object(image_cache.ImageCache, 'clean_up', autospec=True)
+    @mock.patch.object(image_cache.ImageCache, '_download_image',
+                       autospec=True)
+    @mock.patch.object(image_cache, '_delete_master_path_if_stale',
+                       return_value=False, autospec=True)
+    def test_fetch_image_concurrent(self, mock_cache_upd, mock_download,
+                                    mock_clean_up):
+        mock_download.side_effect = self._fake_download
+        dest_paths = [os.path.join(self.dest_dir, str(i)) for i in range(5)]
+
+        pool = eventlet.GreenPool()
+        for dest_path in dest_paths:
+            pool.spawn(self.cache.fetch_image, self.uuid, dest_path)
+        pool.waitall()
+
+        mock_cache_upd.assert_called_once_with(self.master_path, self.uuid,
+                                               None)
+        mock_download.assert_called_once_with(
+            self.cache, self.uuid, self.master_path, dest_paths[0],
+            ctx=None, force_raw=True)
+        mock_clean_up.assert_called_once_with(self.cache)
+        for dest_path in dest_paths:
+            self.assertEqual(os.stat(self.master_path).st_ino,
+                             os.stat(dest_path).st_ino)
+        self.assertEqual({}, image_cache._downloads)
+
+    @mock.patch.object(image_cache.ImageCache, 'clean_up', autospec=True)
+    @mock.patch.object(image_cache.ImageCache, '_download_image',
+                       autospec=True)
+    @mock.patch.object(image_cache, '_delete_master_path_if_stale',
+                       return_value=False, autospec=True)
+    def test_fetch_image_concurrent_failure(self, mock_cache_upd,
+                                            mock_download, mock_clean_up):
+        def _fail(*args, **kwargs):
+            eventlet.sleep(0)
+            raise exception.ImageDownloadFailed(image_href=self.uuid,
+                                                reason='boom')
+        mock_download.side_effect = _fail
+
+        threads = [eventlet.spawn(self.cache.fetch_image, self.uuid,
+                                  os.path.join(self.dest_dir, str(i)))
+                   for i in range(3)]
+        for thread in threads:
+            self.assertRaises(exception.ImageDownloadFailed, thread.wait)
+
+        self.assertEqual(1, mock_download.call_count)
+        self.assertFalse(mock_clean_up.called)
+        self.assertEqual({}, image_cache._downloads)
+
+    @mock.patch.object(image_cache.ImageCache, 'clean_up', autospec=True)
+    @mock.patch.object(image_cache.ImageCache, '_download_image',
+                       autospec=True)
+    @mock.patch.object(image_cache, '_delete_master_path_if_stale',
+                       return_value=False, autospec=True)
+    def test_fetch_image_concurrent_killed(self, mock_cache_upd,
+                                           mock_download, mock_clean_up):
+        calls = []
+
+        def _download(*args, **kwargs):
+            calls.append(args[3])
+            if len(calls) == 1:
+                # Killed while downloading
+                eventlet.sleep(60)
+            return self._fake_download(*args, **kwargs)
+        mock_download.side_effect = _download
+
+        dest_paths = [os.path.join(self.dest_dir, str(i)) for i in range(3)]
+        threads = [eventlet.spawn(self.cache.fetch_image, self.uuid,
+                                  dest_path)
+                   for dest_path in dest_paths]
+        eventlet.sleep(0.01)
+        threads[0].kill()
+        for thread in threads[1:]:
+            thread.wait()
+
+        self.assertEqual(2, mock_download.call_count)
+        self.assertEqual(dest_paths[0], calls[0])
+        for dest_path in dest_paths[1:]:
+            self.assertEqual(os.stat(self.master_path).st_ino,
+                             os.stat(dest_path).st_ino)
+        self.assertEqual({}, image_cache._downloads)
+
+    @mock.patch.object(image_cache, '_DOWNLOAD_PROGRESS_INTERVAL', 0.01)
+    @mock.patch.object(image_cache.LOG, 'info', autospec=True)
+    def test__wait_for_download_progress(self, mock_log):
+        download, first = image_cache._join_download(self.master_path)
+        self.assertTrue(first)
+        download.tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(download.tmp_dir, 'image.part'), 'w') as fp:
+            fp.write('TEST')
+        with open(self.master_path, 'w') as fp:
+            fp.write('TEST')
+
+        def _finish():
+            eventlet.sleep(0.05)
+            image_cache._finish_download(self.master_path, download)
+        eventlet.spawn_n(_finish)
+
+        self.assertTrue(self.cache._wait_for_download(
+            download, self.uuid, self.master_path, self.dest_path))
+        self.assertEqual(os.stat(self.master_path).st_ino,
+                         os.stat(self.dest_path).st_ino)
+        self.assertIn(mock.call(mock.ANY, {'href': self.uuid, 'size': 4,
+                                           'time': mock.ANY}),
+                      mock_log.call_args_list)
+
+    def test__wait_for_download_master_removed(self):
+        download, first = image_cache._join_download(self.master_path)
+        image_cache._finish_download(self.master_path, download)
+        self.assertFalse(self.cache._wait_for_download(
+            download, self.uuid, self.master_path, self.dest_path))
+        self.assertFalse(os.path.exists(self.dest_path))
+
+    @mock.patch.object(images, 'download_size', autospec=True,
+                       return_value=4)
+    @mock.patch.object(image_cache, '_fetch', autospec=True)
+    def test_prefetch_image(self, mock_fetch, mock_size):
+        def _fake_fetch(ctx, href, path, force_raw):
+            with open(path, 'w') as fp:
+                fp.write('TEST')
+        mock_fetch.side_effect = _fake_fetch
+        self.cache._cache_size = 10
+        self.cache._cache_ttl = 600
+
+        self.cache.prefetch_image(self.uuid, ctx='fake-ctx', force_raw=False)
+        mock_size.assert_called_once_with('fake-ctx', self.uuid)
+        mock_fetch.assert_called_once_with('fake-ctx', self.uuid, mock.ANY,
+                                           False)
+        # Only the master file and the index are left, so the image can be
+        # evicted from the cache
+        self.assertEqual(sorted([self.uuid, image_cache.INDEX_DIR_NAME]),
+                         sorted(os.listdir(self.master_dir)))
+        self.assertEqual(1, os.stat(self.master_path).st_nlink)
+
+    @mock.patch.object(images, 'download_size', autospec=True,
+                       return_value=11)
+    @mock.patch.object(image_cache.ImageCache, 'fetch_image', autospec=True)
+    def test_prefetch_image_too_big(self, mock_fetch_image, mock_size):
+        self.cache._cache_size = 10
+        self.assertRaises(exception.ImageUnacceptable,
+                          self.cache.prefetch_image, self.uuid)
+        self.assertFalse(mock_fetch_image.called)
+
+    @mock.patch.object(images, 'download_size', autospec=True)
+    @mock.patch.object(image_cache.ImageCache, 'fetch_image', autospec=True)
+    def test_prefetch_image_no_master_dir(self, mock_fetch_image, mock_size):
+        self.cache.master_dir = None
+        self.cache.prefetch_image(self.uuid)
+        self.assertFalse(mock_size.called)
+        self.assertFalse(mock_fetch_image.called)
+
+
+class TestCacheIndex(base.TestCase):
+
+    def setUp(self):
+        super(TestCacheIndex, self).setUp()
+        self.master_dir = tempfile.mkdtemp()
+        self.index = image_cache.CacheIndex(self.master_dir)
+
+    def _create(self, name, data, last_used=None):
+        path = os.path.join(self.master_dir, name)
+        with open(path, 'w') as fp:
+            fp.write(data)
+        if last_used is not None:
+            os.utime(path, (last_used, last_used))
+        return path
+
+    def test_entries_finds_existing_files(self):
+        now = int(time.time())
+        path1 = self._create('1', 'abc', last_used=now + 100)
+        path2 = self._create('2', 'abcde', last_used=now + 50)
+        os.mkdir(os.path.join(self.master_dir, 'tmpdir'))
+
+        self.assertEqual([(path2, now + 50, 5), (path1, now + 100, 3)],
+                         self.index.entries())
+        self.assertEqual(8, self.index.total_size())
+
+    def test_add_touch_remove(self):
+        path1 = self._create('1', 'abc', last_used=time.time() + 100)
+        self.index.entries()
+        path2 = self._create('2', 'abcde')
+        self.index.add('2')
+        self.assertEqual([path2, path1],
+                         [entry[0] for entry in self.index.entries()])
+
+        with mock.patch.object(time, 'time', return_value=time.time() + 200,
+                               autospec=True):
+            self.index.touch('2')
+        self.assertEqual([path1, path2],
+                         [entry[0] for entry in self.index.entries()])
+
+        os.unlink(path2)
+        self.index.remove('2')
+        self.assertEqual([(path1, mock.ANY, 3)], self.index.entries())
+
+    @mock.patch.object(os, 'listdir', autospec=True)
+    def test_no_scan_when_up_to_date(self, mock_listdir):
+        mock_listdir.side_effect = lambda path: ['1']
+        self._create('1', 'abc')
+        self.index.entries()
+        self._create('2', 'abcde')
+        self.index.add('2')
+        os.unlink(os.path.join(self.master_dir, '1'))
+        self.index.remove('1')
+
+        self.assertEqual([os.path.join(self.master_dir, '2')],
+                         [entry[0] for entry in self.index.entries()])
+        self.assertEqual(5, self.index.total_size())
+        mock_listdir.assert_called_once_with(self.master_dir)
+
+    def test_scan_after_external_changes(self):
+        self._create('1', 'abc')
+        self.index.entries()
+        os.unlink(os.path.join(self.master_dir, '1'))
+        path2 = self._create('2', 'abcde')
+        self.assertEqual([(path2, mock.ANY, 5)], self.index.entries())
+
+    def test_persistent(self):
+        self._create('1', 'abc')
+        self.index.entries()
+        self.index.touch('1')
+        last_used = self.index.entries()[0][1]
+
+        index = image_cache.CacheIndex(self.master_dir)
+        self.assertEqual([(os.path.join(self.master_dir, '1'), last_used, 3)],
+                         index.entries())
+
+    def test_entries_by_priority(self):
+        path1 = self._create('1', 'a' * 100)
+        path2 = self._create('2', 'a' * 10)
+        self.index.add('1', cost=1)
+        self.index.add('2', cost=1)
+        # Smaller files are more expensive to keep out of the cache
+        self.assertEqual([path1, path2],
+                         [entry[0] for entry in
+                          self.index.entries(order_by='priority')])
+        # Used 11 times, 1 is now more valuable than 2
+        for i in range(10):
+            self.index.touch('1')
+        self.assertEqual([path2, path1],
+                         [entry[0] for entry in
+                          self.index.entries(order_by='priority')])
+
+    def test_eviction_ages_priorities(self):
+        path1 = self._create('1', 'a' * 10)
+        path2 = self._create('2', 'a' * 10)
+        self.index.add('1', cost=10)
+        self.index.add('2', cost=1)
+        for i in range(3):
+            self.index.touch('2')
+        # 1 has a priority of 1, 2 of 0.4
+        self.assertEqual([path2, path1],
+                         [entry[0] for entry in
+                          self.index.entries(order_by='priority')])
+        os.unlink(path2)
+        self.index.remove('2', evicted=True)
+        path3 = self._create('3', 'a' * 10)
+        self.index.add('3', cost=10)
+        # 3 gets a priority of 1.4, above the one of 1
+        self.assertEqual([path1, path3],
+                         [entry[0] for entry in
+                          self.index.entries(order_by='priority')])
+
+    def test_entries_invalid_order(self):
+        self.assertRaises(ValueError, self.index.entries,
+                          order_by='size; DROP TABLE files')
+
+    def test_upgrade(self):
+        path = self._create('1', 'abc')
+        master_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(master_dir, image_cache.INDEX_DIR_NAME))
+        db = sqlite3.connect(os.path.join(
+            master_dir, image_cache.INDEX_DIR_NAME, 'index.db'))
+        with db:
+            db.execute('CREATE TABLE files (name TEXT PRIMARY KEY, '
+                       'size INTEGER NOT NULL, last_used REAL NOT NULL)')
+            db.execute("INSERT INTO files VALUES ('1', 3, 42)")
+        db.close()
+        os.rename(path, os.path.join(master_dir, '1'))
+
+        index = image_cache.CacheIndex(master_dir)
+        self.assertEqual([(os.path.join(master_dir, '1'), 42, 3)],
+                         index.entries(order_by='priority'))
+
+    def test_shared_by_caches(self):
+        cache1 = image_cache.ImageCache(self.master_dir, 10, 10)
+        cache2 = image_cache.ImageCache(self.master_dir + '/', 10, 10)
+        self.assertIs(cache1._index, cache2._index)
 
 
 @mock.patch.object(os, 'unlink', autospec=True)
@@ -333,8 +647,7 @@ class TestImageCacheCleanUp(base.TestCase):
         self.assertEqual(files[0], survived[0][0])
         # NOTE(dtantsur): do not compare milliseconds
         self.assertEqual(int(new_current_time - 100), int(survived[0][1]))
-        self.assertEqual(int(new_current_time - 100),
-                         int(survived[0][2].st_mtime))
+        self.assertEqual(0, survived[0][2])
 
     @mock.patch.object(image_cache.ImageCache, '_clean_up_ensure_cache_size',
                        autospec=True)
@@ -368,7 +681,11 @@ class TestImageCacheCleanUp(base.TestCase):
 
         for filename in files:
             self.assertTrue(os.path.exists(filename))
-        mock_clean_size.assert_called_once_with(mock.ANY, [], None)
+        mock_clean_size.assert_called_once_with(mock.ANY, mock.ANY, None)
+        # Files in use are left for the next stage, which won't delete them
+        survived = mock_clean_size.call_args[0][1]
+        self.assertEqual(sorted(files + [f + 'copy' for f in files]),
+                         sorted(entry[0] for entry in survived))
 
     @mock.patch.object(image_cache.ImageCache, '_clean_up_too_old',
                        autospec=True)
@@ -443,6 +760,58 @@ class TestImageCacheCleanUp(base.TestCase):
         self.assertTrue(mock_log.called)
         mock_clean_ttl.assert_called_once_with(mock.ANY, mock.ANY, None)
 
+    def _add_files(self, sizes):
+        files = []
+        for name, size in sizes:
+            filename = os.path.join(self.master_dir, name)
+            with open(filename, 'w') as fp:
+                fp.write('a' * size)
+            self.cache._index.add(name, cost=1)
+            files.append(filename)
+        return files
+
+    def test_clean_up_lru(self):
+        small, big = self._add_files([('small', 3), ('big', 8)])
+        # small is used by every deployment, but less recently than big
+        for i in range(5):
+            self.cache._index.touch('small')
+        with mock.patch.object(time, 'time', return_value=time.time() + 100,
+                               autospec=True):
+            self.cache._index.touch('big')
+
+        self.cache.clean_up()
+
+        self.assertFalse(os.path.exists(small))
+        self.assertTrue(os.path.exists(big))
+
+    def test_clean_up_gdsf(self):
+        self.cache = image_cache.ImageCache(self.master_dir, cache_size=10,
+                                            cache_ttl=600, policy='gdsf')
+        small, big = self._add_files([('small', 3), ('big', 8)])
+        for i in range(5):
+            self.cache._index.touch('small')
+        self.cache._index.touch('big')
+
+        self.cache.clean_up()
+
+        self.assertTrue(os.path.exists(small))
+        self.assertFalse(os.path.exists(big))
+
+    def test_clean_up_pinned(self):
+        pinned_href = 'http://127.0.0.1/deploy_kernel'
+        pinned_name = image_cache._master_file_name(pinned_href)
+        self.cache = image_cache.ImageCache(self.master_dir, cache_size=1,
+                                            cache_ttl=600,
+                                            pinned=[pinned_href])
+        pinned, other = self._add_files([(pinned_name, 3), ('other', 3)])
+
+        new_current_time = time.time() + 900
+        with mock.patch.object(time, 'time', lambda: new_current_time):
+            self.cache.clean_up()
+
+        self.assertTrue(os.path.exists(pinned))
+        self.assertFalse(os.path.exists(other))
+
     @mock.patch.object(utils, 'rmtree_without_raise', autospec=True)
     @mock.patch.object(image_cache, '_fetch', autospec=True)
     def test_temp_images_not_cleaned(self, mock_fetch, mock_rmtree):
@@ -689,9 +1058,25 @@ class TestFetchCleanup(base.TestCase):
     @mock.patch.object(image_cache, '_clean_up_caches', autospec=True)
     def test__fetch(self, mock_clean, mock_raw, mock_fetch, mock_size):
         mock_size.return_value = 100
+        mock_fetch.return_value = 'qcow2'
         image_cache._fetch('fake', 'fake-uuid', '/foo/bar', force_raw=True)
         mock_fetch.assert_called_once_with('fake', 'fake-uuid',
                                            '/foo/bar.part', force_raw=False)
         mock_clean.assert_called_once_with('/foo', 100)
         mock_raw.assert_called_once_with('fake-uuid', '/foo/bar',
-                                         '/foo/bar.part')
+                                         '/foo/bar.part',
+                                         image_format='qcow2')
+
+    @mock.patch.object(images, 'converted_size', autospec=True)
+    @mock.patch.object(images, 'fetch', autospec=True)
+    @mock.patch.object(images, 'image_to_raw', autospec=True)
+    @mock.patch.object(image_cache, '_clean_up_caches', autospec=True)
+    def test__fetch_raw(self, mock_clean, mock_raw, mock_fetch, mock_size):
+        mock_fetch.return_value = 'raw'
+        image_cache._fetch('fake', 'fake-uuid', '/foo/bar', force_raw=True)
+        mock_fetch.assert_called_once_with('fake', 'fake-uuid',
+                                           '/foo/bar.part', force_raw=False)
+        self.assertFalse(mock_size.called)
+        self.assertFalse(mock_clean.called)
+        mock_raw.assert_called_once_with('fake-uuid', '/foo/bar',
+                                         '/foo/bar.part', image_format='raw')
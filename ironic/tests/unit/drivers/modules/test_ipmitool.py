@@ -42,6 +42,7 @@ from ironic.common import utils
 from ironic.conductor import task_manager
 from ironic.drivers.modules import console_utils
 from ironic.drivers.modules import ipmitool as ipmi
+from ironic.drivers.modules import ipmitool_shell
 from ironic.drivers import utils as driver_utils
 from ironic.tests import base
 from ironic.tests.unit.conductor import mgr_utils
@@ -1167,6 +1168,114 @@ class IPMIToolPrivateMethodTestCase(db_base.DbTestCase):
         mock_exec.assert_called_once_with(*args)
         self.assertFalse(mock_sleep.called)
 
+    @mock.patch.object(ipmi, '_is_option_supported', autospec=True)
+    @mock.patch.object(ipmitool_shell, 'execute', autospec=True)
+    @mock.patch.object(utils, 'execute', autospec=True)
+    def test__exec_ipmitool_shell_sessions(self, mock_exec, mock_shell,
+                                           mock_support, mock_sleep):
+        self.config(use_shell_sessions=True, group='ipmi')
+        ipmi.LAST_CMD_TIME = {}
+        args = [
+            'ipmitool',
+            '-I', 'lanplus',
+            '-H', self.info['address'],
+            '-L', self.info['priv_level'],
+            '-U', self.info['username'],
+        ]
+        mock_support.return_value = False
+        mock_shell.return_value = ('Chassis Power is on\n', '')
+
+        self.assertEqual(('Chassis Power is on\n', ''),
+                         ipmi._exec_ipmitool(self.info, 'power status'))
+
+        mock_shell.assert_called_once_with(args, self.info['password'],
+                                           'power status')
+        self.assertFalse(mock_exec.called)
+        self.assertFalse(mock_sleep.called)
+
+    @mock.patch.object(ipmi, '_is_option_supported', autospec=True)
+    @mock.patch.object(ipmitool_shell, 'execute', autospec=True)
+    def test__exec_ipmitool_shell_sessions_retry(self, mock_shell,
+                                                 mock_support, mock_sleep):
+        self.config(use_shell_sessions=True, group='ipmi')
+        self.config(min_command_interval=1, group='ipmi')
+        self.config(retry_timeout=2, group='ipmi')
+        ipmi.LAST_CMD_TIME = {}
+        mock_support.return_value = False
+        mock_shell.side_effect = [
+            processutils.ProcessExecutionError(
+                stderr="insufficient resources for session"),
+            ('Chassis Power is on\n', '')]
+
+        ipmi._exec_ipmitool(self.info, 'power status')
+
+        self.assertEqual(2, mock_shell.call_count)
+
+    @mock.patch.object(ipmi, '_exec_ipmitool_now', autospec=True)
+    def test__exec_ipmitool_command_scheduler(self, mock_exec, mock_sleep):
+        self.config(use_command_scheduler=True, group='ipmi')
+        mock_exec.return_value = ('Chassis Power is on\n', '')
+
+        self.assertEqual(('Chassis Power is on\n', ''),
+                         ipmi._exec_ipmitool(self.info, 'power status'))
+        mock_exec.assert_called_once_with(self.info, 'power status')
+
+    @mock.patch.object(ipmi, '_exec_ipmitool_now', autospec=True)
+    def test__exec_ipmitool_command_scheduler_error(self, mock_exec,
+                                                    mock_sleep):
+        self.config(use_command_scheduler=True, group='ipmi')
+        mock_exec.side_effect = processutils.ProcessExecutionError()
+
+        self.assertRaises(processutils.ProcessExecutionError,
+                          ipmi._exec_ipmitool, self.info, 'power on')
+        mock_exec.assert_called_once_with(self.info, 'power on')
+
+    @mock.patch.object(ipmi, '_exec_ipmitool_now', autospec=True)
+    def test__exec_ipmitool_async_coalesces_power_status(self, mock_exec,
+                                                         mock_sleep):
+        mock_exec.return_value = ('Chassis Power is on\n', '')
+
+        # Nothing runs before the futures are waited on
+        future1 = ipmi._exec_ipmitool_async(self.info, 'power status')
+        future2 = ipmi._exec_ipmitool_async(self.info, 'power status')
+
+        self.assertIs(future1, future2)
+        self.assertEqual(('Chassis Power is on\n', ''), future1.result())
+        mock_exec.assert_called_once_with(self.info, 'power status')
+
+    @mock.patch.object(ipmi.ipmitool_scheduler, 'submit', autospec=True)
+    def test__exec_ipmitool_async_coalesce_key(self, mock_submit,
+                                               mock_sleep):
+        ipmi._exec_ipmitool_async(self.info, 'power status')
+
+        mock_submit.assert_called_once_with(
+            self.info['address'], mock.ANY,
+            coalesce_key=('power status', self.info['address'],
+                          self.info['username'], self.info['uuid']))
+        self.assertNotIn(self.info['password'],
+                         mock_submit.call_args[1]['coalesce_key'])
+
+    @mock.patch.object(ipmi, '_exec_ipmitool_now', autospec=True)
+    def test__exec_ipmitool_async_keeps_order(self, mock_exec, mock_sleep):
+        mock_exec.return_value = ('', '')
+        other_info = dict(self.info, uuid='other-node')
+
+        futures = [ipmi._exec_ipmitool_async(self.info, 'power status'),
+                   ipmi._exec_ipmitool_async(other_info, 'power status'),
+                   ipmi._exec_ipmitool_async(self.info, 'power on'),
+                   ipmi._exec_ipmitool_async(self.info, 'power on'),
+                   ipmi._exec_ipmitool_async(self.info, 'power status')]
+
+        self.assertEqual(5, len(set(futures)))
+        for future in futures:
+            future.result()
+        self.assertEqual([mock.call(self.info, 'power status'),
+                          mock.call(other_info, 'power status'),
+                          mock.call(self.info, 'power on'),
+                          mock.call(self.info, 'power on'),
+                          mock.call(self.info, 'power status')],
+                         mock_exec.call_args_list)
+
     @mock.patch.object(ipmi, '_exec_ipmitool', autospec=True)
     def test__power_status_on(self, mock_exec, mock_sleep):
         mock_exec.return_value = ["Chassis Power is on\n", None]
@@ -1257,6 +1366,11 @@ class IPMIToolDriverTestCase(db_base.DbTestCase):
         self.assertEqual(sorted(expected),
                          sorted(self.driver.get_properties().keys()))
 
+    @mock.patch.object(ipmitool_shell, 'close_idle', autospec=True)
+    def test_close_idle_shell_sessions(self, mock_close_idle):
+        self.driver.power._close_idle_shell_sessions(mock.Mock(), self.context)
+        mock_close_idle.assert_called_once_with()
+
     @mock.patch.object(ipmi, '_exec_ipmitool', autospec=True)
     def test_get_power_state(self, mock_exec):
         returns = iter([["Chassis Power is off\n", None],
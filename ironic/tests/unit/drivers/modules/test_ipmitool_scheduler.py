@@ -0,0 +1,131 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Test class for the ipmitool command scheduler."""
+
+import eventlet
+import mock
+from oslo_concurrency import processutils
+
+from ironic.drivers.modules import ipmitool_scheduler
+from ironic.tests import base
+
+
+class CommandSchedulerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(CommandSchedulerTestCase, self).setUp()
+        self.scheduler = ipmitool_scheduler.CommandScheduler()
+        self.calls = []
+
+    def _command(self, name, result=None):
+        def func():
+            self.calls.append(name)
+            # Let the other queues run
+            eventlet.sleep(0)
+            self.calls.append(name + ' done')
+            return result
+        return func
+
+    def test_submit(self):
+        future = self.scheduler.submit('bmc1', self._command('a', 42))
+        self.assertEqual(1, len(self.scheduler))
+        self.assertEqual(42, future.result())
+        self.assertEqual(['a', 'a done'], self.calls)
+
+    def test_submit_same_bmc_serialized(self):
+        futures = [self.scheduler.submit('bmc1', self._command('a')),
+                   self.scheduler.submit('bmc1', self._command('b'))]
+        for future in futures:
+            future.result()
+        self.assertEqual(['a', 'a done', 'b', 'b done'], self.calls)
+
+    def test_submit_different_bmcs_concurrent(self):
+        futures = [self.scheduler.submit('bmc1', self._command('a')),
+                   self.scheduler.submit('bmc2', self._command('b'))]
+        for future in futures:
+            future.result()
+        self.assertEqual(['a', 'b', 'a done', 'b done'], self.calls)
+
+    def test_submit_exception(self):
+        func = mock.Mock(side_effect=RuntimeError('boom'))
+        future = self.scheduler.submit('bmc1', func)
+        next_future = self.scheduler.submit('bmc1', self._command('a', 1))
+
+        self.assertRaisesRegex(RuntimeError, 'boom', future.result)
+        self.assertEqual(1, next_future.result())
+
+    def test_submit_coalesce(self):
+        func = mock.Mock(return_value=42)
+        future1 = self.scheduler.submit('bmc1', func, coalesce_key='status')
+        future2 = self.scheduler.submit('bmc1', func, coalesce_key='status')
+
+        self.assertIs(future1, future2)
+        self.assertEqual(42, future2.result())
+        func.assert_called_once_with()
+
+    def test_submit_coalesce_only_last(self):
+        func = mock.Mock(return_value=42)
+        future1 = self.scheduler.submit('bmc1', func, coalesce_key='status')
+        self.scheduler.submit('bmc1', self._command('on'))
+        future2 = self.scheduler.submit('bmc1', func, coalesce_key='status')
+
+        self.assertIsNot(future1, future2)
+        self.assertEqual(42, future2.result())
+        self.assertEqual(2, func.call_count)
+
+    def test_submit_no_coalesce_once_started(self):
+        func = mock.Mock(return_value=42)
+        future1 = self.scheduler.submit('bmc1', func, coalesce_key='status')
+        self.assertEqual(42, future1.result())
+        future2 = self.scheduler.submit('bmc1', func, coalesce_key='status')
+
+        self.assertIsNot(future1, future2)
+        self.assertEqual(42, future2.result())
+        self.assertEqual(2, func.call_count)
+
+    def test_submit_cancelled(self):
+        func = mock.Mock()
+        future = self.scheduler.submit('bmc1', func)
+        self.assertTrue(future.cancel())
+        self.scheduler.submit('bmc1', self._command('a')).result()
+        self.assertFalse(func.called)
+
+    @mock.patch.object(eventlet, 'spawn_n', autospec=True)
+    def test_run_killed(self, mock_spawn):
+        def func():
+            raise eventlet.greenlet.GreenletExit()
+        future1 = self.scheduler.submit('bmc1', func)
+        future2 = self.scheduler.submit('bmc1', self._command('a'))
+        mock_spawn.assert_called_once_with(self.scheduler._run, 'bmc1',
+                                           mock.ANY)
+
+        self.assertRaises(eventlet.greenlet.GreenletExit,
+                          self.scheduler._run, *mock_spawn.call_args[0][1:])
+        for future in (future1, future2):
+            self.assertRaises(processutils.ProcessExecutionError,
+                              future.result)
+        self.assertEqual({}, self.scheduler._queues)
+        self.assertEqual([], self.calls)
+
+        # The BMC gets a new queue
+        mock_spawn.reset_mock()
+        self.scheduler.submit('bmc1', self._command('b'))
+        mock_spawn.assert_called_once_with(self.scheduler._run, 'bmc1',
+                                           mock.ANY)
+
+    def test_queue_removed_when_empty(self):
+        self.scheduler.submit('bmc1', self._command('a')).result()
+        # let the green thread notice the queue is empty
+        eventlet.sleep(0)
+        self.assertEqual({}, self.scheduler._queues)
+        self.assertEqual(0, len(self.scheduler))
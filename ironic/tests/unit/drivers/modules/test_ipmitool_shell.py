@@ -0,0 +1,280 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Test class for ipmitool shell sessions."""
+
+import os
+import sys
+import time
+
+import fixtures
+import mock
+from oslo_concurrency import processutils
+
+from ironic.drivers.modules import ipmitool_shell
+from ironic.tests import base
+from ironic.tests.unit.drivers.modules import fake_bmc
+
+FAKE_BMC = [sys.executable,
+            os.path.splitext(fake_bmc.__file__)[0] + '.py']
+
+
+class SessionTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SessionTestCase, self).setUp()
+        self.useFixture(fixtures.EnvironmentVariable('FAKE_BMC_PASSWORD',
+                                                     'secret'))
+        self.session = ipmitool_shell.Session(FAKE_BMC, 'secret')
+        self.addCleanup(self.session.close)
+
+    def test_execute(self):
+        self.assertEqual(('Chassis Power is off', ''),
+                         self.session.execute('power status', 10))
+        self.assertEqual(('Chassis Power Control: Up/On', ''),
+                         self.session.execute('power on', 10))
+        self.assertEqual(('Chassis Power is on', ''),
+                         self.session.execute('power status', 10))
+
+    def test_execute_reuses_process(self):
+        self.session.execute('power status', 10)
+        pid = self.session._process.pid
+        self.session.execute('power status', 10)
+        self.assertEqual(pid, self.session._process.pid)
+        self.assertTrue(self.session.is_alive)
+
+    def test_execute_error_closes_session(self):
+        self.session.execute('power on', 10)
+        self.assertRaisesRegex(processutils.ProcessExecutionError,
+                               'Invalid command: meow',
+                               self.session.execute, 'meow', 10)
+        self.assertFalse(self.session.is_alive)
+        # A new process (with a new power state) is started
+        self.assertEqual(('Chassis Power is off', ''),
+                         self.session.execute('power status', 10))
+
+    def test_execute_retryable_error(self):
+        exc = self.assertRaises(processutils.ProcessExecutionError,
+                                self.session.execute, 'busy', 10)
+        self.assertIn('insufficient resources for session', str(exc))
+
+    def test_execute_timeout(self):
+        self.assertRaisesRegex(processutils.ProcessExecutionError,
+                               'Timed out',
+                               self.session.execute, 'hang', 0.5)
+        self.assertFalse(self.session.is_alive)
+
+    def test_execute_process_exits(self):
+        self.assertRaisesRegex(processutils.ProcessExecutionError,
+                               'exited unexpectedly',
+                               self.session.execute, 'crash', 10)
+        self.assertFalse(self.session.is_alive)
+
+    def test_execute_wrong_password(self):
+        session = ipmitool_shell.Session(FAKE_BMC, 'wrong')
+        self.addCleanup(session.close)
+        self.assertRaises(processutils.ProcessExecutionError,
+                          session.execute, 'power status', 10)
+
+    def test_execute_no_ipmitool(self):
+        session = ipmitool_shell.Session(['/nonexistent/ipmitool'], 'secret')
+        self.assertRaises(processutils.ProcessExecutionError,
+                          session.execute, 'power status', 10)
+        self.assertFalse(session.is_alive)
+
+    def test_close(self):
+        self.session.execute('power status', 10)
+        process = self.session._process
+        self.session.close()
+        self.assertIsNotNone(process.poll())
+        self.assertFalse(self.session.is_alive)
+        # closing twice is fine
+        self.session.close()
+
+    def test_discard(self):
+        self.session.execute('power status', 10)
+        self.assertTrue(self.session.discard())
+        self.assertFalse(self.session.is_alive)
+        self.assertRaises(ipmitool_shell.SessionDiscarded,
+                          self.session.execute, 'power status', 10)
+
+    def test_discard_busy(self):
+        self.session.execute('power status', 10)
+        with self.session._lock:
+            self.assertFalse(self.session.discard(blocking=False))
+        self.assertTrue(self.session.is_alive)
+        self.assertEqual(('Chassis Power is off', ''),
+                         self.session.execute('power status', 10))
+
+    def test_execute_updates_last_used(self):
+        self.session.last_used = 0
+        before = time.time()
+        self.session.execute('power status', 10)
+        self.assertGreaterEqual(self.session.last_used, before)
+
+
+class ErrorRegexTestCase(base.TestCase):
+
+    def test_errors(self):
+        for output in ('Error: Unable to establish IPMI v2 / RMCP+ session',
+                       'Unable to get Chassis Power Status',
+                       'Invalid command: meow',
+                       'Set Chassis Power Control to Up/On failed: Timeout',
+                       'Get Device ID command failed'):
+            self.assertTrue(ipmitool_shell._ERROR_RE.search(output), output)
+
+    def test_not_errors(self):
+        for output in ('Chassis Power is on',
+                       'PS1 Status       | 0x02      | ok\n'
+                       'Drive 0          | failed    | cr',
+                       'HDD Status       | 2.1 | Drive Present, '
+                       'Failed, Rebuild failed'):
+            self.assertFalse(ipmitool_shell._ERROR_RE.search(output), output)
+
+
+@mock.patch.object(ipmitool_shell, 'Session', autospec=True)
+class SessionPoolTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SessionPoolTestCase, self).setUp()
+        self.pool = ipmitool_shell.SessionPool()
+
+    def _session(self, *args, **kwargs):
+        session = mock.Mock(spec=['execute', 'discard', 'last_used'])
+        session.last_used = time.time()
+        session.discard.return_value = True
+        return session
+
+    def test_get_same_session(self, session_mock):
+        session_mock.side_effect = self._session
+        session = self.pool.get(['ipmitool', '-H', 'a'], 'pass')
+        self.assertIs(session, self.pool.get(['ipmitool', '-H', 'a'], 'pass'))
+        session_mock.assert_called_once_with(['ipmitool', '-H', 'a'], 'pass')
+
+    def test_get_different_sessions(self, session_mock):
+        session_mock.side_effect = self._session
+        session1 = self.pool.get(['ipmitool', '-H', 'a'], 'pass')
+        session2 = self.pool.get(['ipmitool', '-H', 'b'], 'pass')
+        session3 = self.pool.get(['ipmitool', '-H', 'a'], 'other')
+        self.assertEqual(3, len(set([session1, session2, session3])))
+        self.assertEqual(3, len(self.pool))
+
+    def test_get_evicts_idle(self, session_mock):
+        self.config(shell_session_idle_timeout=30, group='ipmi')
+        session_mock.side_effect = self._session
+        session1 = self.pool.get(['ipmitool', '-H', 'a'], 'pass')
+        session1.last_used = time.time() - 31
+
+        session2 = self.pool.get(['ipmitool', '-H', 'b'], 'pass')
+        session1.discard.assert_called_once_with(blocking=False)
+        self.assertFalse(session2.discard.called)
+        self.assertEqual(1, len(self.pool))
+        self.assertIsNot(session1,
+                         self.pool.get(['ipmitool', '-H', 'a'], 'pass'))
+
+    def test_close_idle(self, session_mock):
+        self.config(shell_session_idle_timeout=30, group='ipmi')
+        session_mock.side_effect = self._session
+        session1 = self.pool.get(['ipmitool', '-H', 'a'], 'pass')
+        session2 = self.pool.get(['ipmitool', '-H', 'b'], 'pass')
+        session1.last_used = time.time() - 31
+
+        self.pool.close_idle()
+        session1.discard.assert_called_once_with(blocking=False)
+        self.assertFalse(session2.discard.called)
+        self.assertEqual(1, len(self.pool))
+
+    def test_get_keeps_idle_busy(self, session_mock):
+        self.config(shell_session_idle_timeout=30, group='ipmi')
+        session_mock.side_effect = self._session
+        session1 = self.pool.get(['ipmitool', '-H', 'a'], 'pass')
+        session1.last_used = time.time() - 31
+        session1.discard.return_value = False
+
+        self.pool.get(['ipmitool', '-H', 'b'], 'pass')
+        session1.discard.assert_called_once_with(blocking=False)
+        self.assertEqual(2, len(self.pool))
+        self.assertIs(session1,
+                      self.pool.get(['ipmitool', '-H', 'a'], 'pass'))
+
+    def test_get_evicts_least_recently_used(self, session_mock):
+        self.config(shell_session_max=2, group='ipmi')
+        session_mock.side_effect = self._session
+        session1 = self.pool.get(['ipmitool', '-H', 'a'], 'pass')
+        session2 = self.pool.get(['ipmitool', '-H', 'b'], 'pass')
+        self.pool.get(['ipmitool', '-H', 'a'], 'pass')
+
+        self.pool.get(['ipmitool', '-H', 'c'], 'pass')
+        session2.discard.assert_called_once_with(blocking=False)
+        self.assertFalse(session1.discard.called)
+        self.assertEqual(2, len(self.pool))
+
+    def test_get_evicts_least_recently_used_not_busy(self, session_mock):
+        self.config(shell_session_max=2, group='ipmi')
+        session_mock.side_effect = self._session
+        session1 = self.pool.get(['ipmitool', '-H', 'a'], 'pass')
+        session2 = self.pool.get(['ipmitool', '-H', 'b'], 'pass')
+        session1.discard.return_value = False
+
+        self.pool.get(['ipmitool', '-H', 'c'], 'pass')
+        session1.discard.assert_called_once_with(blocking=False)
+        session2.discard.assert_called_once_with(blocking=False)
+        self.assertEqual(2, len(self.pool))
+        self.assertIs(session1,
+                      self.pool.get(['ipmitool', '-H', 'a'], 'pass'))
+
+    def test_get_all_busy(self, session_mock):
+        self.config(shell_session_max=2, group='ipmi')
+        session_mock.side_effect = self._session
+        session1 = self.pool.get(['ipmitool', '-H', 'a'], 'pass')
+        session2 = self.pool.get(['ipmitool', '-H', 'b'], 'pass')
+        session1.discard.return_value = False
+        session2.discard.return_value = False
+
+        self.pool.get(['ipmitool', '-H', 'c'], 'pass')
+        self.assertEqual(3, len(self.pool))
+
+    def test_close_all(self, session_mock):
+        session_mock.side_effect = self._session
+        session1 = self.pool.get(['ipmitool', '-H', 'a'], 'pass')
+        session2 = self.pool.get(['ipmitool', '-H', 'b'], 'pass')
+        self.pool.close_all()
+        session1.discard.assert_called_once_with()
+        session2.discard.assert_called_once_with()
+        self.assertEqual(0, len(self.pool))
+
+    @mock.patch.object(ipmitool_shell, '_POOL', autospec=True)
+    def test_execute(self, pool_mock, session_mock):
+        self.config(retry_timeout=42, group='ipmi')
+        session = pool_mock.get.return_value
+        session.execute.return_value = ('out', '')
+
+        self.assertEqual(('out', ''),
+                         ipmitool_shell.execute(['ipmitool'], 'pass',
+                                                'power status'))
+        pool_mock.get.assert_called_once_with(['ipmitool'], 'pass')
+        session.execute.assert_called_once_with('power status', 42)
+
+    @mock.patch.object(ipmitool_shell, '_POOL', autospec=True)
+    def test_execute_discarded(self, pool_mock, session_mock):
+        self.config(retry_timeout=42, group='ipmi')
+        discarded = mock.Mock(spec=['execute'])
+        discarded.execute.side_effect = ipmitool_shell.SessionDiscarded()
+        session = mock.Mock(spec=['execute'])
+        session.execute.return_value = ('out', '')
+        pool_mock.get.side_effect = [discarded, session]
+
+        self.assertEqual(('out', ''),
+                         ipmitool_shell.execute(['ipmitool'], 'pass',
+                                                'power status'))
+        self.assertEqual(2, pool_mock.get.call_count)
+        session.execute.assert_called_once_with('power status', 42)
@@ -36,6 +36,7 @@ from ironic.conductor import utils as manager_utils
 from ironic.drivers.modules import agent_base_vendor
 from ironic.drivers.modules import agent_client
 from ironic.drivers.modules import deploy_utils
+from ironic.drivers.modules import image_cache
 from ironic.drivers.modules import iscsi_deploy
 from ironic.drivers.modules import pxe
 from ironic.tests.unit.conductor import mgr_utils
@@ -513,6 +514,14 @@ class ISCSIDeployTestCase(db_base.DbTestCase):
                                   shared=True) as task:
             self.assertEqual({}, task.driver.deploy.get_properties())
 
+    @mock.patch.object(image_cache.ImageCache, '__init__', autospec=True,
+                       return_value=None)
+    def test_get_image_cache(self, mock_init):
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertIsInstance(task.driver.deploy.get_image_cache(),
+                                  iscsi_deploy.InstanceImageCache)
+
     @mock.patch.object(iscsi_deploy, 'validate', autospec=True)
     @mock.patch.object(deploy_utils, 'validate_capabilities', autospec=True)
     @mock.patch.object(pxe.PXEBoot, 'validate', autospec=True)
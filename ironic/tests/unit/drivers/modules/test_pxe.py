@@ -34,6 +34,7 @@ from ironic.common import states
 from ironic.conductor import task_manager
 from ironic.drivers.modules import agent_base_vendor
 from ironic.drivers.modules import deploy_utils
+from ironic.drivers.modules import image_cache
 from ironic.drivers.modules import pxe
 from ironic.tests.unit.conductor import mgr_utils
 from ironic.tests.unit.db import base as db_base
@@ -527,6 +528,14 @@ class PXEBootTestCase(db_base.DbTestCase):
                                   shared=True) as task:
             self.assertEqual(expected, task.driver.get_properties())
 
+    @mock.patch.object(image_cache.ImageCache, '__init__', autospec=True,
+                       return_value=None)
+    def test_get_image_cache(self, mock_init):
+        with task_manager.acquire(self.context, self.node.uuid,
+                                  shared=True) as task:
+            self.assertIsInstance(task.driver.boot.get_image_cache(),
+                                  pxe.TFTPImageCache)
+
     @mock.patch.object(base_image_service.BaseImageService, '_show',
                        autospec=True)
     def test_validate_good(self, mock_glance):
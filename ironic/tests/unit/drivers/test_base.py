@@ -14,11 +14,14 @@
 #    under the License.
 
 import json
+import time
 
+import eventlet
 import mock
 
 from ironic.common import exception
 from ironic.common import raid
+from ironic.common import states
 from ironic.drivers import base as driver_base
 from ironic.tests import base
 
@@ -336,6 +339,149 @@ class CleanStepTestCase(base.TestCase):
         method_args_mock.assert_called_once_with(task_mock, **args)
 
 
+class FakePowerInterface(driver_base.PowerInterface):
+
+    def __init__(self):
+        self.power_state = states.POWER_OFF
+        self.bmc_calls = 0
+
+    def get_properties(self):
+        return {}
+
+    def validate(self, task):
+        pass
+
+    def get_power_state(self, task):
+        self.bmc_calls += 1
+        # Let other threads run while the BMC answers
+        eventlet.sleep(0)
+        return self.power_state
+
+    def set_power_state(self, task, power_state):
+        self.power_state = power_state
+
+    def reboot(self, task):
+        if self.get_power_state(task) == states.POWER_OFF:
+            self.set_power_state(task, states.POWER_ON)
+
+
+class PowerStateCacheTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PowerStateCacheTestCase, self).setUp()
+        cache_patch = mock.patch.object(driver_base, 'POWER_STATE_CACHE',
+                                        driver_base.PowerStateCache())
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
+        self.power = FakePowerInterface()
+        self.task = mock.Mock(spec=['node'])
+        self.task.node.uuid = 'fake-uuid'
+
+    def test_disabled(self):
+        self.assertEqual(states.POWER_OFF,
+                         self.power.get_power_state(self.task))
+        self.assertEqual(states.POWER_OFF,
+                         self.power.get_power_state(self.task))
+        self.assertEqual(2, self.power.bmc_calls)
+
+    def test_ttl(self):
+        self.config(power_state_cache_ttl=10, group='conductor')
+        self.power.get_power_state(self.task)
+        self.assertEqual(states.POWER_OFF,
+                         self.power.get_power_state(self.task))
+        self.assertEqual(1, self.power.bmc_calls)
+
+    def test_ttl_expired(self):
+        self.config(power_state_cache_ttl=10, group='conductor')
+        self.power.get_power_state(self.task)
+        expired = time.time() + 11
+        with mock.patch.object(time, 'time', autospec=True) as mock_time:
+            mock_time.return_value = expired
+            self.power.get_power_state(self.task)
+        self.assertEqual(2, self.power.bmc_calls)
+
+    def test_per_node(self):
+        self.config(power_state_cache_ttl=10, group='conductor')
+        other_task = mock.Mock(spec=['node'])
+        other_task.node.uuid = 'other-uuid'
+        self.power.get_power_state(self.task)
+        self.power.get_power_state(other_task)
+        self.assertEqual(2, self.power.bmc_calls)
+
+    def test_error_not_cached(self):
+        self.config(power_state_cache_ttl=10, group='conductor')
+        self.power.power_state = states.ERROR
+        self.power.get_power_state(self.task)
+        self.power.get_power_state(self.task)
+        self.assertEqual(2, self.power.bmc_calls)
+
+    def test_set_power_state_invalidates(self):
+        self.config(power_state_cache_ttl=10, group='conductor')
+        self.power.get_power_state(self.task)
+        self.power.set_power_state(self.task, states.POWER_ON)
+        self.assertEqual(states.POWER_ON,
+                         self.power.get_power_state(self.task))
+        self.assertEqual(2, self.power.bmc_calls)
+
+    def test_reboot_invalidates_and_bypasses_cache(self):
+        self.config(power_state_cache_ttl=10, group='conductor')
+        self.power.get_power_state(self.task)
+        self.power.reboot(self.task)
+        # reboot() asked the BMC directly
+        self.assertEqual(2, self.power.bmc_calls)
+        self.assertEqual(states.POWER_ON,
+                         self.power.get_power_state(self.task))
+        self.assertEqual(3, self.power.bmc_calls)
+
+    def test_nested_power_call(self):
+        def inner(power, task):
+            return getattr(driver_base._power_call, 'active', False)
+
+        def outer(power, task):
+            driver_base._run_power_call(inner, power, task)
+            return getattr(driver_base._power_call, 'active', False)
+
+        self.assertTrue(driver_base._run_power_call(outer, self.power,
+                                                    self.task))
+        self.assertFalse(driver_base._power_call.active)
+
+    def test_concurrent_requests_coalesced(self):
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(lambda i: self.power.get_power_state(
+            self.task), range(5)))
+        self.assertEqual([states.POWER_OFF] * 5, results)
+        self.assertEqual(1, self.power.bmc_calls)
+
+    def test_concurrent_requests_error(self):
+        with mock.patch.object(FakePowerInterface, 'get_power_state',
+                               autospec=True) as mock_get:
+            # The mock replaced the cached method, wrap it again
+            get = driver_base._cache_power_state(mock_get)
+
+            def fail(*args):
+                eventlet.sleep(0)
+                raise exception.IPMIFailure(cmd='power status')
+            mock_get.side_effect = fail
+
+            threads = [eventlet.spawn(get, self.power, self.task)
+                       for i in range(3)]
+            for thread in threads:
+                self.assertRaises(exception.IPMIFailure, thread.wait)
+            mock_get.assert_called_once_with(self.power, self.task)
+
+    def test_invalidate_during_request(self):
+        self.config(power_state_cache_ttl=10, group='conductor')
+
+        def get(task):
+            # The power state changed while the BMC was being asked
+            driver_base.POWER_STATE_CACHE.invalidate(task.node.uuid)
+            return states.POWER_OFF
+        self.assertEqual(states.POWER_OFF,
+                         driver_base.POWER_STATE_CACHE.get(
+                             'fake-uuid', lambda: get(self.task)))
+        self.assertEqual({}, driver_base.POWER_STATE_CACHE._states)
+
+
 class MyRAIDInterface(driver_base.RAIDInterface):
 
     def create_configuration(self, task):
@@ -17,6 +17,7 @@ import mock
 from testtools.matchers import HasLength
 
 from ironic.common import exception
+from ironic.common import json_utils
 from ironic import objects
 from ironic.tests.unit.db import base
 from ironic.tests.unit.db import utils
@@ -36,7 +37,7 @@ class TestNodeObject(base.DbTestCase):
 
             node = objects.Node.get(self.context, node_id)
 
-            mock_get_node.assert_called_once_with(node_id)
+            mock_get_node.assert_called_once_with(node_id, filters=None)
             self.assertEqual(self.context, node._context)
 
     def test_get_by_uuid(self):
@@ -47,7 +48,7 @@ class TestNodeObject(base.DbTestCase):
 
             node = objects.Node.get(self.context, uuid)
 
-            mock_get_node.assert_called_once_with(uuid)
+            mock_get_node.assert_called_once_with(uuid, filters=None)
             self.assertEqual(self.context, node._context)
 
     def test_get_bad_id_and_uuid(self):
@@ -69,7 +70,7 @@ class TestNodeObject(base.DbTestCase):
                 n.driver = "fake-driver"
                 n.save()
 
-                mock_get_node.assert_called_once_with(uuid)
+                mock_get_node.assert_called_once_with(uuid, filters=None)
                 mock_update_node.assert_called_once_with(
                     uuid, {'properties': {"fake": "property"},
                            'driver': 'fake-driver',
@@ -81,7 +82,8 @@ class TestNodeObject(base.DbTestCase):
         uuid = self.fake_node['uuid']
         returns = [dict(self.fake_node, properties={"fake": "first"}),
                    dict(self.fake_node, properties={"fake": "second"})]
-        expected = [mock.call(uuid), mock.call(uuid)]
+        expected = [mock.call(uuid, filters=None),
+                    mock.call(uuid, filters=None)]
         with mock.patch.object(self.dbapi, 'get_node_by_uuid',
                                side_effect=returns,
                                autospec=True) as mock_get_node:
@@ -109,7 +111,8 @@ class TestNodeObject(base.DbTestCase):
             fake_tag = 'fake-tag'
             node = objects.Node.reserve(self.context, fake_tag, node_id)
             self.assertIsInstance(node, objects.Node)
-            mock_reserve.assert_called_once_with(fake_tag, node_id)
+            mock_reserve.assert_called_once_with(fake_tag, node_id,
+                                                 filters=None)
             self.assertEqual(self.context, node._context)
 
     def test_reserve_node_not_found(self):
@@ -122,6 +125,28 @@ class TestNodeObject(base.DbTestCase):
                               objects.Node.reserve, self.context, 'fake-tag',
                               node_id)
 
+    def test_reserve_nodes(self):
+        with mock.patch.object(self.dbapi, 'reserve_nodes',
+                               autospec=True) as mock_reserve:
+            mock_reserve.return_value = [self.fake_node]
+            node_id = self.fake_node['id']
+            nodes = objects.Node.reserve_nodes(self.context, 'fake-tag',
+                                               [node_id, 'other'],
+                                               filters={'maintenance': False})
+            self.assertEqual(1, len(nodes))
+            self.assertIsInstance(nodes[0], objects.Node)
+            self.assertEqual(self.context, nodes[0]._context)
+            mock_reserve.assert_called_once_with(
+                'fake-tag', [node_id, 'other'],
+                filters={'maintenance': False})
+
+    def test_release_nodes(self):
+        with mock.patch.object(self.dbapi, 'release_nodes',
+                               autospec=True) as mock_release:
+            node_id = self.fake_node['id']
+            objects.Node.release_nodes(self.context, 'fake-tag', [node_id])
+            mock_release.assert_called_once_with('fake-tag', [node_id])
+
     def test_release(self):
         with mock.patch.object(self.dbapi, 'release_node',
                                autospec=True) as mock_release:
@@ -165,7 +190,7 @@ class TestNodeObject(base.DbTestCase):
                                'cpus': '-1', 'cpu_arch': 'x86_64'}
             self.assertRaisesRegexp(exception.InvalidParameterValue,
                                     ".*local_gb=5G, cpus=-1$", node.save)
-            mock_get_node.assert_called_once_with(uuid)
+            mock_get_node.assert_called_once_with(uuid, filters=None)
 
     def test__validate_property_values_success(self):
         uuid = self.fake_node['uuid']
@@ -182,3 +207,79 @@ class TestNodeObject(base.DbTestCase):
             }
             node._validate_property_values(values['properties'])
             self.assertEqual(expect, values['properties'])
+
+    def test_json_fields_decoded_on_access(self):
+        db_node = utils.create_test_node(driver_internal_info={'foo': 'bar'})
+
+        node = objects.Node.get_by_uuid(self.context, db_node.uuid)
+        self.assertIn('driver_internal_info', node._encoded_fields)
+        self.assertTrue(node.obj_attr_is_set('driver_internal_info'))
+        self.assertEqual({'foo': 'bar'}, node.driver_internal_info)
+        self.assertNotIn('driver_internal_info', node._encoded_fields)
+        self.assertEqual(set(), node.obj_what_changed())
+
+    def test_json_fields_set_before_access(self):
+        db_node = utils.create_test_node(driver_internal_info={'foo': 'bar'})
+
+        node = objects.Node.get_by_uuid(self.context, db_node.uuid)
+        node.driver_internal_info = {'a': 'b'}
+        self.assertNotIn('driver_internal_info', node._encoded_fields)
+        self.assertEqual({'a': 'b'}, node.driver_internal_info)
+        self.assertEqual(set(['driver_internal_info']),
+                         node.obj_what_changed())
+
+    def test_save_without_decoding(self):
+        db_node = utils.create_test_node(driver_internal_info={'foo': 'bar'})
+
+        node = objects.Node.get_by_uuid(self.context, db_node.uuid)
+        with mock.patch.object(json_utils.EncodedJson, 'decode',
+                               autospec=True) as mock_decode:
+            node.power_state = 'power off'
+            node.save()
+            self.assertFalse(mock_decode.called)
+
+        node = objects.Node.get_by_uuid(self.context, db_node.uuid)
+        self.assertEqual('power off', node.power_state)
+        self.assertEqual({'foo': 'bar'}, node.driver_internal_info)
+
+    def test_refresh_json_fields(self):
+        db_node = utils.create_test_node(driver_internal_info={'foo': 'bar'},
+                                         extra={'a': 'b'})
+        node = objects.Node.get_by_uuid(self.context, db_node.uuid)
+        self.assertEqual({'a': 'b'}, node.extra)
+        self.dbapi.update_node(db_node.id,
+                               {'driver_internal_info': {'foo': 'baz'},
+                                'extra': {'a': 'c'}})
+
+        node.refresh()
+        self.assertEqual({'foo': 'baz'}, node.driver_internal_info)
+        self.assertEqual({'a': 'c'}, node.extra)
+
+    def test_from_db_object_reload(self):
+        db_node = utils.create_test_node(driver_internal_info={'foo': 'bar'},
+                                         extra={'a': 'b'})
+        node = objects.Node.get_by_uuid(self.context, db_node.uuid)
+        # extra is decoded, driver_internal_info is still encoded
+        self.assertEqual({'a': 'b'}, node.extra)
+        self.dbapi.update_node(db_node.id,
+                               {'driver_internal_info': {'foo': 'baz'},
+                                'extra': {'a': 'c'}})
+
+        objects.Node._from_db_object(
+            node, self.dbapi.get_node_by_uuid(db_node.uuid))
+        self.assertIn('extra', node._encoded_fields)
+        self.assertIn('driver_internal_info', node._encoded_fields)
+        self.assertEqual({'foo': 'baz'}, node.driver_internal_info)
+        self.assertEqual({'a': 'c'}, node.extra)
+        self.assertEqual(set(), node.obj_what_changed())
+
+    def test_as_dict_decodes_json_fields(self):
+        db_node = utils.create_test_node(driver_internal_info={'foo': 'bar'})
+
+        node = objects.Node.get_by_uuid(self.context, db_node.uuid)
+        self.assertEqual({'foo': 'bar'},
+                         node.as_dict()['driver_internal_info'])
+        primitive = node.obj_to_primitive()
+        self.assertEqual({'foo': 'bar'},
+                         primitive['ironic_object.data']
+                         ['driver_internal_info'])
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measure how long it takes to build a hash ring and to map nodes onto it.
+
+Example::
+
+    $ python tools/hash_ring_benchmark.py --conductors 100 --exponent 10 \\
+        --nodes 100000
+"""
+
+import optparse
+import os
+import sys
+import time
+import uuid
+
+top_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                       os.pardir))
+sys.path.insert(0, top_dir)
+
+from ironic.common import hash_ring  # noqa
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-c", "--conductors", dest="conductors", type="int",
+                      help="number of conductors in the ring",
+                      default=100)
+    parser.add_option("-e", "--exponent", dest="exponent", type="int",
+                      help="hash partition exponent", default=10)
+    parser.add_option("-n", "--nodes", dest="nodes", type="int",
+                      help="number of node UUIDs to map", default=100000)
+    parser.add_option("-r", "--replicas", dest="replicas", type="int",
+                      help="number of hosts mapped to each partition",
+                      default=1)
+    (options, args) = parser.parse_args()
+
+    hash_ring.CONF.set_override('hash_partition_exponent', options.exponent)
+    conductors = ['conductor-%d' % i for i in range(options.conductors)]
+    nodes = [str(uuid.uuid4()) for i in range(options.nodes)]
+
+    ring, elapsed = timed(hash_ring.HashRing, conductors,
+                          replicas=options.replicas)
+    print("Built a ring of %d partitions for %d conductors in %.3f s" %
+          (len(ring._partitions), options.conductors, elapsed))
+
+    single, elapsed = timed(lambda: [ring.get_hosts(n) for n in nodes])
+    print("Mapped %d nodes with get_hosts() in %.3f s" %
+          (options.nodes, elapsed))
+
+    many, elapsed = timed(ring.get_hosts_many, nodes)
+    print("Mapped %d nodes with get_hosts_many() in %.3f s" %
+          (options.nodes, elapsed))
+
+    if single != many:
+        sys.exit("get_hosts() and get_hosts_many() results differ")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Replay a deploy trace against the master image caches.
+
+Every line of the trace is an image used by a deployment, as
+comma-separated values::
+
+    cache,image,size_mib,download_seconds
+
+where cache is "tftp" for the images of TFTPImageCache (kernels and
+ramdisks) and "instance" for those of InstanceImageCache. Without a trace, a
+random one is generated: every deployment uses one of a few deploy kernel and
+ramdisk pairs and an instance image, usually one of a few popular ones and
+sometimes a big image used only once.
+
+The images are sparse files in temporary directories, added to and removed
+from the caches by the code of ironic, for each eviction policy. The hit
+ratios of both caches are printed for each policy. Images are not kept in
+use by deployments, so all of them can be deleted.
+
+Example::
+
+    $ python tools/image_cache_simulator.py --deploys 2000 --cache-size 20480
+"""
+
+import collections
+import csv
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+top_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                       os.pardir))
+sys.path.insert(0, top_dir)
+
+from ironic.drivers.modules import image_cache  # noqa
+
+MiB = 1024 * 1024
+
+Event = collections.namedtuple('Event', ['cache', 'image', 'size',
+                                         'download_seconds'])
+
+
+def read_trace(path):
+    with open(path) as trace:
+        return [Event(row[0], row[1], int(row[2]) * MiB, float(row[3]))
+                for row in csv.reader(trace) if row]
+
+
+def generate_trace(deploys, seed):
+    rand = random.Random(seed)
+    trace = []
+    for i in range(deploys):
+        pair = int(rand.paretovariate(2)) % 3
+        trace.append(Event('tftp', 'deploy_kernel_%d' % pair, 8 * MiB, 0.5))
+        trace.append(Event('tftp', 'deploy_ramdisk_%d' % pair, 400 * MiB,
+                           8.0))
+        if rand.random() < 0.1:
+            # A one-off image
+            trace.append(Event('instance', 'one_off_%d' % i, 40960 * MiB,
+                               800.0))
+        else:
+            image = int(rand.paretovariate(1.5)) % 10
+            trace.append(Event('instance', 'image_%d' % image, 3072 * MiB,
+                               60.0))
+    return trace
+
+
+def replay(trace, policy, cache_size):
+    """Replay a trace with a policy.
+
+    :returns: a dict of (hits, requests, bytes hit, bytes requested) tuples,
+              by cache.
+    """
+    stats = collections.defaultdict(lambda: [0, 0, 0, 0])
+    caches = {}
+    top = tempfile.mkdtemp()
+    try:
+        for event in trace:
+            cache = caches.get(event.cache)
+            if cache is None:
+                cache = caches[event.cache] = image_cache.ImageCache(
+                    os.path.join(top, event.cache), cache_size,
+                    cache_ttl=10 ** 9, policy=policy)
+            path = os.path.join(cache.master_dir, event.image)
+            counters = stats[event.cache]
+            counters[1] += 1
+            counters[3] += event.size
+            if os.path.exists(path):
+                counters[0] += 1
+                counters[2] += event.size
+                cache._index.touch(event.image)
+                continue
+            with open(path, 'wb') as image:
+                image.truncate(event.size)
+            cache._index.add(event.image, cost=event.download_seconds)
+            cache.clean_up()
+    finally:
+        shutil.rmtree(top)
+    return stats
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-t", "--trace", dest="trace",
+                      help="CSV file with the trace to replay")
+    parser.add_option("-d", "--deploys", dest="deploys", type="int",
+                      help="number of deployments of the generated trace",
+                      default=1000)
+    parser.add_option("-s", "--seed", dest="seed", type="int",
+                      help="seed of the generated trace", default=0)
+    parser.add_option("-c", "--cache-size", dest="cache_size", type="int",
+                      help="size of each cache in MiB", default=20480)
+    (options, args) = parser.parse_args()
+
+    if options.trace:
+        trace = read_trace(options.trace)
+    else:
+        trace = generate_trace(options.deploys, options.seed)
+
+    for policy in sorted(image_cache.EVICTION_POLICIES):
+        stats = replay(trace, policy, options.cache_size * MiB)
+        for cache, (hits, requests, bytes_hit, bytes_requested) in sorted(
+                stats.items()):
+            print("%-5s %-9s hit ratio %5.1f%%, byte hit ratio %5.1f%% "
+                  "(%d requests)" %
+                  (policy, cache, 100.0 * hits / requests,
+                   100.0 * bytes_hit / bytes_requested, requests))
+
+
+if __name__ == '__main__':
+    main()
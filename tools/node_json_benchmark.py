@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Time the listing of nodes with large JSON fields.
+
+The nodes table of the given database is filled with fake nodes whose
+driver_internal_info holds the kind of clean steps a cleaning leaves
+behind. The nodes are listed as Node objects reading only a few fields,
+as "GET /v1/nodes" does, and reading all of them, as the detailed listing
+does, with each JSON codec which can be imported.
+
+The database must be empty, its tables are created and dropped.
+
+Example::
+
+    $ python tools/node_json_benchmark.py --nodes 1000 --steps 200
+"""
+
+import optparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+top_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                       os.pardir))
+sys.path.insert(0, top_dir)
+
+from oslo_config import cfg  # noqa
+from oslo_db import options as db_options  # noqa
+from oslo_utils import importutils  # noqa
+import sqlalchemy  # noqa
+
+from ironic.common import context as ironic_context  # noqa
+from ironic.common import states  # noqa
+from ironic.db.sqlalchemy import models  # noqa
+from ironic import objects  # noqa
+
+CONF = cfg.CONF
+
+CODECS = ('json', 'simplejson', 'ujson')
+
+SHORT_FIELDS = ('uuid', 'instance_uuid', 'power_state', 'provision_state',
+                'maintenance')
+
+
+def driver_internal_info(steps):
+    clean_steps = [{'step': 'erase_devices_%d' % index,
+                    'interface': 'deploy', 'priority': index,
+                    'argsinfo': {'device': '/dev/sd%d' % index,
+                                 'passes': 3, 'random': True}}
+                   for index in range(steps)]
+    return {'clean_steps': clean_steps, 'clean_step_index': steps - 1,
+            'agent_url': 'http://192.0.2.10:9999',
+            'agent_last_heartbeat': 1456789012,
+            'is_whole_disk_image': False}
+
+
+def populate(engine, count, steps):
+    models.Base.metadata.create_all(engine)
+    nodes = models.Node.__table__
+    info = driver_internal_info(steps)
+    rows = []
+    for index in range(count):
+        rows.append({
+            'uuid': str(uuid.uuid4()),
+            'driver': 'fake',
+            'provision_state': states.AVAILABLE,
+            'properties': {'cpus': 8, 'memory_mb': 16384, 'local_gb': 100},
+            'driver_info': {'ipmi_address': '192.0.2.%d' % (index % 250)},
+            'driver_internal_info': info,
+            'instance_info': {}, 'extra': {}})
+        if len(rows) == 500:
+            engine.execute(nodes.insert(), rows)
+            rows = []
+    if rows:
+        engine.execute(nodes.insert(), rows)
+
+
+def timed(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def list_nodes(context, fields):
+    for node in objects.Node.list(context):
+        for field in fields:
+            getattr(node, field)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--nodes", dest="nodes", type="int",
+                      help="number of nodes to create", default=1000)
+    parser.add_option("-s", "--steps", dest="steps", type="int",
+                      help="number of clean steps in the "
+                      "driver_internal_info of each node", default=200)
+    parser.add_option("-c", "--connection", dest="connection",
+                      help="SQLAlchemy URL of an empty database, a "
+                      "temporary sqlite database by default")
+    (options, args) = parser.parse_args()
+
+    sqlite_path = None
+    connection = options.connection
+    if not connection:
+        sqlite_path = tempfile.mktemp(suffix='.sqlite')
+        connection = 'sqlite:///%s' % sqlite_path
+    db_options.set_defaults(CONF)
+    CONF([], project='ironic')
+    CONF.set_override('connection', connection, 'database')
+    engine = sqlalchemy.create_engine(connection)
+    objects.register_all()
+    context = ironic_context.get_admin_context()
+
+    try:
+        populate(engine, options.nodes, options.steps)
+        size = len(models.Node.driver_internal_info.type.process_bind_param(
+            driver_internal_info(options.steps), engine.dialect))
+        print("Created %d nodes with a driver_internal_info of %d bytes" %
+              (options.nodes, size))
+
+        print("%-12s %15s %15s" % ('codec', 'few fields', 'all fields'))
+        for codec in CODECS:
+            if codec != 'json' and importutils.try_import(codec) is None:
+                print("%-12s %15s" % (codec, 'not installed'))
+                continue
+            CONF.set_override('json_codec', codec, 'database')
+            few = timed(lambda: list_nodes(context, SHORT_FIELDS))
+            everything = timed(lambda: list_nodes(context,
+                                                  objects.Node.fields))
+            print("%-12s %12.1f ms %12.1f ms" % (codec, few * 1000,
+                                                 everything * 1000))
+    finally:
+        models.Base.metadata.drop_all(engine)
+        if sqlite_path:
+            os.unlink(sqlite_path)
+
+
+if __name__ == '__main__':
+    main()
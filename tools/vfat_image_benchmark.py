@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compare the ways of building the floppy images of virtual media boot.
+
+The images are built with the deploy parameters of a node, as the iLO and
+iRMC drivers do, by ironic.common.images.create_vfat_image, and by running
+dd, mkfs.vfat, mount, a copy and umount as it did before. The second way
+needs root privileges and the dosfstools, and is skipped without them.
+
+Example::
+
+    $ sudo python tools/vfat_image_benchmark.py --images 50
+"""
+
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+top_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                       os.pardir))
+sys.path.insert(0, top_dir)
+
+from ironic.common import images  # noqa
+
+PARAMETERS = {
+    'deployment_id': '1be26c0b-03f2-4d2e-ae87-c02d7f33c123',
+    'deployment_key': '0123456789ABCDEF',
+    'iscsi_target_iqn': 'iqn.2008-10.org.openstack:1be26c0b-03f2-4d2e',
+    'ironic_api_url': 'http://192.0.2.1:6385',
+    'disk': 'cciss/c0d0,sda,hda,vda',
+    'boot_option': 'netboot',
+    'boot_mode': 'bios',
+    'coreos.configdrive': 0,
+}
+
+
+def build_in_process(path, parameters):
+    images.create_vfat_image(path, parameters=parameters)
+
+
+def build_with_mount(path, parameters):
+    mount_dir = tempfile.mkdtemp()
+    try:
+        subprocess.check_call(['dd', 'if=/dev/zero', 'of=%s' % path,
+                               'count=1', 'bs=100KiB'],
+                              stderr=open(os.devnull, 'w'))
+        subprocess.check_call(['mkfs', '-t', 'vfat', '-n', 'ir-vfd-dev',
+                               path], stdout=open(os.devnull, 'w'))
+        subprocess.check_call(['mount', '-o', 'loop,umask=0', path,
+                               mount_dir])
+        try:
+            with open(os.path.join(mount_dir, 'parameters.txt'), 'w') as f:
+                f.write('\n'.join('%s=%s' % item
+                                  for item in parameters.items()))
+        finally:
+            subprocess.check_call(['umount', mount_dir])
+    finally:
+        os.rmdir(mount_dir)
+
+
+def can_mount():
+    if os.geteuid() != 0:
+        return False
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.call(['which', 'mkfs.vfat'], stdout=devnull) == 0
+
+
+def run(build, count, directory):
+    start = time.time()
+    for index in range(count):
+        build(os.path.join(directory, 'image-%d.img' % index), PARAMETERS)
+    return (time.time() - start) / count
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--images", dest="images", type="int",
+                      help="number of images built in each way",
+                      default=20)
+    (options, args) = parser.parse_args()
+
+    ways = [('in-process', build_in_process)]
+    if can_mount():
+        ways.append(('mount', build_with_mount))
+    else:
+        print("Skipping the mount based build, which needs root "
+              "privileges and mkfs.vfat")
+
+    directory = tempfile.mkdtemp()
+    try:
+        for name, build in ways:
+            elapsed = run(build, options.images, directory)
+            print("%-10s %8.2f ms per image" % (name, elapsed * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()